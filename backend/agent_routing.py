@@ -0,0 +1,259 @@
+"""
+Cache de roteamento dos agentes do AI Builder (config_ia ativos)
+
+Os agentes ativos são carregados uma vez, com o config JSON já interpretado,
+e o cache é invalidado por LISTEN/NOTIFY no canal config_ia_changed
+(migration 008). Rotear uma mensagem não faz nenhuma consulta ao banco.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "config_ia_changed"
+
+PRIORITY_ORDER = {"critica": 1, "alta": 2, "media": 3, "baixa": 4}
+
+
+def _parse_agent(row) -> Dict[str, Any]:
+    """Linha de config_ia -> agente pronto para roteamento"""
+    config = row["config"]
+    if isinstance(config, str):
+        config = json.loads(config or "{}")
+    config = config if isinstance(config, dict) else {}
+    return {
+        "id": row["id"],
+        "name": row["nome"],
+        "provider": row["provider"] or config.get("provider", "groq"),
+        "category": config.get("category", "geral"),
+        "sla_hours": int(config.get("sla_hours", config.get("sla", 24)) or 24),
+        "priority": config.get("priority", "media"),
+        "config": config,
+    }
+
+
+class AgentRoutingCache:
+    """Agentes ativos em memória, ordenados por prioridade e SLA
+
+    AGENT_ROUTING_CACHE_TTL: segundos até recarregar quando o LISTEN não está
+    conectado (padrão 300). Com o LISTEN ativo o cache só é recarregado após
+    uma notificação.
+    """
+
+    def __init__(self, pool_getter: Callable[[], Any], dsn_getter: Callable[[], Optional[str]]):
+        self._pool_getter = pool_getter
+        self._dsn_getter = dsn_getter
+        self.ttl = int(os.getenv("AGENT_ROUTING_CACHE_TTL", "300"))
+
+        self._agents: Optional[List[Dict[str, Any]]] = None
+        self._loaded_at = 0.0
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+        self._listen_conn: Optional[asyncpg.Connection] = None
+        self._listen_task: Optional[asyncio.Task] = None
+        self._connection_lost = asyncio.Event()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._invalidation_listeners: List[Callable[[], None]] = []
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.notifications = 0
+        self._routing_times = deque(maxlen=1000)
+
+    @property
+    def listening(self) -> bool:
+        return self._listen_conn is not None and not self._listen_conn.is_closed()
+
+    async def get_agents(self) -> List[Dict[str, Any]]:
+        """Agentes ativos (do cache; recarrega somente se invalidado)"""
+        if self._is_fresh():
+            self.hits += 1
+            return self._agents
+
+        self.misses += 1
+        async with self._lock:
+            if not self._is_fresh():
+                await self._load()
+        return self._agents
+
+    def _is_fresh(self) -> bool:
+        if self._agents is None or self._stale:
+            return False
+        if not self.listening and time.monotonic() - self._loaded_at > self.ttl:
+            return False
+        return True
+
+    async def _load(self):
+        pool = self._pool_getter()
+        if pool is None:
+            raise RuntimeError("Pool PostgreSQL não inicializado")
+
+        # Limpar o flag antes da consulta: notificação durante a carga força nova carga
+        self._stale = False
+        try:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT id, nome, provider, config
+                    FROM config_ia
+                    WHERE active = true
+                """)
+        except Exception:
+            # Manter desatualizado: a próxima chamada tenta de novo em vez de usar a lista antiga
+            self._stale = True
+            raise
+
+        agents = []
+        for row in rows:
+            try:
+                agents.append(_parse_agent(row))
+            except Exception as e:
+                logger.error(f"❌ Config inválido no agente {row['id']}: {e}")
+        agents.sort(key=lambda a: (PRIORITY_ORDER.get(a["priority"], 5), a["sla_hours"]))
+
+        self._agents = agents
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+        logger.info(f"🎯 Cache de roteamento carregado: {len(agents)} agente(s) ativo(s)")
+
+    def add_invalidation_listener(self, callback: Callable[[], None]):
+        """Chamar `callback` a cada invalidação (local ou via NOTIFY de outra réplica)"""
+        self._invalidation_listeners.append(callback)
+
+    def invalidate(self, reason: str = ""):
+        """Marcar cache como desatualizado e recarregar em background"""
+        self._stale = True
+        if reason:
+            logger.info(f"🔄 Cache de roteamento invalidado ({reason})")
+        for callback in self._invalidation_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"❌ Erro em listener de invalidação: {e}")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = loop.create_task(self._refresh())
+
+    async def _refresh(self):
+        try:
+            async with self._lock:
+                if self._stale:
+                    await self._load()
+        except Exception as e:
+            logger.error(f"❌ Erro ao recarregar cache de roteamento: {e}")
+
+    async def route(self, message: str, matcher) -> Optional[Dict[str, Any]]:
+        """Agente para a mensagem
+
+        Primeiro agente (por prioridade/SLA) cuja categoria aparece na mensagem
+        segundo `matcher` (KeywordMatcher); senão o primeiro agente ativo.
+        """
+        agents = await self.get_agents()
+        started = time.perf_counter()
+        try:
+            if not agents:
+                return None
+            matched_categories = matcher.score(message)
+            for agent in agents:
+                if agent["category"] in matched_categories:
+                    return dict(agent)
+            return dict(agents[0])
+        finally:
+            self._routing_times.append((time.perf_counter() - started) * 1_000_000)
+
+    # ------------------------------------------------------------------
+    # LISTEN/NOTIFY
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        """Conectar o LISTEN (com reconexão automática)"""
+        if self._listen_task is None:
+            self._listen_task = asyncio.create_task(self._listen_loop())
+
+    async def stop(self):
+        if self._listen_task:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except asyncio.CancelledError:
+                pass
+            self._listen_task = None
+        await self._close_listen_conn()
+
+    async def _listen_loop(self):
+        while True:
+            dsn = self._dsn_getter()
+            if not dsn:
+                logger.warning("⚠️ DATABASE_URL não configurada; cache de roteamento sem LISTEN")
+                return
+            try:
+                self._connection_lost.clear()
+                self._listen_conn = await asyncpg.connect(dsn)
+                self._listen_conn.add_termination_listener(lambda conn: self._connection_lost.set())
+                await self._listen_conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                logger.info(f"👂 LISTEN {NOTIFY_CHANNEL} ativo")
+                # Notificações podem ter sido perdidas enquanto desconectado
+                self.invalidate()
+                await self._connection_lost.wait()
+                logger.warning("⚠️ Conexão LISTEN perdida; reconectando")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Erro no LISTEN {NOTIFY_CHANNEL}: {e}")
+            await self._close_listen_conn()
+            await asyncio.sleep(5)
+
+    async def _close_listen_conn(self):
+        conn, self._listen_conn = self._listen_conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close()
+            except Exception:
+                conn.terminate()
+
+    def _on_notify(self, conn, pid, channel, payload):
+        self.notifications += 1
+        self.invalidate(f"notify {payload}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        times = sorted(self._routing_times)
+        return {
+            "agents": len(self._agents) if self._agents is not None else None,
+            "listening": self.listening,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "reloads": self.reloads,
+            "notifications": self.notifications,
+            "routing_us": {
+                "samples": len(times),
+                "p50": round(times[len(times) // 2], 1) if times else None,
+                "p99": round(times[min(len(times) - 1, int(len(times) * 0.99))], 1) if times else None,
+            },
+        }
+
+
+def _chamados_pool():
+    from .chamados_service import chamados_service
+    return chamados_service.pool
+
+
+def _chamados_dsn():
+    from .chamados_service import chamados_service
+    return chamados_service.database_url or os.getenv("DATABASE_URL")
+
+
+# Instância global
+agent_routing_cache = AgentRoutingCache(_chamados_pool, _chamados_dsn)
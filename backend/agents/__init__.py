@@ -2,16 +2,11 @@
 Sistema Multi-Agente para Cidadão.AI
 """
 
-from .base_agent import BaseAgent
+from .base_agent import BaseAgent, AgentMessage
 from .categorization_agent import CategorizationAgent
-from .ticket_agent import TicketAgent
-from .protocol_agent import ProtocolAgent
-from .agent_router import AgentRouter
 
 __all__ = [
     'BaseAgent',
-    'CategorizationAgent', 
-    'TicketAgent',
-    'ProtocolAgent',
-    'AgentRouter'
+    'AgentMessage',
+    'CategorizationAgent'
 ]
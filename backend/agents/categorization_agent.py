@@ -6,6 +6,7 @@ from typing import Dict, Any, Optional, List
 from datetime import datetime
 from .base_agent import BaseAgent, AgentMessage
 from ..ai_providers import AIProviderFactory
+from ..categorization import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +56,9 @@ class CategorizationAgent(BaseAgent):
                 "time_nome": "Secretaria de Obras"
             }
         }
+        self.keyword_matcher = KeywordMatcher(
+            {category: info["keywords"] for category, info in self.categories.items()}
+        )
         
         logger.info("🏷️ Agente de Categorização inicializado")
     
@@ -176,30 +180,13 @@ class CategorizationAgent(BaseAgent):
     
     def _categorize_by_keywords(self, description: str) -> Dict[str, Any]:
         """Categorizar usando palavras-chave"""
-        description_lower = description.lower()
-        
-        best_category = None
-        best_score = 0
-        
-        for category, info in self.categories.items():
-            score = 0
-            keywords = info["keywords"]
-            
-            # Contar palavras-chave encontradas
-            for keyword in keywords:
-                if keyword in description_lower:
-                    score += 1
-            
-            # Normalizar score (0-1)
-            normalized_score = score / len(keywords)
-            
-            if normalized_score > best_score:
-                best_score = normalized_score
-                best_category = category
+        # Score normalizado (0-1): palavras-chave encontradas / total da categoria
+        ranked = self.keyword_matcher.rank(description)
+        best = max(ranked, key=lambda match: match["confidence"], default=None)
         
         return {
-            "category": best_category,
-            "confidence": best_score,
+            "category": best["key"] if best else None,
+            "confidence": best["confidence"] if best else 0,
             "method": "keywords"
         }
     
@@ -4,8 +4,8 @@ Agente de IA para atendimento automático ao cidadão - Suporte múltiplos prove
 import os
 import logging
 from typing import Optional, Dict, Any
-from datetime import datetime
 from .ai_providers import AIProviderFactory
+from .conversation_memory import conversation_memory
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +15,7 @@ class CidadaoAIAgent:
     def __init__(self):
         self.provider = None
         self.system_prompt = self._get_system_prompt()
-        self.conversation_memory = {}  # Para manter contexto das conversas
+        self.conversation_memory = conversation_memory  # Contexto das conversas (compartilhado)
         
         # Configurar provedor de IA
         self._setup_ai_provider()
@@ -92,24 +92,14 @@ class CidadaoAIAgent:
             return None
         
         try:
-            # Preparar contexto da conversa
-            conversation_key = f"conv_{conversation_id}"
-            
-            # Obter histórico da conversa (se existir)
-            conversation_history = self.conversation_memory.get(conversation_key, [])
-            
-            # Adicionar mensagem atual ao histórico
-            conversation_history.append({
-                "role": "user",
-                "content": message,
-                "timestamp": datetime.now().isoformat()
-            })
+            # Obter histórico da conversa (4 anteriores + atual = últimas 5 mensagens de contexto)
+            conversation_history = await self.conversation_memory.get(conversation_id, limit=4)
+            user_message = {"role": "user", "content": message}
             
             # Preparar mensagens para o provedor
             messages = [{"role": "system", "content": self.system_prompt}]
             
-            # Adicionar histórico (últimas 5 mensagens para manter contexto)
-            for msg in conversation_history[-5:]:
+            for msg in conversation_history + [user_message]:
                 messages.append({
                     "role": msg["role"],
                     "content": msg["content"]
@@ -132,15 +122,12 @@ class CidadaoAIAgent:
                 logger.error("🚨 ERRO: Provedor não retornou resposta")
                 return self._get_fallback_response()
             
-            # Adicionar resposta ao histórico
-            conversation_history.append({
-                "role": "assistant",
-                "content": ai_response,
-                "timestamp": datetime.now().isoformat()
-            })
-            
-            # Manter apenas últimas 10 mensagens para não sobrecarregar
-            self.conversation_memory[conversation_key] = conversation_history[-10:]
+            # Adicionar mensagem e resposta ao histórico (limitado e com TTL no store)
+            await self.conversation_memory.append(
+                conversation_id,
+                user_message,
+                {"role": "assistant", "content": ai_response}
+            )
             
             logger.info(f"✅ Resposta gerada: {ai_response[:100]}...")
             
@@ -163,17 +150,14 @@ class CidadaoAIAgent:
         """Obter nome do provedor atual"""
         return self.provider.get_provider_name() if self.provider else "Nenhum"
     
-    def get_conversation_context(self, conversation_id: int) -> list:
+    async def get_conversation_context(self, conversation_id: int) -> list:
         """Obter contexto de uma conversa específica"""
-        conversation_key = f"conv_{conversation_id}"
-        return self.conversation_memory.get(conversation_key, [])
+        return await self.conversation_memory.get(conversation_id)
     
-    def clear_conversation_context(self, conversation_id: int):
+    async def clear_conversation_context(self, conversation_id: int):
         """Limpar contexto de uma conversa específica"""
-        conversation_key = f"conv_{conversation_id}"
-        if conversation_key in self.conversation_memory:
-            del self.conversation_memory[conversation_key]
-            logger.info(f"Contexto da conversa {conversation_id} limpo")
+        await self.conversation_memory.clear(conversation_id)
+        logger.info(f"Contexto da conversa {conversation_id} limpo")
 
 # Instância global do agente
 ai_agent = CidadaoAIAgent()
@@ -4,19 +4,148 @@ Serviço para construção e gerenciamento de agentes IA
 import os
 import logging
 import json
+import asyncpg
 from typing import Optional, Dict, Any, List
 from datetime import datetime
+from decimal import Decimal
 from .models import ConfigIA
 from .chamados_service import chamados_service
+from .categorization import KeywordMatcher
+from .agent_routing import agent_routing_cache
+from .cache import TTLCache
+from .interaction_logger import agent_interactions_log, agora
 
 logger = logging.getLogger(__name__)
 
 
+# Palavras-chave por categoria de agente
+CATEGORY_KEYWORDS = {
+    'infraestrutura': ['buraco', 'rua', 'asfalto', 'calçada', 'iluminação', 'esgoto', 'poste', 'pavimentação', 'vazamento'],
+    'saude': ['posto', 'saúde', 'médico', 'remédio', 'hospital', 'clínica', 'atendimento', 'consulta', 'vacina'],
+    'educacao': ['escola', 'educação', 'professor', 'merenda', 'transporte', 'ensino', 'matrícula', 'aluno'],
+    'assistencia_social': ['bolsa', 'assistência', 'social', 'cadastro', 'benefício', 'auxílio', 'família'],
+    'vendas': ['venda', 'comprar', 'produto', 'serviço', 'comercial', 'preço', 'orçamento']
+}
+CATEGORY_MATCHER = KeywordMatcher(CATEGORY_KEYWORDS)
+
+# Analytics dos agentes: leituras dos rollups da migration 013 (agent_interactions_daily,
+# agent_interactions_hourly, agent_query_stats). Consultas fixas e parametrizadas, que
+# o asyncpg prepara uma vez por conexão e reutiliza.
+ANALYTICS_MAX_DAYS = 3650
+
+ANALYTICS_OVERVIEW_SQL = """
+    SELECT
+        COALESCE(SUM(interactions), 0)::BIGINT as total_interactions,
+        (SUM(response_time_sum) / NULLIF(SUM(response_time_count), 0))::FLOAT8 as avg_response_time,
+        COALESCE(SUM(successful), 0)::BIGINT as successful_interactions,
+        COALESCE(SUM(failed), 0)::BIGINT as failed_interactions,
+        (SUM(tokens_sum)::NUMERIC / NULLIF(SUM(interactions), 0))::FLOAT8 as avg_tokens,
+        SUM(cost_sum) as total_cost
+    FROM agent_interactions_daily
+    WHERE agent_id = $1
+    AND dia >= (NOW() - make_interval(days => $2::INT))::DATE
+"""
+
+ANALYTICS_CATEGORIES_SQL = """
+    SELECT NULLIF(category, '') as category, SUM(interactions)::BIGINT as count
+    FROM agent_interactions_daily
+    WHERE agent_id = $1
+    AND dia >= (NOW() - make_interval(days => $2::INT))::DATE
+    GROUP BY category
+    ORDER BY count DESC
+"""
+
+ANALYTICS_DAILY_SQL = """
+    SELECT
+        dia as date,
+        SUM(interactions)::BIGINT as interactions,
+        (SUM(response_time_sum) / NULLIF(SUM(response_time_count), 0))::FLOAT8 as avg_response_time,
+        SUM(successful)::BIGINT as successful
+    FROM agent_interactions_daily
+    WHERE agent_id = $1
+    AND dia >= (NOW() - make_interval(days => $2::INT))::DATE
+    GROUP BY dia
+    ORDER BY date DESC
+"""
+
+PERFORMANCE_GENERAL_SQL = """
+    SELECT
+        COALESCE(SUM(interactions), 0)::BIGINT as total_requests,
+        (SUM(response_time_sum) / NULLIF(SUM(response_time_count), 0))::FLOAT8 as avg_response_time,
+        MIN(response_time_min) as min_response_time,
+        MAX(response_time_max) as max_response_time,
+        COALESCE(SUM(successful), 0)::BIGINT as successful_requests,
+        COALESCE(SUM(failed), 0)::BIGINT as failed_requests,
+        (SUM(tokens_sum)::NUMERIC / NULLIF(SUM(interactions), 0))::FLOAT8 as avg_tokens_per_request,
+        SUM(cost_sum) as total_cost
+    FROM agent_interactions_daily
+    WHERE agent_id = $1
+"""
+
+PERFORMANCE_HOURLY_SQL = """
+    SELECT
+        EXTRACT(HOUR FROM hora) as hour,
+        SUM(interactions)::BIGINT as requests,
+        (SUM(response_time_sum) / NULLIF(SUM(response_time_count), 0))::FLOAT8 as avg_response_time,
+        SUM(successful)::BIGINT as successful
+    FROM agent_interactions_hourly
+    WHERE agent_id = $1
+    GROUP BY EXTRACT(HOUR FROM hora)
+    ORDER BY hour
+"""
+
+PERFORMANCE_TOP_QUERIES_SQL = """
+    SELECT
+        user_message,
+        frequency,
+        (response_time_sum / NULLIF(response_time_count, 0))::FLOAT8 as avg_response_time,
+        successful
+    FROM agent_query_stats
+    WHERE agent_id = $1
+    ORDER BY frequency DESC
+    LIMIT $2
+"""
+
+# Listagem de agentes com a última atividade de cada um numa única consulta
+LIST_AGENTS_SQL = """
+    SELECT c.id, c.nome, c.provider, c.config, c.active, c.created_at, c.updated_at,
+           a.last_activity
+    FROM config_ia c
+    LEFT JOIN LATERAL (
+        SELECT MAX(d.last_interaction) AS last_activity
+        FROM agent_interactions_daily d
+        WHERE d.agent_id = c.id
+    ) a ON TRUE
+    WHERE c.prefeitura_id = $1
+    ORDER BY c.created_at DESC
+"""
+
+LIST_AGENTS_FALLBACK_SQL = """
+    SELECT c.id, c.nome, c.provider, c.config, c.active, c.created_at, c.updated_at,
+           a.last_activity
+    FROM config_ia c
+    LEFT JOIN LATERAL (
+        SELECT MAX(i.created_at) AS last_activity
+        FROM agent_interactions i
+        WHERE i.agent_id = c.id
+    ) a ON TRUE
+    WHERE c.prefeitura_id = $1
+    ORDER BY c.created_at DESC
+"""
+
+
 class AIBuilderService:
     """Serviço para construção de agentes IA"""
     
     def __init__(self):
         self.templates = self._load_templates()
+        # Listagem de agentes por prefeitura; limpa em qualquer alteração de config_ia
+        # (LISTEN/NOTIFY do cache de roteamento). O TTL limita a defasagem de last_activity.
+        self._agents_cache = TTLCache(
+            max_size=100,
+            ttl=float(os.getenv("AI_BUILDER_AGENTS_CACHE_TTL", "30"))
+        )
+        agent_routing_cache.add_invalidation_listener(self._agents_cache.clear)
     
     def _normalize_config_input(self, raw: Dict[str, Any]) -> Dict[str, Any]:
         """Normaliza chaves vindas do frontend (camelCase) para snake_case.
@@ -270,77 +399,13 @@ SEMPRE:
         return self.templates
     
     async def get_active_agent_for_message(self, message: str) -> Optional[Dict[str, Any]]:
-        """Obter agente ativo apropriado para a mensagem"""
+        """Obter agente ativo apropriado para a mensagem (sem consulta ao banco após a carga)"""
         try:
-            async with chamados_service.pool.acquire() as conn:
-                # Buscar agentes ativos ordenados por prioridade
-                agents = await conn.fetch("""
-                    SELECT id, nome, provider, config, category, sla_hours, priority, active
-                    FROM config_ia 
-                    WHERE active = true 
-                    ORDER BY 
-                        CASE priority 
-                            WHEN 'critica' THEN 1 
-                            WHEN 'alta' THEN 2 
-                            WHEN 'media' THEN 3 
-                            WHEN 'baixa' THEN 4 
-                        END,
-                        sla_hours ASC
-                """)
-                
-                if not agents:
-                    return None
-                
-                # Para cada agente, verificar se a mensagem se encaixa na categoria
-                for agent in agents:
-                    config = agent['config'] if isinstance(agent['config'], dict) else {}
-                    category = agent['category']
-                    
-                    # Verificar keywords da categoria
-                    if self._message_matches_category(message, category):
-                        return {
-                            'id': agent['id'],
-                            'name': agent['nome'],
-                            'provider': agent['provider'],
-                            'category': category,
-                            'sla_hours': agent['sla_hours'],
-                            'priority': agent['priority'],
-                            'config': config
-                        }
-                
-                # Se nenhum agente específico foi encontrado, retornar o primeiro ativo
-                first_agent = agents[0]
-                config = first_agent['config'] if isinstance(first_agent['config'], dict) else {}
-                
-                return {
-                    'id': first_agent['id'],
-                    'name': first_agent['nome'],
-                    'provider': first_agent['provider'],
-                    'category': first_agent['category'],
-                    'sla_hours': first_agent['sla_hours'],
-                    'priority': first_agent['priority'],
-                    'config': config
-                }
-                
+            return await agent_routing_cache.route(message, CATEGORY_MATCHER)
         except Exception as e:
             logger.error(f"Erro ao buscar agente ativo: {e}")
             return None
     
-    def _message_matches_category(self, message: str, category: str) -> bool:
-        """Verificar se mensagem se encaixa na categoria do agente"""
-        message_lower = message.lower()
-        
-        category_keywords = {
-            'infraestrutura': ['buraco', 'rua', 'asfalto', 'calçada', 'iluminação', 'esgoto', 'poste', 'pavimentação', 'vazamento'],
-            'saude': ['posto', 'saúde', 'médico', 'remédio', 'hospital', 'clínica', 'atendimento', 'consulta', 'vacina'],
-            'educacao': ['escola', 'educação', 'professor', 'merenda', 'transporte', 'ensino', 'matrícula', 'aluno'],
-            'assistencia_social': ['bolsa', 'assistência', 'social', 'cadastro', 'benefício', 'auxílio', 'família'],
-            'vendas': ['venda', 'comprar', 'produto', 'serviço', 'comercial', 'preço', 'orçamento']
-        }
-        
-        keywords = category_keywords.get(category, [])
-        return any(keyword in message_lower for keyword in keywords)
-    
     async def process_message_with_agent(self, agent_config: Dict[str, Any], message: str, 
                                        conversation_id: int, contact_info: Dict[str, Any] = None) -> Optional[str]:
         """Processar mensagem usando agente específico do AI Builder"""
@@ -397,15 +462,12 @@ SEMPRE:
     async def _log_agent_interaction(self, agent_id: int, user_message: str, ai_response: str, 
                                    conversation_id: int, response_time: float = 0.0, 
                                    tokens_used: int = 0, cost: float = 0.0):
-        """Registrar interação do agente para analytics"""
+        """Registrar interação do agente para analytics (gravação em lote, sem esperar o banco)"""
         try:
-            async with chamados_service.pool.acquire() as conn:
-                await conn.execute("""
-                    INSERT INTO agent_interactions 
-                    (agent_id, user_message, ai_response, response_time, tokens_used, cost, success, metadata)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-                """, agent_id, user_message, ai_response, response_time, tokens_used, cost, True, 
-                    json.dumps({"conversation_id": conversation_id}))
+            await agent_interactions_log.put((
+                agent_id, user_message, ai_response, Decimal(str(round(response_time, 3))), tokens_used,
+                Decimal(str(cost)), True, None, json.dumps({"conversation_id": conversation_id}), agora()
+            ))
         except Exception as e:
             logger.error(f"Erro ao registrar interação do agente: {e}")
     
@@ -437,6 +499,7 @@ SEMPRE:
                     RETURNING id, nome, provider, config, active, created_at
                 """, prefeitura_id, agent_config["name"], agent_config["provider"], 
                     json.dumps(agent_config), agent_config["active"], datetime.now())
+                agent_routing_cache.invalidate()
                 
                 return {
                     "status": "success",
@@ -486,6 +549,7 @@ SEMPRE:
                     RETURNING id, nome, provider, config, active, updated_at
                 """, agent_id, agent_config["name"], agent_config["provider"], 
                     json.dumps(agent_config), datetime.now())
+                agent_routing_cache.invalidate()
                 
                 if result:
                     return {
@@ -514,57 +578,56 @@ SEMPRE:
             }
     
     async def list_agent_configs(self, prefeitura_id: int = 1) -> Dict[str, Any]:
-        """Listar todas as configurações de agentes"""
+        """Listar todas as configurações de agentes (uma consulta, resultado em cache)"""
+        cached = self._agents_cache.get(prefeitura_id)
+        if cached is not None:
+            return cached
         try:
             async with chamados_service.pool.acquire() as conn:
-                results = await conn.fetch("""
-                    SELECT id, nome, provider, config, active, created_at, updated_at
-                    FROM config_ia
-                    WHERE prefeitura_id = $1
-                    ORDER BY created_at DESC
-                """, prefeitura_id)
+                try:
+                    results = await conn.fetch(LIST_AGENTS_SQL, prefeitura_id)
+                except asyncpg.UndefinedTableError:
+                    # Sem os rollups da migration 013
+                    results = await conn.fetch(LIST_AGENTS_FALLBACK_SQL, prefeitura_id)
                 
-                agents = []
-                for row in results:
-                    try:
-                        config_data = row["config"] if isinstance(row["config"], dict) else json.loads(row["config"] or '{}')
-                        
-                        # Extrair dados do config
-                        category = config_data.get('category', 'geral')
-                        sla_hours = config_data.get('sla_hours', config_data.get('sla', 24))
-                        priority = config_data.get('priority', 'media')
-                        system_prompt = config_data.get('system_prompt', '')
-                        
-                        # Buscar última atividade do agente
-                        last_activity = await conn.fetchval("""
-                            SELECT MAX(created_at) 
-                            FROM agent_interactions 
-                            WHERE agent_id = $1
-                        """, row["id"])
-                        
-                        agents.append({
-                            "id": row["id"],
-                            "name": row["nome"],  # Mudança: usar 'name' em vez de 'nome'
-                            "provider": row["provider"],
-                            "category": category,
-                            "sla_hours": sla_hours,
-                            "priority": priority,
-                            "config": config_data,
-                            "active": row["active"],
-                            "created_at": row["created_at"].isoformat(),
-                            "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None,
-                            "last_activity": last_activity.isoformat() if last_activity else None,
-                            "system_prompt": system_prompt[:100] + "..." if len(system_prompt) > 100 else system_prompt
-                        })
-                    except Exception as e:
-                        logger.error(f"Erro ao processar agente {row['id']}: {e}")
-                        continue
-                
-                return {
-                    "status": "success",
-                    "agents": agents,
-                    "total": len(agents)
-                }
+            agents = []
+            for row in results:
+                try:
+                    config_data = row["config"] if isinstance(row["config"], dict) else json.loads(row["config"] or '{}')
+                    
+                    # Extrair dados do config
+                    category = config_data.get('category', 'geral')
+                    sla_hours = config_data.get('sla_hours', config_data.get('sla', 24))
+                    priority = config_data.get('priority', 'media')
+                    system_prompt = config_data.get('system_prompt', '')
+                    
+                    last_activity = row["last_activity"]
+                    
+                    agents.append({
+                        "id": row["id"],
+                        "name": row["nome"],  # Mudança: usar 'name' em vez de 'nome'
+                        "provider": row["provider"],
+                        "category": category,
+                        "sla_hours": sla_hours,
+                        "priority": priority,
+                        "config": config_data,
+                        "active": row["active"],
+                        "created_at": row["created_at"].isoformat(),
+                        "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None,
+                        "last_activity": last_activity.isoformat() if last_activity else None,
+                        "system_prompt": system_prompt[:100] + "..." if len(system_prompt) > 100 else system_prompt
+                    })
+                except Exception as e:
+                    logger.error(f"Erro ao processar agente {row['id']}: {e}")
+                    continue
+            
+            result = {
+                "status": "success",
+                "agents": agents,
+                "total": len(agents)
+            }
+            self._agents_cache.set(prefeitura_id, result)
+            return result
                 
         except Exception as e:
             logger.error(f"❌ Erro ao listar agentes: {e}")
@@ -679,6 +742,7 @@ SEMPRE:
                     WHERE id = $1
                     RETURNING id, nome
                 """, agent_id)
+                agent_routing_cache.invalidate()
                 
                 if result:
                     return {
@@ -708,6 +772,7 @@ SEMPRE:
                     WHERE id = $1
                     RETURNING id, nome, active
                 """, agent_id, datetime.now())
+                agent_routing_cache.invalidate()
                 
                 if result:
                     return {
@@ -732,47 +797,54 @@ SEMPRE:
                 "message": f"Erro ao fazer deploy: {str(e)}"
             }
     
+    async def deactivate_agent(self, agent_id: int) -> Dict[str, Any]:
+        """Desativar agente no sistema"""
+        try:
+            async with chamados_service.pool.acquire() as conn:
+                result = await conn.fetchrow("""
+                    UPDATE config_ia 
+                    SET active = false, updated_at = $2
+                    WHERE id = $1
+                    RETURNING id, nome, active
+                """, agent_id, datetime.now())
+                agent_routing_cache.invalidate()
+                
+                if result:
+                    return {
+                        "status": "success",
+                        "message": f"Agente '{result['nome']}' desativado com sucesso",
+                        "agent": {
+                            "id": result["id"],
+                            "nome": result["nome"],
+                            "active": result["active"]
+                        }
+                    }
+                else:
+                    return {
+                        "status": "error",
+                        "message": "Agente não encontrado"
+                    }
+                    
+        except Exception as e:
+            logger.error(f"❌ Erro ao desativar agente: {e}")
+            return {
+                "status": "error",
+                "message": f"Erro ao desativar agente: {str(e)}"
+            }
+    
     async def get_agent_analytics(self, agent_id: int, days: int = 30) -> Dict[str, Any]:
-        """Obter analytics de um agente"""
+        """Obter analytics de um agente (rollup diário, por dia completo)"""
         try:
+            days = max(1, min(int(days), ANALYTICS_MAX_DAYS))
             async with chamados_service.pool.acquire() as conn:
                 # Buscar métricas do agente
-                metrics = await conn.fetchrow(f"""
-                    SELECT 
-                        COUNT(*) as total_interactions,
-                        AVG(response_time) as avg_response_time,
-                        COUNT(CASE WHEN success = true THEN 1 END) as successful_interactions,
-                        COUNT(CASE WHEN success = false THEN 1 END) as failed_interactions,
-                        AVG(tokens_used) as avg_tokens,
-                        SUM(cost) as total_cost
-                    FROM agent_interactions 
-                    WHERE agent_id = $1 
-                    AND created_at >= NOW() - INTERVAL '{days} days'
-                """, agent_id)
+                metrics = await conn.fetchrow(ANALYTICS_OVERVIEW_SQL, agent_id, days)
                 
                 # Buscar distribuição por categoria
-                categories = await conn.fetch(f"""
-                    SELECT category, COUNT(*) as count
-                    FROM agent_interactions 
-                    WHERE agent_id = $1 
-                    AND created_at >= NOW() - INTERVAL '{days} days'
-                    GROUP BY category
-                    ORDER BY count DESC
-                """, agent_id)
+                categories = await conn.fetch(ANALYTICS_CATEGORIES_SQL, agent_id, days)
                 
                 # Buscar performance por dia
-                daily_performance = await conn.fetch(f"""
-                    SELECT 
-                        DATE(created_at) as date,
-                        COUNT(*) as interactions,
-                        AVG(response_time) as avg_response_time,
-                        COUNT(CASE WHEN success = true THEN 1 END) as successful
-                    FROM agent_interactions 
-                    WHERE agent_id = $1 
-                    AND created_at >= NOW() - INTERVAL '{days} days'
-                    GROUP BY DATE(created_at)
-                    ORDER BY date DESC
-                """, agent_id)
+                daily_performance = await conn.fetch(ANALYTICS_DAILY_SQL, agent_id, days)
                 
                 return {
                     "status": "success",
@@ -919,50 +991,17 @@ SEMPRE:
             }
     
     async def get_agent_performance_metrics(self, agent_id: int) -> Dict[str, Any]:
-        """Obter métricas de performance detalhadas"""
+        """Obter métricas de performance detalhadas (rollups horário/diário e top queries)"""
         try:
             async with chamados_service.pool.acquire() as conn:
                 # Métricas gerais
-                general_metrics = await conn.fetchrow("""
-                    SELECT 
-                        COUNT(*) as total_requests,
-                        AVG(response_time) as avg_response_time,
-                        MIN(response_time) as min_response_time,
-                        MAX(response_time) as max_response_time,
-                        COUNT(CASE WHEN success = true THEN 1 END) as successful_requests,
-                        COUNT(CASE WHEN success = false THEN 1 END) as failed_requests,
-                        AVG(tokens_used) as avg_tokens_per_request,
-                        SUM(cost) as total_cost
-                    FROM agent_interactions 
-                    WHERE agent_id = $1
-                """, agent_id)
+                general_metrics = await conn.fetchrow(PERFORMANCE_GENERAL_SQL, agent_id)
                 
                 # Performance por hora do dia
-                hourly_performance = await conn.fetch("""
-                    SELECT 
-                        EXTRACT(HOUR FROM created_at) as hour,
-                        COUNT(*) as requests,
-                        AVG(response_time) as avg_response_time,
-                        COUNT(CASE WHEN success = true THEN 1 END) as successful
-                    FROM agent_interactions 
-                    WHERE agent_id = $1
-                    GROUP BY EXTRACT(HOUR FROM created_at)
-                    ORDER BY hour
-                """, agent_id)
+                hourly_performance = await conn.fetch(PERFORMANCE_HOURLY_SQL, agent_id)
                 
                 # Top queries mais comuns
-                top_queries = await conn.fetch("""
-                    SELECT 
-                        user_message,
-                        COUNT(*) as frequency,
-                        AVG(response_time) as avg_response_time,
-                        COUNT(CASE WHEN success = true THEN 1 END) as successful
-                    FROM agent_interactions 
-                    WHERE agent_id = $1
-                    GROUP BY user_message
-                    ORDER BY frequency DESC
-                    LIMIT 10
-                """, agent_id)
+                top_queries = await conn.fetch(PERFORMANCE_TOP_QUERIES_SQL, agent_id, 10)
                 
                 return {
                     "status": "success",
@@ -2,6 +2,7 @@
 Provedores de IA - Interface abstrata para múltiplos provedores
 """
 import os
+import asyncio
 import logging
 from abc import ABC, abstractmethod
 from typing import Optional, Dict, Any, List
@@ -9,12 +10,25 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Prazo padrão (segundos) de cada chamada e máximo de chamadas simultâneas por provedor
+AI_PROVIDER_TIMEOUT = float(os.getenv("AI_PROVIDER_TIMEOUT", "30"))
+AI_PROVIDER_MAX_CONCURRENCY = int(os.getenv("AI_PROVIDER_MAX_CONCURRENCY", "10"))
+
 class AIProvider(ABC):
-    """Interface abstrata para provedores de IA"""
+    """Interface abstrata para provedores de IA
+    
+    As chamadas usam os clientes assíncronos dos SDKs, então não bloqueiam o
+    event loop. Cada provedor tem um semáforo compartilhado entre instâncias
+    (limite de concorrência) e cada chamada tem um prazo (`timeout`).
+    """
+    
+    _semaphores: Dict[str, asyncio.Semaphore] = {}
+    _stats: Dict[str, Dict[str, int]] = {}
     
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.client = None
+        self.timeout = AI_PROVIDER_TIMEOUT
         self._initialize_client()
     
     @abstractmethod
@@ -23,10 +37,63 @@ class AIProvider(ABC):
         pass
     
     @abstractmethod
-    async def generate_response(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
-        """Gerar resposta usando o provedor"""
+    async def _complete(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
+        """Chamada ao SDK do provedor (sem tratamento de erro)"""
         pass
     
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Semáforo de concorrência do provedor (ex.: GROQ_MAX_CONCURRENCY)"""
+        name = self.get_provider_name()
+        if name not in AIProvider._semaphores:
+            limit = int(os.getenv(f"{name.upper()}_MAX_CONCURRENCY", AI_PROVIDER_MAX_CONCURRENCY))
+            AIProvider._semaphores[name] = asyncio.Semaphore(limit)
+            AIProvider._stats[name] = {"limit": limit, "in_flight": 0, "calls": 0, "timeouts": 0, "errors": 0}
+        return AIProvider._semaphores[name]
+    
+    async def generate_response(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
+        """Gerar resposta usando o provedor
+        
+        Args:
+            messages: Mensagens no formato OpenAI (role/content)
+            timeout: Prazo da chamada em segundos, incluindo a espera na fila (opcional)
+            
+        Returns:
+            Texto gerado ou None em caso de erro/prazo excedido. Cancelamentos são propagados.
+        """
+        if not self.client:
+            return None
+        
+        timeout = kwargs.pop("timeout", None) or self.timeout
+        semaphore = self._get_semaphore()
+        stats = AIProvider._stats[self.get_provider_name()]
+        
+        async def _limited():
+            async with semaphore:
+                stats["in_flight"] += 1
+                try:
+                    return await self._complete(messages, **kwargs)
+                finally:
+                    stats["in_flight"] -= 1
+        
+        stats["calls"] += 1
+        try:
+            return await asyncio.wait_for(_limited(), timeout=timeout)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            logger.error(f"⏱️ {self.get_provider_name()} excedeu o prazo de {timeout}s")
+            return None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats["errors"] += 1
+            logger.error(f"❌ Erro ao gerar resposta com {self.get_provider_name()}: {e}")
+            return None
+    
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, int]]:
+        """Chamadas, timeouts e concorrência atual por provedor"""
+        return {name: dict(values) for name, values in cls._stats.items()}
+    
     @abstractmethod
     def is_available(self) -> bool:
         """Verificar se o provedor está disponível"""
@@ -42,29 +109,22 @@ class GroqProvider(AIProvider):
     
     def _initialize_client(self):
         try:
-            from groq import Groq
-            self.client = Groq(api_key=self.api_key)
+            from groq import AsyncGroq
+            self.client = AsyncGroq(api_key=self.api_key, timeout=self.timeout)
             logger.info("🚀 Cliente Groq inicializado com sucesso")
         except Exception as e:
             logger.error(f"❌ Erro ao inicializar Groq: {e}")
             self.client = None
     
-    async def generate_response(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
-        if not self.client:
-            return None
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=kwargs.get("model", "llama-3.1-8b-instant"),  # Modelo atual do Groq
-                messages=messages,
-                max_tokens=kwargs.get("max_tokens", 300),
-                temperature=kwargs.get("temperature", 0.7),
-                top_p=kwargs.get("top_p", 0.9)
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            logger.error(f"❌ Erro ao gerar resposta com Groq: {e}")
-            return None
+    async def _complete(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
+        response = await self.client.chat.completions.create(
+            model=kwargs.get("model", "llama-3.1-8b-instant"),  # Modelo atual do Groq
+            messages=messages,
+            max_tokens=kwargs.get("max_tokens", 300),
+            temperature=kwargs.get("temperature", 0.7),
+            top_p=kwargs.get("top_p", 0.9)
+        )
+        return response.choices[0].message.content.strip()
     
     def is_available(self) -> bool:
         return self.client is not None
@@ -77,31 +137,24 @@ class OpenAIProvider(AIProvider):
     
     def _initialize_client(self):
         try:
-            from openai import OpenAI
-            self.client = OpenAI(api_key=self.api_key)
+            from openai import AsyncOpenAI
+            self.client = AsyncOpenAI(api_key=self.api_key, timeout=self.timeout)
             logger.info("🤖 Cliente OpenAI inicializado com sucesso")
         except Exception as e:
             logger.error(f"❌ Erro ao inicializar OpenAI: {e}")
             self.client = None
     
-    async def generate_response(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
-        if not self.client:
-            return None
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=kwargs.get("model", "gpt-3.5-turbo"),
-                messages=messages,
-                max_tokens=kwargs.get("max_tokens", 300),
-                temperature=kwargs.get("temperature", 0.7),
-                top_p=kwargs.get("top_p", 0.9),
-                frequency_penalty=kwargs.get("frequency_penalty", 0.1),
-                presence_penalty=kwargs.get("presence_penalty", 0.1)
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            logger.error(f"❌ Erro ao gerar resposta com OpenAI: {e}")
-            return None
+    async def _complete(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
+        response = await self.client.chat.completions.create(
+            model=kwargs.get("model", "gpt-3.5-turbo"),
+            messages=messages,
+            max_tokens=kwargs.get("max_tokens", 300),
+            temperature=kwargs.get("temperature", 0.7),
+            top_p=kwargs.get("top_p", 0.9),
+            frequency_penalty=kwargs.get("frequency_penalty", 0.1),
+            presence_penalty=kwargs.get("presence_penalty", 0.1)
+        )
+        return response.choices[0].message.content.strip()
     
     def is_available(self) -> bool:
         return self.client is not None
@@ -115,37 +168,30 @@ class AnthropicProvider(AIProvider):
     def _initialize_client(self):
         try:
             import anthropic
-            self.client = anthropic.Anthropic(api_key=self.api_key)
+            self.client = anthropic.AsyncAnthropic(api_key=self.api_key, timeout=self.timeout)
             logger.info("🧠 Cliente Anthropic inicializado com sucesso")
         except Exception as e:
             logger.error(f"❌ Erro ao inicializar Anthropic: {e}")
             self.client = None
     
-    async def generate_response(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
-        if not self.client:
-            return None
+    async def _complete(self, messages: List[Dict[str, str]], **kwargs) -> Optional[str]:
+        # Converter formato de mensagens para Anthropic
+        system_message = None
+        user_messages = []
         
-        try:
-            # Converter formato de mensagens para Anthropic
-            system_message = None
-            user_messages = []
-            
-            for msg in messages:
-                if msg["role"] == "system":
-                    system_message = msg["content"]
-                else:
-                    user_messages.append(msg)
-            
-            response = self.client.messages.create(
-                model=kwargs.get("model", "claude-3-sonnet-20240229"),
-                max_tokens=kwargs.get("max_tokens", 300),
-                system=system_message,
-                messages=user_messages
-            )
-            return response.content[0].text
-        except Exception as e:
-            logger.error(f"❌ Erro ao gerar resposta com Anthropic: {e}")
-            return None
+        for msg in messages:
+            if msg["role"] == "system":
+                system_message = msg["content"]
+            else:
+                user_messages.append(msg)
+        
+        response = await self.client.messages.create(
+            model=kwargs.get("model", "claude-3-sonnet-20240229"),
+            max_tokens=kwargs.get("max_tokens", 300),
+            system=system_message,
+            messages=user_messages
+        )
+        return response.content[0].text
     
     def is_available(self) -> bool:
         return self.client is not None
@@ -180,3 +226,23 @@ class AIProviderFactory:
     def get_available_providers() -> List[str]:
         """Listar provedores disponíveis"""
         return ["groq", "openai", "anthropic"]
+
+# Provedores compartilhados por nome (um cliente/pool HTTP por provedor)
+_provider_cache: Dict[str, AIProvider] = {}
+
+def get_provider(provider_name: str) -> Optional[AIProvider]:
+    """Obter instância compartilhada do provedor usando a API key do ambiente"""
+    name = (provider_name or "").lower()
+    provider = _provider_cache.get(name)
+    if provider is not None:
+        return provider
+    
+    api_key = os.getenv(f"{name.upper()}_API_KEY")
+    if not api_key:
+        logger.warning(f"⚠️ API key não configurada para {provider_name}")
+        return None
+    
+    provider = AIProviderFactory.create_provider(name, api_key)
+    if provider:
+        _provider_cache[name] = provider
+    return provider
@@ -5,8 +5,8 @@ import os
 import logging
 from typing import List, Optional, Dict, Any
 from datetime import datetime
-import httpx
 from .models import ChatwootAttachment
+from .chatwoot_client import chatwoot_client
 
 logger = logging.getLogger(__name__)
 
@@ -95,36 +95,20 @@ class AttachmentService:
         """
         Envia uma imagem para o Chatwoot via API
         """
-        url = f"{self.chatwoot_url}/api/v1/accounts/{self.account_id}/conversations/{conversation_id}/messages"
-        
-        headers = {
-            "api_access_token": self.chatwoot_token,
-        }
-        
-        # Preparar dados do multipart
-        data = {
-            "message_type": "outgoing",
-            "content": content or "📷 Imagem enviada",
-        }
+        logger.info(f"Enviando imagem para Chatwoot: {filename} ({len(file_bytes)} bytes)")
         
-        files = {
-            "attachments[]": (filename, file_bytes, content_type)
-        }
+        result = await chatwoot_client.send_attachment(
+            conversation_id,
+            filename,
+            file_bytes,
+            content_type,
+            content=content or "📷 Imagem enviada",
+            account_id=int(self.account_id)
+        )
         
-        logger.info(f"Enviando imagem para Chatwoot: {filename} ({len(file_bytes)} bytes)")
+        logger.info(f"Chatwoot response: {result}")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, data=data, files=files)
-            
-            logger.info(f"Response status: {response.status_code}")
-            logger.info(f"Response headers: {dict(response.headers)}")
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            logger.info(f"Chatwoot response: {result}")
-            
-            return result
+        return result
     
     async def get_signed_url(self, attachment: ChatwootAttachment) -> Optional[str]:
         """
@@ -0,0 +1,241 @@
+"""
+Conversão de áudio para MP3 (mensagens de voz do painel para o WhatsApp)
+
+O ffmpeg roda com asyncio.create_subprocess_exec, lendo o áudio de stdin e
+escrevendo o MP3 em stdout, sem arquivos temporários e sem bloquear o event loop.
+No máximo AUDIO_TRANSCODE_CONCURRENCY conversões rodam ao mesmo tempo (padrão: a
+cota de CPU do container); até AUDIO_TRANSCODE_MAX_QUEUE esperam a vez e as demais
+são recusadas com TranscoderBusy.
+
+O tamanho final é decidido antes de codificar (uma passada só): o MP3 sai em
+bitrate constante, escolhido numa escada de qualidades pela duração estimada do
+áudio, e -t limita a duração para que o arquivo nunca passe do limite do WhatsApp.
+
+decode_pcm usa o mesmo pool para decodificar os áudios recebidos antes da transcrição.
+"""
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WHATSAPP_MAX_BYTES = 16 * 1024 * 1024
+
+# (bitrate kbps, sample rate) da melhor para a pior qualidade de voz
+ESCADA_MP3: List[Tuple[int, int]] = [(32, 16000), (24, 16000), (16, 8000), (8, 8000)]
+
+# Cabeçalhos/quadros do MP3 além do bitrate nominal
+MARGEM_MP3 = 1.03
+
+
+class TranscodeError(Exception):
+    """Falha na conversão do áudio"""
+
+
+class TranscoderBusy(TranscodeError):
+    """Fila de conversões cheia"""
+
+
+@dataclass
+class TranscodeResult:
+    data: bytes
+    mime: str
+    extension: str
+    bitrate_kbps: int
+    sample_rate: int
+    max_duration: float
+    elapsed_ms: float
+
+
+def cota_de_cpu() -> int:
+    """CPUs disponíveis para o processo (limite do cgroup, se houver)"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, -(-int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, -(-quota // period))
+    except (OSError, ValueError):
+        pass
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def escolher_qualidade(duracao_estimada: float, max_bytes: int) -> Tuple[int, int]:
+    """Melhor degrau da escada cujo MP3 cabe em max_bytes para a duração estimada"""
+    for kbps, sample_rate in ESCADA_MP3:
+        if kbps * 1000 / 8 * duracao_estimada * MARGEM_MP3 <= max_bytes:
+            return kbps, sample_rate
+    return ESCADA_MP3[-1]
+
+
+class AudioTranscoder:
+    """Pool limitado de processos ffmpeg
+
+    AUDIO_TRANSCODE_CONCURRENCY: conversões simultâneas (padrão: cota de CPU)
+    AUDIO_TRANSCODE_MAX_QUEUE: conversões esperando vaga (padrão 4x a concorrência)
+    AUDIO_TRANSCODE_TIMEOUT: segundos por conversão (padrão 120)
+    AUDIO_TRANSCODE_MIN_INPUT_KBPS: bitrate mínimo suposto para a entrada, usado para
+        estimar a duração quando o container não informa (padrão 24, o WebM do
+        MediaRecorder não informa)
+    FFMPEG_PATH: executável do ffmpeg (padrão "ffmpeg")
+    """
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.concurrency = 0
+        self.max_queue = 0
+        self.timeout = 120.0
+        self.min_input_kbps = 24
+        self.ffmpeg = "ffmpeg"
+
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.truncated_risk = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.total_wait_ms = 0.0
+
+    def _configure(self):
+        if self._semaphore is not None:
+            return
+        self.concurrency = max(1, int(os.getenv("AUDIO_TRANSCODE_CONCURRENCY") or 0) or cota_de_cpu())
+        self.max_queue = max(0, int(os.getenv("AUDIO_TRANSCODE_MAX_QUEUE") or self.concurrency * 4))
+        self.timeout = float(os.getenv("AUDIO_TRANSCODE_TIMEOUT", "120"))
+        self.min_input_kbps = max(1, int(os.getenv("AUDIO_TRANSCODE_MIN_INPUT_KBPS", "24")))
+        self.ffmpeg = os.getenv("FFMPEG_PATH", "ffmpeg")
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        logger.info(f"🎛️ Conversão de áudio: {self.concurrency} simultânea(s), fila {self.max_queue}")
+
+    async def to_mp3(self, data: bytes, max_bytes: int = WHATSAPP_MAX_BYTES) -> TranscodeResult:
+        """Converter para MP3 mono de voz que caiba em max_bytes"""
+        self._configure()
+        if not data:
+            raise TranscodeError("áudio vazio")
+
+        # Duração estimada pelo tamanho (entrada a pelo menos min_input_kbps):
+        # superestimar só reduz a qualidade, nunca estoura o limite
+        duracao_estimada = len(data) * 8 / (self.min_input_kbps * 1000)
+        kbps, sample_rate = escolher_qualidade(duracao_estimada, max_bytes)
+        max_duration = max_bytes / MARGEM_MP3 / (kbps * 1000 / 8)
+        if kbps == ESCADA_MP3[-1][0] and duracao_estimada > max_duration:
+            self.truncated_risk += 1
+            logger.warning(f"⚠️ Áudio longo (~{duracao_estimada:.0f}s): MP3 limitado a {max_duration:.0f}s")
+
+        args = [
+            self.ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-vn", "-ac", "1", "-ar", str(sample_rate),
+            "-af", "highpass=f=80,lowpass=f=8000",  # Filtros para voz
+            "-c:a", "libmp3lame", "-b:a", f"{kbps}k",
+            "-t", f"{max_duration:.2f}",
+            "-f", "mp3", "pipe:1",
+        ]
+        output, elapsed_ms = await self._run(args, data)
+        if len(output) > max_bytes:
+            # Não deveria acontecer (bitrate constante + -t); não mandar arquivo recusado
+            raise TranscodeError(f"MP3 com {len(output)} bytes acima do limite de {max_bytes}")
+        return TranscodeResult(output, "audio/mpeg", "mp3", kbps, sample_rate, max_duration, elapsed_ms)
+
+    async def decode_pcm(self, data: bytes, sample_rate: int = 16000, max_seconds: float = 900) -> bytes:
+        """Decodificar para PCM s16le mono (entrada da transcrição)"""
+        self._configure()
+        if not data:
+            raise TranscodeError("áudio vazio")
+        args = [
+            self.ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-vn", "-ac", "1", "-ar", str(sample_rate),
+            "-af", "highpass=f=80",
+            "-t", f"{max_seconds:.2f}",
+            "-f", "s16le", "-c:a", "pcm_s16le", "pipe:1",
+        ]
+        output, _ = await self._run(args, data)
+        return output
+
+    async def _run(self, args: List[str], data: bytes) -> Tuple[bytes, float]:
+        if self.waiting >= self.max_queue and self._semaphore.locked():
+            self.rejected += 1
+            raise TranscoderBusy(f"{self.running} conversões em andamento e {self.waiting} na fila")
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.total_wait_ms += (time.perf_counter() - queued) * 1000
+
+        self.running += 1
+        started = time.perf_counter()
+        try:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+            except OSError as e:
+                raise TranscodeError(f"ffmpeg indisponível: {e}")
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(data), self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise TranscodeError(f"ffmpeg excedeu {self.timeout:.0f}s")
+            except BaseException:
+                # Cancelamento (cliente desconectou): não deixar o ffmpeg órfão
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            if process.returncode != 0:
+                detalhe = stderr.decode(errors="replace").strip().splitlines()[-1:] or ["sem detalhes"]
+                raise TranscodeError(f"ffmpeg saiu com código {process.returncode}: {detalhe[0]}")
+        except TranscodeError:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.completed += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        return stdout, elapsed_ms
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "truncated_risk": self.truncated_risk,
+            "avg_ms": round(self.total_ms / self.completed, 1) if self.completed else None,
+            "max_ms": round(self.max_ms, 1),
+            "avg_wait_ms": round(self.total_wait_ms / max(self.completed + self.failed, 1), 1),
+        }
+
+
+# Instância global
+audio_transcoder = AudioTranscoder()
@@ -2,8 +2,9 @@
 Módulo para transcrição de áudio usando OpenAI Whisper API
 """
 import os
+import asyncio
 import logging
-from openai import OpenAI
+from openai import AsyncOpenAI
 from typing import Optional
 
 logger = logging.getLogger(__name__)
@@ -24,6 +25,8 @@ class AudioTranscriber:
         
         AudioTranscriber._initialized = True
         self.client = None  # Será inicializado sob demanda
+        self.model = "whisper-1"
+        self.timeout = float(os.getenv("AUDIO_TRANSCRIBE_TIMEOUT", "60"))
 
     def initialize(self):
         """Inicializar cliente OpenAI (chamado após carregar .env)"""
@@ -36,33 +39,52 @@ class AudioTranscriber:
             raise ValueError("OPENAI_API_KEY não configurada")
         
         logger.info(f"🔑 OpenAI API Key configurada: {api_key[:10]}...")
-        self.client = OpenAI(api_key=api_key)
+        # AUDIO_TRANSCRIBE_BASE_URL: servidor compatível com a API de transcrição (ex.: stub de testes)
+        base_url = os.getenv("AUDIO_TRANSCRIBE_BASE_URL") or None
+        self.model = os.getenv("AUDIO_TRANSCRIBE_MODEL", "whisper-1")
+        self.client = AsyncOpenAI(api_key=api_key, timeout=self.timeout, base_url=base_url)
         logger.info("✅ Cliente OpenAI inicializado")
 
     async def transcribe(self, audio_path: str) -> Optional[str]:
         """Transcrever áudio usando OpenAI Whisper API"""
+        logger.info(f"🎯 Transcrevendo áudio: {audio_path}")
+
+        # Leitura do arquivo fora do event loop
+        audio_bytes = await asyncio.to_thread(self._read_file, audio_path)
+        return await self.transcribe_bytes(os.path.basename(audio_path), audio_bytes)
+
+    async def transcribe_bytes(self, filename: str, audio_bytes: bytes) -> Optional[str]:
+        """Transcrever áudio já em memória (o formato vem da extensão do filename)"""
         if self.client is None:
             self.initialize()
 
         try:
-            logger.info(f"🎯 Transcrevendo áudio: {audio_path}")
-            
-            with open(audio_path, "rb") as audio_file:
-                # Transcrever usando Whisper
-                response = self.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
+            # Transcrever usando Whisper
+            response = await asyncio.wait_for(
+                self.client.audio.transcriptions.create(
+                    model=self.model,
+                    file=(filename, audio_bytes),
                     language="pt"
-                )
-                
-                # Extrair texto
-                text = response.text
-                logger.info(f"✅ Transcrição concluída: {text[:100]}...")
-                return text
-                
+                ),
+                timeout=self.timeout
+            )
+            
+            # Extrair texto
+            text = response.text
+            logger.info(f"✅ Transcrição concluída: {text[:100]}...")
+            return text
+            
+        except asyncio.TimeoutError:
+            logger.error(f"⏱️ Transcrição excedeu o prazo de {self.timeout}s: {filename}")
+            return None
         except Exception as e:
             logger.error(f"❌ Erro na transcrição: {str(e)}")
             return None
 
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
 # Criar instância global (sem inicializar ainda)
 transcriber = AudioTranscriber()
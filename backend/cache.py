@@ -0,0 +1,106 @@
+"""
+Cache em memória com limite de itens (LRU) e expiração (TTL)
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+
+class TTLCache:
+    """Cache LRU com TTL por item
+
+    get/set/delete são O(1). Itens expirados são removidos quando acessados e
+    o item menos usado recentemente é descartado quando o limite é atingido.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = 300.0,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, expires_at: float, now: float) -> bool:
+        return expires_at and expires_at <= now
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Obter item (renova a posição LRU)"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if self._expired(expires_at, time.monotonic()):
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Gravar item (ttl=None usa o TTL padrão; 0 não expira)"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = (expires_at, value)
+
+        while len(self._data) > self.max_size:
+            old_key, (_, old_value) = self._data.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(old_key, old_value)
+
+    def touch(self, key: Hashable, ttl: Optional[float] = None) -> bool:
+        """Renovar TTL de um item existente"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key: Hashable) -> bool:
+        """Remover item"""
+        return self._data.pop(key, None) is not None
+
+    def clear(self):
+        self._data.clear()
+
+    def purge_expired(self) -> int:
+        """Remover todos os itens expirados; retorna quantos foram removidos"""
+        now = time.monotonic()
+        expired = [k for k, (exp, _) in self._data.items() if self._expired(exp, now)]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def keys(self) -> Iterator[Hashable]:
+        return iter(list(self._data.keys()))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Tamanho e taxa de acerto"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_MISSING = object()
@@ -0,0 +1,316 @@
+"""
+Motor de categorização por palavras-chave (autômato Aho-Corasick)
+
+Todas as palavras-chave de todas as categorias ficam em um único autômato,
+então o texto é percorrido uma vez só, independente do número de categorias.
+"""
+import logging
+import unicodedata
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas e sem acentos ("Iluminação" -> "iluminacao")"""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class KeywordMatcher:
+    """Pontua categorias pelas palavras-chave encontradas no texto
+
+    - Acentos e maiúsculas são ignorados (normalize_text).
+    - Palavras-chave só casam com palavras inteiras; plural simples ("buracos")
+      casa com a palavra-chave no singular ("buraco").
+    - Categorias podem ser adicionadas, alteradas e removidas sem reconstruir
+      o autômato do zero: a trie é atualizada no lugar e os links de falha são
+      recalculados (uma passada linear) na próxima busca.
+
+    O score de uma categoria é o número de palavras-chave distintas dela
+    encontradas no texto.
+    """
+
+    # Sufixos aceitos após a palavra-chave (plural simples)
+    PLURAL_SUFFIXES = ("s", "es")
+
+    def __init__(self, categories: Optional[Dict[Hashable, Iterable[str]]] = None):
+        # Trie: transições, link de falha e ids de palavras-chave por nó
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._terminal: List[Optional[int]] = [None]
+        self._outputs: List[tuple] = [()]
+
+        # Palavras-chave: texto normalizado <-> id, tamanho e categorias por id
+        self._keyword_ids: Dict[str, int] = {}
+        self._keyword_text: Dict[int, str] = {}
+        self._keyword_len: Dict[int, int] = {}
+        self._keyword_categories: Dict[int, Set[Hashable]] = {}
+        self._next_keyword_id = 0
+
+        # Categorias: chave -> ids das palavras-chave, dados e ordem de cadastro
+        self._categories: Dict[Hashable, Set[int]] = {}
+        self._raw_keywords: Dict[Hashable, tuple] = {}
+        self._data: Dict[Hashable, Any] = {}
+        self._order: Dict[Hashable, int] = {}
+        self._next_order = 0
+
+        self._dirty = False
+        self._dead_keywords = 0
+
+        for key, keywords in (categories or {}).items():
+            self.set_category(key, keywords)
+
+    # ------------------------------------------------------------------
+    # Manutenção das categorias
+    # ------------------------------------------------------------------
+
+    def set_category(self, key: Hashable, keywords: Iterable[str], data: Any = None) -> bool:
+        """Adicionar ou atualizar categoria; retorna True se as palavras-chave mudaram"""
+        if key not in self._order:
+            self._order[key] = self._next_order
+            self._next_order += 1
+        self._data[key] = data
+
+        raw = tuple(keywords or ())
+        if self._raw_keywords.get(key) == raw:
+            return False
+        self._raw_keywords[key] = raw
+
+        normalized = {normalize_text(k).strip() for k in raw if k}
+        normalized.discard("")
+        current = self._categories.get(key)
+        if current is not None and {self._keyword_text[kid] for kid in current} == normalized:
+            return False
+
+        if current:
+            self._unlink(key, current)
+        ids = set()
+        for keyword in normalized:
+            kid = self._insert(keyword)
+            self._keyword_categories[kid].add(key)
+            ids.add(kid)
+        self._categories[key] = ids
+        self._dirty = True
+        return True
+
+    def remove_category(self, key: Hashable) -> bool:
+        """Remover categoria"""
+        ids = self._categories.pop(key, None)
+        self._raw_keywords.pop(key, None)
+        self._data.pop(key, None)
+        self._order.pop(key, None)
+        if ids is None:
+            return False
+        self._unlink(key, ids)
+        self._dirty = True
+        return True
+
+    def sync(self, categories: Dict[Hashable, Any], keywords_getter=None) -> int:
+        """Sincronizar com o conjunto completo de categorias
+
+        Apenas categorias novas, alteradas ou removidas tocam o autômato.
+        `categories` mapeia chave -> dados; `keywords_getter(dados)` extrai as
+        palavras-chave (padrão: os próprios dados). Retorna quantas mudaram.
+        """
+        getter = keywords_getter or (lambda data: data)
+        changed = 0
+        for key in [k for k in self._categories if k not in categories]:
+            changed += self.remove_category(key)
+        for key, data in categories.items():
+            changed += self.set_category(key, getter(data), data)
+        return changed
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._categories
+
+    def __len__(self) -> int:
+        return len(self._categories)
+
+    def get_data(self, key: Hashable) -> Any:
+        return self._data.get(key)
+
+    def keyword_count(self, key: Hashable) -> int:
+        return len(self._categories.get(key, ()))
+
+    # ------------------------------------------------------------------
+    # Busca
+    # ------------------------------------------------------------------
+
+    def score(self, text: str) -> Dict[Hashable, int]:
+        """Número de palavras-chave distintas encontradas por categoria"""
+        found = self._find_keywords(normalize_text(text))
+        scores: Dict[Hashable, int] = {}
+        for kid in found:
+            for key in self._keyword_categories[kid]:
+                scores[key] = scores.get(key, 0) + 1
+        return scores
+
+    def rank(self, text: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Categorias encontradas, da maior pontuação para a menor
+
+        Empates ficam com a categoria cadastrada primeiro.
+        """
+        scores = self.score(text)
+        ordered = sorted(scores.items(), key=lambda item: (-item[1], self._order[item[0]]))
+        if limit:
+            ordered = ordered[:limit]
+        return [
+            {
+                "key": key,
+                "score": score,
+                "confidence": score / (self.keyword_count(key) or 1),
+                "data": self._data.get(key),
+            }
+            for key, score in ordered
+        ]
+
+    def best(self, text: str) -> Optional[Dict[str, Any]]:
+        """Categoria com maior pontuação (None se nenhuma palavra-chave casou)"""
+        ranked = self.rank(text, limit=1)
+        return ranked[0] if ranked else None
+
+    def _find_keywords(self, text: str) -> Set[int]:
+        if self._dirty:
+            self._build_links()
+
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        keyword_len = self._keyword_len
+        found: Set[int] = set()
+        size = len(text)
+        state = 0
+
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not outputs[state]:
+                continue
+
+            for kid in outputs[state]:
+                if kid in found:
+                    continue
+                start = i - keyword_len[kid] + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                end = i + 1
+                if end < size and _is_word_char(text[end]):
+                    if not self._plural_boundary(text, end):
+                        continue
+                found.add(kid)
+
+        return found
+
+    def _plural_boundary(self, text: str, end: int) -> bool:
+        for suffix in self.PLURAL_SUFFIXES:
+            after = end + len(suffix)
+            if text.startswith(suffix, end) and (after >= len(text) or not _is_word_char(text[after])):
+                return True
+        return False
+
+    # ------------------------------------------------------------------
+    # Autômato
+    # ------------------------------------------------------------------
+
+    def _insert(self, keyword: str) -> int:
+        kid = self._keyword_ids.get(keyword)
+        if kid is not None:
+            return kid
+
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._outputs.append(())
+            state = nxt
+
+        kid = self._next_keyword_id
+        self._next_keyword_id += 1
+        self._keyword_ids[keyword] = kid
+        self._keyword_text[kid] = keyword
+        self._keyword_len[kid] = len(keyword)
+        self._keyword_categories[kid] = set()
+        self._terminal[state] = kid
+        return kid
+
+    def _unlink(self, key: Hashable, ids: Set[int]):
+        """Desassociar categoria das palavras-chave; remove as que ficaram órfãs"""
+        for kid in ids:
+            categories = self._keyword_categories.get(kid)
+            if categories is None:
+                continue
+            categories.discard(key)
+            if not categories:
+                self._drop_keyword(kid)
+
+    def _drop_keyword(self, kid: int):
+        keyword = self._keyword_text.pop(kid)
+        del self._keyword_ids[keyword]
+        del self._keyword_len[kid]
+        del self._keyword_categories[kid]
+        self._dead_keywords += 1
+
+        state = 0
+        for ch in keyword:
+            state = self._goto[state][ch]
+        self._terminal[state] = None
+
+        # Muitos nós mortos: compactar a trie
+        if self._dead_keywords > 1000 and self._dead_keywords > len(self._keyword_len):
+            self._compact()
+
+    def _compact(self):
+        """Reconstruir a trie apenas com as palavras-chave vivas (mantém os ids)"""
+        self._goto, self._fail, self._terminal, self._outputs = [{}], [0], [None], [()]
+        self._dead_keywords = 0
+        for keyword, kid in self._keyword_ids.items():
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._terminal.append(None)
+                    self._outputs.append(())
+                state = nxt
+            self._terminal[state] = kid
+        self._dirty = True
+
+    def _build_links(self):
+        """Links de falha e saídas (BFS sobre a trie)"""
+        goto, fail, terminal = self._goto, self._fail, self._terminal
+        outputs: List[tuple] = [()] * len(goto)
+        queue = []
+        for nxt in goto[0].values():
+            fail[nxt] = 0
+            outputs[nxt] = (terminal[nxt],) if terminal[nxt] is not None else ()
+            queue.append(nxt)
+
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                own = (terminal[nxt],) if terminal[nxt] is not None else ()
+                outputs[nxt] = own + outputs[fail[nxt]]
+                queue.append(nxt)
+
+        self._outputs = outputs
+        self._dirty = False
@@ -3,21 +3,39 @@ Serviço de IA especializado para sistema de chamados cidadãos
 """
 import os
 import logging
+from contextvars import ContextVar
 from typing import Optional, Dict, Any, List
 from datetime import datetime
-from .ai_agent import CidadaoAIAgent
+from .ai_agent import ai_agent
 from .chamados_service import chamados_service
+from .conversation_state import conversation_state_store, ConversationStateConflict
 from .models import Cidadao, Chamado
+from .message_debouncer import sem_cancelamento
 
 logger = logging.getLogger(__name__)
 
+# Limite da descrição guardada no estado da conversa
+MAX_PROBLEMA_CHARS = 2000
+
+# Turnos refeitos sobre o estado mais recente quando outro turno gravou antes
+MAX_TENTATIVAS_TURNO = 3
+
+# O turno já gravou algo fora do estado (cadastro, chamado) e não pode ser refeito
+_turno_com_efeito: ContextVar[bool] = ContextVar("turno_com_efeito", default=False)
+
+
+def _antes_de_gravar():
+    """Chamar antes de gravar cadastro/chamado: o turno não é mais cancelado nem refeito"""
+    sem_cancelamento()
+    _turno_com_efeito.set(True)
+
 
 class ChamadosAIService:
     """Serviço de IA para gerenciamento de chamados"""
     
     def __init__(self):
-        self.ai_agent = CidadaoAIAgent()
-        self.conversation_states = {}  # Estados das conversas
+        self.ai_agent = ai_agent  # Instância compartilhada (mesmo provedor e memória)
+        self.conversation_states = conversation_state_store  # Estados das conversas (Redis/Postgres/memória)
     
     def is_available(self) -> bool:
         """Verificar se IA está disponível"""
@@ -29,42 +47,58 @@ class ChamadosAIService:
         try:
             logger.info(f"🤖 PROCESSANDO MENSAGEM CIDADÃO - Conversa {conversation_id}")
             
-            # Obter estado da conversa
-            state = self.conversation_states.get(conversation_id, {})
-            current_step = state.get('step', 'initial')
-            
             # Extrair telefone do contato
             telefone = contact_info.get('phone_number', '') if contact_info else ''
             
-            if current_step == 'initial':
-                return await self._handle_initial_message(message, telefone, conversation_id, contact_info)
-            
-            elif current_step == 'collecting_data':
-                return await self._handle_data_collection(message, telefone, conversation_id, contact_info, state)
-            
-            elif current_step == 'collecting_issue':
-                return await self._handle_issue_collection(message, telefone, conversation_id, contact_info, state)
-            
-            elif current_step == 'confirming_category':
-                return await self._handle_category_confirmation(message, telefone, conversation_id, contact_info, state)
-            
-            elif current_step == 'collecting_address':
-                return await self._handle_address_collection(message, telefone, conversation_id, contact_info, state)
-            
-            elif current_step == 'ticket_created':
-                return await self._handle_ticket_created(message, telefone, conversation_id, contact_info, state)
-            
-            else:
-                # Estado desconhecido, voltar ao início
-                self.conversation_states[conversation_id] = {'step': 'initial'}
-                return await self._handle_initial_message(message, telefone, conversation_id, contact_info)
+            for tentativa in range(1, MAX_TENTATIVAS_TURNO + 1):
+                # Obter estado da conversa (uma leitura por turno; os handlers alteram `state` localmente)
+                state, version = await self.conversation_states.load(conversation_id)
+                current_step = state.get('step', 'initial')
+                _turno_com_efeito.set(False)
+                response = await self._executar_etapa(message, telefone, conversation_id, contact_info,
+                                                      state, current_step)
+                
+                # Uma gravação por turno. Em conflito, o turno é refeito sobre o estado novo,
+                # a não ser que já tenha gravado cadastro/chamado (aí o estado é mesclado)
+                definitivo = _turno_com_efeito.get() or tentativa == MAX_TENTATIVAS_TURNO
+                if await self._save_state(conversation_id, state, version, current_step, definitivo):
+                    return response
+                logger.warning(f"⚠️ Conversa {conversation_id}: estado alterado por outro turno, refazendo o turno")
+            return response
                 
         except Exception as e:
             logger.error(f"❌ Erro ao processar mensagem do cidadão: {e}")
             return "Desculpe, ocorreu um erro interno. Por favor, tente novamente."
     
+    async def _executar_etapa(self, message: str, telefone: str, conversation_id: int,
+                              contact_info: Dict[str, Any], state: Dict[str, Any], current_step: str) -> str:
+        """Executar o handler da etapa atual (altera `state`) e retornar a resposta"""
+        if current_step == 'initial':
+            return await self._handle_initial_message(message, telefone, conversation_id, contact_info, state)
+        
+        elif current_step == 'collecting_data':
+            return await self._handle_data_collection(message, telefone, conversation_id, contact_info, state)
+        
+        elif current_step == 'collecting_issue':
+            return await self._handle_issue_collection(message, telefone, conversation_id, contact_info, state)
+        
+        elif current_step == 'confirming_category':
+            return await self._handle_category_confirmation(message, telefone, conversation_id, contact_info, state)
+        
+        elif current_step == 'collecting_address':
+            return await self._handle_address_collection(message, telefone, conversation_id, contact_info, state)
+        
+        elif current_step == 'ticket_created':
+            return await self._handle_ticket_created(message, telefone, conversation_id, contact_info, state)
+        
+        else:
+            # Estado desconhecido, voltar ao início
+            self._set_state(state, step='initial')
+            return await self._handle_initial_message(message, telefone, conversation_id, contact_info, state)
+    
     async def _handle_initial_message(self, message: str, telefone: str, 
-                                    conversation_id: int, contact_info: Dict[str, Any]) -> str:
+                                    conversation_id: int, contact_info: Dict[str, Any],
+                                    state: Dict[str, Any]) -> str:
         """Processar mensagem inicial"""
         try:
             # Verificar se é consulta de status
@@ -76,10 +110,7 @@ class ChamadosAIService:
             
             if cidadao:
                 # Cidadão já cadastrado, ir direto para coleta do problema
-                self.conversation_states[conversation_id] = {
-                    'step': 'collecting_issue',
-                    'cidadao': cidadao
-                }
+                self._set_state(state, step='collecting_issue', cidadao=self._resumir_cidadao(cidadao))
                 
                 return f"""Olá {cidadao.nome}! 👋
 
@@ -88,10 +119,7 @@ Vejo que você já está cadastrado em nosso sistema.
 Como posso ajudá-lo hoje? Por favor, descreva o problema ou solicitação que gostaria de registrar."""
             else:
                 # Cidadão não cadastrado, iniciar processo de cadastro
-                self.conversation_states[conversation_id] = {
-                    'step': 'collecting_data',
-                    'dados_coletados': {}
-                }
+                self._set_state(state, step='collecting_data', dados_coletados={})
                 
                 return """Olá! 👋 Bem-vindo ao sistema de atendimento da Prefeitura!
 
@@ -108,15 +136,13 @@ Por favor, me informe seu **nome completo**:"""
                                     state: Dict[str, Any]) -> str:
         """Processar coleta de dados do cidadão"""
         try:
-            dados = state.get('dados_coletados', {})
+            dados = state.setdefault('dados_coletados', {})
             
             if 'nome' not in dados:
                 # Coletando nome
-                dados['nome'] = message.strip()
+                dados['nome'] = message.strip()[:255]
                 dados['telefone'] = telefone
                 
-                self.conversation_states[conversation_id]['dados_coletados'] = dados
-                
                 return f"""Perfeito, {dados['nome']}! 😊
 
 Agora preciso do seu **CPF** (apenas os números):"""
@@ -126,7 +152,6 @@ Agora preciso do seu **CPF** (apenas os números):"""
                 cpf = ''.join(filter(str.isdigit, message))
                 if len(cpf) == 11:
                     dados['cpf'] = cpf
-                    self.conversation_states[conversation_id]['dados_coletados'] = dados
                     
                     return """Ótimo! Agora me informe seu **endereço completo** (rua, número, bairro):"""
                 else:
@@ -134,8 +159,7 @@ Agora preciso do seu **CPF** (apenas os números):"""
             
             elif 'endereco' not in dados:
                 # Coletando endereço
-                dados['endereco'] = message.strip()
-                self.conversation_states[conversation_id]['dados_coletados'] = dados
+                dados['endereco'] = message.strip()[:500]
                 
                 return """Agora me informe seu **e-mail** (opcional - pode digitar "não tenho"):"""
             
@@ -158,14 +182,13 @@ Agora preciso do seu **CPF** (apenas os números):"""
                     endereco=dados['endereco']
                 )
                 
+                # Gravação: a partir daqui o turno não é mais cancelado por mensagem nova
+                _antes_de_gravar()
                 response = await chamados_service.cadastrar_cidadao(request)
                 
                 if response.status == "success":
                     # Cadastro realizado, ir para coleta do problema
-                    self.conversation_states[conversation_id] = {
-                        'step': 'collecting_issue',
-                        'cidadao': response.cidadao
-                    }
+                    self._set_state(state, step='collecting_issue', cidadao=self._resumir_cidadao(response.cidadao))
                     
                     return f"""✅ Cadastro realizado com sucesso!
 
@@ -185,16 +208,16 @@ Por favor, descreva o problema ou solicitação que gostaria de registrar:"""
         """Processar coleta do problema/solicitação"""
         try:
             # Salvar descrição do problema
-            self.conversation_states[conversation_id]['problema'] = message.strip()
+            state['problema'] = message.strip()[:MAX_PROBLEMA_CHARS]
             
             # Categorizar automaticamente
             from .chamados_service import chamados_service
             categoria = await chamados_service._categorizar_chamado(message, 1)
             
             if categoria:
-                self.conversation_states[conversation_id].update({
+                state.update({
                     'step': 'confirming_category',
-                    'categoria_sugerida': categoria
+                    'categoria_sugerida': self._resumir_categoria(categoria)
                 })
                 
                 return f"""Entendi! Analisando sua solicitação...
@@ -205,7 +228,7 @@ Por favor, descreva o problema ou solicitação que gostaria de registrar:"""
 Esta categorização está correta? (Digite "sim" ou "não")"""
             else:
                 # Categoria não identificada, pedir para especificar
-                self.conversation_states[conversation_id]['step'] = 'manual_category'
+                state['step'] = 'manual_category'
                 
                 return """Não consegui identificar automaticamente a categoria do seu chamado.
 
@@ -231,7 +254,7 @@ Digite o nome do setor:"""
             
             if resposta in ['sim', 's', 'yes', 'y', 'correto', 'certo']:
                 # Categoria confirmada, coletar endereço
-                self.conversation_states[conversation_id]['step'] = 'collecting_address'
+                state['step'] = 'collecting_address'
                 
                 return """✅ Perfeito! Categoria confirmada.
 
@@ -239,7 +262,7 @@ Agora preciso do **endereço onde ocorre o problema** (rua, número, bairro):"""
             
             elif resposta in ['não', 'nao', 'n', 'no', 'errado', 'incorreto']:
                 # Categoria incorreta, pedir para especificar
-                self.conversation_states[conversation_id]['step'] = 'manual_category'
+                state['step'] = 'manual_category'
                 
                 return """Entendi! Vamos especificar melhor.
 
@@ -277,24 +300,23 @@ Digite o nome do setor:"""
                 fonte='whatsapp'
             )
             
+            # Gravação: a partir daqui o turno não é mais cancelado por mensagem nova
+            _antes_de_gravar()
             response = await chamados_service.criar_chamado(request)
             
             if response.status == "success":
                 # Chamado criado com sucesso
-                self.conversation_states[conversation_id] = {
-                    'step': 'ticket_created',
-                    'protocolo': response.protocolo,
-                    'chamado': response.chamado
-                }
+                categoria = state.get('categoria_sugerida', {})
+                self._set_state(state, step='ticket_created', protocolo=response.protocolo)
                 
                 return f"""🎉 **Chamado criado com sucesso!**
 
 📋 **Protocolo**: {response.protocolo}
 📝 **Descrição**: {response.chamado.titulo}
-🏢 **Setor**: {state.get('categoria_sugerida', {}).get('time_nome', 'A definir')}
+🏢 **Setor**: {categoria.get('time_nome', 'A definir')}
 📍 **Local**: {endereco}
 
-⏰ **Previsão de atendimento**: {self._calcular_previsao(state.get('categoria_sugerida', {}).get('sla_horas', 72))}
+⏰ **Previsão de atendimento**: {self._calcular_previsao(categoria.get('sla_horas', 72))}
 
 Você pode consultar o status deste chamado a qualquer momento digitando: **status {response.protocolo}**
 
@@ -368,7 +390,7 @@ Para criar um novo chamado, basta me enviar uma mensagem descrevendo seu problem
             
             # Verificar se quer criar novo chamado
             if any(word in message.lower() for word in ['novo', 'outro', 'problema', 'chamado']):
-                self.conversation_states[conversation_id] = {'step': 'collecting_issue'}
+                self._set_state(state, step='collecting_issue')
                 return """Ótimo! Vamos criar um novo chamado.
 
 Por favor, descreva o problema ou solicitação:"""
@@ -383,6 +405,51 @@ Se precisar de mais alguma coisa ou quiser criar outro chamado, é só me avisar
             logger.error(f"❌ Erro após criação do chamado: {e}")
             return "Desculpe, ocorreu um erro. Por favor, tente novamente."
     
+    @staticmethod
+    def _set_state(state: Dict[str, Any], **values):
+        """Substituir o estado do turno (mantém a mesma referência)"""
+        state.clear()
+        state.update(values)
+    
+    @staticmethod
+    def _resumir_cidadao(cidadao) -> Dict[str, Any]:
+        """Somente o necessário do cidadão para o estado da conversa"""
+        return {'id': cidadao.id, 'nome': cidadao.nome}
+    
+    @staticmethod
+    def _resumir_categoria(categoria: Dict[str, Any]) -> Dict[str, Any]:
+        """Somente os campos da categoria usados no fluxo"""
+        return {key: categoria.get(key) for key in ('id', 'nome', 'time_id', 'time_nome', 'sla_horas', 'prioridade')}
+    
+    async def _save_state(self, conversation_id: int, state: Dict[str, Any], version: int, step_lido: str,
+                          definitivo: bool = True) -> bool:
+        """Gravar o estado do turno com controle de versão
+        
+        Retorna False em conflito quando o turno pode ser refeito sobre o estado novo.
+        Se não pode (definitivo), mescla com a versão mais recente: se nenhum outro turno
+        avançou o fluxo, os dados_coletados dos dois turnos são unidos campo a campo;
+        caso contrário prevalece o outro turno.
+        """
+        try:
+            await self.conversation_states.save(conversation_id, state, version)
+            return True
+        except ConversationStateConflict:
+            if not definitivo:
+                return False
+            atual, nova_versao = await self.conversation_states.load(conversation_id)
+            if atual.get('step', 'initial') != step_lido:
+                logger.warning(f"⚠️ Conversa {conversation_id}: estado alterado por outro turno, mantendo o mais recente")
+                return True
+            if step_lido == 'collecting_data' and state.get('step') == 'collecting_data':
+                state['dados_coletados'] = {**atual.get('dados_coletados', {}), **state.get('dados_coletados', {})}
+            try:
+                await self.conversation_states.save(conversation_id, state, nova_versao)
+            except ConversationStateConflict:
+                logger.warning(f"⚠️ Conversa {conversation_id}: conflito persistente ao gravar estado")
+        except Exception as e:
+            logger.error(f"❌ Erro ao gravar estado da conversa {conversation_id}: {e}")
+        return True
+    
     def _gerar_titulo_chamado(self, descricao: str) -> str:
         """Gerar título baseado na descrição"""
         # Pegar as primeiras palavras da descrição
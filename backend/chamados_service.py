@@ -2,17 +2,25 @@
 Serviço para gerenciamento de chamados cidadãos
 """
 import os
+import json
+import base64
 import logging
 import asyncio
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Optional, List, Dict, Any, Tuple
 from decimal import Decimal
 import asyncpg
+from .categorization import KeywordMatcher
+from .protocolo_allocator import ProtocoloAllocator
+from .cache import TTLCache
+from .metricas_chamados import metricas_chamados
+from .interaction_logger import interacoes_chamado_log, agora
 from .models import (
     Cidadao, Chamado, Time, CategoriaChamado, InteracaoChamado,
     CriarChamadoRequest, CriarChamadoResponse,
-    CadastrarCidadaoRequest, CadastrarCidadaoResponse,
-    ConsultarChamadoRequest, ConsultarChamadoResponse
+    CadastrarCidadaoRequest, CadastrarCidadaoResponse, CadastrarCidadaosLoteResponse,
+    ConsultarChamadoRequest, ConsultarChamadoResponse,
+    AtualizarStatusChamadoRequest, AtualizarStatusChamadoResponse
 )
 
 logger = logging.getLogger(__name__)
@@ -24,6 +32,17 @@ class ChamadosService:
     def __init__(self):
         self.database_url = os.getenv("DATABASE_URL")
         self.pool = None
+        # Categorização: um autômato por prefeitura, recarregado periodicamente
+        self.categorias_refresh_seconds = int(os.getenv("CATEGORIAS_REFRESH_SECONDS", "300"))
+        self._categorias_matchers: Dict[int, Tuple[float, KeywordMatcher]] = {}
+        self._categorias_lock = asyncio.Lock()
+        # Protocolos: contadores por (prefixo, ano); PROTOCOLO_BLOCK_SIZE > 1 reserva blocos
+        self.protocolos = ProtocoloAllocator()
+        # Consultas por protocolo ("qual o status do meu protocolo?")
+        self._consultas_cache = TTLCache(
+            max_size=int(os.getenv("CONSULTA_CHAMADO_CACHE_SIZE", "5000")),
+            ttl=float(os.getenv("CONSULTA_CHAMADO_CACHE_TTL", "30"))
+        )
     
     async def init_db(self):
         """Inicializar pool de conexões"""
@@ -94,193 +113,27 @@ class ChamadosService:
     # ========================================
     
     async def cadastrar_cidadao(self, request: CadastrarCidadaoRequest, prefeitura_id: int = 1) -> CadastrarCidadaoResponse:
-        """Cadastrar novo cidadão"""
+        """Cadastrar novo cidadão (ou atualizar pelo telefone) em uma única chamada ao banco"""
         try:
+            data_nascimento = self._parse_data_nascimento(request.data_nascimento)
+            
             async with self.pool.acquire() as conn:
-                # Verificar se cidadão já existe
-                existing = await conn.fetchrow(
-                    """
-                    SELECT c.id,
-                           e.id AS endereco_id
-                    FROM cidadaos c
-                    LEFT JOIN LATERAL (
-                        SELECT id
-                        FROM cidadao_enderecos ce
-                        WHERE ce.cidadao_id = c.id
-                        ORDER BY ce.is_principal DESC, ce.created_at DESC
-                        LIMIT 1
-                    ) e ON TRUE
-                    WHERE c.telefone = $1
-                      AND c.prefeitura_id = $2
-                      AND c.active = TRUE
-                    """,
-                    request.telefone,
-                    prefeitura_id,
-                )
-
-                if existing:
-                    await conn.execute(
-                        """
-                        UPDATE cidadaos SET
-                            nome = $1,
-                            cpf = $2,
-                            email = $3,
-                            data_nascimento = $4,
-                            genero = $5,
-                            updated_at = NOW()
-                        WHERE id = $6
-                        """,
-                        request.nome,
-                        request.cpf,
-                        request.email,
-                        request.data_nascimento,
-                        request.genero,
-                        existing["id"],
-                    )
-
-                    if existing["endereco_id"]:
-                        await conn.execute(
-                            """
-                            UPDATE cidadao_enderecos SET
-                                cep = $1,
-                                logradouro = $2,
-                                numero = $3,
-                                bairro = $4,
-                                cidade = $5,
-                                estado = $6,
-                                complemento = $7,
-                                updated_at = NOW()
-                            WHERE id = $8
-                            """,
-                            request.cep,
-                            request.endereco,
-                            request.numero,
-                            request.bairro,
-                            request.cidade,
-                            request.estado,
-                            request.complemento,
-                            existing["endereco_id"],
-                        )
-                    else:
-                        await conn.execute(
-                            """
-                            INSERT INTO cidadao_enderecos (
-                                cidadao_id, cep, logradouro, numero, bairro,
-                                cidade, estado, complemento, is_principal,
-                                created_at
-                            ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, TRUE, NOW())
-                            """,
-                            existing["id"],
-                            request.cep,
-                            request.endereco,
-                            request.numero,
-                            request.bairro,
-                            request.cidade,
-                            request.estado,
-                            request.complemento,
-                        )
-
-                    cidadao_data = await conn.fetchrow(
-                        """
-                        SELECT
-                            c.*,
-                            e.cep,
-                            e.logradouro,
-                            e.numero,
-                            e.bairro,
-                            e.cidade,
-                            e.estado,
-                            e.complemento
-                        FROM cidadaos c
-                        LEFT JOIN cidadao_enderecos e ON e.cidadao_id = c.id
-                                                           AND e.is_principal = TRUE
-                        WHERE c.id = $1
-                        """,
-                        existing["id"],
-                    )
-
-                    # Converter config se necessário
-                    cidadao_dict = dict(cidadao_data)
-                    if isinstance(cidadao_dict.get('config'), str):
-                        try:
-                            import json
-                            cidadao_dict['config'] = json.loads(cidadao_dict['config'])
-                        except:
-                            cidadao_dict['config'] = {}
-                    
-                    return CadastrarCidadaoResponse(
-                        status="success",
-                        cidadao=Cidadao(
-                            **cidadao_dict,
-                            endereco=request.endereco,
-                            numero=request.numero,
-                            bairro=request.bairro,
-                            cidade=request.cidade,
-                            estado=request.estado,
-                            cep=request.cep,
-                            complemento=request.complemento,
-                        ),
-                        message="Dados do cidadão atualizados com sucesso",
-                    )
-                else:
-                    # Inserir novo cidadão
-                    cidadao_data = await conn.fetchrow("""
-                        INSERT INTO cidadaos (
-                            prefeitura_id, nome, cpf, telefone, email,
-                            data_nascimento, genero
-                        ) VALUES ($1, $2, $3, $4, $5, $6, $7)
-                        RETURNING *
-                        """,
-                        prefeitura_id,
-                        request.nome,
-                        request.cpf,
-                        request.telefone,
-                        request.email,
-                        request.data_nascimento,
-                        request.genero,
-                    )
-
-                    await conn.execute(
-                        """
-                        INSERT INTO cidadao_enderecos (
-                            cidadao_id, cep, logradouro, numero, bairro,
-                            cidade, estado, complemento, is_principal,
-                            created_at
-                        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, TRUE, NOW())
-                        """,
-                        cidadao_data["id"],
-                        request.cep,
-                        request.endereco,
-                        request.numero,
-                        request.bairro,
-                        request.cidade,
-                        request.estado,
-                        request.complemento,
-                    )
-                    
-                    # Converter config se necessário
-                    cidadao_dict = dict(cidadao_data)
-                    if isinstance(cidadao_dict.get('config'), str):
-                        try:
-                            import json
-                            cidadao_dict['config'] = json.loads(cidadao_dict['config'])
-                        except:
-                            cidadao_dict['config'] = {}
-                    
-                    return CadastrarCidadaoResponse(
-                        status="success",
-                        cidadao=Cidadao(
-                            **cidadao_dict,
-                            endereco=request.endereco,
-                            numero=request.numero,
-                            bairro=request.bairro,
-                            cidade=request.cidade,
-                            estado=request.estado,
-                            cep=request.cep,
-                            complemento=request.complemento,
-                        ),
-                        message="Cidadão cadastrado com sucesso",
+                cidadao_data = await conn.fetchrow("""
+                    SELECT * FROM upsert_cidadao(
+                        $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14
                     )
+                """, prefeitura_id, request.telefone, request.nome, request.cpf, request.email,
+                    data_nascimento, request.genero, request.cep, request.endereco, request.numero,
+                    request.bairro, request.cidade, request.estado, request.complemento)
+            
+            cidadao_dict = dict(cidadao_data)
+            inserido = cidadao_dict.pop('inserido')
+            
+            return CadastrarCidadaoResponse(
+                status="success",
+                cidadao=Cidadao(**cidadao_dict),
+                message="Cidadão cadastrado com sucesso" if inserido else "Dados do cidadão atualizados com sucesso",
+            )
                     
         except Exception as e:
             logger.error(f"❌ Erro ao cadastrar cidadão: {e}")
@@ -289,6 +142,79 @@ class ChamadosService:
                 message=f"Erro ao cadastrar cidadão: {str(e)}"
             )
     
+    async def cadastrar_cidadaos_lote(self, requests: List[CadastrarCidadaoRequest],
+                                      prefeitura_id: int = 1) -> CadastrarCidadaosLoteResponse:
+        """Cadastrar/atualizar vários cidadãos (importação do CadÚnico)
+        
+        Cada bloco de CIDADAOS_LOTE_TAMANHO registros é enviado numa única chamada
+        a upsert_cidadaos(); erros ficam isolados por registro.
+        """
+        tamanho = int(os.getenv("CIDADAOS_LOTE_TAMANHO", "500"))
+        inseridos = atualizados = 0
+        erros: List[Dict[str, Any]] = []
+        
+        try:
+            registros = []
+            for indice, request in enumerate(requests):
+                try:
+                    data_nascimento = self._parse_data_nascimento(request.data_nascimento)
+                except ValueError as e:
+                    erros.append({"indice": indice, "telefone": request.telefone, "erro": str(e)})
+                    continue
+                registro = request.dict()
+                registro["data_nascimento"] = data_nascimento.isoformat() if data_nascimento else None
+                registros.append((indice, registro))
+            
+            async with self.pool.acquire() as conn:
+                for inicio in range(0, len(registros), tamanho):
+                    bloco = registros[inicio:inicio + tamanho]
+                    resultados = await conn.fetch("""
+                        SELECT indice, cidadao_id, inserido, erro FROM upsert_cidadaos($1, $2::jsonb)
+                    """, prefeitura_id, json.dumps([registro for _, registro in bloco]))
+                    
+                    for resultado in resultados:
+                        indice, registro = bloco[resultado['indice']]
+                        if resultado['erro']:
+                            erros.append({"indice": indice, "telefone": registro["telefone"], "erro": resultado['erro']})
+                        elif resultado['inserido']:
+                            inseridos += 1
+                        else:
+                            atualizados += 1
+            
+            erros.sort(key=lambda erro: erro["indice"])
+            logger.info(f"📥 Lote de cidadãos: {inseridos} novo(s), {atualizados} atualizado(s), {len(erros)} erro(s)")
+            return CadastrarCidadaosLoteResponse(
+                status="success" if not erros else "partial",
+                total=len(requests),
+                inseridos=inseridos,
+                atualizados=atualizados,
+                erros=erros,
+                message=f"{inseridos + atualizados} de {len(requests)} cidadão(s) processado(s)"
+            )
+            
+        except Exception as e:
+            logger.error(f"❌ Erro ao cadastrar lote de cidadãos: {e}")
+            return CadastrarCidadaosLoteResponse(
+                status="error",
+                total=len(requests),
+                inseridos=inseridos,
+                atualizados=atualizados,
+                erros=erros,
+                message=f"Erro ao cadastrar lote de cidadãos: {str(e)}"
+            )
+    
+    @staticmethod
+    def _parse_data_nascimento(valor: Optional[str]) -> Optional[date]:
+        """Aceita AAAA-MM-DD ou DD/MM/AAAA"""
+        if not valor:
+            return None
+        for formato in ("%Y-%m-%d", "%d/%m/%Y"):
+            try:
+                return datetime.strptime(valor.strip(), formato).date()
+            except ValueError:
+                continue
+        raise ValueError(f"Data de nascimento inválida: {valor}")
+    
     async def buscar_cidadao_por_telefone(self, telefone: str, prefeitura_id: int = 1) -> Optional[Cidadao]:
         """Buscar cidadão por telefone"""
         try:
@@ -322,26 +248,27 @@ class ChamadosService:
     async def criar_chamado(self, request: CriarChamadoRequest, prefeitura_id: int = 1) -> CriarChamadoResponse:
         """Criar novo chamado"""
         try:
+            # Buscar cidadão
+            cidadao = await self.buscar_cidadao_por_telefone(request.cidadao_telefone, prefeitura_id)
+            if not cidadao:
+                return CriarChamadoResponse(
+                    status="error",
+                    message="Cidadão não encontrado. É necessário cadastrar primeiro."
+                )
+            
+            # Categorizar automaticamente
+            categoria = await self._categorizar_chamado(request.titulo + " " + request.descricao, prefeitura_id)
+            
+            # Calcular SLA deadline
+            sla_deadline = None
+            if categoria:
+                sla_deadline = datetime.now() + timedelta(hours=categoria['sla_horas'])
+            
+            # Uma conexão só para protocolo + INSERT (as consultas acima usam a sua própria)
             async with self.pool.acquire() as conn:
-                # Buscar cidadão
-                cidadao = await self.buscar_cidadao_por_telefone(request.cidadao_telefone, prefeitura_id)
-                if not cidadao:
-                    return CriarChamadoResponse(
-                        status="error",
-                        message="Cidadão não encontrado. É necessário cadastrar primeiro."
-                    )
-                
-                # Categorizar automaticamente
-                categoria = await self._categorizar_chamado(request.titulo + " " + request.descricao, prefeitura_id)
-                
                 # Gerar protocolo
                 protocolo = await self._gerar_protocolo(categoria['time_id'] if categoria else None, conn)
                 
-                # Calcular SLA deadline
-                sla_deadline = None
-                if categoria:
-                    sla_deadline = datetime.now() + timedelta(hours=categoria['sla_horas'])
-                
                 # Inserir chamado
                 chamado_data = await conn.fetchrow("""
                     INSERT INTO chamados (
@@ -354,19 +281,19 @@ class ChamadosService:
                      categoria['time_id'] if categoria else None, request.titulo, request.descricao,
                      request.endereco_ocorrencia, request.latitude, request.longitude,
                      categoria['prioridade'] if categoria else 'normal', sla_deadline, request.fonte)
-                
-                # Registrar interação
-                await self._registrar_interacao(
-                    chamado_data['id'], None, 'mensagem', 
-                    f"Chamado criado automaticamente via {request.fonte}", {}
-                )
-                
-                return CriarChamadoResponse(
-                    status="success",
-                    chamado=Chamado(**chamado_data),
-                    protocolo=protocolo,
-                    message=f"Chamado criado com sucesso! Protocolo: {protocolo}"
-                )
+            
+            # Registrar interação
+            await self._registrar_interacao(
+                chamado_data['id'], None, 'mensagem', 
+                f"Chamado criado automaticamente via {request.fonte}", {}
+            )
+            
+            return CriarChamadoResponse(
+                status="success",
+                chamado=self._chamado_from_row(chamado_data),
+                protocolo=protocolo,
+                message=f"Chamado criado com sucesso! Protocolo: {protocolo}"
+            )
                 
         except Exception as e:
             logger.error(f"❌ Erro ao criar chamado: {e}")
@@ -376,73 +303,73 @@ class ChamadosService:
             )
     
     async def consultar_chamado(self, request: ConsultarChamadoRequest, prefeitura_id: int = 1) -> ConsultarChamadoResponse:
-        """Consultar chamado por protocolo ou telefone"""
+        """Consultar chamado por protocolo ou telefone
+        
+        Chamado, cidadão (com endereço principal), categoria e time vêm de uma
+        única consulta. Consultas por protocolo passam por um cache curto
+        (CONSULTA_CHAMADO_CACHE_TTL), invalidado quando o status muda.
+        """
         try:
+            if request.protocolo:
+                cache_key = (prefeitura_id, request.protocolo.upper())
+                cached = self._consultas_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+                filtro = "c.protocolo = $1"
+                valor = request.protocolo.upper()
+            elif request.telefone_cidadao:
+                # Último chamado do cidadão
+                filtro = "c.cidadao_id IN (SELECT id FROM cidadaos WHERE telefone = $1 AND prefeitura_id = $2)"
+                valor = request.telefone_cidadao
+            else:
+                return ConsultarChamadoResponse(
+                    status="error",
+                    message="É necessário informar protocolo ou telefone do cidadão"
+                )
+            
             async with self.pool.acquire() as conn:
-                if request.protocolo:
-                    # Buscar por protocolo
-                    chamado_data = await conn.fetchrow("""
-                        SELECT c.*, ci.nome as cidadao_nome, ci.telefone as cidadao_telefone,
-                               cat.nome as categoria_nome, t.nome as time_nome
-                        FROM chamados c
-                        JOIN cidadaos ci ON c.cidadao_id = ci.id
-                        LEFT JOIN categorias_chamados cat ON c.categoria_id = cat.id
-                        LEFT JOIN times t ON c.time_id = t.id
-                        WHERE c.protocolo = $1 AND c.prefeitura_id = $2
-                    """, request.protocolo, prefeitura_id)
-                    
-                elif request.telefone_cidadao:
-                    # Buscar último chamado do cidadão
-                    chamado_data = await conn.fetchrow("""
-                        SELECT c.*, ci.nome as cidadao_nome, ci.telefone as cidadao_telefone,
-                               cat.nome as categoria_nome, t.nome as time_nome
-                        FROM chamados c
-                        JOIN cidadaos ci ON c.cidadao_id = ci.id
-                        LEFT JOIN categorias_chamados cat ON c.categoria_id = cat.id
-                        LEFT JOIN times t ON c.time_id = t.id
-                        WHERE ci.telefone = $1 AND c.prefeitura_id = $2
-                        ORDER BY c.created_at DESC
+                row = await conn.fetchrow(f"""
+                    SELECT to_jsonb(c) AS chamado,
+                           to_jsonb(ci) || jsonb_build_object(
+                               'endereco', e.logradouro, 'numero', e.numero, 'bairro', e.bairro,
+                               'cidade', e.cidade, 'estado', e.estado, 'cep', e.cep,
+                               'complemento', e.complemento
+                           ) AS cidadao,
+                           to_jsonb(cat) AS categoria,
+                           to_jsonb(t) AS time
+                    FROM chamados c
+                    JOIN cidadaos ci ON c.cidadao_id = ci.id
+                    LEFT JOIN LATERAL (
+                        SELECT * FROM cidadao_enderecos ce
+                        WHERE ce.cidadao_id = ci.id
+                        ORDER BY ce.is_principal DESC, ce.created_at DESC
                         LIMIT 1
-                    """, request.telefone_cidadao, prefeitura_id)
-                else:
-                    return ConsultarChamadoResponse(
-                        status="error",
-                        message="É necessário informar protocolo ou telefone do cidadão"
-                    )
-                
-                if not chamado_data:
-                    return ConsultarChamadoResponse(
-                        status="error",
-                        message="Chamado não encontrado"
-                    )
-                
-                # Buscar dados completos
-                cidadao = await self.buscar_cidadao_por_telefone(chamado_data['cidadao_telefone'], prefeitura_id)
-                
-                categoria = None
-                if chamado_data['categoria_id']:
-                    categoria_data = await conn.fetchrow("""
-                        SELECT * FROM categorias_chamados WHERE id = $1
-                    """, chamado_data['categoria_id'])
-                    if categoria_data:
-                        categoria = CategoriaChamado(**categoria_data)
-                
-                time = None
-                if chamado_data['time_id']:
-                    time_data = await conn.fetchrow("""
-                        SELECT * FROM times WHERE id = $1
-                    """, chamado_data['time_id'])
-                    if time_data:
-                        time = Time(**time_data)
-                
+                    ) e ON TRUE
+                    LEFT JOIN categorias_chamados cat ON c.categoria_id = cat.id
+                    LEFT JOIN times t ON c.time_id = t.id
+                    WHERE {filtro} AND c.prefeitura_id = $2
+                    ORDER BY c.created_at DESC
+                    LIMIT 1
+                """, valor, prefeitura_id)
+            
+            if not row:
                 return ConsultarChamadoResponse(
-                    status="success",
-                    chamado=Chamado(**chamado_data),
-                    cidadao=cidadao,
-                    categoria=categoria,
-                    time=time,
-                    message="Chamado encontrado com sucesso"
+                    status="error",
+                    message="Chamado não encontrado"
                 )
+            
+            categoria = json.loads(row['categoria']) if row['categoria'] else None
+            time = json.loads(row['time']) if row['time'] else None
+            response = ConsultarChamadoResponse(
+                status="success",
+                chamado=Chamado(**json.loads(row['chamado'])),
+                cidadao=Cidadao(**json.loads(row['cidadao'])),
+                categoria=CategoriaChamado(**categoria) if categoria else None,
+                time=Time(**time) if time else None,
+                message="Chamado encontrado com sucesso"
+            )
+            self._consultas_cache.set((prefeitura_id, response.chamado.protocolo), response)
+            return response
                 
         except Exception as e:
             logger.error(f"❌ Erro ao consultar chamado: {e}")
@@ -451,6 +378,59 @@ class ChamadosService:
                 message=f"Erro ao consultar chamado: {str(e)}"
             )
     
+    async def atualizar_status_chamado(self, protocolo: str, request: AtualizarStatusChamadoRequest,
+                                       prefeitura_id: int = 1) -> AtualizarStatusChamadoResponse:
+        """Atualizar status do chamado e registrar a mudança no histórico (uma consulta)"""
+        try:
+            protocolo = protocolo.upper()
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow("""
+                    WITH atualizado AS (
+                        UPDATE chamados c SET
+                            status = $3::varchar,
+                            resolved_at = CASE WHEN $3::varchar = 'resolvido' THEN COALESCE(anterior.resolved_at, NOW()) END,
+                            updated_at = NOW()
+                        FROM chamados anterior
+                        WHERE anterior.id = c.id
+                          AND c.protocolo = $1
+                          AND c.prefeitura_id = $2
+                        RETURNING c.*, anterior.status AS status_anterior
+                    ), interacao AS (
+                        INSERT INTO interacoes_chamado (chamado_id, agente_id, tipo, conteudo, metadata)
+                        SELECT id, $4, 'status_change', $5,
+                               jsonb_build_object('status_anterior', status_anterior, 'status', status)
+                        FROM atualizado
+                    )
+                    SELECT * FROM atualizado
+                """, protocolo, prefeitura_id, request.status, request.agente_id,
+                    request.observacao or f"Status alterado para {request.status}")
+            
+            # Status mudou: a próxima consulta do protocolo vai ao banco
+            self._consultas_cache.delete((prefeitura_id, protocolo))
+            
+            if not row:
+                return AtualizarStatusChamadoResponse(
+                    status="error",
+                    message="Chamado não encontrado"
+                )
+            
+            chamado_dict = dict(row)
+            status_anterior = chamado_dict.pop('status_anterior')
+            logger.info(f"🔄 Chamado {protocolo}: {status_anterior} -> {request.status}")
+            return AtualizarStatusChamadoResponse(
+                status="success",
+                chamado=self._chamado_from_row(chamado_dict),
+                status_anterior=status_anterior,
+                message=f"Status do chamado atualizado para {request.status}"
+            )
+            
+        except Exception as e:
+            logger.error(f"❌ Erro ao atualizar status do chamado: {e}")
+            return AtualizarStatusChamadoResponse(
+                status="error",
+                message=f"Erro ao atualizar status do chamado: {str(e)}"
+            )
+    
     # ========================================
     # MÉTODOS AUXILIARES
     # ========================================
@@ -458,71 +438,91 @@ class ChamadosService:
     async def _categorizar_chamado(self, texto: str, prefeitura_id: int) -> Optional[Dict[str, Any]]:
         """Categorizar chamado baseado no texto"""
         try:
+            matcher = await self._get_categorias_matcher(prefeitura_id)
+            melhor = matcher.best(texto)
+            return dict(melhor["data"]) if melhor else None
+                
+        except Exception as e:
+            logger.error(f"❌ Erro ao categorizar chamado: {e}")
+            return None
+    
+    async def _get_categorias_matcher(self, prefeitura_id: int) -> KeywordMatcher:
+        """Autômato de palavras-chave das categorias ativas da prefeitura
+        
+        As categorias são relidas a cada CATEGORIAS_REFRESH_SECONDS (ou após
+        invalidar_categorias); só as que mudaram são atualizadas no autômato.
+        """
+        loaded_at, matcher = self._categorias_matchers.get(prefeitura_id, (0.0, None))
+        loop = asyncio.get_running_loop()
+        if matcher is not None and loop.time() - loaded_at < self.categorias_refresh_seconds:
+            return matcher
+        
+        # Uma releitura por vez; quem esperou usa o resultado
+        async with self._categorias_lock:
+            loaded_at, matcher = self._categorias_matchers.get(prefeitura_id, (0.0, None))
+            if matcher is not None and loop.time() - loaded_at < self.categorias_refresh_seconds:
+                return matcher
+            
             async with self.pool.acquire() as conn:
-                # Buscar categorias com palavras-chave
                 categorias = await conn.fetch("""
                     SELECT cc.*, t.nome as time_nome
                     FROM categorias_chamados cc
                     JOIN times t ON cc.time_id = t.id
                     WHERE cc.prefeitura_id = $1 AND cc.active = true
+                    ORDER BY cc.id
                 """, prefeitura_id)
-                
-                texto_lower = texto.lower()
-                melhor_match = None
-                melhor_score = 0
-                
-                for categoria in categorias:
-                    score = 0
-                    keywords = categoria['keywords'] or []
-                    
-                    for keyword in keywords:
-                        if keyword.lower() in texto_lower:
-                            score += 1
-                    
-                    if score > melhor_score:
-                        melhor_score = score
-                        melhor_match = dict(categoria)
-                
-                return melhor_match if melhor_match and melhor_score > 0 else None
-                
-        except Exception as e:
-            logger.error(f"❌ Erro ao categorizar chamado: {e}")
-            return None
+            
+            matcher = matcher or KeywordMatcher()
+            changed = matcher.sync(
+                {categoria['id']: dict(categoria) for categoria in categorias},
+                keywords_getter=lambda categoria: categoria['keywords'] or []
+            )
+            if changed:
+                logger.info(f"🏷️ Categorias da prefeitura {prefeitura_id}: {changed} atualizada(s), {len(matcher)} ativa(s)")
+            self._categorias_matchers[prefeitura_id] = (loop.time(), matcher)
+            return matcher
+    
+    def invalidar_categorias(self, prefeitura_id: Optional[int] = None):
+        """Forçar releitura das categorias na próxima categorização"""
+        if prefeitura_id is None:
+            for key, (_, matcher) in self._categorias_matchers.items():
+                self._categorias_matchers[key] = (0.0, matcher)
+        elif prefeitura_id in self._categorias_matchers:
+            self._categorias_matchers[prefeitura_id] = (0.0, self._categorias_matchers[prefeitura_id][1])
     
     async def _gerar_protocolo(self, time_id: Optional[int], conn) -> str:
-        """Gerar protocolo único"""
+        """Gerar protocolo único (contador por prefixo/ano, migration 009)"""
         try:
-            if time_id:
-                # Gerar protocolo com prefixo do time
-                protocolo = await conn.fetchval("""
-                    SELECT gerar_protocolo_chamado($1)
-                """, time_id)
-                return protocolo
-            else:
-                # Protocolo genérico
-                ano = datetime.now().year
-                sequencial = await conn.fetchval("""
-                    SELECT COALESCE(MAX(CAST(SUBSTRING(protocolo FROM '\d+$') AS INT)), 0) + 1
-                    FROM chamados 
-                    WHERE protocolo LIKE 'GERAL-' || $1 || '-%'
-                """, ano)
-                return f"GERAL-{ano}-{sequencial:03d}"
+            return await self.protocolos.gerar(conn, time_id)
                 
+        except asyncpg.exceptions.UndefinedFunctionError:
+            logger.warning("⚠️ reservar_protocolos() não existe; aplique a migration 009")
+            return await conn.fetchval("SELECT gerar_protocolo_chamado($1)", time_id)
         except Exception as e:
             logger.error(f"❌ Erro ao gerar protocolo: {e}")
             # Fallback
             return f"CHAMADO-{datetime.now().strftime('%Y%m%d%H%M%S')}"
     
+    @staticmethod
+    def _chamado_from_row(row) -> Chamado:
+        """Converter linha de chamados em modelo (campos JSONB chegam como texto)"""
+        chamado_dict = dict(row)
+        for campo, padrao in (('anexos', []), ('config', {})):
+            if isinstance(chamado_dict.get(campo), str):
+                try:
+                    chamado_dict[campo] = json.loads(chamado_dict[campo])
+                except ValueError:
+                    chamado_dict[campo] = padrao
+        return Chamado(**chamado_dict)
+    
     async def _registrar_interacao(self, chamado_id: int, agente_id: Optional[int], 
                                  tipo: str, conteudo: str, metadata: Dict[str, Any]):
-        """Registrar interação no histórico do chamado"""
+        """Registrar interação no histórico do chamado (gravação em lote, sem esperar o banco)"""
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute("""
-                    INSERT INTO interacoes_chamado (chamado_id, agente_id, tipo, conteudo, metadata)
-                    VALUES ($1, $2, $3, $4, $5)
-                """, chamado_id, agente_id, tipo, conteudo, metadata)
-                
+            await interacoes_chamado_log.put((
+                chamado_id, agente_id, tipo, conteudo,
+                json.dumps(metadata or {}, default=str), agora()
+            ))
         except Exception as e:
             logger.error(f"❌ Erro ao registrar interação: {e}")
     
@@ -531,7 +531,15 @@ class ChamadosService:
     # ========================================
     
     async def obter_metricas_dashboard(self, prefeitura_id: int = 1) -> Dict[str, Any]:
-        """Obter métricas para dashboard"""
+        """Obter métricas para dashboard (contadores incrementais da migration 012)"""
+        try:
+            return await metricas_chamados.obter(prefeitura_id)
+        except asyncpg.UndefinedTableError:
+            logger.warning("⚠️ metricas_chamados não existe (migration 012); usando vw_dashboard_metrics")
+        except Exception as e:
+            logger.error(f"❌ Erro ao obter métricas: {e}")
+            return {}
+        
         try:
             async with self.pool.acquire() as conn:
                 metrics = await conn.fetchrow("""
@@ -555,27 +563,110 @@ class ChamadosService:
             logger.error(f"❌ Erro ao obter métricas: {e}")
             return {}
     
-    async def listar_cidadaos(self, prefeitura_id: int = 1):
-        """Listar todos os cidadãos cadastrados"""
+    # ========================================
+    # LISTAGENS (paginação por cursor)
+    # ========================================
+    
+    def _filtros_cidadaos(self, prefeitura_id: int, cursor: Optional[str],
+                          data_inicio: Optional[datetime], data_fim: Optional[datetime]) -> Tuple[str, list]:
+        filtros = ["c.prefeitura_id = $1", "c.active = true"]
+        args: list = [prefeitura_id]
+        if data_inicio:
+            args.append(data_inicio)
+            filtros.append(f"c.created_at >= ${len(args)}")
+        if data_fim:
+            args.append(data_fim)
+            filtros.append(f"c.created_at < ${len(args)}")
+        if cursor:
+            self._filtro_cursor(cursor, args, filtros)
+        return """
+            SELECT
+                c.id,
+                c.nome,
+                c.telefone,
+                c.email,
+                c.chatwoot_contact_id,
+                c.created_at,
+                c.updated_at,
+                e.cep,
+                e.logradouro,
+                e.numero,
+                e.bairro,
+                e.cidade,
+                e.estado,
+                e.complemento
+            FROM cidadaos c
+            LEFT JOIN LATERAL (
+                SELECT *
+                FROM cidadao_enderecos ce
+                WHERE ce.cidadao_id = c.id
+                ORDER BY ce.is_principal DESC, ce.created_at DESC
+                LIMIT 1
+            ) e ON TRUE
+            WHERE """ + " AND ".join(filtros) + """
+            ORDER BY c.created_at DESC NULLS FIRST, c.id DESC
+        """, args
+    
+    @staticmethod
+    def _cidadao_listagem(row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "nome": row["nome"],
+            "telefone": row["telefone"],
+            "email": row["email"],
+            "endereco": {
+                "cep": row["cep"],
+                "logradouro": row["logradouro"],
+                "numero": row["numero"],
+                "bairro": row["bairro"],
+                "cidade": row["cidade"],
+                "estado": row["estado"],
+                "complemento": row["complemento"],
+            },
+            "chatwoot_contact_id": row["chatwoot_contact_id"],
+            "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+            "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None
+        }
+    
+    async def listar_cidadaos(self, prefeitura_id: int = 1, limit: int = 50, cursor: Optional[str] = None,
+                              data_inicio: Optional[datetime] = None,
+                              data_fim: Optional[datetime] = None,
+                              incluir_total: bool = False) -> Dict[str, Any]:
+        """Listar cidadãos cadastrados, mais recentes primeiro
+        
+        Retorna {"data": [...], "next_cursor": ...}; next_cursor é None na última página.
+        Com incluir_total, "total" traz a contagem de todos os registros do filtro.
+        Cursor inválido levanta ValueError.
+        """
+        query, args = self._filtros_cidadaos(prefeitura_id, cursor, data_inicio, data_fim)
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(f"{query} LIMIT {limit + 1}", *args)
+                pagina = self._pagina(rows, limit, self._cidadao_listagem)
+                if incluir_total:
+                    query, args = self._filtros_cidadaos(prefeitura_id, None, data_inicio, data_fim)
+                    pagina["total"] = await conn.fetchval(f"SELECT COUNT(*) FROM ({self._sem_ordem(query)}) q", *args)
+            return pagina
+        except Exception as e:
+            logger.error(f"❌ Erro ao listar cidadãos: {e}")
+            return {"data": [], "next_cursor": None}
+    
+    async def stream_cidadaos(self, prefeitura_id: int = 1, cursor: Optional[str] = None,
+                              data_inicio: Optional[datetime] = None,
+                              data_fim: Optional[datetime] = None):
+        """Cidadãos um a um via cursor do banco (memória constante)"""
+        query, args = self._filtros_cidadaos(prefeitura_id, cursor, data_inicio, data_fim)
+        async for row in self._stream(query, args):
+            yield self._cidadao_listagem(row)
+
+    async def obter_cidadao(self, cidadao_id: int, prefeitura_id: int = 1) -> Optional[Dict[str, Any]]:
+        """Cidadão no formato da listagem, com os campos do formulário de edição"""
         try:
             async with self.pool.acquire() as conn:
-                cidadaos_data = await conn.fetch(
-                    """
-                    SELECT
-                        c.id,
-                        c.nome,
-                        c.telefone,
-                        c.email,
-                        c.chatwoot_contact_id,
-                        c.created_at,
-                        c.updated_at,
-                        e.cep,
-                        e.logradouro,
-                        e.numero,
-                        e.bairro,
-                        e.cidade,
-                        e.estado,
-                        e.complemento
+                row = await conn.fetchrow("""
+                    SELECT c.id, c.nome, c.cpf, c.telefone, c.email, c.chatwoot_contact_id,
+                           c.data_nascimento, c.genero, c.active, c.created_at, c.updated_at,
+                           e.cep, e.logradouro, e.numero, e.bairro, e.cidade, e.estado, e.complemento
                     FROM cidadaos c
                     LEFT JOIN LATERAL (
                         SELECT *
@@ -584,79 +675,155 @@ class ChamadosService:
                         ORDER BY ce.is_principal DESC, ce.created_at DESC
                         LIMIT 1
                     ) e ON TRUE
-                    WHERE c.prefeitura_id = $1 AND c.active = true
-                    ORDER BY c.created_at DESC
-                    """,
-                    prefeitura_id,
-                )
-                
-                cidadaos = []
-                for row in cidadaos_data:
-                    cidadaos.append({
-                        "id": row["id"],
-                        "nome": row["nome"],
-                        "telefone": row["telefone"],
-                        "email": row["email"],
-                        "endereco": {
-                            "cep": row["cep"],
-                            "logradouro": row["logradouro"],
-                            "numero": row["numero"],
-                            "bairro": row["bairro"],
-                            "cidade": row["cidade"],
-                            "estado": row["estado"],
-                            "complemento": row["complemento"],
-                        },
-                        "chatwoot_contact_id": row["chatwoot_contact_id"],
-                        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
-                        "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None
-                    })
-                
-                return cidadaos
-                
+                    WHERE c.id = $1 AND c.prefeitura_id = $2
+                """, cidadao_id, prefeitura_id)
+            if not row:
+                return None
+            cidadao = self._cidadao_listagem(row)
+            cidadao.update({
+                "cpf": row["cpf"],
+                "data_nascimento": row["data_nascimento"].isoformat() if row["data_nascimento"] else None,
+                "genero": row["genero"],
+                "active": row["active"],
+            })
+            return cidadao
         except Exception as e:
-            logger.error(f"❌ Erro ao listar cidadãos: {e}")
-            return []
+            logger.error(f"❌ Erro ao obter cidadão {cidadao_id}: {e}")
+            return None
+
+    def _filtros_chamados(self, prefeitura_id: int, cursor: Optional[str], status: Optional[str],
+                          time_id: Optional[int], categoria_id: Optional[int],
+                          data_inicio: Optional[datetime], data_fim: Optional[datetime]) -> Tuple[str, list]:
+        filtros = ["c.prefeitura_id = $1"]
+        args: list = [prefeitura_id]
+        for coluna, valor in (("c.status", status), ("c.time_id", time_id), ("c.categoria_id", categoria_id)):
+            if valor is not None:
+                args.append(valor)
+                filtros.append(f"{coluna} = ${len(args)}")
+        if data_inicio:
+            args.append(data_inicio)
+            filtros.append(f"c.created_at >= ${len(args)}")
+        if data_fim:
+            args.append(data_fim)
+            filtros.append(f"c.created_at < ${len(args)}")
+        if cursor:
+            self._filtro_cursor(cursor, args, filtros)
+        return """
+            SELECT c.id, c.protocolo, c.titulo, c.descricao, c.status, c.prioridade,
+                   c.created_at, c.updated_at, c.resolved_at,
+                   ci.nome as cidadao_nome, ci.telefone as cidadao_telefone,
+                   cat.nome as categoria_nome, t.nome as time_nome
+            FROM chamados c
+            JOIN cidadaos ci ON c.cidadao_id = ci.id
+            LEFT JOIN categorias_chamados cat ON c.categoria_id = cat.id
+            LEFT JOIN times t ON c.time_id = t.id
+            WHERE """ + " AND ".join(filtros) + """
+            ORDER BY c.created_at DESC NULLS FIRST, c.id DESC
+        """, args
     
-    async def listar_chamados(self, prefeitura_id: int = 1):
-        """Listar todos os chamados"""
+    @staticmethod
+    def _chamado_listagem(row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "protocolo": row["protocolo"],
+            "titulo": row["titulo"],
+            "descricao": row["descricao"],
+            "status": row["status"],
+            "prioridade": row["prioridade"],
+            "cidadao_nome": row["cidadao_nome"],
+            "cidadao_telefone": row["cidadao_telefone"],
+            "categoria_nome": row["categoria_nome"],
+            "time_nome": row["time_nome"],
+            "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+            "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None,
+            "resolved_at": row["resolved_at"].isoformat() if row["resolved_at"] else None
+        }
+    
+    async def listar_chamados(self, prefeitura_id: int = 1, limit: int = 50, cursor: Optional[str] = None,
+                              status: Optional[str] = None, time_id: Optional[int] = None,
+                              categoria_id: Optional[int] = None, data_inicio: Optional[datetime] = None,
+                              data_fim: Optional[datetime] = None,
+                              incluir_total: bool = False) -> Dict[str, Any]:
+        """Listar chamados, mais recentes primeiro
+        
+        Retorna {"data": [...], "next_cursor": ...}; next_cursor é None na última página.
+        Com incluir_total, "total" traz a contagem de todos os registros do filtro.
+        Cursor inválido levanta ValueError.
+        """
+        query, args = self._filtros_chamados(prefeitura_id, cursor, status, time_id, categoria_id,
+                                             data_inicio, data_fim)
         try:
             async with self.pool.acquire() as conn:
-                chamados_data = await conn.fetch("""
-                    SELECT c.id, c.protocolo, c.titulo, c.descricao, c.status, c.prioridade,
-                           c.created_at, c.updated_at, c.resolved_at,
-                           ci.nome as cidadao_nome, ci.telefone as cidadao_telefone,
-                           cat.nome as categoria_nome, t.nome as time_nome
-                    FROM chamados c
-                    JOIN cidadaos ci ON c.cidadao_id = ci.id
-                    LEFT JOIN categorias_chamados cat ON c.categoria_id = cat.id
-                    LEFT JOIN times t ON c.time_id = t.id
-                    WHERE c.prefeitura_id = $1
-                    ORDER BY c.created_at DESC
-                """, prefeitura_id)
-                
-                chamados = []
-                for row in chamados_data:
-                    chamados.append({
-                        "id": row["id"],
-                        "protocolo": row["protocolo"],
-                        "titulo": row["titulo"],
-                        "descricao": row["descricao"],
-                        "status": row["status"],
-                        "prioridade": row["prioridade"],
-                        "cidadao_nome": row["cidadao_nome"],
-                        "cidadao_telefone": row["cidadao_telefone"],
-                        "categoria_nome": row["categoria_nome"],
-                        "time_nome": row["time_nome"],
-                        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
-                        "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None,
-                        "resolved_at": row["resolved_at"].isoformat() if row["resolved_at"] else None
-                    })
-                
-                return chamados
-                
+                rows = await conn.fetch(f"{query} LIMIT {limit + 1}", *args)
+                pagina = self._pagina(rows, limit, self._chamado_listagem)
+                if incluir_total:
+                    query, args = self._filtros_chamados(prefeitura_id, None, status, time_id, categoria_id,
+                                                         data_inicio, data_fim)
+                    pagina["total"] = await conn.fetchval(f"SELECT COUNT(*) FROM ({self._sem_ordem(query)}) q", *args)
+            return pagina
         except Exception as e:
             logger.error(f"❌ Erro ao listar chamados: {e}")
-            return []
+            return {"data": [], "next_cursor": None}
+    
+    async def stream_chamados(self, prefeitura_id: int = 1, cursor: Optional[str] = None,
+                              status: Optional[str] = None, time_id: Optional[int] = None,
+                              categoria_id: Optional[int] = None, data_inicio: Optional[datetime] = None,
+                              data_fim: Optional[datetime] = None):
+        """Chamados um a um via cursor do banco (memória constante)"""
+        query, args = self._filtros_chamados(prefeitura_id, cursor, status, time_id, categoria_id,
+                                             data_inicio, data_fim)
+        async for row in self._stream(query, args):
+            yield self._chamado_listagem(row)
+    
+    @staticmethod
+    def _filtro_cursor(cursor: str, args: list, filtros: List[str]):
+        # Ordem (created_at DESC NULLS FIRST, id DESC): linhas sem data vêm antes de todas as outras
+        created_at, ultimo_id = decodificar_cursor(cursor)
+        if created_at is None:
+            args.append(ultimo_id)
+            filtros.append(f"((c.created_at IS NULL AND c.id < ${len(args)}) OR c.created_at IS NOT NULL)")
+        else:
+            args.extend([created_at, ultimo_id])
+            filtros.append(f"(c.created_at, c.id) < (${len(args) - 1}, ${len(args)})")
+    
+    @staticmethod
+    def _sem_ordem(query: str) -> str:
+        # ORDER BY externo não importa para COUNT(*)
+        return query.rsplit("ORDER BY", 1)[0]
+    
+    @staticmethod
+    def _pagina(rows, limit: int, serializar) -> Dict[str, Any]:
+        # limit + 1 linhas: a extra só indica que existe próxima página
+        pagina = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            ultimo = pagina[-1]
+            next_cursor = codificar_cursor(ultimo["created_at"], ultimo["id"])
+        return {"data": [serializar(row) for row in pagina], "next_cursor": next_cursor}
+    
+    async def _stream(self, query: str, args: list):
+        # Cursor de servidor exige transação; a conexão fica presa até o fim do stream
+        prefetch = int(os.getenv("LISTAGEM_STREAM_PREFETCH", "500"))
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                async for row in conn.cursor(query, *args, prefetch=prefetch):
+                    yield row
+
+
+def codificar_cursor(created_at: Optional[datetime], registro_id: int) -> str:
+    """Cursor opaco para a posição (created_at, id) da última linha da página"""
+    bruto = f"{created_at.isoformat() if created_at else ''}|{registro_id}".encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """Inverso de codificar_cursor; ValueError se o cursor for inválido"""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, registro_id = bruto.rsplit("|", 1)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(registro_id)
+    except Exception:
+        raise ValueError("Cursor de paginação inválido")
 
 
 # Instância global do serviço
@@ -0,0 +1,321 @@
+"""
+Cliente HTTP compartilhado para a API do Chatwoot
+"""
+import os
+import random
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Timeouts (segundos) por endpoint; uploads de mídia precisam de mais tempo
+DEFAULT_TIMEOUTS: Dict[str, float] = {
+    "default": float(os.getenv("CHATWOOT_TIMEOUT", "10")),
+    "list_conversations": float(os.getenv("CHATWOOT_TIMEOUT_LIST", "10")),
+    "list_messages": float(os.getenv("CHATWOOT_TIMEOUT_LIST", "10")),
+    "send_message": float(os.getenv("CHATWOOT_TIMEOUT_SEND", "10")),
+    "send_attachment": float(os.getenv("CHATWOOT_TIMEOUT_UPLOAD", "60")),
+    "download_media": float(os.getenv("CHATWOOT_TIMEOUT_DOWNLOAD", "60")),
+}
+
+# Status que indicam falha transitória do Chatwoot
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+def extract_chatwoot_payload(api_response: Any) -> List[Dict[str, Any]]:
+    """Extrai a lista de itens retornada pela API do Chatwoot independentemente do formato.
+
+    Algumas versões retornam em payload no topo (data["payload"]) e outras retornam em data.payload.
+    Esta função tenta ambos os formatos e retorna sempre uma lista.
+    """
+    try:
+        if not isinstance(api_response, dict):
+            return []
+
+        # Formato 1: { "payload": [...] }
+        if "payload" in api_response and isinstance(api_response["payload"], list):
+            return api_response["payload"]
+
+        # Formato 2: { "data": { "payload": [...] } }
+        data_obj = api_response.get("data")
+        if isinstance(data_obj, dict) and isinstance(data_obj.get("payload"), list):
+            return data_obj["payload"]
+
+        # Formato 3: { "data": [...] }
+        if isinstance(data_obj, list):
+            return data_obj
+    except Exception:
+        pass
+    return []
+
+
+class RetryBudget:
+    """Orçamento global de retentativas (token bucket)
+
+    Cada requisição deposita `ratio` tokens e cada retentativa consome um token,
+    limitando as retentativas a uma fração do tráfego. Evita que uma falha do
+    Chatwoot multiplique a carga enviada a ele.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10.0, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+        self.exhausted = 0
+
+    def deposit(self):
+        """Registrar uma requisição original"""
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Consumir um token para retentar; False se o orçamento acabou"""
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.exhausted += 1
+        return False
+
+
+class ChatwootClient:
+    """Cliente da API do Chatwoot com pool de conexões, HTTP/2 opcional e retentativas
+
+    Uma única instância (e um único httpx.AsyncClient) é criada na startup e
+    fechada no shutdown, reaproveitando conexões keep-alive entre chamadas. Os
+    anexos (data_url) são baixados por um segundo pool, sem o token da API: o
+    download segue redirects para o storage (S3, disco...).
+    """
+
+    def __init__(self, base_url: Optional[str] = None, api_token: Optional[str] = None,
+                 account_id: Optional[int] = None):
+        # URL/token resolvidos sob demanda: o .env é carregado depois do import
+        self._base_url = base_url
+        self._api_token = api_token
+        self._account_id = account_id
+
+        self.max_connections = int(os.getenv("CHATWOOT_MAX_CONNECTIONS", "20"))
+        self.max_keepalive = int(os.getenv("CHATWOOT_MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(os.getenv("CHATWOOT_KEEPALIVE_EXPIRY", "30"))
+        self.http2 = os.getenv("CHATWOOT_HTTP2", "false").lower() == "true"
+        self.max_retries = int(os.getenv("CHATWOOT_MAX_RETRIES", "2"))
+        self.backoff_base = float(os.getenv("CHATWOOT_BACKOFF_BASE", "0.2"))
+        self.backoff_max = float(os.getenv("CHATWOOT_BACKOFF_MAX", "2"))
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+
+        self.retry_budget = RetryBudget(
+            ratio=float(os.getenv("CHATWOOT_RETRY_BUDGET_RATIO", "0.2")),
+            min_tokens=float(os.getenv("CHATWOOT_RETRY_BUDGET_MIN", "10")),
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._media_client: Optional[httpx.AsyncClient] = None
+        self._lock = asyncio.Lock()
+
+        # Métricas
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+
+    # Normalização dos formatos de resposta das diferentes versões do Chatwoot
+    normalize_payload = staticmethod(extract_chatwoot_payload)
+
+    @property
+    def base_url(self) -> str:
+        return (self._base_url or os.getenv("CHATWOOT_URL") or "").rstrip("/")
+
+    @property
+    def api_token(self) -> Optional[str]:
+        return self._api_token or os.getenv("CHATWOOT_API_TOKEN")
+
+    @property
+    def account_id(self) -> int:
+        return int(self._account_id or os.getenv("CHATWOOT_ACCOUNT_ID", "1"))
+
+    @property
+    def configured(self) -> bool:
+        """Verifica se URL e token do Chatwoot estão configurados"""
+        return bool(self.base_url and self.api_token)
+
+    async def start(self):
+        """Criar o httpx.AsyncClient compartilhado"""
+        async with self._lock:
+            if self._client is not None:
+                return
+
+            http2 = self.http2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("⚠️ CHATWOOT_HTTP2 ativo mas pacote 'h2' não instalado, usando HTTP/1.1")
+                    http2 = False
+
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "api_access_token": self.api_token or "",
+                    "Accept": "application/json",
+                },
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.timeouts["default"]),
+                http2=http2,
+            )
+            self._media_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.timeouts["download_media"]),
+                follow_redirects=True,
+                http2=http2,
+            )
+            logger.info(
+                f"✅ Cliente Chatwoot iniciado (http2={http2}, "
+                f"max_connections={self.max_connections})"
+            )
+
+    async def close(self):
+        """Fechar conexões do pool"""
+        async with self._lock:
+            if self._client is not None:
+                await self._client.aclose()
+                await self._media_client.aclose()
+                self._client = None
+                self._media_client = None
+                logger.info("✅ Cliente Chatwoot fechado")
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    async def media_client(self) -> httpx.AsyncClient:
+        """Pool compartilhado para baixar anexos (URLs absolutas, sem o token da API)"""
+        if self._media_client is None:
+            await self.start()
+        return self._media_client
+
+    def _backoff(self, attempt: int) -> float:
+        """Backoff exponencial com full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def request(self, method: str, path: str, endpoint: str = "default", **kwargs) -> httpx.Response:
+        """Executar requisição com timeout do endpoint e retentativas
+
+        GETs são retentados em erros de rede e status transitórios. Demais métodos
+        só são retentados quando a conexão falhou antes do envio (sem risco de
+        mensagem duplicada).
+
+        Raises:
+            httpx.HTTPStatusError: se a resposta final não for 2xx
+            httpx.HTTPError: se todas as tentativas falharem
+        """
+        client = await self._get_client()
+        idempotent = method.upper() in ("GET", "HEAD")
+        timeout = self.timeouts.get(endpoint, self.timeouts["default"])
+
+        self.requests += 1
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                response = await client.request(method, path, timeout=timeout, **kwargs)
+                if not (idempotent and response.status_code in RETRYABLE_STATUS):
+                    response.raise_for_status()
+                    return response
+                error: Exception = httpx.HTTPStatusError(
+                    f"Chatwoot {response.status_code}", request=response.request, response=response
+                )
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                error = e
+            except (httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.ReadError) as e:
+                if not idempotent:
+                    self.errors += 1
+                    raise
+                error = e
+            except httpx.HTTPStatusError:
+                self.errors += 1
+                raise
+
+            if attempt >= self.max_retries or not self.retry_budget.withdraw():
+                self.errors += 1
+                if isinstance(error, httpx.HTTPStatusError):
+                    error.response.raise_for_status()
+                raise error
+
+            attempt += 1
+            self.retries += 1
+            delay = self._backoff(attempt)
+            logger.warning(f"⚠️ Chatwoot {method} {endpoint} falhou ({error}), retentativa {attempt} em {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def _conversation_path(self, conversation_id: int, account_id: Optional[int] = None) -> str:
+        return f"/api/v1/accounts/{account_id or self.account_id}/conversations/{conversation_id}"
+
+    async def list_conversations_raw(self, account_id: Optional[int] = None) -> Dict[str, Any]:
+        """Resposta bruta da listagem de conversas"""
+        response = await self.request(
+            "GET", f"/api/v1/accounts/{account_id or self.account_id}/conversations",
+            endpoint="list_conversations",
+        )
+        return response.json()
+
+    async def list_conversations(self, account_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Listar conversas (payload normalizado)"""
+        return self.normalize_payload(await self.list_conversations_raw(account_id))
+
+    async def list_messages(self, conversation_id: int, account_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Listar mensagens de uma conversa (payload normalizado)"""
+        response = await self.request(
+            "GET", f"{self._conversation_path(conversation_id, account_id)}/messages",
+            endpoint="list_messages",
+        )
+        return self.normalize_payload(response.json())
+
+    async def send_message(self, conversation_id: int, content: str, account_id: Optional[int] = None,
+                           message_type: str = "outgoing") -> Dict[str, Any]:
+        """Enviar mensagem de texto para uma conversa"""
+        response = await self.request(
+            "POST", f"{self._conversation_path(conversation_id, account_id)}/messages",
+            endpoint="send_message",
+            json={"content": content, "message_type": message_type},
+        )
+        return response.json()
+
+    async def send_attachment(self, conversation_id: int, filename: str, file_bytes: bytes,
+                              content_type: str, content: str = "",
+                              account_id: Optional[int] = None) -> Dict[str, Any]:
+        """Enviar mensagem com anexo (multipart)"""
+        files: Dict[str, Tuple[str, bytes, str]] = {
+            "attachments[]": (filename, file_bytes, content_type)
+        }
+        response = await self.request(
+            "POST", f"{self._conversation_path(conversation_id, account_id)}/messages",
+            endpoint="send_attachment",
+            data={"message_type": "outgoing", "content": content or ""},
+            files=files,
+        )
+        return response.json()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Métricas do cliente"""
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+            "retry_budget_exhausted": self.retry_budget.exhausted,
+            "http2": self.http2,
+            "started": self._client is not None,
+        }
+
+
+# Instância global
+chatwoot_client = ChatwootClient()
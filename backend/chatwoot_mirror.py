@@ -0,0 +1,304 @@
+"""
+Espelho local dos contatos, conversas e mensagens do Chatwoot (migration 015)
+
+Os handlers de webhook só colocam a linha num buffer (write-behind); o BatchWriter grava
+em lote a cada CHATWOOT_MIRROR_BATCH_SIZE linhas ou CHATWOOT_MIRROR_FLUSH_MS, com spill
+em disco se o banco cair (mesmo mecanismo do registro de interações). Cada lote vai por
+COPY para uma tabela temporária e entra com um único INSERT ... ON CONFLICT: várias
+versões do mesmo id no lote viram a mais nova, e uma linha só é sobrescrita por versão
+(updated_at do Chatwoot) igual ou mais nova, então webhooks fora de ordem não fazem o
+estado voltar.
+
+A leitura (list_messages, get_conversation) vê o que já foi gravado: o atraso é de no
+máximo um intervalo de gravação. conversation_messages serve o histórico de mensagens do
+painel técnico sem ir ao Chatwoot quando a conversa começou depois do espelho (todas as
+mensagens passaram pelos webhooks); para as anteriores retorna None e o chamador busca
+no Chatwoot.
+"""
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .chatwoot_config import MESSAGE_TYPES
+from .interaction_logger import BatchWriter, _chamados_pool
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_TYPE_NAMES = {valor: nome for nome, valor in MESSAGE_TYPES.items()}
+
+CONTACT_COLUMNS = ["id", "account_id", "name", "phone_number", "email", "identifier",
+                   "additional_attributes", "custom_attributes", "updated_at"]
+CONVERSATION_COLUMNS = ["id", "account_id", "inbox_id", "contact_id", "status", "assignee_id", "team_id",
+                        "labels", "additional_attributes", "custom_attributes", "created_at",
+                        "last_activity_at", "updated_at"]
+MESSAGE_COLUMNS = ["id", "conversation_id", "account_id", "message_type", "content_type", "content",
+                   "private", "sender_type", "sender_id", "attachments", "content_attributes",
+                   "created_at", "updated_at"]
+
+
+class UpsertBatchWriter(BatchWriter):
+    """BatchWriter que grava com UPSERT por id, respeitando a versão (updated_at)"""
+
+    def __init__(self, table: str, columns: Sequence[str], pool_getter: Callable[[], Any],
+                 key: str = "id", version: str = "updated_at", env_prefix: str = "CHATWOOT_MIRROR"):
+        super().__init__(table, columns, pool_getter, env_prefix=env_prefix)
+        self.key = key
+        self.version = version
+        self.staging = f"_staging_{table}"
+        self._key_index = self.columns.index(key)
+        self.coalesced = 0
+        self.stale = 0
+
+    def _upsert_sql(self, source: str) -> str:
+        cols = ", ".join(self.columns)
+        updates = ", ".join(f"{col} = EXCLUDED.{col}" for col in self.columns if col != self.key)
+        return f"""
+            INSERT INTO {self.table} AS t ({cols}) {source}
+            ON CONFLICT ({self.key}) DO UPDATE SET {updates}, synced_at = NOW()
+            WHERE t.{self.version} IS NULL OR EXCLUDED.{self.version} >= t.{self.version}
+        """
+
+    async def _copy(self, conn, batch: List[Tuple]) -> int:
+        cols = ", ".join(self.columns)
+        async with conn.transaction():
+            await conn.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {self.staging} "
+                f"(LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+            await conn.copy_records_to_table(self.staging, records=batch, columns=self.columns)
+            status = await conn.execute(self._upsert_sql(
+                f"SELECT DISTINCT ON ({self.key}) {cols} FROM {self.staging} "
+                f"ORDER BY {self.key}, {self.version} DESC NULLS LAST"
+            ))
+        aplicadas = int(status.split()[-1])
+        distintas = len({record[self._key_index] for record in batch})
+        self.coalesced += len(batch) - distintas
+        self.stale += distintas - aplicadas
+        return aplicadas
+
+    def _insert_sql(self) -> str:
+        placeholders = ", ".join(f"${i + 1}" for i in range(len(self.columns)))
+        return self._upsert_sql(f"VALUES ({placeholders})")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats["coalesced"] = self.coalesced
+        stats["stale"] = self.stale
+        return stats
+
+
+def _data(valor: Any) -> Optional[datetime]:
+    """Datas do Chatwoot: epoch (int/float) ou ISO 8601"""
+    if valor is None or valor == "":
+        return None
+    try:
+        if isinstance(valor, (int, float)):
+            return datetime.fromtimestamp(valor, tz=timezone.utc)
+        if isinstance(valor, str):
+            try:
+                data = datetime.fromisoformat(valor)
+            except ValueError:
+                return datetime.fromtimestamp(float(valor), tz=timezone.utc)
+            return data if data.tzinfo else data.replace(tzinfo=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    return None
+
+
+def _json(valor: Any) -> Optional[str]:
+    return json.dumps(valor, default=str, ensure_ascii=False) if valor not in (None, "") else None
+
+
+def _id(objeto: Any) -> Optional[int]:
+    return objeto.get("id") if isinstance(objeto, dict) else None
+
+
+def _conta(payload: Dict[str, Any]) -> Optional[int]:
+    return payload.get("account_id") or _id(payload.get("account"))
+
+
+def linha_contato(contact: Dict[str, Any]) -> Tuple:
+    return (
+        contact["id"],
+        _conta(contact),
+        contact.get("name"),
+        contact.get("phone_number"),
+        contact.get("email"),
+        contact.get("identifier"),
+        _json(contact.get("additional_attributes")),
+        _json(contact.get("custom_attributes")),
+        _data(contact.get("updated_at")) or datetime.now(timezone.utc),
+    )
+
+
+def linha_conversa(conversation: Dict[str, Any]) -> Tuple:
+    meta = conversation.get("meta") or {}
+    contact_id = _id(meta.get("sender")) or (conversation.get("contact_inbox") or {}).get("contact_id")
+    labels = conversation.get("labels")
+    return (
+        conversation["id"],
+        _conta(conversation),
+        conversation.get("inbox_id"),
+        contact_id,
+        conversation.get("status"),
+        _id(meta.get("assignee")),
+        _id(meta.get("team")),
+        [str(label) for label in labels] if isinstance(labels, list) else None,
+        _json(conversation.get("additional_attributes")),
+        _json(conversation.get("custom_attributes")),
+        _data(conversation.get("created_at")),
+        _data(conversation.get("last_activity_at") or conversation.get("timestamp")),
+        _data(conversation.get("updated_at")) or datetime.now(timezone.utc),
+    )
+
+
+def linha_mensagem(message: Dict[str, Any], conversation: Dict[str, Any], criada: bool) -> Tuple:
+    """criada: message_created (sem updated_at, a versão é a data de criação)"""
+    sender = message.get("sender") or {}
+    message_type = message.get("message_type")
+    created_at = _data(message.get("created_at"))
+    versao = _data(message.get("updated_at"))
+    if versao is None:
+        versao = created_at if criada and created_at else datetime.now(timezone.utc)
+    return (
+        message["id"],
+        message.get("conversation_id") or conversation.get("id"),
+        _conta(message),
+        MESSAGE_TYPE_NAMES.get(message_type, str(message_type)) if message_type is not None else None,
+        message.get("content_type"),
+        message.get("content"),
+        bool(message.get("private")),
+        (message.get("sender_type") or sender.get("type") or "").lower() or None,
+        message.get("sender_id") or sender.get("id"),
+        _json(message.get("attachments")),
+        _json(message.get("content_attributes")),
+        created_at,
+        versao,
+    )
+
+
+def mensagem_da_linha(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Linha de chatwoot_messages no formato da API do Chatwoot (list_messages)"""
+    message_type = row.get("message_type")
+    if message_type in MESSAGE_TYPES:
+        message_type = MESSAGE_TYPES[message_type]
+    elif isinstance(message_type, str) and message_type.isdigit():
+        message_type = int(message_type)
+    created_at = row.get("created_at")
+    return {
+        "id": row["id"],
+        "conversation_id": row["conversation_id"],
+        "account_id": row.get("account_id"),
+        "message_type": message_type,
+        "content_type": row.get("content_type"),
+        "content": row.get("content"),
+        "private": row.get("private"),
+        "sender_type": row.get("sender_type"),
+        "sender_id": row.get("sender_id"),
+        "attachments": json.loads(row["attachments"]) if row.get("attachments") else [],
+        "content_attributes": json.loads(row["content_attributes"]) if row.get("content_attributes") else {},
+        "created_at": int(created_at.timestamp()) if created_at else None,
+    }
+
+
+class ChatwootMirror:
+    """Contatos, conversas e mensagens do Chatwoot gravados em lote no Postgres"""
+
+    def __init__(self, pool_getter: Callable[[], Any] = _chamados_pool):
+        self._pool_getter = pool_getter
+        self.contacts = UpsertBatchWriter("chatwoot_contacts", CONTACT_COLUMNS, pool_getter)
+        self.conversations = UpsertBatchWriter("chatwoot_conversations", CONVERSATION_COLUMNS, pool_getter)
+        self.messages = UpsertBatchWriter("chatwoot_messages", MESSAGE_COLUMNS, pool_getter)
+        self.writers = [self.contacts, self.conversations, self.messages]
+        self._inicio: Optional[datetime] = None
+
+    async def start(self):
+        for writer in self.writers:
+            await writer.start()
+        logger.info("🪞 Espelho do Chatwoot iniciado (gravação em lote)")
+
+    async def stop(self):
+        """Gravar o que estiver no buffer"""
+        for writer in self.writers:
+            await writer.stop()
+
+    async def save_message(self, message: Dict[str, Any], conversation: Dict[str, Any], criada: bool = True):
+        if message.get("id") is None or not (message.get("conversation_id") or conversation.get("id")):
+            return
+        await self.messages.put(linha_mensagem(message, conversation, criada))
+
+    async def save_conversation(self, conversation: Dict[str, Any]):
+        if conversation.get("id") is None:
+            return
+        await self.conversations.put(linha_conversa(conversation))
+
+    async def save_contact(self, contact: Dict[str, Any]):
+        if contact.get("id") is None:
+            return
+        await self.contacts.put(linha_contato(contact))
+
+    async def list_messages(self, conversation_id: int, limit: int = 50,
+                            since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Últimas mensagens da conversa (ordem cronológica)"""
+        pool = self._pool_getter()
+        if pool is None:
+            return []
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT * FROM chatwoot_messages
+                WHERE conversation_id = $1 AND ($2::timestamptz IS NULL OR created_at > $2)
+                ORDER BY created_at DESC, id DESC
+                LIMIT $3
+            """, conversation_id, since, limit)
+        return [dict(row) for row in reversed(rows)]
+
+    async def get_conversation(self, conversation_id: int) -> Optional[Dict[str, Any]]:
+        pool = self._pool_getter()
+        if pool is None:
+            return None
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM chatwoot_conversations WHERE id = $1", conversation_id)
+        return dict(row) if row else None
+
+    async def _mirror_start(self, conn) -> Optional[datetime]:
+        """Primeira gravação do espelho (a mais antiga ainda registrada, cacheada)"""
+        if self._inicio is None:
+            self._inicio = await conn.fetchval("SELECT MIN(synced_at) FROM chatwoot_conversations")
+        return self._inicio
+
+    async def conversation_messages(self, conversation_id: int, since: Optional[datetime] = None,
+                                    limit: int = 50) -> Optional[List[Dict[str, Any]]]:
+        """Mensagens da conversa no formato da API do Chatwoot, ou None se o espelho não as tem
+
+        O espelho só tem todas as mensagens da conversa (ou as posteriores a since) se elas
+        chegaram depois do início do espelho; senão, ou com o banco indisponível, None.
+        """
+        pool = self._pool_getter()
+        if pool is None:
+            return None
+        try:
+            async with pool.acquire() as conn:
+                inicio = await self._mirror_start(conn)
+            if inicio is None:
+                completa = False
+            elif since is not None and since >= inicio:
+                completa = True
+            else:
+                conversa = await self.get_conversation(conversation_id)
+                completa = bool(conversa and conversa.get("created_at") and conversa["created_at"] >= inicio)
+            rows = await self.list_messages(conversation_id, limit, since) if completa else []
+        except Exception as e:
+            logger.warning(f"⚠️ Espelho do Chatwoot indisponível para leitura: {e}")
+            completa, rows = False, []
+        # Conversa nova ainda sem mensagens gravadas (atraso do lote): o Chatwoot responde
+        if not completa or (not rows and since is None):
+            return None
+        return [mensagem_da_linha(row) for row in rows]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {writer.table: writer.get_stats() for writer in self.writers}
+
+
+# Instância global
+chatwoot_mirror = ChatwootMirror()
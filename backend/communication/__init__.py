@@ -3,11 +3,11 @@ Sistema de Comunicação entre Agentes
 """
 
 from .message_queue import MessageQueue
-from .agent_bus import AgentBus
-from .event_handler import EventHandler
+from .conversation_dispatcher import ConversationDispatcher, MailboxFull, conversation_dispatcher
 
 __all__ = [
     'MessageQueue',
-    'AgentBus', 
-    'EventHandler'
+    'ConversationDispatcher',
+    'MailboxFull',
+    'conversation_dispatcher'
 ]
@@ -0,0 +1,296 @@
+"""
+Execução ordenada por conversa (atores) com paralelismo entre conversas
+
+Cada conversa é um ator com sua caixa de mensagens (fila do MessageQueue com o id do
+ator). As mensagens de um ator são processadas uma de cada vez, na ordem de chegada,
+então duas mensagens da mesma conversa nunca disputam o estado do fluxo de chamados.
+Conversas diferentes rodam em paralelo num pool fixo de CONVERSATION_WORKERS; cada vez
+que um worker pega um ator processa uma mensagem só e devolve o ator ao fim da fila de
+prontos, para uma conversa movimentada não segurar as demais.
+
+Atores sem mensagens há CONVERSATION_ACTOR_IDLE_SECONDS são descartados. Se quem
+despachou desiste (a espera em dispatch é cancelada), a mensagem não é processada ou,
+se já estava em andamento, o processamento é cancelado.
+
+A ordem é garantida dentro do processo: com várias réplicas consumindo a mesma fila de
+webhooks, mensagens da mesma conversa podem cair em réplicas diferentes.
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..agents.base_agent import AgentMessage
+from .message_queue import MessageQueue
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[AgentMessage], Awaitable[Any]]
+
+
+class MailboxFull(Exception):
+    """Caixa de mensagens da conversa atingiu o tamanho máximo configurado"""
+
+
+@dataclass
+class _Ator:
+    actor_id: str
+    ultima_atividade: float
+    agendado: bool = False  # na fila de prontos ou em execução
+    processadas: int = 0
+
+
+class ConversationDispatcher:
+    """Atores por conversa: FIFO dentro da conversa, pool limitado entre conversas
+
+    CONVERSATION_WORKERS: conversas processadas ao mesmo tempo (padrão 8)
+    CONVERSATION_MAILBOX_MAX_SIZE: mensagens aguardando por conversa (padrão 200)
+    CONVERSATION_ACTOR_IDLE_SECONDS: tempo sem mensagens até descartar o ator (padrão 300)
+    """
+
+    def __init__(self, workers: Optional[int] = None, mailbox_size: Optional[int] = None,
+                 idle_seconds: Optional[float] = None):
+        self._config = (workers, mailbox_size, idle_seconds)
+        self.num_workers = 0
+        self.mailbox_size = 0
+        self.idle_seconds = 0.0
+        self.handler: Optional[MessageHandler] = None
+        self.mailboxes: Optional[MessageQueue] = None
+        self._atores: Dict[str, _Ator] = {}
+        self._aguardando: Dict[int, asyncio.Future] = {}
+        self._prontos: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._limpeza: Optional[asyncio.Task] = None
+        self._running = False
+        self._ocupados = 0
+
+        # Métricas
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.abandoned = 0
+        self.evicted = 0
+        self.max_depth = 0
+        self.max_wait = 0.0
+        self._wait_total = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def start(self, handler: MessageHandler):
+        """Iniciar o pool de workers e a limpeza de atores inativos"""
+        if self._running:
+            return
+
+        workers, mailbox_size, idle_seconds = self._config
+        self.num_workers = workers or int(os.getenv("CONVERSATION_WORKERS") or 8)
+        self.mailbox_size = mailbox_size or int(os.getenv("CONVERSATION_MAILBOX_MAX_SIZE") or 200)
+        self.idle_seconds = idle_seconds or float(os.getenv("CONVERSATION_ACTOR_IDLE_SECONDS") or 300)
+
+        self.handler = handler
+        self.mailboxes = MessageQueue(max_size=self.mailbox_size)
+        self._prontos = asyncio.Queue()
+        self._running = True
+        self._workers = [
+            asyncio.create_task(self._worker_loop(i), name=f"conversation-worker-{i}")
+            for i in range(self.num_workers)
+        ]
+        self._limpeza = asyncio.create_task(self._limpeza_loop(), name="conversation-actors-cleanup")
+        logger.info(
+            f"🎭 Dispatcher de conversas iniciado (workers={self.num_workers}, "
+            f"caixa={self.mailbox_size}, inatividade={self.idle_seconds:.0f}s)"
+        )
+
+    async def stop(self, timeout: float = 10.0):
+        """Parar workers aguardando a mensagem em andamento"""
+        if not self._running:
+            return
+
+        self._running = False
+        if self._limpeza:
+            self._limpeza.cancel()
+        # Workers ociosos ficam presos em _prontos.get(): acordar um por worker
+        for _ in self._workers:
+            self._prontos.put_nowait(None)
+        if self._workers:
+            done, pending = await asyncio.wait(self._workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, self._limpeza, return_exceptions=True)
+        self._workers = []
+
+        descartadas = len(self._aguardando)
+        for futuro in self._aguardando.values():
+            if not futuro.done():
+                futuro.set_exception(RuntimeError("Dispatcher de conversas parado"))
+        self._aguardando.clear()
+        self.mailboxes.clear_all_queues()
+        self._atores.clear()
+        if descartadas:
+            logger.warning(f"⚠️ {descartadas} mensagem(ns) de conversa descartada(s) no shutdown")
+        logger.info("✅ Dispatcher de conversas parado")
+
+    async def dispatch(self, actor_id: str, event: str, data: Dict[str, Any],
+                       conversation_id: Optional[int] = None, from_agent: str = "webhook") -> Any:
+        """Colocar a mensagem na caixa do ator e esperar o processamento
+
+        Retorna o resultado do handler (ou propaga sua exceção).
+
+        Raises:
+            MailboxFull: se a caixa da conversa atingiu o tamanho máximo
+        """
+        if not self._running:
+            raise RuntimeError("Dispatcher de conversas não iniciado")
+
+        ator = self._atores.get(actor_id)
+        if ator is None:
+            ator = self._atores[actor_id] = _Ator(actor_id, time.monotonic())
+        ator.ultima_atividade = time.monotonic()
+
+        profundidade = self.mailboxes.get_queue_size(actor_id)
+        if profundidade >= self.mailbox_size:
+            self.rejected += 1
+            raise MailboxFull(f"Caixa da conversa {actor_id} cheia ({self.mailbox_size})")
+
+        message = AgentMessage(
+            event=event,
+            from_agent=from_agent,
+            to_agent=actor_id,
+            conversation_id=conversation_id,
+            data=data,
+            timestamp=datetime.now(),
+        )
+        futuro = asyncio.get_running_loop().create_future()
+        self._aguardando[id(message)] = futuro
+        await self.mailboxes.enqueue(message)
+        self.max_depth = max(self.max_depth, profundidade + 1)
+
+        if not ator.agendado:
+            ator.agendado = True
+            self._prontos.put_nowait(actor_id)
+        return await futuro
+
+    async def _worker_loop(self, worker_id: int):
+        """Processar uma mensagem do próximo ator pronto e devolvê-lo à fila"""
+        while self._running:
+            actor_id = await self._prontos.get()
+            if actor_id is None:
+                break
+            ator = self._atores.get(actor_id)
+            message = await self.mailboxes.dequeue(actor_id)
+            if ator is None or message is None:
+                if ator is not None:
+                    ator.agendado = False
+                continue
+
+            futuro = self._aguardando.pop(id(message), None)
+            if futuro is not None and futuro.cancelled():
+                # Quem despachou desistiu (shutdown, partição da fila perdida): não processar
+                self.abandoned += 1
+                self._requeue_ator(actor_id, ator)
+                continue
+            espera = (datetime.now() - message.timestamp).total_seconds()
+            self._wait_total += espera
+            self.max_wait = max(self.max_wait, espera)
+            self._ocupados += 1
+            # Em tarefa própria: se quem despachou desistir no meio, o processamento é cancelado
+            tarefa = asyncio.ensure_future(self.handler(message))
+            if futuro is not None:
+                futuro.add_done_callback(lambda f, tarefa=tarefa: tarefa.cancel() if f.cancelled() else None)
+            try:
+                try:
+                    await asyncio.wait({tarefa})
+                except asyncio.CancelledError:
+                    tarefa.cancel()
+                    await asyncio.gather(tarefa, return_exceptions=True)
+                    raise
+                if tarefa.cancelled():
+                    self.abandoned += 1
+                    logger.info(f"✋ Mensagem da conversa {actor_id} ({message.event}) cancelada por quem despachou")
+                else:
+                    resultado = tarefa.result()
+                    self.processed += 1
+                    if futuro is not None and not futuro.done():
+                        futuro.set_result(resultado)
+            except asyncio.CancelledError:
+                if futuro is not None and not futuro.done():
+                    futuro.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ Erro na conversa {actor_id} ({message.event}) no worker {worker_id}: {e}")
+                if futuro is not None and not futuro.done():
+                    futuro.set_exception(e)
+            finally:
+                self._ocupados -= 1
+                ator.processadas += 1
+                self._requeue_ator(actor_id, ator)
+
+    def _requeue_ator(self, actor_id: str, ator: _Ator):
+        """Devolver o ator à fila de prontos se ainda tem mensagens na caixa"""
+        ator.ultima_atividade = time.monotonic()
+        if self.mailboxes.get_queue_size(actor_id):
+            self._prontos.put_nowait(actor_id)
+        else:
+            ator.agendado = False
+
+    async def _limpeza_loop(self):
+        """Descartar atores sem mensagens há mais de idle_seconds"""
+        intervalo = max(1.0, self.idle_seconds / 4)
+        while self._running:
+            await asyncio.sleep(intervalo)
+            self.evict_idle()
+
+    def evict_idle(self) -> int:
+        """Remover atores inativos e suas caixas vazias"""
+        limite = time.monotonic() - self.idle_seconds
+        removidos = 0
+        for actor_id, ator in list(self._atores.items()):
+            if ator.agendado or ator.ultima_atividade > limite or self.mailboxes.get_queue_size(actor_id):
+                continue
+            del self._atores[actor_id]
+            self.mailboxes.remove_queue(actor_id)
+            removidos += 1
+        if removidos:
+            self.evicted += removidos
+            logger.debug(f"🧹 {removidos} ator(es) de conversa inativo(s) descartado(s)")
+        return removidos
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Atores, profundidade das caixas, ocupação do pool e espera na fila"""
+        profundidades = self.mailboxes.get_all_queue_sizes() if self.mailboxes else {}
+        com_mensagens = {actor_id: d for actor_id, d in profundidades.items() if d}
+        mais_cheias = sorted(com_mensagens.items(), key=lambda item: item[1], reverse=True)[:5]
+        atendidas = self.processed + self.failed
+        return {
+            "running": self._running,
+            "workers": len(self._workers),
+            "busy_workers": self._ocupados,
+            "actors": len(self._atores),
+            "ready_actors": self._prontos.qsize() if self._prontos else 0,
+            "mailbox_max_size": self.mailbox_size,
+            "mailbox_depth": {
+                "total": sum(com_mensagens.values()),
+                "max": max(com_mensagens.values(), default=0),
+                "max_seen": self.max_depth,
+                "deepest": dict(mais_cheias),
+            },
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "abandoned": self.abandoned,
+            "evicted": self.evicted,
+            "wait_seconds": {
+                "avg": round(self._wait_total / atendidas, 3) if atendidas else 0.0,
+                "max": round(self.max_wait, 3),
+            },
+            "idle_seconds": self.idle_seconds,
+        }
+
+
+# Instância global
+conversation_dispatcher = ConversationDispatcher()
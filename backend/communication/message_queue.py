@@ -95,6 +95,11 @@ class MessageQueue:
             self.queues[agent_id].clear()
             logger.info(f"🗑️ Fila do agente {agent_id} limpa")
     
+    def remove_queue(self, agent_id: str):
+        """Descartar fila e lock do agente (fila vazia de agente inativo)"""
+        self.queues.pop(agent_id, None)
+        self.locks.pop(agent_id, None)
+
     def clear_all_queues(self):
         """Limpar todas as filas"""
         for agent_id in list(self.queues.keys()):
@@ -0,0 +1,176 @@
+"""
+Memória de conversas dos agentes de IA (histórico recente por conversa)
+"""
+import os
+import json
+import time
+import logging
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def _pack(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Formato compacto: r=role, c=content, t=timestamp (epoch)"""
+    return {"r": message["role"], "c": message["content"], "t": int(message.get("t") or time.time())}
+
+
+def _unpack(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {"role": item["r"], "content": item["c"], "timestamp": item.get("t")}
+
+
+class InMemoryConversationMemory:
+    """Histórico em memória do processo (LRU + TTL, deque limitada por conversa)"""
+
+    backend = "memory"
+
+    def __init__(self, max_messages: int, ttl: int, max_conversations: int):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._conversations = TTLCache(max_size=max_conversations, ttl=ttl)
+
+    async def get(self, conversation_id: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        history = self._conversations.get(conversation_id)
+        if not history:
+            return []
+        items = list(history)[-limit:] if limit else list(history)
+        return [_unpack(item) for item in items]
+
+    async def append(self, conversation_id: int, *messages: Dict[str, Any]):
+        history = self._conversations.get(conversation_id)
+        if history is None:
+            history = deque(maxlen=self.max_messages)
+        history.extend(_pack(m) for m in messages)
+        # Regrava para renovar o TTL da conversa
+        self._conversations.set(conversation_id, history)
+
+    async def clear(self, conversation_id: int):
+        self._conversations.delete(conversation_id)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "max_messages": self.max_messages,
+            "ttl_seconds": self.ttl,
+            "conversations": len(self._conversations),
+            "cache": self._conversations.get_stats(),
+        }
+
+
+class RedisConversationMemory:
+    """Histórico em listas Redis (compartilhado entre réplicas e persistente a restarts)
+
+    Cada conversa é uma lista com RPUSH + LTRIM + EXPIRE num único pipeline,
+    então o tamanho por conversa e o tempo de vida são fixos.
+    """
+
+    backend = "redis"
+
+    def __init__(self, max_messages: int, ttl: int, redis_url: Optional[str] = None,
+                 key_prefix: str = "cidadaoai:memory"):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self.key_prefix = key_prefix
+        self._redis = None
+        self.errors = 0
+
+    def _client(self):
+        if self._redis is None:
+            import redis.asyncio as redis
+            url = self.redis_url or os.getenv("REDIS_URL", "redis://localhost:6380")
+            self._redis = redis.from_url(url)
+        return self._redis
+
+    def _key(self, conversation_id: int) -> str:
+        return f"{self.key_prefix}:{conversation_id}"
+
+    async def get(self, conversation_id: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        try:
+            start = -limit if limit else 0
+            raw_items = await self._client().lrange(self._key(conversation_id), start, -1)
+            return [_unpack(json.loads(raw)) for raw in raw_items]
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Erro ao ler memória da conversa {conversation_id}: {e}")
+            return []
+
+    async def append(self, conversation_id: int, *messages: Dict[str, Any]):
+        key = self._key(conversation_id)
+        try:
+            pipe = self._client().pipeline(transaction=False)
+            pipe.rpush(key, *[json.dumps(_pack(m), separators=(",", ":"), ensure_ascii=False) for m in messages])
+            pipe.ltrim(key, -self.max_messages, -1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Erro ao gravar memória da conversa {conversation_id}: {e}")
+
+    async def clear(self, conversation_id: int):
+        try:
+            await self._client().delete(self._key(conversation_id))
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Erro ao limpar memória da conversa {conversation_id}: {e}")
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "max_messages": self.max_messages,
+            "ttl_seconds": self.ttl,
+            "key_prefix": self.key_prefix,
+            "errors": self.errors,
+        }
+
+
+class ConversationMemory:
+    """Memória de conversas com backend configurável
+
+    CONVERSATION_MEMORY_BACKEND: "memory" (padrão) ou "redis"
+    CONVERSATION_MEMORY_MAX_MESSAGES: mensagens mantidas por conversa (padrão 10)
+    CONVERSATION_MEMORY_TTL: segundos sem atividade até expirar (padrão 86400)
+    CONVERSATION_MEMORY_MAX_CONVERSATIONS: limite do backend em memória (padrão 5000)
+
+    O backend é criado no primeiro uso, depois do carregamento do .env.
+    """
+
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def store(self):
+        if self._backend is None:
+            backend = os.getenv("CONVERSATION_MEMORY_BACKEND", "memory").lower()
+            max_messages = int(os.getenv("CONVERSATION_MEMORY_MAX_MESSAGES", "10"))
+            ttl = int(os.getenv("CONVERSATION_MEMORY_TTL", "86400"))
+            if backend == "redis":
+                self._backend = RedisConversationMemory(max_messages, ttl)
+            else:
+                max_conversations = int(os.getenv("CONVERSATION_MEMORY_MAX_CONVERSATIONS", "5000"))
+                self._backend = InMemoryConversationMemory(max_messages, ttl, max_conversations)
+            logger.info(f"🧠 Memória de conversas: {self._backend.backend} (max_messages={max_messages}, ttl={ttl}s)")
+        return self._backend
+
+    async def get(self, conversation_id: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Últimas mensagens da conversa (mais antigas primeiro)"""
+        return await self.store.get(conversation_id, limit)
+
+    async def append(self, conversation_id: int, *messages: Dict[str, Any]):
+        """Adicionar mensagens ({role, content}) ao histórico"""
+        if messages:
+            await self.store.append(conversation_id, *messages)
+
+    async def clear(self, conversation_id: int):
+        """Apagar histórico da conversa"""
+        await self.store.clear(conversation_id)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return await self.store.get_stats()
+
+
+# Instância global compartilhada pelos agentes
+conversation_memory = ConversationMemory()
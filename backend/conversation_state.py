@@ -0,0 +1,268 @@
+"""
+Armazenamento do estado das conversas do fluxo de chamados (ChamadosAIService)
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Estado vazio + versão 0 = conversa sem estado salvo
+EMPTY: Tuple[Dict[str, Any], int] = ({}, 0)
+
+
+class ConversationStateConflict(Exception):
+    """Estado foi alterado por outro worker/réplica desde a leitura"""
+
+
+def _dumps(state: Dict[str, Any]) -> str:
+    return json.dumps(state, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class InMemoryStateStore:
+    """Estado no processo (apenas uma réplica/worker)"""
+
+    backend = "memory"
+
+    def __init__(self, ttl: int, max_conversations: int = 10000):
+        self.ttl = ttl
+        self._states = TTLCache(max_size=max_conversations, ttl=ttl)
+
+    async def load(self, conversation_id: int) -> Tuple[Dict[str, Any], int]:
+        entry = self._states.get(conversation_id)
+        if entry is None:
+            return {}, 0
+        version, raw = entry
+        return json.loads(raw), version
+
+    async def save(self, conversation_id: int, state: Dict[str, Any], expected_version: int) -> int:
+        entry = self._states.get(conversation_id)
+        current = entry[0] if entry else 0
+        if current != expected_version:
+            raise ConversationStateConflict(f"conversa {conversation_id}: versão {current} != {expected_version}")
+        self._states.set(conversation_id, (current + 1, _dumps(state)))
+        return current + 1
+
+    async def delete(self, conversation_id: int):
+        self._states.delete(conversation_id)
+
+
+class RedisStateStore:
+    """Estado em hash Redis {v, s} com compare-and-set via script Lua e EXPIRE"""
+
+    backend = "redis"
+
+    # Grava somente se a versão atual for a esperada; retorna a nova versão ou -1
+    CAS_SCRIPT = """
+    local current = tonumber(redis.call('HGET', KEYS[1], 'v') or '0')
+    if current ~= tonumber(ARGV[1]) then
+        return -1
+    end
+    redis.call('HSET', KEYS[1], 'v', current + 1, 's', ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return current + 1
+    """
+
+    def __init__(self, ttl: int, redis_url: Optional[str] = None, key_prefix: str = "cidadaoai:state"):
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self.key_prefix = key_prefix
+        self._redis = None
+        self._cas = None
+
+    def _client(self):
+        if self._redis is None:
+            import redis.asyncio as redis
+            url = self.redis_url or os.getenv("REDIS_URL", "redis://localhost:6380")
+            self._redis = redis.from_url(url)
+            self._cas = self._redis.register_script(self.CAS_SCRIPT)
+        return self._redis
+
+    def _key(self, conversation_id: int) -> str:
+        return f"{self.key_prefix}:{conversation_id}"
+
+    async def load(self, conversation_id: int) -> Tuple[Dict[str, Any], int]:
+        version, raw = await self._client().hmget(self._key(conversation_id), "v", "s")
+        if version is None or raw is None:
+            return {}, 0
+        return json.loads(raw), int(version)
+
+    async def save(self, conversation_id: int, state: Dict[str, Any], expected_version: int) -> int:
+        self._client()
+        new_version = await self._cas(
+            keys=[self._key(conversation_id)],
+            args=[expected_version, _dumps(state), self.ttl],
+        )
+        if int(new_version) < 0:
+            raise ConversationStateConflict(f"conversa {conversation_id}: versão esperada {expected_version}")
+        return int(new_version)
+
+    async def delete(self, conversation_id: int):
+        await self._client().delete(self._key(conversation_id))
+
+
+class PostgresStateStore:
+    """Estado na tabela conversation_states (migration 007)
+
+    A gravação é um único UPSERT condicionado à versão lida; linhas expiradas
+    contam como inexistentes e são removidas periodicamente.
+    """
+
+    backend = "postgres"
+
+    def __init__(self, ttl: int, pool_getter: Callable[[], Any]):
+        self.ttl = ttl
+        self._pool_getter = pool_getter
+
+    @property
+    def pool(self):
+        pool = self._pool_getter()
+        if pool is None:
+            raise RuntimeError("Pool PostgreSQL não inicializado")
+        return pool
+
+    async def load(self, conversation_id: int) -> Tuple[Dict[str, Any], int]:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT state, version FROM conversation_states
+                WHERE conversation_id = $1 AND expires_at > NOW()
+            """, conversation_id)
+        if not row:
+            return {}, 0
+        state = row["state"]
+        return (json.loads(state) if isinstance(state, str) else dict(state)), row["version"]
+
+    async def save(self, conversation_id: int, state: Dict[str, Any], expected_version: int) -> int:
+        async with self.pool.acquire() as conn:
+            new_version = await conn.fetchval("""
+                INSERT INTO conversation_states (conversation_id, state, version, updated_at, expires_at)
+                VALUES ($1, $2::jsonb, $3 + 1, NOW(), NOW() + make_interval(secs => $4))
+                ON CONFLICT (conversation_id) DO UPDATE
+                SET state = EXCLUDED.state,
+                    version = EXCLUDED.version,
+                    updated_at = NOW(),
+                    expires_at = EXCLUDED.expires_at
+                WHERE conversation_states.version = $3
+                   OR conversation_states.expires_at <= NOW()
+                RETURNING version
+            """, conversation_id, _dumps(state), expected_version, float(self.ttl))
+        if new_version is None:
+            raise ConversationStateConflict(f"conversa {conversation_id}: versão esperada {expected_version}")
+        return new_version
+
+    async def delete(self, conversation_id: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM conversation_states WHERE conversation_id = $1", conversation_id)
+
+    async def purge_expired(self) -> int:
+        """Remover fluxos abandonados"""
+        async with self.pool.acquire() as conn:
+            result = await conn.execute("DELETE FROM conversation_states WHERE expires_at <= NOW()")
+        return int(result.split()[-1])
+
+
+class ConversationStateStore:
+    """Estado das conversas com backend configurável
+
+    CONVERSATION_STATE_BACKEND: "memory" (padrão, uma réplica), "redis" ou "postgres"
+    CONVERSATION_STATE_TTL: segundos sem atividade até o fluxo expirar (padrão 86400)
+    CONVERSATION_STATE_MAX_BYTES: tamanho máximo do estado serializado (padrão 8192)
+
+    Uso por turno: `load` uma vez, alterar o dict localmente e `save` uma vez com a
+    versão lida. `save` levanta ConversationStateConflict se outro worker gravou antes.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self.max_bytes = int(os.getenv("CONVERSATION_STATE_MAX_BYTES", "8192"))
+        self._purge_task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.saves = 0
+        self.conflicts = 0
+        self.errors = 0
+
+    @property
+    def store(self):
+        if self._backend is None:
+            backend = os.getenv("CONVERSATION_STATE_BACKEND", "memory").lower()
+            ttl = int(os.getenv("CONVERSATION_STATE_TTL", "86400"))
+            if backend == "redis":
+                self._backend = RedisStateStore(ttl)
+            elif backend == "postgres":
+                from .chamados_service import chamados_service
+                self._backend = PostgresStateStore(ttl, lambda: chamados_service.pool)
+            else:
+                self._backend = InMemoryStateStore(ttl)
+            logger.info(f"💾 Estado das conversas: {self._backend.backend} (ttl={ttl}s)")
+        return self._backend
+
+    async def load(self, conversation_id: int) -> Tuple[Dict[str, Any], int]:
+        """Estado atual e versão (0 se não existe ou expirou)"""
+        self.loads += 1
+        try:
+            return await self.store.load(conversation_id)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Erro ao carregar estado da conversa {conversation_id}: {e}")
+            return {}, 0
+
+    async def save(self, conversation_id: int, state: Dict[str, Any], expected_version: int) -> int:
+        """Gravar estado se a versão ainda for `expected_version`; retorna a nova versão
+
+        Raises:
+            ConversationStateConflict: se o estado mudou desde a leitura
+        """
+        size = len(_dumps(state).encode())
+        if size > self.max_bytes:
+            logger.warning(f"⚠️ Estado da conversa {conversation_id} com {size} bytes (limite {self.max_bytes})")
+        try:
+            version = await self.store.save(conversation_id, state, expected_version)
+            self.saves += 1
+            return version
+        except ConversationStateConflict:
+            self.conflicts += 1
+            raise
+
+    async def delete(self, conversation_id: int):
+        await self.store.delete(conversation_id)
+
+    async def start(self, purge_interval: Optional[int] = None):
+        """Agendar limpeza periódica de estados expirados (backend postgres)"""
+        if not isinstance(self.store, PostgresStateStore) or self._purge_task:
+            return
+        interval = purge_interval or int(os.getenv("CONVERSATION_STATE_PURGE_INTERVAL", "600"))
+
+        async def _purge_loop():
+            while True:
+                try:
+                    removed = await self.store.purge_expired()
+                    if removed:
+                        logger.info(f"🧹 {removed} estado(s) de conversa expirado(s) removido(s)")
+                except Exception as e:
+                    logger.error(f"❌ Erro ao limpar estados expirados: {e}")
+                await asyncio.sleep(interval)
+
+        self._purge_task = asyncio.create_task(_purge_loop())
+
+    async def stop(self):
+        if self._purge_task:
+            self._purge_task.cancel()
+            self._purge_task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.store.backend,
+            "ttl_seconds": self.store.ttl,
+            "loads": self.loads,
+            "saves": self.saves,
+            "conflicts": self.conflicts,
+            "errors": self.errors,
+        }
+
+
+# Instância global
+conversation_state_store = ConversationStateStore()
@@ -1,6 +1,7 @@
 # AI service for processing messages and generating responses
 import openai
 import os
+import asyncio
 from typing import Optional, Dict, Any
 import logging
 
@@ -8,8 +9,11 @@ logger = logging.getLogger(__name__)
 
 class IAService:
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
+        # Cliente assíncrono: não bloqueia o event loop durante a chamada
+        self.timeout = float(os.getenv("AI_PROVIDER_TIMEOUT", "30"))
+        self.client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=self.timeout
         )
     
     async def generate_response(self, message: str, context: Optional[Dict[str, Any]] = None) -> str:
@@ -42,11 +46,14 @@ class IAService:
             messages.append({"role": "user", "content": message})
             
             # Generate response
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=500,
-                temperature=0.7
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=messages,
+                    max_tokens=500,
+                    temperature=0.7
+                ),
+                timeout=self.timeout
             )
             
             return response.choices[0].message.content
@@ -77,11 +84,14 @@ class IAService:
             - entities: entidades identificadas
             """
             
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200,
-                temperature=0.3
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=200,
+                    temperature=0.3
+                ),
+                timeout=self.timeout
             )
             
             # TODO: Parse JSON response properly
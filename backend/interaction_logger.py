@@ -0,0 +1,445 @@
+"""
+Registro de interações em lote (agent_interactions, interacoes_chamado)
+
+Quem registra só coloca a linha num buffer em memória; uma tarefa de fundo grava
+o buffer com COPY (copy_records_to_table) a cada INTERACTION_LOG_BATCH_SIZE linhas
+ou INTERACTION_LOG_FLUSH_MS milissegundos. Se o banco estiver indisponível, o lote
+vai para um arquivo JSONL em INTERACTION_LOG_SPILL_DIR e é regravado quando o banco
+voltar. Com o buffer cheio (INTERACTION_LOG_MAX_BUFFER), put() espera a próxima
+gravação por até INTERACTION_LOG_PUT_TIMEOUT_MS e depois manda a linha para o disco.
+
+O diretório de spill fica num volume (docker-compose) compartilhado pelas réplicas:
+cada arquivo é reservado com rename antes de ser regravado, então só uma réplica o lê.
+Datas com fuso (agora()) são convertidas para o fuso da sessão do banco nas colunas
+TIMESTAMP sem fuso, as mesmas em que o banco grava NOW().
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import socket
+from collections import deque
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple
+from zoneinfo import ZoneInfo
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPILL_DIR = os.path.join(os.path.dirname(__file__), '..', 'spill')
+# Arquivo reservado por uma réplica que morreu durante a regravação volta à fila depois disso
+SPILL_CLAIM_TIMEOUT = 600
+
+# Erros de conexão: o lote vai para o disco. Demais erros do Postgres são de dados
+# (FK, CHECK...) e fazem o lote ser regravado linha a linha, descartando as inválidas.
+CONNECTION_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+    asyncpg.exceptions.InterfaceError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.CannotConnectNowError,
+    asyncpg.exceptions.TooManyConnectionsError,
+    asyncpg.exceptions.AdminShutdownError,
+)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"$d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"$dec": str(value)}
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1:
+        if "$dt" in obj:
+            return datetime.fromisoformat(obj["$dt"])
+        if "$d" in obj:
+            return date.fromisoformat(obj["$d"])
+        if "$dec" in obj:
+            return Decimal(obj["$dec"])
+    return obj
+
+
+class BatchWriter:
+    """Buffer de linhas de uma tabela gravado em lote via COPY"""
+
+    def __init__(self, table: str, columns: Sequence[str], pool_getter: Callable[[], Any],
+                 env_prefix: str = "INTERACTION_LOG"):
+        self.table = table
+        self.columns = list(columns)
+        self._pool_getter = pool_getter
+        self.env_prefix = env_prefix
+
+        self.batch_size = 500
+        self.flush_interval = 0.2
+        self.max_buffer = 20000
+        self.put_timeout = 0.05
+        self.spill_dir = DEFAULT_SPILL_DIR
+        self._configured = False
+
+        self._buffer: Deque[Tuple] = deque()
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._spill_pending = False
+        self._spill_tasks: Set[asyncio.Task] = set()
+        # Colunas TIMESTAMP sem fuso e fuso da sessão do banco (lidos na primeira gravação)
+        self._naive_columns: Optional[List[int]] = None
+        self._db_timezone = None
+
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.rejected = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_ms: Optional[float] = None
+
+    def _configure(self):
+        if self._configured:
+            return
+        prefix = self.env_prefix
+        self.batch_size = max(1, int(os.getenv(f"{prefix}_BATCH_SIZE", "500")))
+        self.flush_interval = int(os.getenv(f"{prefix}_FLUSH_MS", "200")) / 1000
+        self.max_buffer = max(self.batch_size, int(os.getenv(f"{prefix}_MAX_BUFFER", "20000")))
+        self.put_timeout = int(os.getenv(f"{prefix}_PUT_TIMEOUT_MS", "50")) / 1000
+        self.spill_dir = os.getenv(f"{prefix}_SPILL_DIR", DEFAULT_SPILL_DIR)
+        self._configured = True
+
+    # ------------------------------------------------------------------
+    # Entrada
+    # ------------------------------------------------------------------
+
+    def submit(self, record: Tuple) -> bool:
+        """Enfileirar sem esperar; com o buffer cheio a linha vai para o disco em segundo plano"""
+        self._configure()
+        self._ensure_started()
+        self.submitted += 1
+        if len(self._buffer) >= self.max_buffer:
+            task = asyncio.get_running_loop().create_task(self._spill([record]))
+            self._spill_tasks.add(task)
+            task.add_done_callback(self._spill_tasks.discard)
+            return False
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        if len(self._buffer) >= self.max_buffer:
+            self._space.clear()
+        return True
+
+    async def put(self, record: Tuple) -> bool:
+        """Enfileirar; com o buffer cheio espera a gravação por até put_timeout"""
+        self._configure()
+        if len(self._buffer) >= self.max_buffer:
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._space.wait(), self.put_timeout)
+            except asyncio.TimeoutError:
+                pass
+            if len(self._buffer) >= self.max_buffer:
+                self._ensure_started()
+                self.submitted += 1
+                await self._spill([record])
+                return False
+        return self.submit(record)
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._task is not None or self._stopping:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def start(self):
+        self._configure()
+        self._stopping = False
+        # Lotes salvos em disco por uma execução anterior
+        await asyncio.to_thread(self._release_stale_claims)
+        self._spill_pending = bool(self._spill_files())
+        self._ensure_started()
+
+    async def stop(self):
+        """Parar a tarefa de fundo e gravar tudo o que estiver no buffer"""
+        self._stopping = True
+        if self._task:
+            # Esperar o lote em andamento: cancelar no meio do flush perderia as linhas já retiradas do buffer
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._spill_tasks:
+            await asyncio.gather(*self._spill_tasks, return_exceptions=True)
+        while self._buffer:
+            await self.flush()
+        if self.written or self.spilled:
+            logger.info(f"💾 {self.table}: {self.written} gravada(s), {self.spilled} no disco")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while self._buffer:
+                    await self.flush()
+                    if len(self._buffer) < self.batch_size:
+                        break
+                if self._spill_pending:
+                    await self._replay_spill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Erro ao gravar lote em {self.table}: {e}")
+
+    # ------------------------------------------------------------------
+    # Gravação
+    # ------------------------------------------------------------------
+
+    async def flush(self) -> int:
+        """Gravar um lote do buffer (até batch_size linhas); retorna linhas gravadas"""
+        async with self._flush_lock:
+            batch = []
+            while self._buffer and len(batch) < self.batch_size:
+                batch.append(self._buffer.popleft())
+            if len(self._buffer) < self.max_buffer:
+                self._space.set()
+            if not batch:
+                return 0
+            return await self._write(batch, spill_on_failure=True)
+
+    async def _write(self, batch: List[Tuple], spill_on_failure: bool) -> int:
+        pool = self._pool_getter()
+        if pool is None:
+            # Sem banco configurado: não há onde regravar depois
+            self.dropped += len(batch)
+            return 0
+
+        started = time.perf_counter()
+        try:
+            async with pool.acquire() as conn:
+                batch = await self._localize(conn, batch)
+                try:
+                    written = await self._copy(conn, batch)
+                except CONNECTION_ERRORS:
+                    raise
+                except asyncpg.PostgresError as e:
+                    # Uma linha inválida derruba o COPY inteiro: regravar uma a uma
+                    logger.warning(f"⚠️ COPY em {self.table} falhou ({e}); gravando linha a linha")
+                    written = await self._write_rows(conn, batch)
+        except CONNECTION_ERRORS as e:
+            self.last_error = str(e)
+            if not spill_on_failure:
+                raise
+            logger.error(f"❌ Banco indisponível para {self.table}: {e}; {len(batch)} linha(s) para o disco")
+            await self._spill(batch)
+            return 0
+
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.batches += 1
+        self.written += written
+        return written
+
+    async def _localize(self, conn, batch: List[Tuple]) -> List[Tuple]:
+        """Datas com fuso no fuso da sessão do banco, nas colunas TIMESTAMP sem fuso"""
+        if self._naive_columns is None:
+            timezone_name = await conn.fetchval("SELECT current_setting('TimeZone')")
+            naive = await conn.fetch("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_name = $1 AND table_schema = ANY(current_schemas(false))
+                  AND data_type = 'timestamp without time zone'
+            """, self.table)
+            names = {row["column_name"] for row in naive}
+            self._db_timezone = ZoneInfo(timezone_name)
+            self._naive_columns = [i for i, column in enumerate(self.columns) if column in names]
+        if not self._naive_columns:
+            return batch
+        localized = []
+        for record in batch:
+            values = list(record)
+            for i in self._naive_columns:
+                value = values[i]
+                if isinstance(value, datetime) and value.tzinfo is not None:
+                    values[i] = value.astimezone(self._db_timezone).replace(tzinfo=None)
+            localized.append(tuple(values))
+        return localized
+
+    async def _copy(self, conn, batch: List[Tuple]) -> int:
+        """Gravar o lote inteiro; retorna linhas gravadas"""
+        await conn.copy_records_to_table(self.table, records=batch, columns=self.columns)
+        return len(batch)
+
+    def _insert_sql(self) -> str:
+        """INSERT de uma linha, usado quando o lote falha"""
+        placeholders = ", ".join(f"${i + 1}" for i in range(len(self.columns)))
+        return f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES ({placeholders})"
+
+    async def _write_rows(self, conn, batch: List[Tuple]) -> int:
+        query = self._insert_sql()
+        written = 0
+        for record in batch:
+            try:
+                await conn.execute(query, *record)
+                written += 1
+            except CONNECTION_ERRORS:
+                raise
+            except asyncpg.PostgresError as e:
+                self.rejected += 1
+                self.last_error = str(e)
+                logger.error(f"❌ Linha descartada em {self.table}: {e}")
+        return written
+
+    # ------------------------------------------------------------------
+    # Disco
+    # ------------------------------------------------------------------
+
+    def _spill_write(self, batch: List[Tuple]):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        name = f"{self.table}-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.jsonl"
+        path = os.path.join(self.spill_dir, name)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for record in batch:
+                f.write(json.dumps(list(record), default=_json_default, ensure_ascii=False) + "\n")
+        os.replace(path + ".tmp", path)
+
+    async def _spill(self, batch: List[Tuple]):
+        try:
+            await asyncio.to_thread(self._spill_write, batch)
+            self.spilled += len(batch)
+            self._spill_pending = True
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"❌ Não foi possível gravar {len(batch)} linha(s) de {self.table} em disco: {e}")
+
+    def _spill_files(self) -> List[str]:
+        if not os.path.isdir(self.spill_dir):
+            return []
+        prefix = f"{self.table}-"
+        return sorted(
+            os.path.join(self.spill_dir, name)
+            for name in os.listdir(self.spill_dir)
+            if name.startswith(prefix) and name.endswith(".jsonl")
+        )
+
+    def _release_stale_claims(self):
+        if not os.path.isdir(self.spill_dir):
+            return
+        limite = time.time() - SPILL_CLAIM_TIMEOUT
+        for name in os.listdir(self.spill_dir):
+            base, _, _ = name.partition(".jsonl.")
+            if not name.startswith(f"{self.table}-") or base == name or name.endswith(".bad"):
+                continue
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if os.path.getmtime(path) < limite:
+                    os.rename(path, os.path.join(self.spill_dir, base + ".jsonl"))
+                    logger.warning(f"♻️ Lote de {self.table} reservado por uma réplica parada voltou à fila: {name}")
+            except FileNotFoundError:
+                continue
+
+    @staticmethod
+    def _claim_and_read(path: str) -> Optional[Tuple[str, List[Tuple]]]:
+        """Reservar o arquivo (rename) e ler o lote; None se outra réplica já o reservou"""
+        claimed = f"{path}.{socket.gethostname()}-{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        os.utime(claimed)
+        try:
+            with open(claimed, encoding="utf-8") as f:
+                batch = [tuple(json.loads(line, object_hook=_json_object_hook)) for line in f if line.strip()]
+        except ValueError:
+            os.replace(claimed, path + ".bad")
+            raise
+        return claimed, batch
+
+    async def _replay_spill(self):
+        """Regravar lotes salvos em disco (mais antigos primeiro)"""
+        for path in await asyncio.to_thread(self._spill_files):
+            try:
+                claimed = await asyncio.to_thread(self._claim_and_read, path)
+            except ValueError as e:
+                logger.error(f"❌ Arquivo de spill inválido {path}: {e}; renomeado para .bad")
+                continue
+            if claimed is None:
+                continue
+            claimed_path, batch = claimed
+            try:
+                if batch:
+                    await self._write(batch, spill_on_failure=False)
+            except CONNECTION_ERRORS:
+                # Devolver o arquivo para a próxima tentativa (desta ou de outra réplica)
+                await asyncio.to_thread(os.replace, claimed_path, path)
+                return
+            except BaseException:
+                await asyncio.to_thread(os.replace, claimed_path, path)
+                raise
+            await asyncio.to_thread(os.remove, claimed_path)
+            self.replayed += len(batch)
+            logger.info(f"♻️ {len(batch)} linha(s) de {self.table} regravada(s) do disco")
+        self._spill_pending = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffer),
+            "submitted": self.submitted,
+            "written": self.written,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "spill_files": len(self._spill_files()),
+            "last_flush_ms": self.last_flush_ms,
+            "last_error": self.last_error,
+        }
+
+
+def _chamados_pool():
+    from .chamados_service import chamados_service
+    return chamados_service.pool
+
+
+def agora() -> datetime:
+    """created_at de colunas TIMESTAMP WITH TIME ZONE: hora do registro, não da gravação do lote"""
+    return datetime.now(timezone.utc)
+
+
+# Instâncias globais
+agent_interactions_log = BatchWriter(
+    "agent_interactions",
+    ["agent_id", "user_message", "ai_response", "response_time", "tokens_used",
+     "cost", "success", "category", "metadata", "created_at"],
+    _chamados_pool,
+)
+interacoes_chamado_log = BatchWriter(
+    "interacoes_chamado",
+    ["chamado_id", "agente_id", "tipo", "conteudo", "metadata", "created_at"],
+    _chamados_pool,
+)
+INTERACTION_WRITERS = [agent_interactions_log, interacoes_chamado_log]
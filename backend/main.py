@@ -2,30 +2,47 @@
 """
 Cidadão.AI - Backend com Chatwoot
 """
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException, Header
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, BackgroundTasks, HTTPException, Header, Query
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi import UploadFile, File, Form
 from backend.websocket_manager import ws_manager, app as socketio_app
 from backend.attachment_service import AttachmentService
-from backend.models import ChatwootAttachment, ImageUploadRequest, ImageUploadResponse, CadastrarCidadaoRequest
+from backend.models import ChatwootAttachment, ImageUploadRequest, ImageUploadResponse, CadastrarCidadaoRequest, CadastrarCidadaosLoteRequest, AtualizarStatusChamadoRequest
 from fastapi.responses import FileResponse
 import httpx
 import json
+import functools
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import redis.asyncio as redis
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from openai import OpenAI
 import logging
 from backend.media_handler import media_handler
+from backend.media_store import media_store
 from backend.audio_transcriber import transcriber
+from backend.audio_transcoder import audio_transcoder, TranscodeError, TranscoderBusy
 from backend.ai_agent import ai_agent
-from backend.chamados_service import chamados_service
+from backend.chamados_service import chamados_service, decodificar_cursor
 from backend.chamados_ai_service import chamados_ai_service
+from backend.agent_routing import agent_routing_cache
+from backend.metricas_chamados import metricas_chamados
+from backend.interaction_logger import INTERACTION_WRITERS
+from backend.chatwoot_mirror import chatwoot_mirror
+from backend.partition_maintenance import partition_maintenance
+from backend.chatwoot_config import SUPPORTED_WEBHOOK_EVENTS
+from backend.webhook_queue import WebhookQueue, WebhookQueueFull, WebhookRetry
+from backend.webhook_dedup import WebhookDeduplicator
+from backend.transcription_service import TranscriptionService
+from backend.message_debouncer import message_debouncer
+from backend.communication import conversation_dispatcher, MailboxFull
+from backend.agents import AgentMessage
+from backend.chatwoot_client import chatwoot_client
+from backend.ai_providers import AIProvider
 
 # Configurar logging primeiro
 logging.basicConfig(level=logging.INFO)
@@ -188,6 +205,8 @@ async def update_time(time_id: int, payload: dict):
                 json.dumps(payload.get("config")) if payload.get("config") is not None else None,
                 payload.get("active"),
             )
+            # Categorias carregam o nome do time e somem com o time inativo
+            chamados_service.invalidar_categorias()
             return {"status": "success"}
     except Exception as e:
         logger.error(f"Erro ao atualizar time: {e}")
@@ -199,12 +218,128 @@ async def delete_time(time_id: int):
     try:
         async with chamados_service.pool.acquire() as conn:
             await conn.execute("DELETE FROM times WHERE id = $1", time_id)
+            chamados_service.invalidar_categorias()
             return {"status": "success"}
     except Exception as e:
         logger.error(f"Erro ao deletar time: {e}")
         return {"status": "error", "message": str(e)}
 
 
+@app.get("/api/tecnico/categorias", tags=["Painel Técnico"])
+async def list_categorias(prefeitura_id: int = 1):
+    try:
+        async with chamados_service.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT cc.id, cc.prefeitura_id, cc.time_id, t.nome AS time_nome, cc.nome, cc.descricao,
+                       cc.keywords, cc.prioridade, cc.sla_horas, cc.template_resposta, cc.active, cc.created_at
+                FROM categorias_chamados cc
+                LEFT JOIN times t ON t.id = cc.time_id
+                WHERE cc.prefeitura_id = $1
+                ORDER BY cc.nome
+                """,
+                prefeitura_id,
+            )
+            data = []
+            for r in rows:
+                item = dict(r)
+                item["keywords"] = list(r["keywords"]) if r["keywords"] else []
+                item["created_at"] = r["created_at"].isoformat() if r["created_at"] else None
+                data.append(item)
+            return {"status": "success", "data": data}
+    except Exception as e:
+        logger.error(f"Erro ao listar categorias: {e}")
+        return {"status": "error", "message": str(e)}
+
+
+@app.post("/api/tecnico/categorias", tags=["Painel Técnico"])
+async def create_categoria(payload: dict):
+    try:
+        if payload.get("keywords") is not None and not isinstance(payload["keywords"], list):
+            return {"status": "error", "message": "keywords deve ser uma lista"}
+        prefeitura_id = payload.get("prefeitura_id", 1)
+        async with chamados_service.pool.acquire() as conn:
+            result = await conn.fetchrow(
+                """
+                INSERT INTO categorias_chamados (
+                    prefeitura_id, time_id, nome, descricao, keywords, prioridade, sla_horas,
+                    template_resposta, active, created_at
+                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, TRUE, NOW())
+                RETURNING id, nome
+                """,
+                prefeitura_id,
+                payload.get("time_id"),
+                payload.get("nome"),
+                payload.get("descricao"),
+                payload.get("keywords", []),
+                payload.get("prioridade", "normal"),
+                payload.get("sla_horas", 72),
+                payload.get("template_resposta"),
+            )
+        chamados_service.invalidar_categorias(prefeitura_id)
+        return {"status": "success", "id": result["id"], "nome": result["nome"]}
+    except Exception as e:
+        logger.error(f"Erro ao criar categoria: {e}")
+        return {"status": "error", "message": str(e)}
+
+
+@app.put("/api/tecnico/categorias/{categoria_id}", tags=["Painel Técnico"])
+async def update_categoria(categoria_id: int, payload: dict):
+    try:
+        if payload.get("keywords") is not None and not isinstance(payload["keywords"], list):
+            return {"status": "error", "message": "keywords deve ser uma lista"}
+        async with chamados_service.pool.acquire() as conn:
+            prefeitura_id = await conn.fetchval(
+                """
+                UPDATE categorias_chamados SET
+                    time_id = COALESCE($2, time_id),
+                    nome = COALESCE($3, nome),
+                    descricao = COALESCE($4, descricao),
+                    keywords = COALESCE($5, keywords),
+                    prioridade = COALESCE($6, prioridade),
+                    sla_horas = COALESCE($7, sla_horas),
+                    template_resposta = COALESCE($8, template_resposta),
+                    active = COALESCE($9, active)
+                WHERE id = $1
+                RETURNING prefeitura_id
+                """,
+                categoria_id,
+                payload.get("time_id"),
+                payload.get("nome"),
+                payload.get("descricao"),
+                payload.get("keywords"),
+                payload.get("prioridade"),
+                payload.get("sla_horas"),
+                payload.get("template_resposta"),
+                payload.get("active"),
+            )
+        if prefeitura_id is None:
+            return {"status": "error", "message": "Categoria não encontrada"}
+        chamados_service.invalidar_categorias(prefeitura_id)
+        return {"status": "success"}
+    except Exception as e:
+        logger.error(f"Erro ao atualizar categoria: {e}")
+        return {"status": "error", "message": str(e)}
+
+
+@app.delete("/api/tecnico/categorias/{categoria_id}", tags=["Painel Técnico"])
+async def delete_categoria(categoria_id: int):
+    try:
+        async with chamados_service.pool.acquire() as conn:
+            # Chamados antigos continuam apontando para a categoria: só desativar
+            prefeitura_id = await conn.fetchval(
+                "UPDATE categorias_chamados SET active = FALSE WHERE id = $1 RETURNING prefeitura_id",
+                categoria_id,
+            )
+        if prefeitura_id is None:
+            return {"status": "error", "message": "Categoria não encontrada"}
+        chamados_service.invalidar_categorias(prefeitura_id)
+        return {"status": "success"}
+    except Exception as e:
+        logger.error(f"Erro ao deletar categoria: {e}")
+        return {"status": "error", "message": str(e)}
+
+
 @app.get("/api/tecnico/agentes", tags=["Painel Técnico"])
 async def list_agentes(prefeitura_id: int = 1):
     try:
@@ -398,6 +533,16 @@ else:
 
 redis_client = redis.from_url(REDIS_URL)
 
+# Processamento de webhooks: "queue" (responde 200 e processa em background) ou "sync"
+WEBHOOK_PROCESSING_MODE = os.getenv("WEBHOOK_PROCESSING_MODE", "queue").lower()
+webhook_queue = WebhookQueue(redis_client=redis_client)
+
+# Reenvios do Chatwoot (timeout) ignorados antes de enfileirar ou processar
+webhook_dedup = WebhookDeduplicator(redis_client=redis_client)
+
+# Transcrição dos áudios recebidos em background (cache por hash no Redis)
+transcription_service = TranscriptionService(redis_client=redis_client)
+
 # Inicializar serviço de chamados
 @app.on_event("startup")
 async def startup_event():
@@ -409,42 +554,98 @@ async def startup_event():
     except Exception as e:
         logger.error(f"❌ Erro ao inicializar serviços: {e}")
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Fechar serviços no shutdown"""
     try:
-        logger.info("🔄 Fechando serviços...")
-        await chamados_service.close()
-        logger.info("✅ Serviços fechados")
+        await ws_manager.start()
     except Exception as e:
-        logger.error(f"❌ Erro ao fechar serviços: {e}")
+        logger.error(f"❌ Erro ao iniciar WebSocket multi-réplica: {e}")
 
-# Utilidades para Chatwoot
-def extract_chatwoot_payload(api_response: Any) -> List[Dict[str, Any]]:
-    """Extrai a lista de itens retornada pela API do Chatwoot independentemente do formato.
+    try:
+        await chatwoot_client.start()
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar cliente Chatwoot: {e}")
 
-    Algumas versões retornam em payload no topo (data["payload"]) e outras retornam em data.payload.
-    Esta função tenta ambos os formatos e retorna sempre uma lista.
-    """
     try:
-        if not isinstance(api_response, dict):
-            return []
+        await conversation_dispatcher.start(executar_webhook)
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar dispatcher de conversas: {e}")
 
-        # Formato 1: { "payload": [...] }
-        if "payload" in api_response and isinstance(api_response["payload"], list):
-            return api_response["payload"]
+    if WEBHOOK_PROCESSING_MODE == "queue":
+        try:
+            await webhook_queue.start(processar_webhook_da_fila)
+        except Exception as e:
+            logger.error(f"❌ Erro ao iniciar fila de webhooks: {e}")
+
+    try:
+        await message_debouncer.start(gerar_resposta_ia, entregar_resposta_ia)
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar agrupamento de mensagens: {e}")
 
-        # Formato 2: { "data": { "payload": [...] } }
-        data_obj = api_response.get("data")
-        if isinstance(data_obj, dict) and isinstance(data_obj.get("payload"), list):
-            return data_obj["payload"]
+    try:
+        await transcription_service.start()
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar fila de transcrição: {e}")
 
-        # Formato 3: { "data": [...] }
-        if isinstance(data_obj, list):
-            return data_obj
-    except Exception:
-        pass
-    return []
+    try:
+        await agent_routing_cache.start()
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar cache de roteamento de agentes: {e}")
+
+    try:
+        await chamados_ai_service.conversation_states.start()
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar limpeza de estados das conversas: {e}")
+
+    for writer in INTERACTION_WRITERS:
+        try:
+            await writer.start()
+        except Exception as e:
+            logger.error(f"❌ Erro ao iniciar registro de interações em {writer.table}: {e}")
+
+    try:
+        await chatwoot_mirror.start()
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar espelho do Chatwoot: {e}")
+
+    try:
+        await metricas_chamados.start()
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar reconciliação das métricas: {e}")
+
+    try:
+        await partition_maintenance.start()
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar manutenção das partições: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Fechar serviços no shutdown
+
+    Cada serviço é fechado à parte: a falha de um (ex.: Redis fora do ar) não impede
+    os seguintes, em especial a gravação das interações pendentes e o fechamento do pool.
+    """
+    logger.info("🔄 Fechando serviços...")
+    # Em ordem: interações pendentes e espelho gravam antes de fechar o pool de chamados
+    etapas = [
+        ("parar fila de webhooks", webhook_queue.stop),
+        ("parar dispatcher de conversas", conversation_dispatcher.stop),
+        ("parar fila de transcrição", transcription_service.stop),
+        ("parar agrupamento de mensagens", message_debouncer.stop),
+        ("parar limpeza de estados das conversas", chamados_ai_service.conversation_states.stop),
+        ("parar cache de roteamento de agentes", agent_routing_cache.stop),
+        ("parar reconciliação das métricas", metricas_chamados.stop),
+        ("parar manutenção das partições", partition_maintenance.stop),
+        ("parar WebSocket multi-réplica", ws_manager.stop),
+        ("fechar cliente Chatwoot", chatwoot_client.close),
+        *((f"parar registro de interações em {writer.table}", writer.stop) for writer in INTERACTION_WRITERS),
+        ("parar espelho do Chatwoot", chatwoot_mirror.stop),
+        ("fechar serviço de chamados", chamados_service.close),
+    ]
+    for descricao, fechar in etapas:
+        try:
+            await fechar()
+        except Exception as e:
+            logger.error(f"❌ Erro ao {descricao}: {e}")
+    logger.info("✅ Serviços fechados")
 
 # Modelos Pydantic
 class WebhookPayload(BaseModel):
@@ -468,6 +669,45 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/api/ws/status", tags=["Status"])
+async def get_websocket_status():
+    """Backend do WebSocket e presença desta réplica"""
+    return {"status": "success", **ws_manager.get_stats(), "timestamp": datetime.now().isoformat()}
+
+@app.get("/api/ws/conversations/{conversation_id}/presence", tags=["Status"])
+async def get_conversation_presence(conversation_id: int):
+    """Clientes conectados à conversa em todas as réplicas"""
+    try:
+        members = await ws_manager.conversation_members(conversation_id)
+        return {
+            "status": "success",
+            "conversation_id": conversation_id,
+            "clients": len(members),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Error reading websocket presence: {str(e)}")
+        return {
+            "status": "error",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }
+
+@app.get("/api/audio/transcoder/status", tags=["Status"])
+async def get_audio_transcoder_status():
+    """Fila e tempos da conversão de áudio (ffmpeg)"""
+    return {"status": "success", **audio_transcoder.get_stats(), "timestamp": datetime.now().isoformat()}
+
+@app.get("/api/audio/transcription/status", tags=["Status"])
+async def get_audio_transcription_status():
+    """Fila, cache e economia (segundos de fala vs. áudio) da transcrição"""
+    return {"status": "success", **transcription_service.get_stats(), "timestamp": datetime.now().isoformat()}
+
+@app.get("/api/media/status", tags=["Status"])
+async def get_media_status():
+    """Uso do volume de mídia (arquivos, cota e reaproveitamento)"""
+    return {"status": "success", **media_store.get_stats(), "timestamp": datetime.now().isoformat()}
+
 @app.get("/api/agent/status", tags=["AI Agent"])
 async def get_agent_status():
     """Verificar status do agente IA"""
@@ -479,7 +719,9 @@ async def get_agent_status():
             "groq_configured": bool(os.getenv("GROQ_API_KEY")),
             "openai_configured": bool(os.getenv("OPENAI_API_KEY")),
             "anthropic_configured": bool(os.getenv("ANTHROPIC_API_KEY")),
-            "conversation_memory_count": len(ai_agent.conversation_memory),
+            "conversation_memory": await ai_agent.conversation_memory.get_stats(),
+            "message_debounce": message_debouncer.get_stats(),
+            "providers": AIProvider.get_stats(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -501,10 +743,7 @@ async def get_agent_debug():
             "groq_configured": bool(os.getenv("GROQ_API_KEY")),
             "openai_configured": bool(os.getenv("OPENAI_API_KEY")),
             "anthropic_configured": bool(os.getenv("ANTHROPIC_API_KEY")),
-            "conversation_memory": {
-                "total_conversations": len(ai_agent.conversation_memory),
-                "conversation_ids": list(ai_agent.conversation_memory.keys())
-            },
+            "conversation_memory": await ai_agent.conversation_memory.get_stats(),
             "environment": {
                 "groq_key_set": bool(os.getenv("GROQ_API_KEY")),
                 "groq_key_length": len(os.getenv("GROQ_API_KEY", "")) if os.getenv("GROQ_API_KEY") else 0,
@@ -566,6 +805,12 @@ async def get_chamados_status():
             "status": "success",
             "chamados_ai_available": chamados_ai_service.is_available(),
             "database_connected": chamados_service.pool is not None,
+            "conversation_states": chamados_ai_service.conversation_states.get_stats(),
+            "consultas_cache": chamados_service._consultas_cache.get_stats(),
+            "metricas": metricas_chamados.get_stats(),
+            "interaction_log": {writer.table: writer.get_stats() for writer in INTERACTION_WRITERS},
+            "chatwoot_mirror": chatwoot_mirror.get_stats(),
+            "particoes": partition_maintenance.get_stats(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -594,6 +839,42 @@ async def get_chamados_metrics():
             "timestamp": datetime.now().isoformat()
         }
 
+@app.post("/api/chamados/metrics/reconciliar", tags=["Chamados"])
+async def reconciliar_chamados_metrics():
+    """Recalcular os contadores do dashboard a partir das tabelas"""
+    try:
+        corrigidos = await metricas_chamados.reconciliar()
+        return {
+            "status": "success",
+            "grupos_corrigidos": corrigidos,
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Error reconciling chamados metrics: {str(e)}")
+        return {
+            "status": "error",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }
+
+@app.post("/api/chamados/particoes/manutencao", tags=["Chamados"])
+async def manter_particoes():
+    """Criar partições futuras e arquivar as expiradas (interações)"""
+    try:
+        resultado = await partition_maintenance.manter()
+        return {
+            "status": "success",
+            "tabelas": resultado,
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Error maintaining partitions: {str(e)}")
+        return {
+            "status": "error",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }
+
 @app.post("/api/chamados/criar", tags=["Chamados"])
 async def criar_chamado(request: dict):
     """Criar novo chamado"""
@@ -642,6 +923,27 @@ async def consultar_chamado(request: dict):
             "timestamp": datetime.now().isoformat()
         }
 
+@app.post("/api/chamados/{protocolo}/status", tags=["Chamados"])
+async def atualizar_status_chamado(protocolo: str, payload: AtualizarStatusChamadoRequest):
+    """Atualizar status do chamado (aberto, em_andamento, resolvido, cancelado)"""
+    try:
+        result = await chamados_service.atualizar_status_chamado(protocolo, payload)
+        if result.status != "success":
+            status_code = 404 if result.message == "Chamado não encontrado" else 400
+            raise HTTPException(status_code=status_code, detail=result.message)
+        return {
+            "status": "success",
+            "chamado": result.chamado.dict() if result.chamado else None,
+            "status_anterior": result.status_anterior,
+            "message": result.message,
+            "timestamp": datetime.now().isoformat()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao atualizar status do chamado: {str(e)}")
+        raise HTTPException(status_code=500, detail="Erro ao atualizar status do chamado")
+
 @app.post("/api/chamados/cidadaos", tags=["Chamados"])
 async def cadastrar_cidadao(payload: CadastrarCidadaoRequest):
     try:
@@ -659,6 +961,20 @@ async def cadastrar_cidadao(payload: CadastrarCidadaoRequest):
         logger.error(f"Erro ao cadastrar cidadão: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro ao cadastrar cidadão")
 
+@app.post("/api/chamados/cidadaos/lote", tags=["Chamados"])
+async def cadastrar_cidadaos_lote(payload: CadastrarCidadaosLoteRequest):
+    """Cadastrar/atualizar cidadãos em lote (importação do CadÚnico)"""
+    try:
+        result = await chamados_service.cadastrar_cidadaos_lote(payload.cidadaos)
+        if result.status == "error":
+            raise HTTPException(status_code=400, detail=result.message)
+        return result.dict()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao cadastrar lote de cidadãos: {str(e)}")
+        raise HTTPException(status_code=500, detail="Erro ao cadastrar lote de cidadãos")
+
 # Webhook endpoint para Chatwoot
 @app.post("/webhook/chatwoot", tags=["Webhooks"])
 async def chatwoot_webhook(request: Request):
@@ -670,50 +986,143 @@ async def chatwoot_webhook(request: Request):
     - conversation_created: Nova conversa criada
     - conversation_updated: Conversa atualizada
     - contact_updated: Contato atualizado
+
+    No modo "queue" (padrão) o webhook é validado, gravado na fila e respondido
+    imediatamente; os workers da fila executam o processamento. Reenvios da mesma
+    entrega (ver webhook_dedup) são respondidos sem processar.
     """
     try:
         # Receber payload bruto
         payload = await request.json()
-        logger.info(f"Received webhook payload: {json.dumps(payload, indent=2)}")
+        logger.debug(f"Received webhook payload: {json.dumps(payload, indent=2)}")
         
+        if not isinstance(payload, dict):
+            logger.warning("Invalid webhook payload")
+            return {"status": "error", "message": "Invalid payload"}
+
         # Extrair evento
         event = payload.get("event")
         if not event:
             logger.warning("No event found in payload")
             return {"status": "error", "message": "No event found"}
         
-        logger.info(f"Processing webhook event: {event}")
-        
         # Nota: Chatwoot não oferece verificação de assinatura HMAC
         # Os webhooks são enviados sem secret token ou headers personalizados
         # A verificação de autenticidade deve ser feita por outros meios se necessário
-        
-        # Processar diferentes tipos de eventos
-        if event == "message_created":
-            await handle_message_created(payload)
-        elif event == "message_updated":
-            await handle_message_updated(payload)
-        elif event == "conversation_created":
-            await handle_conversation_created(payload)
-        elif event == "conversation_updated":
-            await handle_conversation_updated(payload)
-        elif event == "conversation_status_changed":
-            await handle_conversation_status_changed(payload)
-        elif event == "contact_updated":
-            await handle_contact_updated(payload)
-        elif event == "conversation_typing_on":
-            await handle_conversation_typing_on(payload)
-        elif event == "conversation_typing_off":
-            await handle_conversation_typing_off(payload)
-        else:
+
+        if event not in SUPPORTED_WEBHOOK_EVENTS:
             logger.warning(f"Unhandled webhook event: {event}")
+            return {"status": "ignored", "event": event}
+
+        # Entrega repetida: responder 200 para o Chatwoot parar de reenviar
+        dedup_key = webhook_dedup.make_key(event, payload)
+        if not await webhook_dedup.claim(event, dedup_key):
+            return {"status": "duplicate", "event": event}
+
+        if WEBHOOK_PROCESSING_MODE == "queue":
+            try:
+                # Partição pela conversa: a ordem se mantém entre réplicas
+                envelope_id = await webhook_queue.enqueue(event, payload, key=ator_do_webhook(payload)[0])
+            except WebhookQueueFull as e:
+                logger.error(f"❌ {e}")
+                await webhook_dedup.release(dedup_key)
+                raise HTTPException(status_code=503, detail="Webhook queue full")
+            except Exception:
+                await webhook_dedup.release(dedup_key)
+                raise
+            logger.info(f"📥 Webhook {event} enfileirado ({envelope_id})")
+            return {"status": "accepted", "event": event, "id": envelope_id}
+
+        logger.info(f"Processing webhook event: {event}")
+        try:
+            await processar_webhook_em_ordem(payload)
+        except MailboxFull as e:
+            logger.error(f"❌ {e}")
+            await webhook_dedup.release(dedup_key)
+            raise HTTPException(status_code=503, detail="Conversation mailbox full")
+        except Exception:
+            await webhook_dedup.release(dedup_key)
+            raise
         
         return {"status": "success", "event": event}
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/api/webhook/queue/stats", tags=["Webhooks"])
+async def get_webhook_queue_stats():
+    """Profundidade, atraso e vazão da fila de webhooks"""
+    try:
+        return {
+            "status": "success",
+            "mode": WEBHOOK_PROCESSING_MODE,
+            "queue": await webhook_queue.get_stats(),
+            "conversations": conversation_dispatcher.get_stats(),
+            "dedup": webhook_dedup.get_stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Error getting webhook queue stats: {str(e)}")
+        return {"status": "error", "message": str(e)}
+
+def ator_do_webhook(payload: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+    """Ator que processa o webhook: a conversa, ou o contato em contact_updated"""
+    event = payload.get("event") or ""
+    conversation_id = (payload.get("conversation") or {}).get("id")
+    if conversation_id is None and event.startswith("conversation_"):
+        # Eventos de conversa trazem a própria conversa no payload
+        conversation_id = payload.get("id")
+    if conversation_id is not None:
+        return f"conversation:{conversation_id}", conversation_id
+    return f"{event.split('_')[0]}:{payload.get('id')}", None
+
+async def processar_webhook_em_ordem(payload: Dict[str, Any]):
+    """Processar o webhook na vez da sua conversa (ordem de chegada, pool limitado)"""
+    if not conversation_dispatcher.running:
+        # Dispatcher não iniciou: processar direto, sem ordem por conversa
+        await dispatch_webhook_event(payload)
+        return
+    actor_id, conversation_id = ator_do_webhook(payload)
+    await conversation_dispatcher.dispatch(actor_id, payload.get("event"), payload, conversation_id=conversation_id)
+
+async def processar_webhook_da_fila(payload: Dict[str, Any]):
+    """Handler da fila de webhooks: com a caixa da conversa cheia, tentar de novo depois"""
+    try:
+        await processar_webhook_em_ordem(payload)
+    except MailboxFull as e:
+        raise WebhookRetry(str(e))
+
+async def executar_webhook(message: AgentMessage):
+    """Handler dos atores de conversa"""
+    await dispatch_webhook_event(message.data)
+
+async def dispatch_webhook_event(payload: Dict[str, Any]):
+    """Encaminhar o webhook para o handler do evento"""
+    event = payload.get("event")
+
+    # Processar diferentes tipos de eventos
+    if event == "message_created":
+        await handle_message_created(payload)
+    elif event == "message_updated":
+        await handle_message_updated(payload)
+    elif event == "conversation_created":
+        await handle_conversation_created(payload)
+    elif event == "conversation_updated":
+        await handle_conversation_updated(payload)
+    elif event == "conversation_status_changed":
+        await handle_conversation_status_changed(payload)
+    elif event == "contact_updated":
+        await handle_contact_updated(payload)
+    elif event == "conversation_typing_on":
+        await handle_conversation_typing_on(payload)
+    elif event == "conversation_typing_off":
+        await handle_conversation_typing_off(payload)
+    else:
+        logger.warning(f"Unhandled webhook event: {event}")
+
 async def handle_message_created(data: Dict[str, Any]):
     """Processar mensagem criada"""
     try:
@@ -722,6 +1131,7 @@ async def handle_message_created(data: Dict[str, Any]):
         conversation_id = message_data.get("conversation", {}).get("id")
         
         # Processar áudio se houver
+        texto_original = message_data.get("content")
         audio_info = await media_handler.handle_audio(message_data)
         if audio_info:
             logger.info(f"✅ Áudio processado: {audio_info['filepath']}")
@@ -820,33 +1230,77 @@ async def handle_message_created(data: Dict[str, Any]):
             
             logger.info(f"📨 Nova mensagem recebida: {content[:100]}...")
             
+            if audio_info and not texto_original:
+                # Áudio sem texto: responder depois da transcrição, sem segurar o webhook
+                aceito = transcription_service.submit(
+                    audio_info["filepath"],
+                    audio_info.get("sha256"),
+                    functools.partial(responder_audio_transcrito, message_data, conversation_data),
+                )
+                if aceito:
+                    logger.info("🎧 Áudio enviado para a fila de transcrição")
+                else:
+                    await responder_audio_transcrito(message_data, conversation_data, None)
             # Verificar se agente está disponível
-            if ai_agent.is_available():
-                logger.info("🤖 Agente IA disponível - processando mensagem automaticamente")
-                
-                # Processar com IA
-                ai_response = await process_with_ai(content, conversation_data)
+            elif ai_agent.is_available():
+                logger.info("🤖 Agente IA disponível - agrupando mensagem para resposta automática")
                 
-                # Enviar resposta do agente para Chatwoot
-                if ai_response:
-                    await send_message_to_chatwoot(
-                        conversation_data.get("id"),
-                        ai_response,
-                        message_data.get("account", {}).get("id"),
-                        is_ai_agent=True
-                    )
-                    logger.info("✅ Resposta do agente enviada automaticamente")
+                # Uma resposta por rajada de mensagens (ver message_debouncer)
+                await message_debouncer.submit(
+                    conversation_data.get("id"),
+                    content,
+                    contexto_resposta_ia(message_data, conversation_data)
+                )
             else:
                 logger.warning("⚠️ Agente IA não disponível - mensagem não será respondida automaticamente")
         else:
             logger.info(f"🔍 DEBUG - Condição não atendida: message_type='{message_type}', sender_type='{sender_type}'")
         
-        # Salvar no banco de dados
-        await save_message_to_database(message_data, conversation_data)
+        # Salvar no banco de dados (payload original do Chatwoot)
+        await save_message_to_database(data, conversation_data)
         
     except Exception as e:
         logger.error(f"Error handling message created: {str(e)}")
 
+def contexto_resposta_ia(message_data: Dict[str, Any], conversation_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Dados da conversa usados ao gerar e entregar a resposta agrupada"""
+    return {
+        "conversation": conversation_data,
+        "account_id": message_data.get("account", {}).get("id"),
+    }
+
+async def gerar_resposta_ia(conversation_id: int, content: str, contexto: Dict[str, Any]) -> Optional[str]:
+    """Gerar resposta para as mensagens agrupadas (pode ser cancelada por mensagem nova)"""
+    if not ai_agent.is_available():
+        logger.warning("⚠️ Agente IA não disponível - mensagem não será respondida automaticamente")
+        return None
+    return await process_with_ai(content, contexto["conversation"])
+
+async def entregar_resposta_ia(conversation_id: int, ai_response: str, contexto: Dict[str, Any]):
+    """Enviar resposta do agente para o Chatwoot"""
+    await send_message_to_chatwoot(conversation_id, ai_response, contexto["account_id"], is_ai_agent=True)
+    logger.info("✅ Resposta do agente enviada automaticamente")
+
+async def responder_audio_transcrito(message_data: Dict[str, Any], conversation_data: Dict[str, Any],
+                                     texto: Optional[str]):
+    """Responder a um áudio do cidadão com base na transcrição"""
+    try:
+        conversation_id = conversation_data.get("id")
+        if texto:
+            await ws_manager.emit_message_transcription(conversation_id, message_data.get("id"), texto)
+
+        if not ai_agent.is_available():
+            logger.warning("⚠️ Agente IA não disponível - áudio não será respondido automaticamente")
+            return
+
+        # Sem transcrição (falha ou áudio sem fala) o agente responde ao aviso de áudio, como antes
+        content = texto or message_data.get("content") or "🎵 Mensagem de áudio"
+        await message_debouncer.submit(
+            conversation_id, content, contexto_resposta_ia(message_data, conversation_data)
+        )
+    except Exception as e:
+        logger.error(f"❌ Erro ao responder áudio transcrito: {str(e)}")
+
 async def handle_message_updated(data: Dict[str, Any]):
     """Processar mensagem atualizada"""
     try:
@@ -871,6 +1325,9 @@ async def handle_conversation_status_changed(data: Dict[str, Any]):
         # Atualizar status no banco de dados
         await update_conversation_status(conversation_data)
         
+        # Avisar os painéis dos técnicos que veem a conversa
+        await ws_manager.emit_conversation_update(conversation_data)
+        
     except Exception as e:
         logger.error(f"Error handling conversation status change: {str(e)}")
 
@@ -884,6 +1341,9 @@ async def handle_conversation_created(data: Dict[str, Any]):
         # Salvar conversa no banco de dados
         await save_conversation_to_database(conversation_data)
         
+        # Avisar os painéis dos técnicos que veem a conversa
+        await ws_manager.emit_conversation_update(conversation_data)
+        
     except Exception as e:
         logger.error(f"Error handling conversation created: {str(e)}")
 
@@ -896,6 +1356,9 @@ async def handle_conversation_updated(data: Dict[str, Any]):
         # Atualizar conversa no banco de dados
         await update_conversation_in_database(conversation_data)
         
+        # Avisar os painéis dos técnicos que veem a conversa
+        await ws_manager.emit_conversation_update(conversation_data)
+        
     except Exception as e:
         logger.error(f"Error handling conversation updated: {str(e)}")
 
@@ -1007,26 +1470,11 @@ async def send_message_to_chatwoot(conversation_id: int, content: str, account_i
             logger.warning("Chatwoot API not configured")
             return
         
-        url = f"{CHATWOOT_URL}/api/v1/accounts/{account_id}/conversations/{conversation_id}/messages"
-        
-        headers = {
-            "api_access_token": CHATWOOT_API_TOKEN,
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        
         # Adicionar prefixo para identificar mensagens do agente
         if is_ai_agent:
             content = f"🤖 {content}"
         
-        payload = {
-            "content": content,
-            "message_type": "outgoing"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
+        await chatwoot_client.send_message(conversation_id, content, account_id=account_id)
             
         agent_type = "Agente IA" if is_ai_agent else "Técnico"
         logger.info(f"✅ Mensagem enviada para Chatwoot conversa {conversation_id} ({agent_type})")
@@ -1035,10 +1483,9 @@ async def send_message_to_chatwoot(conversation_id: int, content: str, account_i
         logger.error(f"❌ Erro ao enviar mensagem para Chatwoot: {str(e)}")
 
 async def save_message_to_database(message_data: Dict[str, Any], conversation_data: Dict[str, Any]):
-    """Salvar mensagem no banco de dados"""
+    """Salvar mensagem no banco de dados (gravação em lote, ver chatwoot_mirror)"""
     try:
-        # TODO: Implementar salvamento no PostgreSQL
-        logger.info(f"Saving message {message_data.get('id')} to database")
+        await chatwoot_mirror.save_message(message_data, conversation_data, criada=True)
         
     except Exception as e:
         logger.error(f"Error saving message to database: {str(e)}")
@@ -1046,8 +1493,7 @@ async def save_message_to_database(message_data: Dict[str, Any], conversation_da
 async def save_conversation_to_database(conversation_data: Dict[str, Any]):
     """Salvar conversa no banco de dados"""
     try:
-        # TODO: Implementar salvamento no PostgreSQL
-        logger.info(f"Saving conversation {conversation_data.get('id')} to database")
+        await chatwoot_mirror.save_conversation(conversation_data)
         
     except Exception as e:
         logger.error(f"Error saving conversation to database: {str(e)}")
@@ -1055,8 +1501,7 @@ async def save_conversation_to_database(conversation_data: Dict[str, Any]):
 async def update_message_in_database(message_data: Dict[str, Any], conversation_data: Dict[str, Any]):
     """Atualizar mensagem no banco de dados"""
     try:
-        # TODO: Implementar atualização no PostgreSQL
-        logger.info(f"Updating message {message_data.get('id')} in database")
+        await chatwoot_mirror.save_message(message_data, conversation_data, criada=False)
         
     except Exception as e:
         logger.error(f"Error updating message in database: {str(e)}")
@@ -1064,17 +1509,15 @@ async def update_message_in_database(message_data: Dict[str, Any], conversation_
 async def update_conversation_in_database(conversation_data: Dict[str, Any]):
     """Atualizar conversa no banco de dados"""
     try:
-        # TODO: Implementar atualização no PostgreSQL
-        logger.info(f"Updating conversation {conversation_data.get('id')} in database")
+        await chatwoot_mirror.save_conversation(conversation_data)
         
     except Exception as e:
         logger.error(f"Error updating conversation in database: {str(e)}")
 
 async def update_conversation_status(conversation_data: Dict[str, Any]):
-    """Atualizar status da conversa no banco de dados"""
+    """Atualizar status da conversa no banco de dados (o payload traz a conversa inteira)"""
     try:
-        # TODO: Implementar atualização no PostgreSQL
-        logger.info(f"Updating conversation {conversation_data.get('id')} status")
+        await chatwoot_mirror.save_conversation(conversation_data)
         
     except Exception as e:
         logger.error(f"Error updating conversation status: {str(e)}")
@@ -1082,8 +1525,7 @@ async def update_conversation_status(conversation_data: Dict[str, Any]):
 async def update_contact_in_database(contact_data: Dict[str, Any]):
     """Atualizar contato no banco de dados"""
     try:
-        # TODO: Implementar atualização no PostgreSQL
-        logger.info(f"Updating contact {contact_data.get('id')} in database")
+        await chatwoot_mirror.save_contact(contact_data)
         
     except Exception as e:
         logger.error(f"Error updating contact in database: {str(e)}")
@@ -1182,55 +1624,42 @@ async def get_conversations():
         if not CHATWOOT_API_TOKEN:
             raise HTTPException(status_code=400, detail="CHATWOOT_API_TOKEN not configured")
         
-        # Chamada real para API do Chatwoot
-        url = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations"
-        headers = {
-            "api_access_token": CHATWOOT_API_TOKEN,
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+        # Chamada real para API do Chatwoot (payload já normalizado independentemente da versão)
+        payload = await chatwoot_client.list_conversations()
+        logger.info(f"Processing {len(payload)} conversations from Chatwoot")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-
-            # Extrair payload independentemente da versão
-            payload = extract_chatwoot_payload(data)
-            logger.info(f"Processing {len(payload)} conversations from Chatwoot")
-            
-            conversations = []
-            for conv in payload:
-                # Extrair dados do contato
-                meta = conv.get("meta", {})
-                sender = meta.get("sender", {})
-                
-                # Extrair última mensagem
-                messages = conv.get("messages", [])
-                last_message = "Sem mensagens"
-                if messages:
-                    last_msg = messages[-1]
-                    last_message = last_msg.get("content", "Sem mensagens")
-                
-                conversation = {
-                    "id": conv.get("id"),
-                    "contact": {
-                        "name": sender.get("name", "Usuário"),
-                        "phone": sender.get("phone_number", "")
-                    },
-                    "lastMessage": last_message,
-                    "timestamp": conv.get("last_activity_at", conv.get("updated_at")),
-                    "status": conv.get("status", "open"),
-                    "unreadCount": conv.get("unread_count", 0)
-                }
-                conversations.append(conversation)
+        conversations = []
+        for conv in payload:
+            # Extrair dados do contato
+            meta = conv.get("meta", {})
+            sender = meta.get("sender", {})
             
-            logger.info(f"Processed {len(conversations)} conversations for frontend")
+            # Extrair última mensagem
+            messages = conv.get("messages", [])
+            last_message = "Sem mensagens"
+            if messages:
+                last_msg = messages[-1]
+                last_message = last_msg.get("content", "Sem mensagens")
             
-            return {
-                "status": "success",
-                "conversations": conversations
+            conversation = {
+                "id": conv.get("id"),
+                "contact": {
+                    "name": sender.get("name", "Usuário"),
+                    "phone": sender.get("phone_number", "")
+                },
+                "lastMessage": last_message,
+                "timestamp": conv.get("last_activity_at", conv.get("updated_at")),
+                "status": conv.get("status", "open"),
+                "unreadCount": conv.get("unread_count", 0)
             }
+            conversations.append(conversation)
+        
+        logger.info(f"Processed {len(conversations)} conversations for frontend")
+        
+        return {
+            "status": "success",
+            "conversations": conversations
+        }
         
     except Exception as e:
         import traceback
@@ -1238,8 +1667,7 @@ async def get_conversations():
         logger.error(f"Error getting conversations: {str(e)}\n{error_details}")
         
         # Log request details
-        logger.error(f"Request URL: {url}")
-        logger.error(f"Request headers: {headers}")
+        logger.error(f"Chatwoot URL: {chatwoot_client.base_url}")
         
         # Retornar dados mockados em caso de erro
         return {
@@ -1257,7 +1685,7 @@ async def get_conversations():
                     "unreadCount": 2
                 }
             ],
-            "message": f"Using mock data due to error: {str(e)}\nURL: {url}"
+            "message": f"Using mock data due to error: {str(e)}\nURL: {chatwoot_client.base_url}"
         }
 
 @app.get("/api/conversations/{conversation_id}/messages", tags=["Frontend API"])
@@ -1274,94 +1702,87 @@ async def get_conversation_messages(
         if not CHATWOOT_API_TOKEN:
             raise HTTPException(status_code=400, detail="CHATWOOT_API_TOKEN not configured")
         
-        # Chamada real para API do Chatwoot
-        url = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations/{conversation_id}/messages"
-        headers = {
-            "api_access_token": CHATWOOT_API_TOKEN,
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Processar mensagens para o frontend (inclui áudio e imagens)
-            messages: List[Dict[str, Any]] = []
-            for msg in extract_chatwoot_payload(data):
-                content = msg.get("content") or ""
-                # Mapear remetente
-                sender = "user" if msg.get("message_type") == 1 else "contact"
-
-                # Detectar áudio nos attachments
-                audio_url: Optional[str] = None
-                attachments = msg.get("attachments", [])
-                audio_attachment = next((a for a in attachments if a.get("file_type") == "audio"), None)
-                if audio_attachment:
-                    # Tentar URL local salva previamente (via webhook) ou fallback para data_url do Chatwoot
-                    audio_url = audio_attachment.get("local_url") or audio_attachment.get("data_url")
+        # Espelho local quando ele tem o histórico da conversa; senão, API do Chatwoot
+        since_dt = datetime.fromtimestamp(since, tz=timezone.utc) if since else None
+        chatwoot_messages = await chatwoot_mirror.conversation_messages(conversation_id, since=since_dt)
+        if chatwoot_messages is None:
+            chatwoot_messages = await chatwoot_client.list_messages(conversation_id)
+        
+        # Processar mensagens para o frontend (inclui áudio e imagens)
+        messages: List[Dict[str, Any]] = []
+        for msg in chatwoot_messages:
+            content = msg.get("content") or ""
+            # Mapear remetente
+            sender = "user" if msg.get("message_type") == 1 else "contact"
+
+            # Detectar áudio nos attachments
+            audio_url: Optional[str] = None
+            attachments = msg.get("attachments", [])
+            audio_attachment = next((a for a in attachments if a.get("file_type") == "audio"), None)
+            if audio_attachment:
+                # Tentar URL local salva previamente (via webhook) ou fallback para data_url do Chatwoot
+                audio_url = audio_attachment.get("local_url") or audio_attachment.get("data_url")
+                # Se não há content, exibir rótulo amigável
+                if not content:
+                    content = "🎵 Mensagem de áudio"
+
+            # Processar imagens nos attachments (NOVA FUNCIONALIDADE)
+            image_attachments = []
+            try:
+                logger.info(f"🔍 API: Verificando attachments para mensagem {msg.get('id')}: {len(attachments)} attachments")
+                
+                # Criar uma mensagem temporária para processar imagens
+                temp_message = {
+                    "attachments": attachments,
+                    "id": msg.get("id"),
+                    "conversation_id": conversation_id
+                }
+                
+                # Processar imagens usando o attachment_service
+                processed_images = await attachment_service.process_message_attachments(temp_message)
+                logger.info(f"🖼️ API: Processadas {len(processed_images)} imagens para mensagem {msg.get('id')}")
+                
+                if processed_images:
+                    image_attachments = [
+                        {
+                            "id": img.id,
+                            "filename": img.filename,
+                            "content_type": img.content_type,
+                            "file_size": img.file_size,
+                            "data_url": img.data_url
+                        } for img in processed_images
+                    ]
+                    
                     # Se não há content, exibir rótulo amigável
                     if not content:
-                        content = "🎵 Mensagem de áudio"
-
-                # Processar imagens nos attachments (NOVA FUNCIONALIDADE)
-                image_attachments = []
-                try:
-                    logger.info(f"🔍 API: Verificando attachments para mensagem {msg.get('id')}: {len(attachments)} attachments")
-                    
-                    # Criar uma mensagem temporária para processar imagens
-                    temp_message = {
-                        "attachments": attachments,
-                        "id": msg.get("id"),
-                        "conversation_id": conversation_id
-                    }
-                    
-                    # Processar imagens usando o attachment_service
-                    processed_images = await attachment_service.process_message_attachments(temp_message)
-                    logger.info(f"🖼️ API: Processadas {len(processed_images)} imagens para mensagem {msg.get('id')}")
-                    
-                    if processed_images:
-                        image_attachments = [
-                            {
-                                "id": img.id,
-                                "filename": img.filename,
-                                "content_type": img.content_type,
-                                "file_size": img.file_size,
-                                "data_url": img.data_url
-                            } for img in processed_images
-                        ]
+                        content = "📷 Imagem enviada"
                         
-                        # Se não há content, exibir rótulo amigável
-                        if not content:
-                            content = "📷 Imagem enviada"
-                            
-                        logger.info(f"✅ API: Adicionadas {len(image_attachments)} image_attachments para mensagem {msg.get('id')}")
-                    else:
-                        logger.info(f"❌ API: Nenhuma imagem processada para mensagem {msg.get('id')}")
-                except Exception as e:
-                    logger.warning(f"Erro ao processar imagens na API: {e}")
-                    import traceback
-                    logger.error(f"Traceback: {traceback.format_exc()}")
-                    # Não falhar se houver erro no processamento de imagens
-
-                message = {
-                    "id": msg.get("id"),
-                    "conversation_id": conversation_id,
-                    "content": content,
-                    "sender": sender,
-                    "timestamp": msg.get("created_at"),
-                    "status": msg.get("status", "sent"),
-                    "audio_url": audio_url,
-                    "attachments": attachments,
-                    "image_attachments": image_attachments,  # NOVA FUNCIONALIDADE
-                }
-                messages.append(message)
-            
-            return {
-                "status": "success",
-                "messages": messages
+                    logger.info(f"✅ API: Adicionadas {len(image_attachments)} image_attachments para mensagem {msg.get('id')}")
+                else:
+                    logger.info(f"❌ API: Nenhuma imagem processada para mensagem {msg.get('id')}")
+            except Exception as e:
+                logger.warning(f"Erro ao processar imagens na API: {e}")
+                import traceback
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                # Não falhar se houver erro no processamento de imagens
+
+            message = {
+                "id": msg.get("id"),
+                "conversation_id": conversation_id,
+                "content": content,
+                "sender": sender,
+                "timestamp": msg.get("created_at"),
+                "status": msg.get("status", "sent"),
+                "audio_url": audio_url,
+                "attachments": attachments,
+                "image_attachments": image_attachments,  # NOVA FUNCIONALIDADE
             }
+            messages.append(message)
+        
+        return {
+            "status": "success",
+            "messages": messages
+        }
         
     except Exception as e:
         logger.error(f"Error getting messages: {str(e)}")
@@ -1399,30 +1820,15 @@ async def send_message_to_conversation(conversation_id: int, message_data: dict)
             raise HTTPException(status_code=400, detail="Content is required")
         
         # Chamada real para API do Chatwoot
-        url = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations/{conversation_id}/messages"
-        headers = {
-            "api_access_token": CHATWOOT_API_TOKEN,
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+        data = await chatwoot_client.send_message(conversation_id, content)
         
-        payload = {
-            "content": content,
-            "message_type": "outgoing"
-        }
+        logger.info(f"Message sent to conversation {conversation_id}: {content}")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            logger.info(f"Message sent to conversation {conversation_id}: {content}")
-            
-            return {
-                "status": "success",
-                "message": "Message sent successfully",
-                "message_id": data.get("id", 123)
-            }
+        return {
+            "status": "success",
+            "message": "Message sent successfully",
+            "message_id": data.get("id", 123)
+        }
         
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
@@ -1439,113 +1845,38 @@ async def send_voice_message(
         if not CHATWOOT_API_TOKEN or not CHATWOOT_URL:
             raise HTTPException(status_code=400, detail="Chatwoot not configured")
 
-        # Montar request multipart para Chatwoot
-        url = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations/{conversation_id}/messages"
-        headers = {
-            "api_access_token": CHATWOOT_API_TOKEN,
-        }
-
         file_bytes = await file.read()
         filename = file.filename or "voice_message.ogg"
         mime = file.content_type or "audio/ogg"
 
         # Converter webm para MP3 diretamente (mais compatível com WhatsApp)
-        try:
-            if "webm" in (mime or "") or (filename or "").endswith(".webm"):
-                import tempfile
-                import subprocess
-                import os
-                
-                logger.info("Convertendo áudio de webm para MP3 (compatibilidade WhatsApp)")
-                
-                # Criar arquivos temporários
-                with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as temp_input:
-                    temp_input.write(file_bytes)
-                    temp_input.flush()
-                    
-                with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_output:
-                    temp_output_path = temp_output.name
-                    temp_output.close()
-                
-                # Converter usando ffmpeg com configurações específicas para WhatsApp MP3
-                subprocess.run([
-                    "ffmpeg", "-y", "-i", temp_input.name,
-                    "-c:a", "libmp3lame", 
-                    "-b:a", "32k",        # Bitrate baixo para WhatsApp
-                    "-ar", "16000",       # Sample rate específico para WhatsApp
-                    "-ac", "1",           # Mono
-                    "-q:a", "9",          # Qualidade máxima (menor bitrate)
-                    "-af", "highpass=f=80,lowpass=f=8000",  # Filtros para voz
-                    temp_output_path
-                ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                
-                # Ler arquivo convertido
-                with open(temp_output_path, "rb") as f:
-                    file_bytes = f.read()
-                
-                # Atualizar filename e mime
+        if "webm" in (mime or "") or (filename or "").endswith(".webm"):
+            logger.info("Convertendo áudio de webm para MP3 (compatibilidade WhatsApp)")
+            try:
+                converted = await audio_transcoder.to_mp3(file_bytes)
+                file_bytes = converted.data
                 filename = (filename.rsplit('.', 1)[0] if '.' in filename else filename) + ".mp3"
-                mime = "audio/mpeg"
-                
-                # Limpar arquivos temporários
-                os.unlink(temp_input.name)
-                os.unlink(temp_output_path)
-                
-                logger.info(f"Conversão MP3 concluída: {filename}, {mime}, {len(file_bytes)} bytes")
-                
-                # Verificar se o arquivo não é muito grande para WhatsApp (16MB limite)
-                if len(file_bytes) > 16 * 1024 * 1024:  # 16MB
-                    logger.warning(f"Arquivo MP3 muito grande ({len(file_bytes)} bytes), reduzindo qualidade")
-                    
-                    # Tentar MP3 com qualidade ainda menor
-                    mp3_low_output = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
-                    mp3_low_path = mp3_low_output.name
-                    mp3_low_output.close()
-                    
-                    subprocess.run([
-                        "ffmpeg", "-y", "-i", temp_input.name,
-                        "-c:a", "libmp3lame", "-b:a", "16k",
-                        "-ar", "8000", "-ac", "1",
-                        mp3_low_path
-                    ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    
-                    with open(mp3_low_path, "rb") as f:
-                        file_bytes = f.read()
-                    
-                    filename = (filename.rsplit('.', 1)[0] if '.' in filename else filename) + "_low.mp3"
-                    mime = "audio/mpeg"
-                    os.unlink(mp3_low_path)
-                    
-                    logger.info(f"MP3 baixa qualidade: {filename}, {mime}, {len(file_bytes)} bytes")
-                
-        except Exception as e:
-            logger.warning(f"Falha ao converter áudio para MP3: {e}")
-            # Continuar com arquivo original se conversão falhar
-
-        data = {
-            "message_type": "outgoing",
-            "content": content or "",
-        }
+                mime = converted.mime
+                logger.info(
+                    f"Conversão MP3 concluída: {filename}, {converted.bitrate_kbps}k/{converted.sample_rate}Hz, "
+                    f"{len(file_bytes)} bytes em {converted.elapsed_ms:.0f}ms"
+                )
+            except TranscoderBusy as e:
+                logger.warning(f"⚠️ Conversão de áudio recusada: {e}")
+                raise HTTPException(status_code=503, detail="Muitos áudios em conversão, tente novamente")
+            except TranscodeError as e:
+                logger.warning(f"Falha ao converter áudio para MP3: {e}")
+                # Continuar com arquivo original se conversão falhar
 
         # Para WhatsApp via Chatwoot, aceitam-se formatos como audio/ogg ou audio/mpeg
         # Alguns provedores exigem campo 'attachments[]' e 'message_type=outgoing'
-        files = {
-            'attachments[]': (filename, file_bytes, mime)
-        }
+        logger.info(f"Enviando áudio para Chatwoot: conversa {conversation_id}")
+        logger.info(f"File: {filename}, MIME: {mime}, Size: {len(file_bytes)} bytes")
 
-        async with httpx.AsyncClient() as client:
-            logger.info(f"Enviando áudio para Chatwoot: {url}")
-            logger.info(f"Headers: {headers}")
-            logger.info(f"Data: {data}")
-            logger.info(f"File: {filename}, MIME: {mime}, Size: {len(file_bytes)} bytes")
-            
-            resp = await client.post(url, headers=headers, data=data, files=files)
-            logger.info(f"Response status: {resp.status_code}")
-            logger.info(f"Response headers: {dict(resp.headers)}")
-            
-            resp.raise_for_status()
-            result = resp.json()
-            logger.info(f"Chatwoot response: {result}")
+        result = await chatwoot_client.send_attachment(
+            conversation_id, filename, file_bytes, mime, content=content or ""
+        )
+        logger.info(f"Chatwoot response: {result}")
 
         return {
             "status": "success",
@@ -1553,6 +1884,8 @@ async def send_voice_message(
             "payload": result
         }
 
+    except HTTPException:
+        raise
     except httpx.HTTPStatusError as e:
         logger.error(f"Chatwoot HTTP error: {e.response.status_code} {e.response.text[:200]}")
         raise HTTPException(status_code=502, detail="Chatwoot API error")
@@ -1626,52 +1959,104 @@ async def debug_conversations():
         if not CHATWOOT_API_TOKEN:
             return {"error": "CHATWOOT_API_TOKEN not configured"}
         
-        url = f"{CHATWOOT_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations"
-        headers = {
-            "api_access_token": CHATWOOT_API_TOKEN,
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+        data = await chatwoot_client.list_conversations_raw()
+        payload = chatwoot_client.normalize_payload(data)
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            return {
-                "status": "success",
-                "raw_data": data,
-                "conversations_count": len(data.get("payload", [])),
-                "first_conversation": data.get("payload", [{}])[0] if data.get("payload") else None
-            }
+        return {
+            "status": "success",
+            "raw_data": data,
+            "conversations_count": len(payload),
+            "first_conversation": payload[0] if payload else None,
+            "client": chatwoot_client.get_stats()
+        }
         
     except Exception as e:
-        return {"error": str(e), "url": url}
+        return {"error": str(e), "url": chatwoot_client.base_url}
+
+LISTAGEM_LIMITE_MAXIMO = 500
+
+
+def _ndjson(registros):
+    """StreamingResponse NDJSON (um objeto JSON por linha)"""
+    async def linhas():
+        try:
+            async for registro in registros:
+                yield json.dumps(registro, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"❌ Erro no stream NDJSON: {e}")
+    return StreamingResponse(linhas(), media_type="application/x-ndjson")
+
 
 @app.get("/api/chamados/cidadaos", tags=["Chamados"])
-async def listar_cidadaos():
-    """Listar todos os cidadãos cadastrados"""
+async def listar_cidadaos(
+    limit: int = Query(50, ge=1, le=LISTAGEM_LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    data_inicio: Optional[datetime] = None,
+    data_fim: Optional[datetime] = None,
+    incluir_total: bool = False,
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Listar cidadãos cadastrados (paginação por cursor)
+    
+    Passe o next_cursor da resposta em `cursor` para a próxima página.
+    formato=ndjson devolve todos os registros do filtro em stream, sem paginação.
+    """
     try:
-        cidadaos = await chamados_service.listar_cidadaos()
-        return {
-            "status": "success",
-            "data": cidadaos,
-            "total": len(cidadaos)
-        }
+        if cursor:
+            decodificar_cursor(cursor)  # validar antes de abrir o stream
+        if formato == "ndjson":
+            return _ndjson(chamados_service.stream_cidadaos(
+                cursor=cursor, data_inicio=data_inicio, data_fim=data_fim
+            ))
+        pagina = await chamados_service.listar_cidadaos(
+            limit=limit, cursor=cursor, data_inicio=data_inicio, data_fim=data_fim,
+            incluir_total=incluir_total
+        )
+        return {"status": "success", **pagina}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erro ao listar cidadãos: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+@app.get("/api/chamados/cidadaos/{cidadao_id}", tags=["Chamados"])
+async def obter_cidadao(cidadao_id: int):
+    """Obter um cidadão pelo id (formulário de edição do admin)"""
+    cidadao = await chamados_service.obter_cidadao(cidadao_id)
+    if not cidadao:
+        raise HTTPException(status_code=404, detail="Cidadão não encontrado")
+    return {"status": "success", "data": cidadao}
+
 @app.get("/api/chamados/chamados", tags=["Chamados"])
-async def listar_chamados():
-    """Listar todos os chamados"""
-    try:
-        chamados = await chamados_service.listar_chamados()
-        return {
-            "status": "success",
-            "data": chamados,
-            "total": len(chamados)
-        }
+async def listar_chamados(
+    limit: int = Query(50, ge=1, le=LISTAGEM_LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    time_id: Optional[int] = None,
+    categoria_id: Optional[int] = None,
+    data_inicio: Optional[datetime] = None,
+    data_fim: Optional[datetime] = None,
+    incluir_total: bool = False,
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Listar chamados (paginação por cursor, filtros por status, time, categoria e período)
+    
+    Passe o next_cursor da resposta em `cursor` para a próxima página.
+    formato=ndjson devolve todos os registros do filtro em stream, sem paginação.
+    """
+    filtros = dict(status=status, time_id=time_id, categoria_id=categoria_id,
+                   data_inicio=data_inicio, data_fim=data_fim)
+    try:
+        if cursor:
+            decodificar_cursor(cursor)  # validar antes de abrir o stream
+        if formato == "ndjson":
+            return _ndjson(chamados_service.stream_chamados(cursor=cursor, **filtros))
+        pagina = await chamados_service.listar_chamados(
+            limit=limit, cursor=cursor, incluir_total=incluir_total, **filtros
+        )
+        return {"status": "success", **pagina}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Erro ao listar chamados: {str(e)}")
         return {"status": "error", "message": str(e)}
@@ -1879,33 +2264,22 @@ async def deactivate_agent(agent_id: int):
     """Desativar agente no sistema"""
     try:
         from .ai_builder_service import ai_builder_service
-        async with chamados_service.pool.acquire() as conn:
-            result = await conn.fetchrow("""
-                UPDATE config_ia 
-                SET active = false, updated_at = $2
-                WHERE id = $1
-                RETURNING id, nome, active
-            """, agent_id, datetime.now())
-            
-            if result:
-                return {
-                    "status": "success",
-                    "message": f"Agente '{result['nome']}' desativado com sucesso",
-                    "agent": {
-                        "id": result["id"],
-                        "nome": result["nome"],
-                        "active": result["active"]
-                    }
-                }
-            else:
-                return {
-                    "status": "error",
-                    "message": "Agente não encontrado"
-                }
+        result = await ai_builder_service.deactivate_agent(agent_id)
+        return result
     except Exception as e:
         logger.error(f"Erro ao desativar agente: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+@app.get("/api/ai-builder/routing/stats", tags=["AI Builder"])
+async def get_agent_routing_stats():
+    """Estatísticas do cache de roteamento de agentes (hit rate e tempo de decisão)"""
+    from .ai_builder_service import ai_builder_service
+    return {
+        "status": "success",
+        "routing": agent_routing_cache.get_stats(),
+        "agents_list_cache": ai_builder_service._agents_cache.get_stats(),
+    }
+
 # ============================================================================
 # AI AGENT - ENDPOINT TEMPORÁRIO
 # ============================================================================
@@ -2,11 +2,14 @@
 Handler para download e armazenamento de mídia do Chatwoot
 """
 import os
+import time
 import logging
 import httpx
-from datetime import datetime
 from typing import Optional, Dict, Any
 
+from .chatwoot_client import chatwoot_client
+from .media_store import media_store
+
 logger = logging.getLogger(__name__)
 
 class MediaHandler:
@@ -53,34 +56,34 @@ class MediaHandler:
                 logger.error("❌ URL de download não encontrada")
                 return None
 
-            # Gerar nome único
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # Nome estável por mensagem: um webhook reenviado reusa o arquivo já salvo
             conversation_id = message_data.get("conversation_id", "unknown")
             message_id = message_data.get("id", "unknown")
-            filename = f"audio_{conversation_id}_{message_id}_{timestamp}.{extension}"
-            filepath = os.path.join(self.media_dir, filename)
-            
-            # Gerar URL pública
-            public_url = f"/media/audio/{filename}"
-            
-            # Baixar áudio
-            logger.info(f"⬇️ Baixando áudio: {download_url}")
-            async with httpx.AsyncClient(follow_redirects=True) as client:
-                response = await client.get(download_url)
-                if response.status_code == 200:
-                    # Salvar arquivo
-                    with open(filepath, "wb") as f:
-                        f.write(response.content)
-                    logger.info(f"✅ Áudio salvo em: {filepath}")
-                    return {
-                        "filepath": filepath,
-                        "public_url": public_url,
-                        "filename": filename
-                    }
-                else:
-                    logger.error(f"❌ Erro ao baixar áudio: {response.status_code}")
-                    return None
+            if message_id == "unknown":
+                alias = f"audio/audio_{conversation_id}_{time.time_ns()}.{extension}"
+                stored = None
+            else:
+                alias = f"audio/audio_{conversation_id}_{message_id}.{extension}"
+                stored = await media_store.find_alias(alias)
+            if stored is None:
+                # Baixar áudio (streaming, gravado no armazenamento por hash)
+                logger.info(f"⬇️ Baixando áudio: {download_url}")
+                client = await chatwoot_client.media_client()
+                stored = await media_store.download(download_url, alias, extension, client)
+                logger.info(f"✅ Áudio salvo em: {stored.filepath} ({stored.size} bytes)")
+            else:
+                logger.info(f"♻️ Áudio já salvo: {stored.filepath}")
 
+            return {
+                "filepath": stored.filepath,
+                "public_url": stored.public_url,
+                "filename": stored.filename,
+                "sha256": stored.sha256
+            }
+
+        except httpx.HTTPStatusError as e:
+            logger.error(f"❌ Erro ao baixar áudio: {e.response.status_code}")
+            return None
         except Exception as e:
             logger.error(f"❌ Erro ao processar áudio: {str(e)}")
             return None
@@ -0,0 +1,356 @@
+"""
+Armazenamento de mídia endereçado por conteúdo (volume media/)
+
+Cada arquivo é gravado uma única vez em media/blobs/<ab>/<sha256>.<ext>. Os nomes
+públicos (ex.: media/audio/audio_<conversa>_<mensagem>.ogg, servido em /media/...)
+são hard links para o blob (symlink se o sistema de arquivos não suportar), então
+um webhook reenviado ou um áudio encaminhado não ocupa espaço de novo.
+
+Os downloads são feitos em streaming (client.stream) e gravados em pedaços fora do
+event loop, calculando o hash durante a gravação: a memória não cresce com o tamanho
+do arquivo. O volume tem cota (MEDIA_QUOTA_MB); ao passar dela, os blobs usados há
+mais tempo (mtime, renovado a cada reuso) são removidos junto com seus nomes públicos.
+
+O índice em memória é só um cache do disco: é refeito a cada MEDIA_RESCAN_SECONDS,
+o que mantém a contagem certa quando várias réplicas dividem o mesmo volume.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIR = "blobs"
+CHUNK_SIZE = 64 * 1024
+
+
+class MediaTooLarge(Exception):
+    """Download acima de MEDIA_MAX_DOWNLOAD_MB"""
+
+
+@dataclass
+class StoredMedia:
+    sha256: str
+    size: int
+    filepath: str
+    public_url: str
+    filename: str
+    deduplicated: bool
+
+
+@dataclass
+class _Entry:
+    path: str
+    size: int
+    mtime: float
+    aliases: Set[str] = field(default_factory=set)
+
+
+class MediaStore:
+    """Blobs por sha256 com nomes públicos, cota e remoção LRU
+
+    MEDIA_QUOTA_MB: limite do volume (padrão 2048, 0 = sem limite)
+    MEDIA_MAX_DOWNLOAD_MB: maior arquivo aceito (padrão 64)
+    MEDIA_RESCAN_SECONDS: intervalo para refazer o índice a partir do disco (padrão 600)
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = os.path.abspath(root or os.path.join(os.path.dirname(__file__), '..', 'media'))
+        self.blobs_dir = os.path.join(self.root, BLOBS_DIR)
+        self.tmp_dir = os.path.join(self.blobs_dir, "tmp")
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()  # mais antigo primeiro
+        self._aliases: Dict[str, str] = {}  # caminho do nome público -> sha256
+        self._total = 0
+        self._lock: Optional[asyncio.Lock] = None
+        self._scanned_at = 0.0
+
+        self.downloads = 0
+        self.bytes_downloaded = 0
+        self.dedup_hits = 0
+        self.alias_hits = 0
+        self.evicted = 0
+        self.bytes_evicted = 0
+
+    @property
+    def quota_bytes(self) -> int:
+        return int(float(os.getenv("MEDIA_QUOTA_MB", "2048")) * 1024 * 1024)
+
+    @property
+    def max_download_bytes(self) -> int:
+        return int(float(os.getenv("MEDIA_MAX_DOWNLOAD_MB", "64")) * 1024 * 1024)
+
+    def public_url(self, relpath: str) -> str:
+        return "/media/" + relpath.replace(os.sep, "/")
+
+    def _blob_path(self, sha256: str, extension: str) -> str:
+        return os.path.join(self.blobs_dir, sha256[:2], f"{sha256}.{extension}")
+
+    def _stored(self, sha256: str, size: int, alias: str, deduplicated: bool) -> StoredMedia:
+        return StoredMedia(
+            sha256=sha256,
+            size=size,
+            filepath=os.path.join(self.root, alias),
+            public_url=self.public_url(alias),
+            filename=os.path.basename(alias),
+            deduplicated=deduplicated,
+        )
+
+    # Índice ------------------------------------------------------------------
+
+    def _scan(self) -> "OrderedDict[str, _Entry]":
+        """Ler blobs e nomes públicos do disco (roda em thread)"""
+        entries: Dict[str, _Entry] = {}
+        by_inode: Dict[int, str] = {}
+        for dirpath, dirnames, filenames in os.walk(self.blobs_dir):
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != self.tmp_dir]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                key = name.split(".", 1)[0]
+                entries[key] = _Entry(path, st.st_size, st.st_mtime)
+                by_inode[st.st_ino] = key
+
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if d != BLOBS_DIR]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                relpath = os.path.relpath(path, self.root)
+                try:
+                    if os.path.islink(path):
+                        key = os.path.basename(os.readlink(path)).split(".", 1)[0]
+                    else:
+                        st = os.stat(path)
+                        key = by_inode.get(st.st_ino)
+                        if key is None:
+                            # Arquivo anterior ao armazenamento por hash: entra na cota como está
+                            key = relpath
+                            entries[key] = _Entry(path, st.st_size, st.st_mtime)
+                            continue
+                except OSError:
+                    continue
+                if key in entries:
+                    entries[key].aliases.add(path)
+
+        return OrderedDict(sorted(entries.items(), key=lambda item: item[1].mtime))
+
+    async def _ensure_index(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        rescan = float(os.getenv("MEDIA_RESCAN_SECONDS", "600"))
+        if self._scanned_at and time.monotonic() - self._scanned_at < rescan:
+            return
+        self._scanned_at = time.monotonic()
+        entries = await asyncio.to_thread(self._scan)
+        self._entries = entries
+        self._aliases = {path: key for key, entry in entries.items() for path in entry.aliases}
+        self._total = sum(entry.size for entry in entries.values())
+        logger.info(f"📂 Mídia: {len(entries)} arquivo(s), {self._total / 1024 / 1024:.1f} MB em {self.root}")
+
+    # Gravação ----------------------------------------------------------------
+
+    async def find_alias(self, alias: str) -> Optional[StoredMedia]:
+        """Nome público já existente (webhook reenviado): reusar sem baixar de novo
+
+        None se o nome não aponta para um blob conhecido (ainda não indexado, removido
+        ou anterior ao armazenamento por hash): o chamador baixa de novo.
+        """
+        path = os.path.join(self.root, alias)
+        await self._ensure_index()
+        async with self._lock:
+            key = self._aliases.get(path)
+            entry = self._entries.get(key) if key else None
+            if entry is None or not await asyncio.to_thread(os.path.exists, path):
+                return None
+            await self._touch(key)
+        self.alias_hits += 1
+        return self._stored(key, entry.size, alias, True)
+
+    async def download(
+        self,
+        url: str,
+        alias: str,
+        extension: str,
+        client: Optional[httpx.AsyncClient] = None,
+    ) -> StoredMedia:
+        """Baixar em streaming para o armazenamento e publicar como media/<alias>"""
+        if client is None:
+            async with httpx.AsyncClient(follow_redirects=True) as own_client:
+                return await self.download(url, alias, extension, own_client)
+
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            length = int(response.headers.get("content-length") or 0)
+            if length > self.max_download_bytes:
+                raise MediaTooLarge(f"{length} bytes")
+            stored = await self.store_stream(response.aiter_bytes(CHUNK_SIZE), alias, extension)
+        self.downloads += 1
+        self.bytes_downloaded += stored.size
+        return stored
+
+    async def store_stream(self, chunks: AsyncIterator[bytes], alias: str, extension: str) -> StoredMedia:
+        """Gravar pedaços num arquivo temporário, calculando o sha256, e publicar"""
+        await self._ensure_index()
+        await asyncio.to_thread(os.makedirs, self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, f"{os.getpid()}-{id(chunks)}-{time.time_ns()}")
+        digest = hashlib.sha256()
+        size = 0
+        limit = self.max_download_bytes
+
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > limit:
+                    raise MediaTooLarge(f"mais de {limit} bytes")
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+            await asyncio.to_thread(f.close)
+        except BaseException:
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(_unlink, tmp_path)
+            raise
+
+        sha256 = digest.hexdigest()
+        blob = self._blob_path(sha256, extension)
+        alias_path = os.path.join(self.root, alias)
+        async with self._lock:
+            existing = self._entries.get(sha256)
+            if existing is not None and not await asyncio.to_thread(os.path.exists, existing.path):
+                # Removido por outra réplica desde o último índice
+                self._entries.pop(sha256)
+                self._total -= existing.size
+                self._forget_aliases(sha256, existing)
+                existing = None
+            if existing is not None:
+                blob = existing.path
+            deduplicated = await asyncio.to_thread(os.path.exists, blob)
+            if deduplicated:
+                await asyncio.to_thread(_unlink, tmp_path)
+                self.dedup_hits += 1
+            else:
+                await asyncio.to_thread(_publish_blob, tmp_path, blob)
+            await asyncio.to_thread(_link, blob, alias_path)
+
+            if existing is None:
+                existing = _Entry(blob, size, time.time())
+                self._entries[sha256] = existing
+                self._total += size
+            previous = self._entries.get(self._aliases.get(alias_path, ""))
+            if previous is not None and previous is not existing:
+                # Nome reaproveitado para outro conteúdo
+                previous.aliases.discard(alias_path)
+            existing.aliases.add(alias_path)
+            self._aliases[alias_path] = sha256
+            await self._touch(sha256)
+            await self._enforce_quota(keep=sha256)
+
+        if deduplicated:
+            logger.info(f"♻️ Mídia repetida ({sha256[:12]}): {alias} aponta para o arquivo existente")
+        return self._stored(sha256, size, alias, deduplicated)
+
+    def _forget_aliases(self, key: str, entry: _Entry):
+        for path in entry.aliases:
+            if self._aliases.get(path) == key:
+                del self._aliases[path]
+
+    async def _touch(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry.mtime = time.time()
+        self._entries.move_to_end(key)
+        try:
+            await asyncio.to_thread(os.utime, entry.path)
+        except OSError:
+            pass
+
+    # Cota --------------------------------------------------------------------
+
+    async def _enforce_quota(self, keep: Optional[str] = None):
+        """Remover os blobs menos usados até ficar em 90% da cota"""
+        quota = self.quota_bytes
+        if not quota or self._total <= quota:
+            return
+        target = quota * 0.9
+        removed, freed = 0, 0
+        for key in list(self._entries):
+            if self._total <= target:
+                break
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            self._forget_aliases(key, entry)
+            await asyncio.to_thread(_remove_entry, entry)
+            self._total -= entry.size
+            removed += 1
+            freed += entry.size
+        self.evicted += removed
+        self.bytes_evicted += freed
+        if removed:
+            logger.info(f"🧹 Cota de mídia: {removed} arquivo(s) removido(s), {freed / 1024 / 1024:.1f} MB liberados")
+
+    async def enforce_quota(self):
+        """Aplicar a cota imediatamente (ex.: após reduzir MEDIA_QUOTA_MB)"""
+        self._scanned_at = 0.0
+        await self._ensure_index()
+        async with self._lock:
+            await self._enforce_quota()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "files": len(self._entries),
+            "used_bytes": self._total,
+            "quota_bytes": self.quota_bytes,
+            "downloads": self.downloads,
+            "bytes_downloaded": self.bytes_downloaded,
+            "dedup_hits": self.dedup_hits,
+            "alias_hits": self.alias_hits,
+            "evicted": self.evicted,
+            "bytes_evicted": self.bytes_evicted,
+        }
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _publish_blob(tmp_path: str, blob: str):
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    os.replace(tmp_path, blob)
+
+
+def _link(blob: str, alias_path: str):
+    """Nome público para o blob: hard link, ou symlink relativo se não houver suporte"""
+    os.makedirs(os.path.dirname(alias_path), exist_ok=True)
+    tmp_alias = f"{alias_path}.{os.getpid()}.tmp"
+    _unlink(tmp_alias)
+    try:
+        os.link(blob, tmp_alias)
+    except OSError:
+        os.symlink(os.path.relpath(blob, os.path.dirname(alias_path)), tmp_alias)
+    os.replace(tmp_alias, alias_path)
+
+
+def _remove_entry(entry: _Entry):
+    for path in entry.aliases:
+        _unlink(path)
+    _unlink(entry.path)
+
+
+# Instância global
+media_store = MediaStore()
@@ -0,0 +1,238 @@
+"""
+Agrupamento das mensagens seguidas do cidadão antes de chamar a IA
+
+No WhatsApp é comum chegarem três ou quatro mensagens curtas em sequência ("oi",
+"bom dia", "tem um buraco na minha rua", "rua X"). Em vez de uma chamada ao LLM (e uma
+resposta) por mensagem, cada conversa acumula as mensagens até ficar
+MESSAGE_DEBOUNCE_QUIET_MS sem novidades, ou até MESSAGE_DEBOUNCE_MAX_WAIT_MS desde a
+primeira, e gera uma única resposta para o texto unido.
+
+Se chega mensagem nova enquanto a resposta ainda está sendo gerada, a geração é
+cancelada e refeita com todas as mensagens. Código com efeito colateral (cadastro,
+abertura de chamado) chama sem_cancelamento() antes de gravar: daí em diante o turno
+vai até o fim e as mensagens novas formam o próximo turno. Turnos da mesma conversa
+nunca rodam ao mesmo tempo, então as respostas não se intercalam.
+
+O agrupamento é local ao processo: mensagens da mesma conversa tratadas por réplicas
+diferentes formam turnos separados. No shutdown as janelas abertas são fechadas na hora
+e os turnos têm até MESSAGE_DEBOUNCE_STOP_TIMEOUT para responder.
+"""
+import os
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# generate(conversa, texto, contexto) -> resposta; deliver(conversa, resposta, contexto)
+GenerateHandler = Callable[[Hashable, str, Any], Awaitable[Optional[str]]]
+DeliverHandler = Callable[[Hashable, str, Any], Awaitable[None]]
+
+
+@dataclass
+class _Turno:
+    mensagens: List[str]
+    primeira_em: float
+    contexto: Any
+    cancelavel: bool = True
+    task: Optional[asyncio.Task] = None
+    # Turno sem volta que este ainda espera terminar
+    anterior: Optional["_Turno"] = None
+
+
+@dataclass
+class _Conversa:
+    pendentes: List[str] = field(default_factory=list)
+    primeira_em: float = 0.0
+    contexto: Any = None
+    timer: Optional[asyncio.TimerHandle] = None
+    turno: Optional[_Turno] = None
+
+
+_turno_atual: ContextVar[Optional[_Turno]] = ContextVar("turno_debounce", default=None)
+
+
+def sem_cancelamento():
+    """Impedir que o turno atual seja cancelado (chamar antes de gravar algo)"""
+    turno = _turno_atual.get()
+    if turno is not None:
+        turno.cancelavel = False
+
+
+class MessageDebouncer:
+    """Janela por conversa: silêncio + espera máxima, um turno de IA por rajada
+
+    MESSAGE_DEBOUNCE_QUIET_MS: silêncio após a última mensagem (padrão 2500, 0 desativa a espera)
+    MESSAGE_DEBOUNCE_MAX_WAIT_MS: espera máxima desde a primeira mensagem (padrão 8000)
+    MESSAGE_DEBOUNCE_STOP_TIMEOUT: espera pelos turnos em andamento no shutdown, em segundos (padrão 10)
+    """
+
+    def __init__(self):
+        self.generate: Optional[GenerateHandler] = None
+        self.deliver: Optional[DeliverHandler] = None
+        self.quiet = 2.5
+        self.max_wait = 8.0
+        self.stop_timeout = 10.0
+        self._conversas: Dict[Hashable, _Conversa] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._running = False
+        self._draining = False
+
+        # Métricas
+        self.messages = 0
+        self.turns = 0
+        self.cancelled = 0
+        self.replies = 0
+        self.failed = 0
+        self.total_wait = 0.0
+
+    async def start(self, generate: GenerateHandler, deliver: DeliverHandler):
+        """Registrar geração (cancelável) e entrega da resposta"""
+        self.generate = generate
+        self.deliver = deliver
+        self.quiet = max(0.0, float(os.getenv("MESSAGE_DEBOUNCE_QUIET_MS") or 2500) / 1000)
+        self.max_wait = max(self.quiet, float(os.getenv("MESSAGE_DEBOUNCE_MAX_WAIT_MS") or 8000) / 1000)
+        self.stop_timeout = float(os.getenv("MESSAGE_DEBOUNCE_STOP_TIMEOUT") or 10)
+        self._running = True
+        self._draining = False
+        logger.info(f"⏳ Agrupamento de mensagens: silêncio {self.quiet:.1f}s, espera máxima {self.max_wait:.1f}s")
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Responder as janelas abertas na hora e esperar os turnos em andamento
+
+        Depois de timeout (MESSAGE_DEBOUNCE_STOP_TIMEOUT) os turnos que não terminaram
+        são cancelados.
+        """
+        if not self._running:
+            return
+        self._draining = True
+        timeout = self.stop_timeout if timeout is None else timeout
+        for conversation_id, conversa in list(self._conversas.items()):
+            if conversa.timer:
+                conversa.timer.cancel()
+                conversa.timer = None
+            self._fechar(conversation_id)
+
+        # Mensagens que chegarem durante a espera também fecham a janela na hora
+        if self._tasks:
+            logger.info(f"⏳ Aguardando {len(self._tasks)} resposta(s) da IA antes de parar (até {timeout:.0f}s)")
+        limite = time.monotonic() + timeout
+        while self._tasks and time.monotonic() < limite:
+            await asyncio.wait(set(self._tasks), timeout=limite - time.monotonic())
+
+        self._running = False
+        perdidas = 0
+        for conversa in self._conversas.values():
+            if conversa.timer:
+                conversa.timer.cancel()
+            perdidas += len(conversa.pendentes)
+            if conversa.turno and conversa.turno.task and not conversa.turno.task.done():
+                perdidas += len(conversa.turno.mensagens)
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._conversas.clear()
+        if perdidas:
+            logger.warning(f"⚠️ {perdidas} mensagem(ns) sem resposta no shutdown")
+
+    async def submit(self, conversation_id: Hashable, text: str, context: Any = None):
+        """Adicionar mensagem do cidadão à janela da conversa"""
+        if not self._running:
+            raise RuntimeError("MessageDebouncer não iniciado")
+        self.messages += 1
+        agora = time.monotonic()
+        conversa = self._conversas.setdefault(conversation_id, _Conversa())
+        if not conversa.pendentes:
+            conversa.primeira_em = agora
+        conversa.pendentes.append(text)
+        conversa.contexto = context
+
+        turno = conversa.turno
+        if turno is not None and turno.cancelavel and agora - turno.primeira_em < self.max_wait:
+            # Resposta ainda em geração: refazer com as mensagens novas
+            turno.task.cancel()
+            # Se o cancelado ainda esperava um turno sem volta, o próximo espera por ele
+            anterior = turno.anterior
+            if anterior is not None and anterior.task and not anterior.task.done():
+                conversa.turno = anterior
+            else:
+                conversa.turno = None
+            conversa.pendentes = turno.mensagens + conversa.pendentes
+            conversa.primeira_em = turno.primeira_em
+            self.cancelled += 1
+            logger.info(f"✋ Geração cancelada na conversa {conversation_id}: nova mensagem")
+
+        self._agendar(conversation_id, conversa, agora)
+
+    def _agendar(self, conversation_id: Hashable, conversa: _Conversa, agora: float):
+        if conversa.timer:
+            conversa.timer.cancel()
+        restante = conversa.primeira_em + self.max_wait - agora
+        atraso = 0.0 if self._draining else max(0.0, min(self.quiet, restante))
+        conversa.timer = asyncio.get_running_loop().call_later(atraso, self._fechar, conversation_id)
+
+    def _fechar(self, conversation_id: Hashable):
+        conversa = self._conversas.get(conversation_id)
+        if conversa is None or not conversa.pendentes or not self._running:
+            return
+        conversa.timer = None
+        anterior = conversa.turno
+        turno = _Turno(conversa.pendentes, conversa.primeira_em, conversa.contexto, anterior=anterior)
+        conversa.pendentes = []
+        conversa.turno = turno
+        turno.task = asyncio.create_task(self._executar(conversation_id, turno))
+        self._tasks.add(turno.task)
+        turno.task.add_done_callback(self._tasks.discard)
+
+    async def _executar(self, conversation_id: Hashable, turno: _Turno):
+        _turno_atual.set(turno)
+        try:
+            anterior = turno.anterior
+            if anterior is not None and anterior.task and not anterior.task.done():
+                # Turno anterior já sem volta (gravando): responder na ordem
+                await asyncio.shield(anterior.task)
+            turno.anterior = None
+            espera = time.monotonic() - turno.primeira_em
+            texto = "\n".join(turno.mensagens)
+            resposta = await self.generate(conversation_id, texto, turno.contexto)
+            # Daqui em diante a resposta é entregue mesmo que chegue mensagem nova
+            turno.cancelavel = False
+            self.turns += 1
+            self.total_wait += espera
+            if resposta:
+                await self.deliver(conversation_id, resposta, turno.contexto)
+                self.replies += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"❌ Erro no turno da conversa {conversation_id}: {e}")
+        finally:
+            conversa = self._conversas.get(conversation_id)
+            if conversa is not None and conversa.turno is turno:
+                conversa.turno = None
+                if not conversa.pendentes and conversa.timer is None:
+                    del self._conversas[conversation_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._running,
+            "quiet_ms": int(self.quiet * 1000),
+            "max_wait_ms": int(self.max_wait * 1000),
+            "open_conversations": len(self._conversas),
+            "messages": self.messages,
+            "turns": self.turns,
+            "cancelled": self.cancelled,
+            "replies": self.replies,
+            "failed": self.failed,
+            "messages_per_turn": round(self.messages / self.turns, 2) if self.turns else None,
+            "avg_wait_ms": round(self.total_wait / self.turns * 1000, 1) if self.turns else None,
+        }
+
+
+# Instância global
+message_debouncer = MessageDebouncer()
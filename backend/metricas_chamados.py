@@ -0,0 +1,160 @@
+"""
+Métricas do dashboard de chamados mantidas incrementalmente
+
+Os contadores por (prefeitura, time, status) e a soma dos tempos de resolução
+ficam em metricas_chamados / metricas_cidadaos (migration 012), atualizados por
+trigger a cada INSERT/UPDATE/DELETE. Ler o dashboard soma algumas dezenas de
+linhas em vez de agregar a tabela de chamados inteira. Um job periódico chama
+reconciliar_metricas() para corrigir qualquer divergência.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+STATUS_CHAMADO = ("aberto", "em_andamento", "resolvido", "cancelado")
+
+
+def _tempo_medio_horas(soma_segundos, quantidade) -> Optional[float]:
+    if not quantidade:
+        return None
+    return round(float(soma_segundos) / float(quantidade) / 3600, 2)
+
+
+class MetricasChamados:
+    """Leitura dos contadores e reconciliação periódica
+
+    METRICAS_RECONCILIACAO_SECONDS: intervalo do job de reconciliação (padrão 3600;
+    0 desativa). A reconciliação trava escritas em chamados/cidadaos enquanto
+    recalcula, então não deve rodar com frequência alta.
+    """
+
+    def __init__(self, pool_getter: Callable[[], Any]):
+        self._pool_getter = pool_getter
+        self._task: Optional[asyncio.Task] = None
+        self.leituras = 0
+        self.reconciliacoes = 0
+        self.grupos_corrigidos = 0
+        self.ultima_reconciliacao: Optional[str] = None
+
+    async def obter(self, prefeitura_id: int) -> Dict[str, Any]:
+        """Totais da prefeitura, por status e por time"""
+        pool = self._pool_getter()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT m.time_id, t.nome AS time_nome, m.status,
+                       SUM(m.total)::BIGINT AS total,
+                       SUM(m.resolvidos_com_tempo)::BIGINT AS resolvidos_com_tempo,
+                       SUM(m.soma_resolucao_segundos) AS soma_resolucao_segundos
+                FROM metricas_chamados m
+                LEFT JOIN times t ON t.id = m.time_id
+                WHERE m.prefeitura_id = $1
+                GROUP BY m.time_id, t.nome, m.status
+            """, prefeitura_id)
+            total_cidadaos = await conn.fetchval(
+                "SELECT COALESCE(SUM(total), 0)::BIGINT FROM metricas_cidadaos WHERE prefeitura_id = $1",
+                prefeitura_id
+            )
+        self.leituras += 1
+
+        por_status = {status: 0 for status in STATUS_CHAMADO}
+        por_time: Dict[int, Dict[str, Any]] = {}
+        soma_segundos = 0.0
+        com_tempo = 0
+        for row in rows:
+            por_status[row["status"]] = por_status.get(row["status"], 0) + row["total"]
+            soma_segundos += row["soma_resolucao_segundos"]
+            com_tempo += row["resolvidos_com_tempo"]
+
+            time = por_time.setdefault(row["time_id"], {
+                "time_id": row["time_id"] or None,
+                "time": row["time_nome"],
+                "total_chamados": 0,
+                "por_status": {status: 0 for status in STATUS_CHAMADO},
+                "_soma": 0.0,
+                "_com_tempo": 0,
+            })
+            time["total_chamados"] += row["total"]
+            time["por_status"][row["status"]] = time["por_status"].get(row["status"], 0) + row["total"]
+            time["_soma"] += row["soma_resolucao_segundos"]
+            time["_com_tempo"] += row["resolvidos_com_tempo"]
+
+        times: List[Dict[str, Any]] = []
+        for time in por_time.values():
+            time["tempo_medio_resolucao_horas"] = _tempo_medio_horas(time.pop("_soma"), time.pop("_com_tempo"))
+            times.append(time)
+        times.sort(key=lambda t: -t["total_chamados"])
+
+        return {
+            "prefeitura_id": prefeitura_id,
+            "total_cidadaos": total_cidadaos,
+            "total_chamados": sum(por_status.values()),
+            "chamados_abertos": por_status["aberto"],
+            "chamados_andamento": por_status["em_andamento"],
+            "chamados_em_andamento": por_status["em_andamento"],
+            "chamados_resolvidos": por_status["resolvido"],
+            "chamados_cancelados": por_status["cancelado"],
+            "tempo_medio_resolucao_horas": _tempo_medio_horas(soma_segundos, com_tempo),
+            "por_time": times,
+        }
+
+    async def reconciliar(self) -> int:
+        """Recalcular os contadores a partir das tabelas; retorna grupos corrigidos"""
+        pool = self._pool_getter()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                corrigidos = await conn.fetchval("SELECT reconciliar_metricas()")
+        self.reconciliacoes += 1
+        self.grupos_corrigidos += corrigidos
+        self.ultima_reconciliacao = datetime.now().isoformat()
+        if corrigidos:
+            logger.warning(f"⚠️ Métricas do dashboard: {corrigidos} grupo(s) divergente(s) corrigido(s)")
+        return corrigidos
+
+    async def start(self, interval: Optional[int] = None):
+        """Agendar a reconciliação periódica"""
+        if self._task:
+            return
+        interval = interval if interval is not None else int(os.getenv("METRICAS_RECONCILIACAO_SECONDS", "3600"))
+        if interval <= 0:
+            return
+
+        async def _loop():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.reconciliar()
+                except asyncpg.UndefinedFunctionError:
+                    logger.warning("⚠️ reconciliar_metricas() não existe (migration 012 não aplicada)")
+                    return
+                except Exception as e:
+                    logger.error(f"❌ Erro ao reconciliar métricas do dashboard: {e}")
+
+        self._task = asyncio.create_task(_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "leituras": self.leituras,
+            "reconciliacoes": self.reconciliacoes,
+            "grupos_corrigidos": self.grupos_corrigidos,
+            "ultima_reconciliacao": self.ultima_reconciliacao,
+        }
+
+
+def _chamados_pool():
+    from .chamados_service import chamados_service
+    return chamados_service.pool
+
+
+# Instância global
+metricas_chamados = MetricasChamados(_chamados_pool)
@@ -0,0 +1,14 @@
+-- Migration para persistir o estado das conversas do fluxo de chamados (ChamadosAIService)
+-- Data: 16 de Outubro de 2026
+
+-- Estado por conversa do Chatwoot com controle de versão (concorrência otimista)
+CREATE TABLE IF NOT EXISTS conversation_states (
+    conversation_id BIGINT PRIMARY KEY,
+    state JSONB NOT NULL DEFAULT '{}'::jsonb,
+    version INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Limpeza de fluxos abandonados
+CREATE INDEX IF NOT EXISTS idx_conversation_states_expires_at ON conversation_states(expires_at);
@@ -0,0 +1,23 @@
+-- Migration para notificar alterações em config_ia (cache de roteamento de agentes)
+-- Data: 16 de Outubro de 2026
+
+-- Notifica o canal config_ia_changed a cada INSERT/UPDATE/DELETE
+CREATE OR REPLACE FUNCTION notify_config_ia_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify(
+        'config_ia_changed',
+        json_build_object('op', TG_OP, 'id', COALESCE(NEW.id, OLD.id))::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_notify_config_ia_changed ON config_ia;
+CREATE TRIGGER trigger_notify_config_ia_changed
+    AFTER INSERT OR UPDATE OR DELETE ON config_ia
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_config_ia_changed();
+
+-- Agentes ativos (carga do cache de roteamento)
+CREATE INDEX IF NOT EXISTS idx_config_ia_active ON config_ia(active) WHERE active = true;
@@ -0,0 +1,62 @@
+-- Migration para gerar protocolos com contadores por (prefixo, ano)
+-- Data: 16 de Outubro de 2026
+
+-- Último número emitido por prefixo e ano (substitui o MAX(...) sobre chamados)
+CREATE TABLE IF NOT EXISTS protocolo_contadores (
+    prefixo VARCHAR(20) NOT NULL,
+    ano INT NOT NULL,
+    ultimo INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (prefixo, ano)
+);
+
+-- Inicializar contadores a partir dos protocolos existentes (PREFIXO-ANO-NNN)
+INSERT INTO protocolo_contadores (prefixo, ano, ultimo)
+SELECT partes[1], partes[2]::INT, MAX(partes[3]::INT)
+FROM (
+    SELECT regexp_match(protocolo, '^(.+)-(\d{4})-(\d+)$') AS partes
+    FROM chamados
+) p
+WHERE partes IS NOT NULL
+GROUP BY partes[1], partes[2]
+ON CONFLICT (prefixo, ano) DO UPDATE
+SET ultimo = GREATEST(protocolo_contadores.ultimo, EXCLUDED.ultimo);
+
+-- Reservar um bloco de números; retorna o último número do bloco
+-- (o bloco é ultimo - p_quantidade + 1 .. ultimo). O UPDATE trava só a linha do
+-- contador, então criações concorrentes nunca recebem o mesmo número.
+CREATE OR REPLACE FUNCTION reservar_protocolos(
+    p_prefixo TEXT,
+    p_ano INT,
+    p_quantidade INT DEFAULT 1
+) RETURNS INT AS $$
+    INSERT INTO protocolo_contadores AS pc (prefixo, ano, ultimo)
+    VALUES (p_prefixo, p_ano, p_quantidade)
+    ON CONFLICT (prefixo, ano) DO UPDATE
+    SET ultimo = pc.ultimo + p_quantidade, updated_at = NOW()
+    RETURNING ultimo;
+$$ LANGUAGE sql;
+
+-- Formato do protocolo: PREFIXO-ANO-NNN (sem truncar acima de 999)
+CREATE OR REPLACE FUNCTION formatar_protocolo(p_prefixo TEXT, p_ano INT, p_sequencial INT)
+RETURNS TEXT AS $$
+    SELECT p_prefixo || '-' || p_ano || '-' ||
+           LPAD(p_sequencial::TEXT, GREATEST(3, LENGTH(p_sequencial::TEXT)), '0');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Mesma assinatura da migration 001, agora usando o contador
+CREATE OR REPLACE FUNCTION gerar_protocolo_chamado(
+    p_time_id INT,
+    p_ano INT DEFAULT EXTRACT(YEAR FROM NOW())
+) RETURNS TEXT AS $$
+DECLARE
+    v_prefixo TEXT;
+BEGIN
+    SELECT UPPER(SUBSTRING(nome, 1, 5)) INTO v_prefixo
+    FROM times
+    WHERE id = p_time_id;
+
+    v_prefixo := COALESCE(v_prefixo, 'GERAL');
+    RETURN formatar_protocolo(v_prefixo, p_ano, reservar_protocolos(v_prefixo, p_ano));
+END;
+$$ LANGUAGE plpgsql;
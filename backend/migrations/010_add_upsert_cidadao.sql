@@ -0,0 +1,165 @@
+-- Migration para cadastrar/atualizar cidadão + endereço em uma única chamada
+-- Data: 16 de Outubro de 2026
+
+-- Cadastro ou atualização por (prefeitura_id, telefone), retornando cidadão + endereço principal.
+-- Roda numa única transação; cadastros simultâneos do mesmo telefone são serializados
+-- por advisory lock (cidadaos não tem UNIQUE em telefone).
+CREATE OR REPLACE FUNCTION upsert_cidadao(
+    p_prefeitura_id INT,
+    p_telefone TEXT,
+    p_nome TEXT,
+    p_cpf TEXT DEFAULT NULL,
+    p_email TEXT DEFAULT NULL,
+    p_data_nascimento DATE DEFAULT NULL,
+    p_genero TEXT DEFAULT NULL,
+    p_cep TEXT DEFAULT NULL,
+    p_logradouro TEXT DEFAULT NULL,
+    p_numero TEXT DEFAULT NULL,
+    p_bairro TEXT DEFAULT NULL,
+    p_cidade TEXT DEFAULT NULL,
+    p_estado TEXT DEFAULT NULL,
+    p_complemento TEXT DEFAULT NULL
+) RETURNS TABLE (
+    id INT,
+    prefeitura_id INT,
+    nome VARCHAR,
+    cpf VARCHAR,
+    telefone VARCHAR,
+    email VARCHAR,
+    chatwoot_contact_id INT,
+    data_nascimento DATE,
+    genero VARCHAR,
+    config JSONB,
+    active BOOLEAN,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    endereco VARCHAR,
+    numero VARCHAR,
+    bairro VARCHAR,
+    cidade VARCHAR,
+    estado VARCHAR,
+    cep VARCHAR,
+    complemento VARCHAR,
+    inserido BOOLEAN
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_cidadao_id INT;
+    v_endereco_id INT;
+    v_inserido BOOLEAN := FALSE;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('cidadao:' || p_prefeitura_id || ':' || p_telefone));
+
+    SELECT c.id INTO v_cidadao_id
+    FROM cidadaos c
+    WHERE c.telefone = p_telefone
+      AND c.prefeitura_id = p_prefeitura_id
+      AND c.active = TRUE
+    ORDER BY c.id
+    LIMIT 1;
+
+    IF v_cidadao_id IS NULL THEN
+        INSERT INTO cidadaos (prefeitura_id, nome, cpf, telefone, email, data_nascimento, genero)
+        VALUES (p_prefeitura_id, p_nome, p_cpf, p_telefone, p_email, p_data_nascimento, p_genero)
+        RETURNING cidadaos.id INTO v_cidadao_id;
+        v_inserido := TRUE;
+    ELSE
+        UPDATE cidadaos c SET
+            nome = p_nome,
+            cpf = p_cpf,
+            email = p_email,
+            data_nascimento = p_data_nascimento,
+            genero = p_genero,
+            updated_at = NOW()
+        WHERE c.id = v_cidadao_id;
+
+        SELECT ce.id INTO v_endereco_id
+        FROM cidadao_enderecos ce
+        WHERE ce.cidadao_id = v_cidadao_id
+        ORDER BY ce.is_principal DESC, ce.created_at DESC
+        LIMIT 1;
+    END IF;
+
+    IF v_endereco_id IS NULL THEN
+        INSERT INTO cidadao_enderecos (
+            cidadao_id, cep, logradouro, numero, bairro,
+            cidade, estado, complemento, is_principal, created_at
+        ) VALUES (
+            v_cidadao_id, p_cep, p_logradouro, p_numero, p_bairro,
+            p_cidade, p_estado, p_complemento, TRUE, NOW()
+        )
+        RETURNING cidadao_enderecos.id INTO v_endereco_id;
+    ELSE
+        UPDATE cidadao_enderecos ce SET
+            cep = p_cep,
+            logradouro = p_logradouro,
+            numero = p_numero,
+            bairro = p_bairro,
+            cidade = p_cidade,
+            estado = p_estado,
+            complemento = p_complemento,
+            updated_at = NOW()
+        WHERE ce.id = v_endereco_id;
+    END IF;
+
+    RETURN QUERY
+    SELECT c.id, c.prefeitura_id, c.nome, c.cpf, c.telefone, c.email,
+           c.chatwoot_contact_id, c.data_nascimento, c.genero, c.config, c.active,
+           c.created_at, c.updated_at,
+           e.logradouro, e.numero, e.bairro, e.cidade, e.estado, e.cep, e.complemento,
+           v_inserido
+    FROM cidadaos c
+    JOIN cidadao_enderecos e ON e.id = v_endereco_id
+    WHERE c.id = v_cidadao_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cadastro em lote (importação do CadÚnico): um registro JSON por cidadão, com as
+-- mesmas chaves de CadastrarCidadaoRequest. Erros ficam isolados por registro.
+CREATE OR REPLACE FUNCTION upsert_cidadaos(
+    p_prefeitura_id INT,
+    p_registros JSONB
+) RETURNS TABLE (
+    indice INT,
+    cidadao_id INT,
+    inserido BOOLEAN,
+    erro TEXT
+) AS $$
+DECLARE
+    r RECORD;
+    v RECORD;
+BEGIN
+    FOR r IN
+        SELECT item, (ordem - 1)::INT AS idx
+        FROM jsonb_array_elements(p_registros) WITH ORDINALITY AS t(item, ordem)
+    LOOP
+        indice := r.idx;
+        BEGIN
+            SELECT * INTO v FROM upsert_cidadao(
+                p_prefeitura_id,
+                r.item->>'telefone',
+                r.item->>'nome',
+                r.item->>'cpf',
+                r.item->>'email',
+                NULLIF(r.item->>'data_nascimento', '')::DATE,
+                r.item->>'genero',
+                r.item->>'cep',
+                r.item->>'endereco',
+                r.item->>'numero',
+                r.item->>'bairro',
+                r.item->>'cidade',
+                r.item->>'estado',
+                r.item->>'complemento'
+            );
+            cidadao_id := v.id;
+            inserido := v.inserido;
+            erro := NULL;
+        EXCEPTION WHEN OTHERS THEN
+            cidadao_id := NULL;
+            inserido := FALSE;
+            erro := SQLERRM;
+        END;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
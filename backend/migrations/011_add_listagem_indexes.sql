@@ -0,0 +1,22 @@
+-- Migration para paginação por cursor nas listagens de chamados e cidadãos
+-- Data: 16 de Outubro de 2026
+
+-- Listagens ordenadas por (created_at, id) DESC dentro da prefeitura: a próxima
+-- página é um range scan a partir do cursor, sem OFFSET nem ordenação em memória.
+CREATE INDEX IF NOT EXISTS idx_chamados_listagem
+    ON chamados (prefeitura_id, created_at DESC, id DESC);
+
+-- Filtros mais usados no painel (status e time) com a mesma ordenação
+CREATE INDEX IF NOT EXISTS idx_chamados_listagem_status
+    ON chamados (prefeitura_id, status, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_chamados_listagem_time
+    ON chamados (prefeitura_id, time_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_cidadaos_listagem
+    ON cidadaos (prefeitura_id, created_at DESC, id DESC)
+    WHERE active = true;
+
+-- Endereço principal do cidadão (LATERAL ... ORDER BY is_principal DESC, created_at DESC LIMIT 1)
+CREATE INDEX IF NOT EXISTS idx_cidadao_enderecos_principal
+    ON cidadao_enderecos (cidadao_id, is_principal DESC, created_at DESC);
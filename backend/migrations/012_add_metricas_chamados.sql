@@ -0,0 +1,184 @@
+-- Migration para métricas do dashboard mantidas incrementalmente
+-- Data: 16 de Outubro de 2026
+
+-- Contadores por (prefeitura, time, status). time_id = 0 quando o chamado não tem time.
+-- Cada grupo é dividido em shards (id do chamado % 8) para que criações simultâneas
+-- não disputem a mesma linha; a leitura soma os shards.
+CREATE TABLE IF NOT EXISTS metricas_chamados (
+    prefeitura_id INT NOT NULL,
+    time_id INT NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    total BIGINT NOT NULL DEFAULT 0,
+    -- chamados com resolved_at e a soma de (resolved_at - created_at) em segundos
+    resolvidos_com_tempo BIGINT NOT NULL DEFAULT 0,
+    soma_resolucao_segundos DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (prefeitura_id, time_id, status, shard)
+);
+
+CREATE TABLE IF NOT EXISTS metricas_cidadaos (
+    prefeitura_id INT NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    total BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (prefeitura_id, shard)
+);
+
+-- Somar (p_sinal = 1) ou subtrair (p_sinal = -1) a contribuição de um chamado
+CREATE OR REPLACE FUNCTION metricas_chamados_aplicar(c chamados, p_sinal INT)
+RETURNS VOID AS $$
+DECLARE
+    v_com_tempo INT := CASE WHEN c.resolved_at IS NOT NULL THEN 1 ELSE 0 END;
+    v_segundos DOUBLE PRECISION := COALESCE(EXTRACT(EPOCH FROM (c.resolved_at - c.created_at)), 0);
+BEGIN
+    IF c.prefeitura_id IS NULL OR c.status IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO metricas_chamados AS m (
+        prefeitura_id, time_id, status, shard, total, resolvidos_com_tempo, soma_resolucao_segundos
+    ) VALUES (
+        c.prefeitura_id, COALESCE(c.time_id, 0), c.status, c.id % 8,
+        p_sinal, p_sinal * v_com_tempo, p_sinal * v_com_tempo * v_segundos
+    )
+    ON CONFLICT (prefeitura_id, time_id, status, shard) DO UPDATE SET
+        total = m.total + EXCLUDED.total,
+        resolvidos_com_tempo = m.resolvidos_com_tempo + EXCLUDED.resolvidos_com_tempo,
+        soma_resolucao_segundos = m.soma_resolucao_segundos + EXCLUDED.soma_resolucao_segundos,
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trigger_metricas_chamados()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND
+       (OLD.prefeitura_id, OLD.time_id, OLD.status, OLD.created_at, OLD.resolved_at) IS NOT DISTINCT FROM
+       (NEW.prefeitura_id, NEW.time_id, NEW.status, NEW.created_at, NEW.resolved_at) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM metricas_chamados_aplicar(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM metricas_chamados_aplicar(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_metricas_chamados ON chamados;
+CREATE TRIGGER trigger_metricas_chamados
+    AFTER INSERT OR DELETE OR UPDATE OF prefeitura_id, time_id, status, created_at, resolved_at ON chamados
+    FOR EACH ROW
+    EXECUTE FUNCTION trigger_metricas_chamados();
+
+-- Cidadãos ativos por prefeitura
+CREATE OR REPLACE FUNCTION trigger_metricas_cidadaos()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_antes INT := CASE WHEN TG_OP <> 'INSERT' AND OLD.active THEN 1 ELSE 0 END;
+    v_depois INT := CASE WHEN TG_OP <> 'DELETE' AND NEW.active THEN 1 ELSE 0 END;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.prefeitura_id IS NOT DISTINCT FROM NEW.prefeitura_id AND v_antes = v_depois THEN
+        RETURN NULL;
+    END IF;
+    IF v_antes = 1 AND OLD.prefeitura_id IS NOT NULL THEN
+        INSERT INTO metricas_cidadaos AS m (prefeitura_id, shard, total)
+        VALUES (OLD.prefeitura_id, OLD.id % 8, -1)
+        ON CONFLICT (prefeitura_id, shard) DO UPDATE SET total = m.total - 1, updated_at = NOW();
+    END IF;
+    IF v_depois = 1 AND NEW.prefeitura_id IS NOT NULL THEN
+        INSERT INTO metricas_cidadaos AS m (prefeitura_id, shard, total)
+        VALUES (NEW.prefeitura_id, NEW.id % 8, 1)
+        ON CONFLICT (prefeitura_id, shard) DO UPDATE SET total = m.total + 1, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_metricas_cidadaos ON cidadaos;
+CREATE TRIGGER trigger_metricas_cidadaos
+    AFTER INSERT OR DELETE OR UPDATE OF prefeitura_id, active ON cidadaos
+    FOR EACH ROW
+    EXECUTE FUNCTION trigger_metricas_cidadaos();
+
+-- Recalcular os contadores a partir das tabelas e corrigir divergências.
+-- Trava escritas em chamados/cidadaos durante a contagem (SHARE) para que nenhum
+-- trigger concorrente se perca; retorna o número de grupos corrigidos.
+CREATE OR REPLACE FUNCTION reconciliar_metricas()
+RETURNS INT AS $$
+DECLARE
+    v_corrigidos INT := 0;
+    v_qtd INT;
+BEGIN
+    LOCK TABLE chamados, cidadaos IN SHARE MODE;
+    DROP TABLE IF EXISTS metricas_esperadas, metricas_divergentes, cidadaos_divergentes;
+
+    CREATE TEMP TABLE metricas_esperadas ON COMMIT DROP AS
+    SELECT prefeitura_id, COALESCE(time_id, 0) AS time_id, status,
+           COUNT(*) AS total,
+           COUNT(resolved_at) AS resolvidos_com_tempo,
+           COALESCE(SUM(EXTRACT(EPOCH FROM (resolved_at - created_at))), 0)::DOUBLE PRECISION AS soma_resolucao_segundos
+    FROM chamados
+    WHERE prefeitura_id IS NOT NULL AND status IS NOT NULL
+    GROUP BY 1, 2, 3;
+
+    CREATE TEMP TABLE metricas_divergentes ON COMMIT DROP AS
+    SELECT COALESCE(e.prefeitura_id, a.prefeitura_id) AS prefeitura_id,
+           COALESCE(e.time_id, a.time_id) AS time_id,
+           COALESCE(e.status, a.status) AS status
+    FROM metricas_esperadas e
+    FULL JOIN (
+        SELECT prefeitura_id, time_id, status,
+               SUM(total) AS total,
+               SUM(resolvidos_com_tempo) AS resolvidos_com_tempo,
+               SUM(soma_resolucao_segundos) AS soma_resolucao_segundos
+        FROM metricas_chamados
+        GROUP BY 1, 2, 3
+    ) a USING (prefeitura_id, time_id, status)
+    WHERE COALESCE(e.total, 0) <> COALESCE(a.total, 0)
+       OR COALESCE(e.resolvidos_com_tempo, 0) <> COALESCE(a.resolvidos_com_tempo, 0)
+       OR abs(COALESCE(e.soma_resolucao_segundos, 0) - COALESCE(a.soma_resolucao_segundos, 0)) > 1;
+
+    DELETE FROM metricas_chamados m
+    USING metricas_divergentes d
+    WHERE (m.prefeitura_id, m.time_id, m.status) = (d.prefeitura_id, d.time_id, d.status);
+
+    INSERT INTO metricas_chamados (prefeitura_id, time_id, status, shard, total,
+                                   resolvidos_com_tempo, soma_resolucao_segundos)
+    SELECT e.prefeitura_id, e.time_id, e.status, 0, e.total, e.resolvidos_com_tempo, e.soma_resolucao_segundos
+    FROM metricas_esperadas e
+    JOIN metricas_divergentes d USING (prefeitura_id, time_id, status);
+
+    SELECT COUNT(*) INTO v_corrigidos FROM metricas_divergentes;
+
+    CREATE TEMP TABLE cidadaos_divergentes ON COMMIT DROP AS
+    SELECT COALESCE(e.prefeitura_id, a.prefeitura_id) AS prefeitura_id, COALESCE(e.total, 0) AS total
+    FROM (
+        SELECT prefeitura_id, COUNT(*) AS total
+        FROM cidadaos
+        WHERE active = true AND prefeitura_id IS NOT NULL
+        GROUP BY 1
+    ) e
+    FULL JOIN (
+        SELECT prefeitura_id, SUM(total) AS total FROM metricas_cidadaos GROUP BY 1
+    ) a USING (prefeitura_id)
+    WHERE COALESCE(e.total, 0) <> COALESCE(a.total, 0);
+
+    DELETE FROM metricas_cidadaos m
+    USING cidadaos_divergentes d
+    WHERE m.prefeitura_id = d.prefeitura_id;
+
+    INSERT INTO metricas_cidadaos (prefeitura_id, shard, total)
+    SELECT prefeitura_id, 0, total FROM cidadaos_divergentes;
+
+    SELECT COUNT(*) INTO v_qtd FROM cidadaos_divergentes;
+
+    RETURN v_corrigidos + v_qtd;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Carga inicial dos contadores
+SELECT reconciliar_metricas();
@@ -0,0 +1,197 @@
+-- Migration para rollups de analytics dos agentes (AI Builder)
+-- Data: 16 de Outubro de 2026
+
+-- Agregados por agente e hora (performance por hora do dia)
+CREATE TABLE IF NOT EXISTS agent_interactions_hourly (
+    agent_id INTEGER NOT NULL REFERENCES config_ia(id) ON DELETE CASCADE,
+    hora TIMESTAMP WITH TIME ZONE NOT NULL,
+    interactions BIGINT NOT NULL DEFAULT 0,
+    successful BIGINT NOT NULL DEFAULT 0,
+    failed BIGINT NOT NULL DEFAULT 0,
+    response_time_count BIGINT NOT NULL DEFAULT 0,
+    response_time_sum NUMERIC NOT NULL DEFAULT 0,
+    response_time_min DECIMAL(10,3),
+    response_time_max DECIMAL(10,3),
+    tokens_sum BIGINT NOT NULL DEFAULT 0,
+    cost_sum NUMERIC NOT NULL DEFAULT 0,
+    last_interaction TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (agent_id, hora)
+);
+
+-- Agregados por agente, dia e categoria (analytics por período e por categoria)
+CREATE TABLE IF NOT EXISTS agent_interactions_daily (
+    agent_id INTEGER NOT NULL REFERENCES config_ia(id) ON DELETE CASCADE,
+    dia DATE NOT NULL,
+    category VARCHAR(100) NOT NULL DEFAULT '',
+    interactions BIGINT NOT NULL DEFAULT 0,
+    successful BIGINT NOT NULL DEFAULT 0,
+    failed BIGINT NOT NULL DEFAULT 0,
+    response_time_count BIGINT NOT NULL DEFAULT 0,
+    response_time_sum NUMERIC NOT NULL DEFAULT 0,
+    response_time_min DECIMAL(10,3),
+    response_time_max DECIMAL(10,3),
+    tokens_sum BIGINT NOT NULL DEFAULT 0,
+    cost_sum NUMERIC NOT NULL DEFAULT 0,
+    last_interaction TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (agent_id, dia, category)
+);
+
+-- Perguntas normalizadas (minúsculas, espaços colapsados) por hash, para o top queries
+CREATE TABLE IF NOT EXISTS agent_query_stats (
+    agent_id INTEGER NOT NULL REFERENCES config_ia(id) ON DELETE CASCADE,
+    query_hash BIGINT NOT NULL,
+    user_message TEXT NOT NULL,
+    frequency BIGINT NOT NULL DEFAULT 0,
+    successful BIGINT NOT NULL DEFAULT 0,
+    response_time_count BIGINT NOT NULL DEFAULT 0,
+    response_time_sum NUMERIC NOT NULL DEFAULT 0,
+    last_seen TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (agent_id, query_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_agent_query_stats_top ON agent_query_stats(agent_id, frequency DESC);
+
+CREATE OR REPLACE FUNCTION normalizar_pergunta(p_texto TEXT)
+RETURNS TEXT AS $$
+    SELECT LEFT(LOWER(regexp_replace(BTRIM(p_texto), '\s+', ' ', 'g')), 500);
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Atualização incremental: um trigger por comando (não por linha), agregando as
+-- linhas inseridas antes do upsert; inserts em lote custam um upsert por grupo.
+CREATE OR REPLACE FUNCTION trigger_agent_interactions_rollup()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO agent_interactions_hourly AS r (
+        agent_id, hora, interactions, successful, failed, response_time_count, response_time_sum,
+        response_time_min, response_time_max, tokens_sum, cost_sum, last_interaction
+    )
+    SELECT agent_id, date_trunc('hour', created_at), COUNT(*),
+           COUNT(*) FILTER (WHERE success), COUNT(*) FILTER (WHERE NOT success),
+           COUNT(response_time), COALESCE(SUM(response_time), 0),
+           MIN(response_time), MAX(response_time),
+           COALESCE(SUM(tokens_used), 0), COALESCE(SUM(cost), 0), MAX(created_at)
+    FROM novas
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (agent_id, hora) DO UPDATE SET
+        interactions = r.interactions + EXCLUDED.interactions,
+        successful = r.successful + EXCLUDED.successful,
+        failed = r.failed + EXCLUDED.failed,
+        response_time_count = r.response_time_count + EXCLUDED.response_time_count,
+        response_time_sum = r.response_time_sum + EXCLUDED.response_time_sum,
+        response_time_min = LEAST(r.response_time_min, EXCLUDED.response_time_min),
+        response_time_max = GREATEST(r.response_time_max, EXCLUDED.response_time_max),
+        tokens_sum = r.tokens_sum + EXCLUDED.tokens_sum,
+        cost_sum = r.cost_sum + EXCLUDED.cost_sum,
+        last_interaction = GREATEST(r.last_interaction, EXCLUDED.last_interaction);
+
+    INSERT INTO agent_interactions_daily AS r (
+        agent_id, dia, category, interactions, successful, failed, response_time_count, response_time_sum,
+        response_time_min, response_time_max, tokens_sum, cost_sum, last_interaction
+    )
+    SELECT agent_id, created_at::DATE, COALESCE(category, ''), COUNT(*),
+           COUNT(*) FILTER (WHERE success), COUNT(*) FILTER (WHERE NOT success),
+           COUNT(response_time), COALESCE(SUM(response_time), 0),
+           MIN(response_time), MAX(response_time),
+           COALESCE(SUM(tokens_used), 0), COALESCE(SUM(cost), 0), MAX(created_at)
+    FROM novas
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (agent_id, dia, category) DO UPDATE SET
+        interactions = r.interactions + EXCLUDED.interactions,
+        successful = r.successful + EXCLUDED.successful,
+        failed = r.failed + EXCLUDED.failed,
+        response_time_count = r.response_time_count + EXCLUDED.response_time_count,
+        response_time_sum = r.response_time_sum + EXCLUDED.response_time_sum,
+        response_time_min = LEAST(r.response_time_min, EXCLUDED.response_time_min),
+        response_time_max = GREATEST(r.response_time_max, EXCLUDED.response_time_max),
+        tokens_sum = r.tokens_sum + EXCLUDED.tokens_sum,
+        cost_sum = r.cost_sum + EXCLUDED.cost_sum,
+        last_interaction = GREATEST(r.last_interaction, EXCLUDED.last_interaction);
+
+    INSERT INTO agent_query_stats AS q (
+        agent_id, query_hash, user_message, frequency, successful,
+        response_time_count, response_time_sum, last_seen
+    )
+    SELECT agent_id, hashtextextended(pergunta, 0), MIN(pergunta), COUNT(*),
+           COUNT(*) FILTER (WHERE success), COUNT(response_time),
+           COALESCE(SUM(response_time), 0), MAX(created_at)
+    FROM (
+        SELECT agent_id, normalizar_pergunta(user_message) AS pergunta, success, response_time, created_at
+        FROM novas
+        WHERE user_message IS NOT NULL
+    ) n
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (agent_id, query_hash) DO UPDATE SET
+        frequency = q.frequency + EXCLUDED.frequency,
+        successful = q.successful + EXCLUDED.successful,
+        response_time_count = q.response_time_count + EXCLUDED.response_time_count,
+        response_time_sum = q.response_time_sum + EXCLUDED.response_time_sum,
+        last_seen = GREATEST(q.last_seen, EXCLUDED.last_seen);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_agent_interactions_rollup ON agent_interactions;
+CREATE TRIGGER trigger_agent_interactions_rollup
+    AFTER INSERT ON agent_interactions
+    REFERENCING NEW TABLE AS novas
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION trigger_agent_interactions_rollup();
+
+-- Reconstruir os rollups a partir de agent_interactions (carga inicial, ou após
+-- UPDATE/DELETE manual de interações, que o trigger não acompanha)
+CREATE OR REPLACE FUNCTION recalcular_agent_rollups()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE agent_interactions IN SHARE MODE;
+    TRUNCATE agent_interactions_hourly, agent_interactions_daily, agent_query_stats;
+
+    INSERT INTO agent_interactions_hourly (
+        agent_id, hora, interactions, successful, failed, response_time_count, response_time_sum,
+        response_time_min, response_time_max, tokens_sum, cost_sum, last_interaction
+    )
+    SELECT agent_id, date_trunc('hour', created_at), COUNT(*),
+           COUNT(*) FILTER (WHERE success), COUNT(*) FILTER (WHERE NOT success),
+           COUNT(response_time), COALESCE(SUM(response_time), 0),
+           MIN(response_time), MAX(response_time),
+           COALESCE(SUM(tokens_used), 0), COALESCE(SUM(cost), 0), MAX(created_at)
+    FROM agent_interactions
+    GROUP BY 1, 2;
+
+    INSERT INTO agent_interactions_daily (
+        agent_id, dia, category, interactions, successful, failed, response_time_count, response_time_sum,
+        response_time_min, response_time_max, tokens_sum, cost_sum, last_interaction
+    )
+    SELECT agent_id, created_at::DATE, COALESCE(category, ''), COUNT(*),
+           COUNT(*) FILTER (WHERE success), COUNT(*) FILTER (WHERE NOT success),
+           COUNT(response_time), COALESCE(SUM(response_time), 0),
+           MIN(response_time), MAX(response_time),
+           COALESCE(SUM(tokens_used), 0), COALESCE(SUM(cost), 0), MAX(created_at)
+    FROM agent_interactions
+    GROUP BY 1, 2, 3;
+
+    INSERT INTO agent_query_stats (
+        agent_id, query_hash, user_message, frequency, successful,
+        response_time_count, response_time_sum, last_seen
+    )
+    SELECT agent_id, hashtextextended(pergunta, 0), MIN(pergunta), COUNT(*),
+           COUNT(*) FILTER (WHERE success), COUNT(response_time),
+           COALESCE(SUM(response_time), 0), MAX(created_at)
+    FROM (
+        SELECT agent_id, normalizar_pergunta(user_message) AS pergunta, success, response_time, created_at
+        FROM agent_interactions
+        WHERE user_message IS NOT NULL
+    ) n
+    GROUP BY 1, 2;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Carga inicial
+SELECT recalcular_agent_rollups();
+
+COMMENT ON TABLE agent_interactions_hourly IS 'Rollup horário de agent_interactions (mantido por trigger)';
+COMMENT ON TABLE agent_interactions_daily IS 'Rollup diário por categoria de agent_interactions (mantido por trigger)';
+COMMENT ON TABLE agent_query_stats IS 'Frequência das perguntas normalizadas por agente (mantido por trigger)';
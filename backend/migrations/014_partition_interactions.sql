@@ -0,0 +1,244 @@
+-- Migration para particionar agent_interactions e interacoes_chamado por mês
+-- Data: 16 de Outubro de 2026
+--
+-- As tabelas atuais são renomeadas para *_legado, os dados são copiados para a nova
+-- tabela particionada (uma partição por mês de created_at + partição default) e a
+-- tabela antiga é removida. Roda numa transação e trava as duas tabelas durante a
+-- cópia: aplicar numa janela de manutenção. As partições futuras e a retenção ficam
+-- a cargo de backend/partition_maintenance.py.
+
+BEGIN;
+
+-- Nome da partição mensal: <tabela>_pAAAA_MM
+CREATE OR REPLACE FUNCTION nome_particao_mensal(p_tabela TEXT, p_mes DATE)
+RETURNS TEXT AS $$
+    SELECT p_tabela || '_p' || to_char(p_mes, 'YYYY_MM');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Criar as partições mensais de p_inicio até p_inicio + p_meses (inclusive) que ainda
+-- não existem. Linhas desse período que caíram na partição default são movidas para
+-- a partição nova antes do ATTACH. Retorna quantas partições foram criadas.
+CREATE OR REPLACE FUNCTION criar_particoes_mensais(p_tabela TEXT, p_inicio DATE, p_meses INT)
+RETURNS INT AS $$
+DECLARE
+    v_mes DATE := date_trunc('month', p_inicio)::DATE;
+    v_fim DATE;
+    v_nome TEXT;
+    v_default TEXT := p_tabela || '_default';
+    v_criadas INT := 0;
+BEGIN
+    FOR i IN 0..p_meses LOOP
+        v_fim := (v_mes + INTERVAL '1 month')::DATE;
+        v_nome := nome_particao_mensal(p_tabela, v_mes);
+
+        IF to_regclass(v_nome) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', v_nome, p_tabela);
+            IF to_regclass(v_default) IS NOT NULL THEN
+                EXECUTE format(
+                    'WITH movidas AS (DELETE FROM %I WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM movidas',
+                    v_default, v_mes, v_fim, v_nome
+                );
+            END IF;
+            EXECUTE format(
+                'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                p_tabela, v_nome, v_mes, v_fim
+            );
+            v_criadas := v_criadas + 1;
+        END IF;
+
+        v_mes := v_fim;
+    END LOOP;
+    RETURN v_criadas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partições mensais de uma tabela com o limite superior (para a retenção)
+CREATE OR REPLACE FUNCTION listar_particoes_mensais(p_tabela TEXT)
+RETURNS TABLE (particao TEXT, mes DATE, linhas_estimadas BIGINT, bytes BIGINT) AS $$
+    SELECT c.relname::TEXT,
+           to_date(substring(c.relname FROM '_p(\d{4}_\d{2})$'), 'YYYY_MM'),
+           GREATEST(c.reltuples, 0)::BIGINT,
+           pg_total_relation_size(c.oid)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = p_tabela::regclass
+      AND c.relname ~ '_p\d{4}_\d{2}$'
+    ORDER BY 2;
+$$ LANGUAGE sql STABLE;
+
+-- ========================================
+-- agent_interactions
+-- ========================================
+
+DO $$
+DECLARE
+    v_inicio DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'agent_interactions'::regclass) = 'p' THEN
+        RAISE NOTICE 'agent_interactions já está particionada';
+        RETURN;
+    END IF;
+
+    DROP VIEW IF EXISTS vw_agent_analytics;
+    DROP VIEW IF EXISTS vw_agent_hourly_performance;
+    DROP VIEW IF EXISTS vw_agent_top_queries;
+
+    ALTER TABLE agent_interactions RENAME TO agent_interactions_legado;
+    ALTER INDEX agent_interactions_pkey RENAME TO agent_interactions_legado_pkey;
+
+    CREATE TABLE agent_interactions (
+        id INTEGER NOT NULL DEFAULT nextval('agent_interactions_id_seq'),
+        agent_id INTEGER NOT NULL CONSTRAINT agent_interactions_agent_id_fkey REFERENCES config_ia(id) ON DELETE CASCADE,
+        user_message TEXT NOT NULL,
+        ai_response TEXT,
+        response_time DECIMAL(10,3),
+        tokens_used INTEGER DEFAULT 0,
+        cost DECIMAL(10,6) DEFAULT 0.0,
+        success BOOLEAN DEFAULT true,
+        category VARCHAR(100),
+        metadata JSONB,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        CONSTRAINT agent_interactions_pkey PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE TABLE agent_interactions_default PARTITION OF agent_interactions DEFAULT;
+
+    SELECT COALESCE(MIN(created_at), NOW())::DATE INTO v_inicio FROM agent_interactions_legado;
+    PERFORM criar_particoes_mensais(
+        'agent_interactions', v_inicio,
+        (EXTRACT(YEAR FROM age(date_trunc('month', NOW()), date_trunc('month', v_inicio))) * 12
+         + EXTRACT(MONTH FROM age(date_trunc('month', NOW()), date_trunc('month', v_inicio))))::INT + 3
+    );
+
+    INSERT INTO agent_interactions (
+        id, agent_id, user_message, ai_response, response_time, tokens_used,
+        cost, success, category, metadata, created_at
+    )
+    SELECT id, agent_id, user_message, ai_response, response_time, tokens_used,
+           cost, success, category, metadata, COALESCE(created_at, NOW())
+    FROM agent_interactions_legado;
+
+    ALTER SEQUENCE agent_interactions_id_seq OWNED BY agent_interactions.id;
+    DROP TABLE agent_interactions_legado;
+END $$;
+
+-- Índices no pai: criados em cada partição, do tamanho do mês
+CREATE INDEX IF NOT EXISTS idx_agent_interactions_agent_created ON agent_interactions(agent_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_agent_interactions_created_at ON agent_interactions(created_at);
+CREATE INDEX IF NOT EXISTS idx_agent_interactions_category ON agent_interactions(category);
+
+-- Rollups da migration 013 (o trigger sumiu com a tabela antiga; criado depois da
+-- cópia para não contar as linhas existentes de novo). Com a retenção ativa, os rollups
+-- guardam o histórico das partições arquivadas: recalcular_agent_rollups() passa a
+-- refletir só os meses que ainda estão no banco.
+DROP TRIGGER IF EXISTS trigger_agent_interactions_rollup ON agent_interactions;
+CREATE TRIGGER trigger_agent_interactions_rollup
+    AFTER INSERT ON agent_interactions
+    REFERENCING NEW TABLE AS novas
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION trigger_agent_interactions_rollup();
+
+-- Views da migration 002
+CREATE OR REPLACE VIEW vw_agent_analytics AS
+SELECT
+    ai.id as agent_id,
+    ai.nome as agent_name,
+    (ai.config->>'provider')::text as provider,
+    COUNT(inter.id) as total_interactions,
+    AVG(inter.response_time) as avg_response_time,
+    MIN(inter.response_time) as min_response_time,
+    MAX(inter.response_time) as max_response_time,
+    COUNT(CASE WHEN inter.success = true THEN 1 END) as successful_interactions,
+    COUNT(CASE WHEN inter.success = false THEN 1 END) as failed_interactions,
+    ROUND(
+        (COUNT(CASE WHEN inter.success = true THEN 1 END)::DECIMAL / NULLIF(COUNT(inter.id), 0)) * 100, 2
+    ) as success_rate,
+    SUM(inter.tokens_used) as total_tokens,
+    AVG(inter.tokens_used) as avg_tokens_per_interaction,
+    SUM(inter.cost) as total_cost,
+    AVG(inter.cost) as avg_cost_per_interaction,
+    MAX(inter.created_at) as last_interaction
+FROM config_ia ai
+LEFT JOIN agent_interactions inter ON ai.id = inter.agent_id
+GROUP BY ai.id, ai.nome, (ai.config->>'provider')::text;
+
+CREATE OR REPLACE VIEW vw_agent_hourly_performance AS
+SELECT
+    ai.id as agent_id,
+    ai.nome as agent_name,
+    EXTRACT(HOUR FROM inter.created_at) as hour,
+    COUNT(inter.id) as interactions,
+    AVG(inter.response_time) as avg_response_time,
+    COUNT(CASE WHEN inter.success = true THEN 1 END) as successful,
+    COUNT(CASE WHEN inter.success = false THEN 1 END) as failed
+FROM config_ia ai
+LEFT JOIN agent_interactions inter ON ai.id = inter.agent_id
+GROUP BY ai.id, ai.nome, EXTRACT(HOUR FROM inter.created_at)
+ORDER BY ai.id, hour;
+
+CREATE OR REPLACE VIEW vw_agent_top_queries AS
+SELECT
+    ai.id as agent_id,
+    ai.nome as agent_name,
+    inter.user_message,
+    COUNT(*) as frequency,
+    AVG(inter.response_time) as avg_response_time,
+    COUNT(CASE WHEN inter.success = true THEN 1 END) as successful,
+    COUNT(CASE WHEN inter.success = false THEN 1 END) as failed
+FROM config_ia ai
+LEFT JOIN agent_interactions inter ON ai.id = inter.agent_id
+WHERE inter.user_message IS NOT NULL
+GROUP BY ai.id, ai.nome, inter.user_message
+ORDER BY ai.id, frequency DESC;
+
+COMMENT ON TABLE agent_interactions IS 'Armazena interações dos agentes IA para analytics (particionada por mês)';
+
+-- ========================================
+-- interacoes_chamado
+-- ========================================
+
+DO $$
+DECLARE
+    v_inicio DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'interacoes_chamado'::regclass) = 'p' THEN
+        RAISE NOTICE 'interacoes_chamado já está particionada';
+        RETURN;
+    END IF;
+
+    ALTER TABLE interacoes_chamado RENAME TO interacoes_chamado_legado;
+    ALTER INDEX interacoes_chamado_pkey RENAME TO interacoes_chamado_legado_pkey;
+
+    CREATE TABLE interacoes_chamado (
+        id INTEGER NOT NULL DEFAULT nextval('interacoes_chamado_id_seq'),
+        chamado_id INT CONSTRAINT interacoes_chamado_chamado_id_fkey REFERENCES chamados(id) ON DELETE CASCADE,
+        agente_id INT CONSTRAINT interacoes_chamado_agente_id_fkey REFERENCES agentes(id),
+        tipo VARCHAR(50) NOT NULL CONSTRAINT interacoes_chamado_tipo_check CHECK (tipo IN ('mensagem', 'atribuicao', 'status_change', 'comentario', 'resolucao')),
+        conteudo TEXT,
+        metadata JSONB DEFAULT '{}',
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        CONSTRAINT interacoes_chamado_pkey PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE TABLE interacoes_chamado_default PARTITION OF interacoes_chamado DEFAULT;
+
+    SELECT COALESCE(MIN(created_at), NOW())::DATE INTO v_inicio FROM interacoes_chamado_legado;
+    PERFORM criar_particoes_mensais(
+        'interacoes_chamado', v_inicio,
+        (EXTRACT(YEAR FROM age(date_trunc('month', NOW()), date_trunc('month', v_inicio))) * 12
+         + EXTRACT(MONTH FROM age(date_trunc('month', NOW()), date_trunc('month', v_inicio))))::INT + 3
+    );
+
+    INSERT INTO interacoes_chamado (id, chamado_id, agente_id, tipo, conteudo, metadata, created_at)
+    SELECT id, chamado_id, agente_id, tipo, conteudo, metadata, COALESCE(created_at, NOW())
+    FROM interacoes_chamado_legado;
+
+    ALTER SEQUENCE interacoes_chamado_id_seq OWNED BY interacoes_chamado.id;
+    DROP TABLE interacoes_chamado_legado;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_interacoes_chamado ON interacoes_chamado(chamado_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_interacoes_created ON interacoes_chamado(created_at);
+
+COMMIT;
@@ -0,0 +1,64 @@
+-- Migration para o espelho local de contatos, conversas e mensagens do Chatwoot
+-- Data: 16 de Outubro de 2026
+--
+-- Preenchidas pelos webhooks (backend/chatwoot_mirror.py) com UPSERT em lote. O id é o do
+-- Chatwoot e updated_at é a versão informada pelo Chatwoot: uma linha só é sobrescrita
+-- por outra com updated_at igual ou mais novo, então webhooks fora de ordem não fazem o
+-- estado voltar. Sem chaves estrangeiras entre as tabelas: a mensagem pode chegar antes
+-- da conversa.
+
+CREATE TABLE IF NOT EXISTS chatwoot_contacts (
+    id BIGINT PRIMARY KEY,
+    account_id BIGINT,
+    name VARCHAR(255),
+    phone_number VARCHAR(50),
+    email VARCHAR(255),
+    identifier VARCHAR(255),
+    additional_attributes JSONB,
+    custom_attributes JSONB,
+    updated_at TIMESTAMP WITH TIME ZONE,
+    synced_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chatwoot_contacts_phone ON chatwoot_contacts(phone_number);
+
+CREATE TABLE IF NOT EXISTS chatwoot_conversations (
+    id BIGINT PRIMARY KEY,
+    account_id BIGINT,
+    inbox_id BIGINT,
+    contact_id BIGINT,
+    status VARCHAR(20),
+    assignee_id BIGINT,
+    team_id BIGINT,
+    labels TEXT[],
+    additional_attributes JSONB,
+    custom_attributes JSONB,
+    created_at TIMESTAMP WITH TIME ZONE,
+    last_activity_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE,
+    synced_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chatwoot_conversations_status
+    ON chatwoot_conversations(status, last_activity_at DESC);
+CREATE INDEX IF NOT EXISTS idx_chatwoot_conversations_contact ON chatwoot_conversations(contact_id);
+
+CREATE TABLE IF NOT EXISTS chatwoot_messages (
+    id BIGINT PRIMARY KEY,
+    conversation_id BIGINT NOT NULL,
+    account_id BIGINT,
+    message_type VARCHAR(20),
+    content_type VARCHAR(50),
+    content TEXT,
+    private BOOLEAN NOT NULL DEFAULT FALSE,
+    sender_type VARCHAR(50),
+    sender_id BIGINT,
+    attachments JSONB,
+    content_attributes JSONB,
+    created_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE,
+    synced_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chatwoot_messages_conversation
+    ON chatwoot_messages(conversation_id, created_at);
@@ -0,0 +1,14 @@
+-- Migration para created_at obrigatório nas listagens paginadas (chamados, cidadaos)
+-- Data: 17 de Outubro de 2026
+--
+-- O cursor das listagens é a posição (created_at, id). Linhas sem created_at (inseridas
+-- com NULL explícito) ficavam fora do range scan dos índices da migration 011; recebem
+-- a data de atualização (ou a atual) e a coluna passa a ser NOT NULL.
+
+UPDATE chamados SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL;
+ALTER TABLE chamados ALTER COLUMN created_at SET DEFAULT NOW();
+ALTER TABLE chamados ALTER COLUMN created_at SET NOT NULL;
+
+UPDATE cidadaos SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL;
+ALTER TABLE cidadaos ALTER COLUMN created_at SET DEFAULT NOW();
+ALTER TABLE cidadaos ALTER COLUMN created_at SET NOT NULL;
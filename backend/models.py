@@ -322,18 +322,18 @@ class CadastrarCidadaoRequest(BaseModel):
     """Request para cadastrar cidadão"""
     
     nome: str
-    cpf: Optional[str]
+    cpf: Optional[str] = None
     telefone: str
-    email: Optional[str]
-    endereco: Optional[str]
-    numero: Optional[str]
-    bairro: Optional[str]
-    cidade: Optional[str]
-    estado: Optional[str]
-    cep: Optional[str]
-    complemento: Optional[str]
-    data_nascimento: Optional[str]
-    genero: Optional[str]
+    email: Optional[str] = None
+    endereco: Optional[str] = None
+    numero: Optional[str] = None
+    bairro: Optional[str] = None
+    cidade: Optional[str] = None
+    estado: Optional[str] = None
+    cep: Optional[str] = None
+    complemento: Optional[str] = None
+    data_nascimento: Optional[str] = None
+    genero: Optional[str] = None
 
 
 class CadastrarCidadaoResponse(BaseModel):
@@ -344,6 +344,23 @@ class CadastrarCidadaoResponse(BaseModel):
     message: str
 
 
+class CadastrarCidadaosLoteRequest(BaseModel):
+    """Request para cadastro de cidadãos em lote (importação do CadÚnico)"""
+    
+    cidadaos: List[CadastrarCidadaoRequest]
+
+
+class CadastrarCidadaosLoteResponse(BaseModel):
+    """Response para cadastro de cidadãos em lote"""
+    
+    status: str  # 'success', 'partial' ou 'error'
+    total: int
+    inseridos: int = 0
+    atualizados: int = 0
+    erros: List[Dict[str, Any]] = []
+    message: str
+
+
 class ConsultarChamadoRequest(BaseModel):
     """Request para consultar chamado"""
     
@@ -351,6 +368,23 @@ class ConsultarChamadoRequest(BaseModel):
     telefone_cidadao: Optional[str] = None
 
 
+class AtualizarStatusChamadoRequest(BaseModel):
+    """Request para atualizar status de chamado"""
+    
+    status: str  # 'aberto', 'em_andamento', 'resolvido', 'cancelado'
+    agente_id: Optional[int] = None
+    observacao: Optional[str] = None
+
+
+class AtualizarStatusChamadoResponse(BaseModel):
+    """Response para atualização de status de chamado"""
+    
+    status: str
+    chamado: Optional[Chamado] = None
+    status_anterior: Optional[str] = None
+    message: str
+
+
 class ConsultarChamadoResponse(BaseModel):
     """Response para consulta de chamado"""
     
@@ -0,0 +1,238 @@
+"""
+Manutenção das partições mensais de agent_interactions e interacoes_chamado
+
+As tabelas são particionadas por mês de created_at (migration 014). Um job periódico
+cria as partições dos próximos PARTICOES_FUTURAS_MESES meses e dos meses que têm linhas
+na partição default (as linhas são movidas para a partição nova) e aplica a retenção:
+partições mais antigas que <TABELA>_RETENTION_MONTHS meses são exportadas para
+PARTITION_ARCHIVE_DIR/<tabela>/<partição>.csv.gz, desanexadas e removidas. Sem
+PARTITION_ARCHIVE_DIR (um volume montado) nada é removido. Os rollups de analytics
+(migration 013) não dependem das linhas brutas e guardam o histórico.
+
+Cada execução roda com um advisory lock: com várias réplicas, só uma faz a manutenção
+e as outras pulam a rodada.
+"""
+import os
+import gzip
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock da manutenção (hashtext no banco)
+TRAVA_MANUTENCAO = "cidadaoai:particoes"
+
+# Tabela -> variável de retenção em meses (0 = manter tudo) e padrão
+TABELAS_PARTICIONADAS = {
+    "agent_interactions": ("AGENT_INTERACTIONS_RETENTION_MONTHS", "0"),
+    "interacoes_chamado": ("INTERACOES_CHAMADO_RETENTION_MONTHS", "0"),
+}
+
+
+def _subtrair_meses(mes: date, meses: int) -> date:
+    total = mes.year * 12 + (mes.month - 1) - meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+class PartitionMaintenance:
+    """Criação de partições futuras e arquivamento das expiradas
+
+    PARTICOES_MANUTENCAO_SECONDS: intervalo do job (padrão 21600; 0 desativa).
+    PARTICOES_FUTURAS_MESES: meses à frente com partição criada (padrão 3).
+    """
+
+    def __init__(self, pool_getter: Callable[[], Any]):
+        self._pool_getter = pool_getter
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.execucoes = 0
+        self.execucoes_ignoradas = 0
+        self.particoes_criadas = 0
+        self.linhas_realocadas = 0
+        self.particoes_arquivadas = 0
+        self.linhas_arquivadas = 0
+        self.ultima_execucao: Optional[str] = None
+        self.ultimo_erro: Optional[str] = None
+
+    @staticmethod
+    def _retencao(tabela: str) -> int:
+        variavel, padrao = TABELAS_PARTICIONADAS[tabela]
+        return max(0, int(os.getenv(variavel, padrao)))
+
+    @staticmethod
+    def _archive_dir() -> Optional[str]:
+        return os.getenv("PARTITION_ARCHIVE_DIR") or None
+
+    async def manter(self) -> Dict[str, Any]:
+        """Criar partições futuras e arquivar as expiradas de todas as tabelas
+
+        Retorna {} se outra réplica estiver com a manutenção em andamento.
+        """
+        async with self._lock:
+            pool = self._pool_getter()
+            async with pool.acquire() as trava:
+                if not await trava.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", TRAVA_MANUTENCAO):
+                    self.execucoes_ignoradas += 1
+                    logger.info("🗂️ Manutenção das partições em andamento em outra réplica; rodada ignorada")
+                    return {}
+                try:
+                    return await self._manter()
+                finally:
+                    await trava.execute("SELECT pg_advisory_unlock(hashtext($1))", TRAVA_MANUTENCAO)
+
+    async def _manter(self) -> Dict[str, Any]:
+        futuras = max(1, int(os.getenv("PARTICOES_FUTURAS_MESES", "3")))
+        hoje = date.today().replace(day=1)
+        resultado: Dict[str, Any] = {}
+        for tabela in TABELAS_PARTICIONADAS:
+            criadas = await self.realocar_default(tabela)
+            criadas += await self.criar_futuras(tabela, hoje, futuras)
+            arquivadas = []
+            retencao = self._retencao(tabela)
+            if retencao and not self._archive_dir():
+                logger.warning(f"⚠️ {tabela}: retenção de {retencao} mês(es) ignorada sem PARTITION_ARCHIVE_DIR")
+            elif retencao:
+                arquivadas = await self.arquivar_expiradas(tabela, _subtrair_meses(hoje, retencao))
+            resultado[tabela] = {"criadas": criadas, "arquivadas": arquivadas}
+
+        self.execucoes += 1
+        self.ultima_execucao = datetime.now().isoformat()
+        return resultado
+
+    async def realocar_default(self, tabela: str) -> int:
+        """Criar as partições dos meses com linhas na partição default, movendo as linhas
+
+        Cobre linhas de meses sem partição (regravadas do disco depois de um mês
+        sem manutenção, datas retroativas...); retorna partições criadas.
+        """
+        default = f"{tabela}_default"
+        pool = self._pool_getter()
+        criadas = 0
+        async with pool.acquire() as conn:
+            if await conn.fetchval("SELECT to_regclass($1)", default) is None:
+                return 0
+            meses = await conn.fetch(
+                f"SELECT date_trunc('month', created_at)::DATE AS mes, COUNT(*) AS linhas "
+                f'FROM "{default}" GROUP BY 1 ORDER BY 1'
+            )
+            for row in meses:
+                criadas += await conn.fetchval(
+                    "SELECT criar_particoes_mensais($1, $2, 0)", tabela, row["mes"]
+                )
+                self.linhas_realocadas += row["linhas"]
+                logger.info(f"🗂️ {tabela}: {row['linhas']} linha(s) de {row['mes']:%Y-%m} movida(s) da partição default")
+        self.particoes_criadas += criadas
+        return criadas
+
+    async def criar_futuras(self, tabela: str, inicio: date, meses: int) -> int:
+        pool = self._pool_getter()
+        async with pool.acquire() as conn:
+            criadas = await conn.fetchval(
+                "SELECT criar_particoes_mensais($1, $2, $3)", tabela, inicio, meses
+            )
+        if criadas:
+            self.particoes_criadas += criadas
+            logger.info(f"🗂️ {tabela}: {criadas} partição(ões) mensal(is) criada(s)")
+        return criadas
+
+    async def arquivar_expiradas(self, tabela: str, limite: date) -> List[str]:
+        """Exportar, desanexar e remover as partições de meses anteriores a limite"""
+        pool = self._pool_getter()
+        async with pool.acquire() as conn:
+            expiradas = await conn.fetch(
+                "SELECT particao FROM listar_particoes_mensais($1) WHERE mes < $2", tabela, limite
+            )
+        arquivadas = []
+        for row in expiradas:
+            await self.arquivar_particao(tabela, row["particao"])
+            arquivadas.append(row["particao"])
+        return arquivadas
+
+    async def arquivar_particao(self, tabela: str, particao: str) -> int:
+        """Exportar a partição para CSV gzip e removê-la; retorna linhas exportadas"""
+        archive_dir = self._archive_dir()
+        if not archive_dir:
+            raise ValueError("PARTITION_ARCHIVE_DIR não configurado: partição não removida")
+        destino_dir = os.path.join(archive_dir, tabela)
+        os.makedirs(destino_dir, exist_ok=True)
+        destino = os.path.join(destino_dir, f"{particao}.csv.gz")
+
+        pool = self._pool_getter()
+        async with pool.acquire() as conn:
+            # A trava impede inserts atrasados na partição entre a exportação e o DROP
+            async with conn.transaction():
+                await conn.execute(f'LOCK TABLE "{particao}" IN SHARE MODE')
+                arquivo = await asyncio.to_thread(gzip.open, destino + ".tmp", "wb")
+                try:
+                    async def escrever(chunk: bytes):
+                        await asyncio.to_thread(arquivo.write, chunk)
+
+                    status = await conn.copy_from_table(
+                        particao, output=escrever, format="csv", header=True
+                    )
+                finally:
+                    await asyncio.to_thread(arquivo.close)
+                os.replace(destino + ".tmp", destino)
+
+                await conn.execute(f'ALTER TABLE "{tabela}" DETACH PARTITION "{particao}"')
+                await conn.execute(f'DROP TABLE "{particao}"')
+
+        linhas = int(status.split()[-1]) if status else 0
+        self.particoes_arquivadas += 1
+        self.linhas_arquivadas += linhas
+        logger.info(f"📦 {particao}: {linhas} linha(s) arquivada(s) em {destino}")
+        return linhas
+
+    async def start(self, interval: Optional[int] = None):
+        """Executar a manutenção agora e depois periodicamente"""
+        if self._task:
+            return
+        interval = interval if interval is not None else int(os.getenv("PARTICOES_MANUTENCAO_SECONDS", "21600"))
+        if interval <= 0 or self._pool_getter() is None:
+            return
+
+        async def _loop():
+            while True:
+                try:
+                    await self.manter()
+                except asyncpg.UndefinedFunctionError:
+                    logger.warning("⚠️ criar_particoes_mensais() não existe (migration 014 não aplicada)")
+                    return
+                except Exception as e:
+                    self.ultimo_erro = str(e)
+                    logger.error(f"❌ Erro na manutenção das partições: {e}")
+                await asyncio.sleep(interval)
+
+        self._task = asyncio.create_task(_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "execucoes": self.execucoes,
+            "particoes_criadas": self.particoes_criadas,
+            "execucoes_ignoradas": self.execucoes_ignoradas,
+            "linhas_realocadas": self.linhas_realocadas,
+            "particoes_arquivadas": self.particoes_arquivadas,
+            "linhas_arquivadas": self.linhas_arquivadas,
+            "retencao_meses": {tabela: self._retencao(tabela) for tabela in TABELAS_PARTICIONADAS},
+            "archive_dir": self._archive_dir(),
+            "ultima_execucao": self.ultima_execucao,
+            "ultimo_erro": self.ultimo_erro,
+        }
+
+
+def _chamados_pool():
+    from .chamados_service import chamados_service
+    return chamados_service.pool
+
+
+# Instância global
+partition_maintenance = PartitionMaintenance(_chamados_pool)
@@ -0,0 +1,90 @@
+"""
+Geração de protocolos de chamados com contadores por (prefixo, ano)
+
+Os números vêm de protocolo_contadores (migration 009) via reservar_protocolos(),
+um UPDATE ... RETURNING que trava apenas a linha do contador. Com
+PROTOCOLO_BLOCK_SIZE > 1 cada processo reserva um bloco de números por vez e os
+distribui localmente (menos idas ao banco; números não usados num restart viram
+lacunas e a ordem entre réplicas deixa de ser estritamente crescente).
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+PREFIXO_GERAL = "GERAL"
+
+
+def formatar_protocolo(prefixo: str, ano: int, sequencial: int) -> str:
+    """PREFIXO-ANO-NNN (igual a formatar_protocolo() no banco)"""
+    return f"{prefixo}-{ano}-{sequencial:03d}"
+
+
+class ProtocoloAllocator:
+    """Distribui números de protocolo sem duplicidade entre processos"""
+
+    def __init__(self, block_size: Optional[int] = None):
+        self._block_size = block_size
+        # (prefixo, ano) -> [próximo, último] do bloco reservado
+        self._blocks: Dict[Tuple[str, int], List[int]] = {}
+        self._locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+        self._prefixos = TTLCache(max_size=1000, ttl=300)
+        self.reservas = 0
+        self.emitidos = 0
+
+    @property
+    def block_size(self) -> int:
+        if self._block_size is None:
+            self._block_size = max(1, int(os.getenv("PROTOCOLO_BLOCK_SIZE", "1")))
+        return self._block_size
+
+    async def gerar(self, conn, time_id: Optional[int], ano: Optional[int] = None) -> str:
+        """Próximo protocolo para o time (GERAL quando sem time)"""
+        prefixo = await self._prefixo_do_time(conn, time_id) if time_id else PREFIXO_GERAL
+        ano = ano or datetime.now().year
+        sequencial = await self.proximo(conn, prefixo, ano)
+        return formatar_protocolo(prefixo, ano, sequencial)
+
+    async def proximo(self, conn, prefixo: str, ano: int) -> int:
+        """Próximo número do contador (prefixo, ano)"""
+        key = (prefixo, ano)
+        if self.block_size == 1:
+            self.reservas += 1
+            self.emitidos += 1
+            return await conn.fetchval("SELECT reservar_protocolos($1, $2, 1)", prefixo, ano)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] > block[1]:
+                ultimo = await conn.fetchval(
+                    "SELECT reservar_protocolos($1, $2, $3)", prefixo, ano, self.block_size
+                )
+                block = [ultimo - self.block_size + 1, ultimo]
+                self._blocks[key] = block
+                self.reservas += 1
+            sequencial = block[0]
+            block[0] += 1
+            self.emitidos += 1
+            return sequencial
+
+    async def _prefixo_do_time(self, conn, time_id: int) -> str:
+        prefixo = self._prefixos.get(time_id)
+        if prefixo is None:
+            prefixo = await conn.fetchval(
+                "SELECT UPPER(SUBSTRING(nome, 1, 5)) FROM times WHERE id = $1", time_id
+            ) or PREFIXO_GERAL
+            self._prefixos.set(time_id, prefixo)
+        return prefixo
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "block_size": self.block_size,
+            "reservas": self.reservas,
+            "emitidos": self.emitidos,
+        }
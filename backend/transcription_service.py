@@ -0,0 +1,428 @@
+"""
+Fila de transcrição dos áudios recebidos (Whisper)
+
+Os áudios dos cidadãos chegam pelo webhook e entram numa fila local consumida por
+TRANSCRIPTION_WORKERS workers, sem segurar o processamento do webhook. Antes do envio
+ao Whisper cada áudio é:
+  1. decodificado para PCM mono 16kHz (ffmpeg, no pool do audio_transcoder);
+  2. recortado por energia (VAD): silêncios longos saem, reduzindo os minutos cobrados;
+  3. dividido nos silêncios em blocos de até TRANSCRIPTION_CHUNK_SECONDS, transcritos
+     em paralelo e unidos na ordem.
+
+A transcrição fica em cache pelo sha256 do áudio (memória e Redis, quando disponível):
+um webhook reenviado ou um áudio encaminhado não é transcrito de novo.
+"""
+import io
+import os
+import sys
+import math
+import time
+import wave
+import asyncio
+import hashlib
+import logging
+import operator
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .cache import TTLCache
+from .audio_transcoder import audio_transcoder, TranscodeError
+from .audio_transcriber import transcriber
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+# Silêncio mantido entre trechos de fala dentro de um bloco
+PAUSA_MS = 300
+
+TranscriptionCallback = Callable[[Optional[str]], Awaitable[None]]
+
+
+def energias(pcm: bytes, sample_rate: int = SAMPLE_RATE, frame_ms: int = FRAME_MS) -> List[float]:
+    """RMS de cada quadro de frame_ms (1 a cada 4 amostras basta para a energia)"""
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) // 2 * 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    n = sample_rate * frame_ms // 1000
+    resultado = []
+    for inicio in range(0, len(samples) - n + 1, n):
+        quadro = samples[inicio:inicio + n:4]
+        resultado.append(math.sqrt(sum(map(operator.mul, quadro, quadro)) / len(quadro)))
+    return resultado
+
+
+def segmentos_de_fala(
+    energia: List[float],
+    limiar_min: float = 300.0,
+    frame_ms: int = FRAME_MS,
+    min_silencio_ms: int = 500,
+    min_fala_ms: int = 90,
+    margem_ms: int = 200,
+) -> List[Tuple[int, int]]:
+    """Trechos [início, fim) em quadros com energia acima do limiar
+
+    O limiar acompanha o ruído de fundo (3x o 10º percentil), limitado a 10% do pico
+    para não cortar fala contínua, e nunca fica abaixo de limiar_min (~ -40 dBFS).
+    """
+    if not energia:
+        return []
+    ordenadas = sorted(energia)
+    piso = ordenadas[len(ordenadas) // 10]
+    pico = ordenadas[min(len(ordenadas) - 1, len(ordenadas) * 95 // 100)]
+    limiar = max(limiar_min, min(piso * 3, pico * 0.1))
+
+    min_silencio = max(1, min_silencio_ms // frame_ms)
+    min_fala = max(1, min_fala_ms // frame_ms)
+    margem = margem_ms // frame_ms
+
+    brutos, inicio, fim, silencio = [], None, 0, 0
+    for i, valor in enumerate(energia):
+        if valor > limiar:
+            if inicio is None:
+                inicio = i
+            fim, silencio = i + 1, 0
+        elif inicio is not None:
+            silencio += 1
+            if silencio >= min_silencio:
+                brutos.append((inicio, fim))
+                inicio = None
+    if inicio is not None:
+        brutos.append((inicio, fim))
+
+    segmentos: List[Tuple[int, int]] = []
+    for inicio, fim in brutos:
+        if fim - inicio < min_fala:
+            continue  # estalos e ruídos curtos
+        inicio, fim = max(0, inicio - margem), min(len(energia), fim + margem)
+        if segmentos and inicio <= segmentos[-1][1]:
+            segmentos[-1] = (segmentos[-1][0], fim)
+        else:
+            segmentos.append((inicio, fim))
+    return segmentos
+
+
+def planejar_blocos(
+    segmentos: List[Tuple[int, int]], energia: List[float], max_quadros: int
+) -> List[List[Tuple[int, int]]]:
+    """Agrupar trechos em blocos de até max_quadros, cortando nos silêncios entre eles
+
+    Um trecho maior que o bloco é cortado no quadro mais baixo dos últimos 20% do limite.
+    """
+    pedacos: List[Tuple[int, int]] = []
+    janela = max(1, max_quadros // 5)
+    for inicio, fim in segmentos:
+        while fim - inicio > max_quadros:
+            limite = inicio + max_quadros
+            corte = min(range(limite - janela, limite), key=lambda i: energia[i]) + 1
+            pedacos.append((inicio, corte))
+            inicio = corte
+        pedacos.append((inicio, fim))
+
+    blocos: List[List[Tuple[int, int]]] = []
+    atual: List[Tuple[int, int]] = []
+    tamanho = 0
+    for inicio, fim in pedacos:
+        if atual and tamanho + (fim - inicio) > max_quadros:
+            blocos.append(atual)
+            atual, tamanho = [], 0
+        atual.append((inicio, fim))
+        tamanho += fim - inicio
+    if atual:
+        blocos.append(atual)
+    return blocos
+
+
+def montar_wav(pcm: bytes, bloco: List[Tuple[int, int]], sample_rate: int = SAMPLE_RATE,
+               frame_ms: int = FRAME_MS) -> bytes:
+    """WAV mono 16 bits com os trechos do bloco separados por pausas curtas"""
+    bytes_por_quadro = sample_rate * frame_ms // 1000 * 2
+    pausa = b"\x00" * (sample_rate * PAUSA_MS // 1000 * 2)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        for i, (inicio, fim) in enumerate(bloco):
+            if i:
+                wav.writeframes(pausa)
+            wav.writeframes(pcm[inicio * bytes_por_quadro:fim * bytes_por_quadro])
+    return buffer.getvalue()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@dataclass
+class _Job:
+    path: str
+    sha256: Optional[str]
+    callbacks: List[TranscriptionCallback] = field(default_factory=list)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class TranscriptionService:
+    """Fila de transcrição com pré-processamento (VAD + blocos) e cache por hash
+
+    TRANSCRIPTION_WORKERS: áudios transcritos ao mesmo tempo (padrão 2)
+    TRANSCRIPTION_QUEUE_MAX_SIZE: áudios aguardando (padrão 200)
+    TRANSCRIPTION_CHUNK_SECONDS: duração máxima de cada envio ao Whisper (padrão 60)
+    TRANSCRIPTION_CHUNK_CONCURRENCY: blocos do mesmo áudio em paralelo (padrão 4)
+    TRANSCRIPTION_MAX_SECONDS: duração máxima transcrita por áudio (padrão 900)
+    TRANSCRIPTION_VAD_MIN_RMS: energia mínima considerada fala, 0-32767 (padrão 300)
+    TRANSCRIPTION_CACHE_TTL: validade do cache em segundos (padrão 30 dias)
+    TRANSCRIPTION_STOP_TIMEOUT: espera pelos áudios pendentes no shutdown (padrão 10)
+    """
+
+    def __init__(self, redis_client=None, key_prefix: str = "cidadaoai:transcricao"):
+        self.redis = redis_client
+        self.key_prefix = key_prefix
+        self.cache = TTLCache(max_size=2000, ttl=3600)
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._jobs: Dict[str, _Job] = {}
+        self._running = False
+        self._draining = False
+
+        self.num_workers = 2
+        self.chunk_seconds = 60.0
+        self.chunk_concurrency = 4
+        self.max_seconds = 900.0
+        self.vad_min_rms = 300.0
+        self.cache_ttl = 30 * 86400
+        self.stop_timeout = 10.0
+
+        # Métricas
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.chunks_sent = 0
+        self.audio_seconds = 0.0
+        self.speech_seconds = 0.0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self._latency_count = 0
+        self._redis_warned = False
+
+    def _configure(self):
+        self.num_workers = max(1, int(os.getenv("TRANSCRIPTION_WORKERS", "2")))
+        self.chunk_seconds = max(5.0, float(os.getenv("TRANSCRIPTION_CHUNK_SECONDS", "60")))
+        self.chunk_concurrency = max(1, int(os.getenv("TRANSCRIPTION_CHUNK_CONCURRENCY", "4")))
+        self.max_seconds = float(os.getenv("TRANSCRIPTION_MAX_SECONDS", "900"))
+        self.vad_min_rms = float(os.getenv("TRANSCRIPTION_VAD_MIN_RMS", "300"))
+        self.cache_ttl = int(os.getenv("TRANSCRIPTION_CACHE_TTL", str(30 * 86400)))
+        self.stop_timeout = float(os.getenv("TRANSCRIPTION_STOP_TIMEOUT", "10"))
+
+    async def start(self):
+        """Iniciar workers da fila"""
+        if self._running:
+            return
+        self._configure()
+        self._queue = asyncio.Queue(maxsize=int(os.getenv("TRANSCRIPTION_QUEUE_MAX_SIZE", "200")))
+        self._running = True
+        self._draining = False
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"transcription-worker-{i}")
+            for i in range(self.num_workers)
+        ]
+        logger.info(f"🎧 Fila de transcrição iniciada ({self.num_workers} workers)")
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Parar a fila: novos áudios são recusados e os pendentes têm até timeout
+        (TRANSCRIPTION_STOP_TIMEOUT) para terminar; os que sobrarem recebem None no
+        callback, como numa falha de transcrição
+        """
+        if not self._running:
+            return
+        self._draining = True
+        timeout = self.stop_timeout if timeout is None else timeout
+        if self._jobs:
+            logger.info(f"⏳ Aguardando {len(self._jobs)} áudio(s) na fila de transcrição (até {timeout:.0f}s)")
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._running = False
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        pendentes = list(self._jobs.values())
+        self._jobs.clear()
+        if pendentes:
+            logger.warning(f"⚠️ {len(pendentes)} áudio(s) sem transcrição no shutdown, seguindo sem o texto")
+        for job in pendentes:
+            await self._notify(job, None)
+
+    def submit(self, audio_path: str, sha256: Optional[str], callback: TranscriptionCallback) -> bool:
+        """Enfileirar áudio; callback recebe o texto ("" sem fala, None em falha)"""
+        if not self._running or self._draining:
+            return False
+        key = sha256 or audio_path
+        job = self._jobs.get(key)
+        if job is not None:
+            # Mesmo áudio já na fila: uma transcrição atende os dois
+            job.callbacks.append(callback)
+            return True
+        job = _Job(audio_path, sha256, [callback])
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"⚠️ Fila de transcrição cheia, áudio ignorado: {audio_path}")
+            return False
+        self._jobs[key] = job
+        self.submitted += 1
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: _Job):
+        try:
+            text = await self.transcribe(job.path, job.sha256)
+        except asyncio.CancelledError:
+            # Shutdown: o job fica em _jobs e stop() responde os callbacks com None
+            raise
+        except Exception as e:
+            logger.error(f"❌ Erro na transcrição de {job.path}: {e}")
+            text = None
+        self._jobs.pop(job.sha256 or job.path, None)
+
+        latency_ms = (time.monotonic() - job.enqueued_at) * 1000
+        self.total_latency_ms += latency_ms
+        self._latency_count += 1
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        await self._notify(job, text)
+
+    async def _notify(self, job: _Job, text: Optional[str]):
+        for callback in job.callbacks:
+            try:
+                await callback(text)
+            except Exception as e:
+                logger.error(f"❌ Erro ao tratar transcrição de {job.path}: {e}")
+
+    # Cache -------------------------------------------------------------------
+
+    async def _cached(self, sha256: str) -> Optional[str]:
+        text = self.cache.get(sha256)
+        if text is not None or self.redis is None:
+            return text
+        try:
+            value = await self.redis.get(f"{self.key_prefix}:{sha256}")
+        except Exception as e:
+            self._warn_redis(e)
+            return None
+        if value is None:
+            return None
+        text = value.decode() if isinstance(value, bytes) else value
+        self.cache.set(sha256, text)
+        return text
+
+    async def _store(self, sha256: str, text: str):
+        self.cache.set(sha256, text)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(f"{self.key_prefix}:{sha256}", text, ex=self.cache_ttl)
+        except Exception as e:
+            self._warn_redis(e)
+
+    def _warn_redis(self, error: Exception):
+        if not self._redis_warned:
+            self._redis_warned = True
+            logger.warning(f"⚠️ Redis indisponível para o cache de transcrições, usando só memória: {error}")
+
+    # Transcrição -------------------------------------------------------------
+
+    async def transcribe(self, audio_path: str, sha256: Optional[str] = None) -> Optional[str]:
+        """Transcrever arquivo (com cache); "" quando não há fala, None em falha"""
+        if sha256:
+            cached = await self._cached(sha256)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+
+        data = await asyncio.to_thread(_read_file, audio_path)
+        if not sha256:
+            sha256 = hashlib.sha256(data).hexdigest()
+            cached = await self._cached(sha256)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+
+        text = await self.transcribe_bytes(data)
+        if text is None:
+            self.failed += 1
+            return None
+        self.completed += 1
+        await self._store(sha256, text)
+        return text
+
+    async def transcribe_bytes(self, data: bytes) -> Optional[str]:
+        """Decodificar, recortar silêncios e transcrever os blocos em paralelo"""
+        try:
+            pcm = await audio_transcoder.decode_pcm(data, SAMPLE_RATE, self.max_seconds)
+        except TranscodeError as e:
+            logger.warning(f"⚠️ Pré-processamento falhou, enviando áudio original: {e}")
+            return await transcriber.transcribe_bytes("audio.ogg", data)
+
+        energia = await asyncio.to_thread(energias, pcm)
+        segmentos = segmentos_de_fala(energia, self.vad_min_rms)
+        duracao = len(pcm) / 2 / SAMPLE_RATE
+        fala = sum(fim - inicio for inicio, fim in segmentos) * FRAME_MS / 1000
+        self.audio_seconds += duracao
+        self.speech_seconds += fala
+        if not segmentos:
+            logger.info(f"🔇 Áudio de {duracao:.1f}s sem fala, transcrição não enviada")
+            return ""
+
+        max_quadros = int(self.chunk_seconds * 1000 // FRAME_MS)
+        blocos = planejar_blocos(segmentos, energia, max_quadros)
+        logger.info(
+            f"🎧 Transcrevendo {duracao:.1f}s de áudio: {fala:.1f}s de fala em {len(blocos)} bloco(s)"
+        )
+
+        semaphore = asyncio.Semaphore(self.chunk_concurrency)
+
+        async def transcrever_bloco(i: int, bloco: List[Tuple[int, int]]) -> Optional[str]:
+            async with semaphore:
+                wav = await asyncio.to_thread(montar_wav, pcm, bloco)
+                self.chunks_sent += 1
+                return await transcriber.transcribe_bytes(f"bloco_{i}.wav", wav)
+
+        textos = await asyncio.gather(*(transcrever_bloco(i, b) for i, b in enumerate(blocos)))
+        if any(texto is None for texto in textos):
+            return None
+        return " ".join(texto.strip() for texto in textos if texto and texto.strip())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._running,
+            "workers": self.num_workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_progress": len(self._jobs),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cache_hits": self.cache_hits,
+            "chunks_sent": self.chunks_sent,
+            "audio_seconds": round(self.audio_seconds, 1),
+            "speech_seconds": round(self.speech_seconds, 1),
+            "avg_latency_ms": round(self.total_latency_ms / self._latency_count, 1) if self._latency_count else None,
+            "max_latency_ms": round(self.max_latency_ms, 1),
+            "cache": self.cache.get_stats(),
+        }
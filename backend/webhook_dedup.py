@@ -0,0 +1,158 @@
+"""
+Deduplicação das entregas de webhook do Chatwoot
+
+O Chatwoot reenvia o webhook quando a resposta demora (timeout), e a mesma
+message_created chegando duas vezes virava duas respostas da IA e dois downloads de
+áudio. Cada entrega recebe uma chave (evento, id do objeto, versão) e só a primeira é
+processada:
+
+    versão = updated_at do payload; message_created não muda depois de criada (só o id
+    conta); sem updated_at, o hash do corpo (reenvios mandam o mesmo corpo)
+
+As chaves ficam num LRU em memória (repetições na mesma réplica não vão ao Redis) e no
+Redis com SET NX + TTL (repetições que caem em outra réplica). Sem Redis, só o LRU local.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookDeduplicator:
+    """Índice de entregas já recebidas: LRU local na frente do Redis (SET NX EX)
+
+    WEBHOOK_DEDUP_TTL: por quanto tempo uma entrega é lembrada (segundos, padrão 3600)
+    WEBHOOK_DEDUP_LOCAL_SIZE: chaves no LRU em memória (padrão 20000)
+    """
+
+    def __init__(self, redis_client=None, ttl: Optional[int] = None, local_size: Optional[int] = None,
+                 key_prefix: str = "cidadaoai:webhook_dedup"):
+        self.redis = redis_client
+        self.ttl = ttl or int(os.getenv("WEBHOOK_DEDUP_TTL") or 3600)
+        self.key_prefix = key_prefix
+        self.local = TTLCache(
+            max_size=local_size or int(os.getenv("WEBHOOK_DEDUP_LOCAL_SIZE") or 20000),
+            ttl=self.ttl,
+        )
+        self._redis_ok = True
+
+        # Métricas
+        self.checked: Dict[str, int] = defaultdict(int)
+        self.duplicates: Dict[str, int] = defaultdict(int)
+        self.detected_by: Dict[str, int] = defaultdict(int)
+        self.unkeyed = 0
+        self.released = 0
+        self.redis_errors = 0
+        self._delay_total = 0.0
+        self._delay_count = 0
+        self.max_delay = 0.0
+
+    @staticmethod
+    def make_key(event: str, payload: Dict[str, Any]) -> Optional[str]:
+        """Chave da entrega, ou None se o evento não identifica um objeto (ex.: digitando)"""
+        objeto_id = payload.get("id")
+        if objeto_id is None:
+            return None
+        versao = payload.get("updated_at")
+        if versao is None:
+            if event == "message_created":
+                versao = "created"
+            else:
+                corpo = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+                versao = hashlib.sha1(corpo.encode()).hexdigest()[:16]
+        return f"{event}:{objeto_id}:{versao}"
+
+    async def claim(self, event: str, key: Optional[str]) -> bool:
+        """Registrar a entrega; False se a mesma chave já foi recebida"""
+        self.checked[event] += 1
+        if key is None:
+            self.unkeyed += 1
+            return True
+
+        agora = time.time()
+        primeira = self.local.get(key)
+        if primeira is not None:
+            self._duplicata(event, "local", agora - primeira)
+            return False
+        # Marcar antes de ir ao Redis: outra entrega igual neste processo já vê a chave
+        self.local.set(key, agora)
+
+        if self.redis is None:
+            return True
+        redis_key = f"{self.key_prefix}:{key}"
+        try:
+            if await self.redis.set(redis_key, agora, nx=True, ex=self.ttl):
+                self._redis_ok = True
+                return True
+            # Já recebida por outra réplica (ou antes de um restart)
+            anterior = await self.redis.get(redis_key)
+            primeira = float(anterior) if anterior else agora
+            self.local.set(key, primeira)
+            self._duplicata(event, "redis", agora - primeira)
+            return False
+        except Exception as e:
+            self.redis_errors += 1
+            if self._redis_ok:
+                logger.warning(f"⚠️ Redis indisponível para deduplicação de webhooks, usando só memória: {e}")
+            self._redis_ok = False
+            return True
+
+    async def release(self, key: Optional[str]):
+        """Esquecer a entrega (processamento falhou e o Chatwoot deve poder reenviar)"""
+        if key is None:
+            return
+        self.local.delete(key)
+        self.released += 1
+        if self.redis is None:
+            return
+        try:
+            await self.redis.delete(f"{self.key_prefix}:{key}")
+        except Exception as e:
+            self.redis_errors += 1
+            logger.error(f"❌ Erro ao liberar chave de deduplicação {key}: {e}")
+
+    def _duplicata(self, event: str, origem: str, atraso: float):
+        self.duplicates[event] += 1
+        self.detected_by[origem] += 1
+        atraso = max(0.0, atraso)
+        self._delay_total += atraso
+        self._delay_count += 1
+        self.max_delay = max(self.max_delay, atraso)
+        logger.info(f"♻️ Webhook {event} repetido ignorado ({atraso:.1f}s após a primeira entrega)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Taxa de entregas repetidas por evento e atraso dos reenvios"""
+        total = sum(self.checked.values())
+        repetidas = sum(self.duplicates.values())
+        return {
+            "backend": "redis" if self.redis is not None and self._redis_ok else "local",
+            "ttl_seconds": self.ttl,
+            "checked": total,
+            "duplicates": repetidas,
+            "duplicate_rate": round(repetidas / total, 4) if total else 0.0,
+            "events": {
+                event: {
+                    "checked": self.checked[event],
+                    "duplicates": self.duplicates.get(event, 0),
+                    "duplicate_rate": round(self.duplicates.get(event, 0) / self.checked[event], 4),
+                }
+                for event in sorted(self.checked)
+            },
+            "detected_by": dict(self.detected_by),
+            "unkeyed": self.unkeyed,
+            "released": self.released,
+            "redis_errors": self.redis_errors,
+            # Atraso entre a primeira entrega e o reenvio: compara com o timeout do Chatwoot
+            "retry_delay_seconds": {
+                "avg": round(self._delay_total / self._delay_count, 3) if self._delay_count else 0.0,
+                "max": round(self.max_delay, 3),
+            },
+            "local": self.local.get_stats(),
+        }
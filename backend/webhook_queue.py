@@ -0,0 +1,567 @@
+"""
+Fila durável para processamento de webhooks do Chatwoot em background
+"""
+import os
+import json
+import math
+import time
+import uuid
+import zlib
+import socket
+import asyncio
+import logging
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+WebhookHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Espera antes de tentar de novo um webhook adiado (dobra a cada adiamento seguido)
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+
+# Renovar / liberar a lease de uma partição só se ela ainda for deste consumidor
+_RENOVAR_SE_DONO = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_LIBERAR_SE_DONO = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class WebhookQueueFull(Exception):
+    """Fila de webhooks atingiu o tamanho máximo configurado"""
+
+
+class WebhookRetry(Exception):
+    """O handler não pode aceitar o webhook agora (ex.: caixa da conversa cheia)
+
+    O webhook volta para o início da sua partição e é tentado de novo após uma espera,
+    sem que os seguintes da mesma partição passem na frente dele.
+    """
+
+
+class _Particao:
+    """Estado local de uma partição da fila (no Redis: lista pendente, de processamento e lease)"""
+
+    def __init__(self, indice: int, pending_key: str, processing_key: str, lease_key: str):
+        self.indice = indice
+        self.pending_key = pending_key
+        self.processing_key = processing_key
+        self.lease_key = lease_key
+        self.fetchers: List[asyncio.Task] = []
+        self.tasks: Set[asyncio.Task] = set()
+        self.ativa = asyncio.Event()  # limpa enquanto um webhook da partição está adiado
+        self.ativa.set()
+        self.buscando = 0
+        self.adiados: List[Any] = []  # fila local: itens adiados, na ordem de chegada
+        self.tentativas = 0
+        self.retomada: Optional[asyncio.Task] = None
+        self.liberando = False
+
+
+class WebhookQueue:
+    """Fila limitada de webhooks, particionada por conversa
+
+    Com Redis disponível cada webhook vai para uma das WEBHOOK_QUEUE_SHARDS partições
+    (hash da chave passada em enqueue, a conversa). Cada partição tem uma lease própria e
+    é consumida por uma única réplica de cada vez, com uma única busca (BLMOVE para a lista
+    de processamento da partição): os webhooks de uma conversa saem na ordem de chegada
+    mesmo com várias réplicas. As partições são divididas entre as réplicas vivas (lease
+    do consumidor, WEBHOOK_CONSUMER_LEASE_SECONDS) e redistribuídas no heartbeat; ao assumir
+    uma partição, a lista de processamento deixada pelo dono anterior volta para a fila.
+    Sem Redis, usa uma asyncio.Queue local (não durável) com WEBHOOK_WORKERS buscas.
+
+    Cada item é processado numa tarefa própria, até WEBHOOK_MAX_IN_FLIGHT ao mesmo tempo,
+    e só sai da lista de processamento quando o handler termina. Assim um item esperando a
+    vez da sua conversa no dispatcher não impede a busca dos próximos. Se o handler levanta
+    WebhookRetry, a partição para de buscar, espera os itens já aceitos e devolve o adiado
+    (e os buscados depois dele) para o início da fila antes de tentar de novo.
+    """
+
+    def __init__(self, redis_client=None, max_size: Optional[int] = None,
+                 workers: Optional[int] = None, key_prefix: str = "cidadaoai:webhooks",
+                 shards: Optional[int] = None):
+        self.redis = redis_client
+        self.max_size = max_size or int(os.getenv("WEBHOOK_QUEUE_MAX_SIZE", "5000"))
+        self.num_workers = workers or int(os.getenv("WEBHOOK_WORKERS", "1"))
+        self.num_shards = shards or int(os.getenv("WEBHOOK_QUEUE_SHARDS") or 16)
+        self.max_in_flight = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT") or 200)
+        self.consumer_id = os.getenv("WEBHOOK_QUEUE_CONSUMER") or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_ttl = int(os.getenv("WEBHOOK_CONSUMER_LEASE_SECONDS") or 30)
+        self.key_prefix = key_prefix
+        self.consumers_key = f"{key_prefix}:consumers"
+        self.lease_key = self._lease_key(self.consumer_id)
+
+        self.handler: Optional[WebhookHandler] = None
+        self.durable = False
+        self._local_queue: Optional[asyncio.Queue] = None
+        self._local_retry: deque = deque()
+        self._owned: Dict[int, _Particao] = {}
+        self._releases: Set[asyncio.Task] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._running = False
+        self._in_flight = 0
+        self.started_at: Optional[float] = None
+
+        # Métricas
+        self.received: Dict[str, int] = defaultdict(int)
+        self.processed: Dict[str, int] = defaultdict(int)
+        self.failed: Dict[str, int] = defaultdict(int)
+        self.retried: Dict[str, int] = defaultdict(int)
+        self.rejected = 0
+        self.reclaimed = 0
+        self._recent: Dict[str, deque] = defaultdict(lambda: deque(maxlen=5000))
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+        self._lag_count = 0
+
+    async def start(self, handler: WebhookHandler):
+        """Iniciar a busca (assume partições e recupera os itens deixados em processamento)"""
+        if self._running:
+            return
+
+        self.handler = handler
+        self.durable = False
+
+        if self.redis is not None:
+            try:
+                await self.redis.ping()
+                await self._renew_lease()
+                self.durable = True
+            except Exception as e:
+                logger.warning(f"⚠️ Redis indisponível para fila de webhooks, usando fila local: {e}")
+
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._running = True
+        self.started_at = time.time()
+
+        if self.durable:
+            try:
+                await self._balance()
+            except Exception as e:
+                logger.error(f"❌ Erro ao assumir partições da fila de webhooks: {e}")
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop(), name="webhook-queue-heartbeat")
+        else:
+            self._local_queue = asyncio.Queue(maxsize=self.max_size)
+            particao = _Particao(0, None, None, None)
+            particao.fetchers = [
+                asyncio.create_task(self._fetch_loop(particao), name=f"webhook-worker-{i}")
+                for i in range(self.num_workers)
+            ]
+            self._owned[0] = particao
+
+        busca = f"partições={len(self._owned)}/{self.num_shards}" if self.durable else f"workers={self.num_workers}"
+        logger.info(
+            f"📥 Fila de webhooks iniciada ({'redis' if self.durable else 'local'}, {busca}, "
+            f"max_size={self.max_size}, max_in_flight={self.max_in_flight})"
+        )
+
+    async def stop(self, timeout: float = 10.0):
+        """Parar a busca aguardando os itens em andamento"""
+        if not self._running:
+            return
+
+        self._running = False
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        for task in self._releases:
+            task.cancel()
+        await asyncio.gather(*self._releases, return_exceptions=True)
+
+        fetchers = [task for particao in self._owned.values() for task in particao.fetchers]
+        if fetchers:
+            done, pending = await asyncio.wait(fetchers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        # Itens já retirados da fila: esperar terminarem (no Redis os não concluídos e os
+        # adiados continuam na lista de processamento e voltam para a fila com a partição)
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        retomadas = [p.retomada for p in self._owned.values() if p.retomada is not None]
+        for task in retomadas:
+            task.cancel()
+        await asyncio.gather(*retomadas, return_exceptions=True)
+
+        if self.durable:
+            # Sem as leases, outra réplica assume já as partições e o que ficou em processamento
+            try:
+                for particao in self._owned.values():
+                    await self.redis.eval(_LIBERAR_SE_DONO, 1, particao.lease_key, self.consumer_id)
+                await self.redis.delete(self.lease_key)
+                await self.redis.srem(self.consumers_key, self.consumer_id)
+            except Exception as e:
+                logger.error(f"❌ Erro ao liberar leases da fila de webhooks: {e}")
+        else:
+            descartados = len(self._local_retry) + sum(len(p.adiados) for p in self._owned.values())
+            if self._local_queue is not None:
+                descartados += self._local_queue.qsize()
+            if descartados:
+                logger.warning(f"⚠️ {descartados} webhook(s) descartado(s) da fila local no shutdown")
+            self._local_retry.clear()
+        self._owned = {}
+        logger.info("✅ Fila de webhooks parada")
+
+    def _lease_key(self, consumer_id: str) -> str:
+        return f"{self.key_prefix}:consumer:{consumer_id}"
+
+    def _pending_key(self, indice: int) -> str:
+        return f"{self.key_prefix}:pending:{indice}"
+
+    def _shard_of(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % self.num_shards
+
+    def _particao(self, indice: int) -> _Particao:
+        return _Particao(indice, self._pending_key(indice), f"{self.key_prefix}:processing:{indice}",
+                         f"{self.key_prefix}:shard:{indice}")
+
+    async def _renew_lease(self):
+        await self.redis.set(self.lease_key, time.time(), ex=self.lease_ttl)
+        await self.redis.sadd(self.consumers_key, self.consumer_id)
+
+    async def _recover(self, particao: _Particao) -> int:
+        """Devolver a lista de processamento da partição para o início da fila"""
+        recovered = 0
+        # Do mais novo para o mais antigo, preservando a ordem FIFO
+        while await self.redis.lmove(particao.processing_key, particao.pending_key, "LEFT", "RIGHT"):
+            recovered += 1
+        return recovered
+
+    async def _live_consumers(self) -> int:
+        """Consumidores com lease válida (os vencidos saem do registro)"""
+        vivos = 0
+        for member in await self.redis.smembers(self.consumers_key):
+            consumer_id = member.decode() if isinstance(member, bytes) else member
+            if consumer_id == self.consumer_id or await self.redis.exists(self._lease_key(consumer_id)):
+                vivos += 1
+            else:
+                await self.redis.srem(self.consumers_key, consumer_id)
+        return max(1, vivos)
+
+    async def _balance(self):
+        """Renovar as leases e ficar com a parte justa das partições entre as réplicas vivas"""
+        await self._renew_lease()
+
+        for particao in list(self._owned.values()):
+            if not await self.redis.eval(_RENOVAR_SE_DONO, 1, particao.lease_key, self.consumer_id, self.lease_ttl):
+                # Lease vencida e assumida por outra réplica: parar a partição na hora. Os itens
+                # em andamento ficam na lista de processamento e são refeitos pelo novo dono,
+                # que os recuperou ao assumir; continuar aqui rodaria a conversa em duas réplicas
+                logger.warning(f"⚠️ Lease da partição {particao.indice} da fila de webhooks perdida")
+                particao.liberando = True
+                del self._owned[particao.indice]
+                tarefas = [*particao.fetchers, *particao.tasks]
+                if particao.retomada is not None:
+                    tarefas.append(particao.retomada)
+                for task in tarefas:
+                    task.cancel()
+                await asyncio.gather(*tarefas, return_exceptions=True)
+
+        cota = math.ceil(self.num_shards / await self._live_consumers())
+        ativas = sorted((p for p in self._owned.values() if not p.liberando), key=lambda p: p.indice)
+
+        for particao in ativas[cota:]:
+            particao.liberando = True
+            task = asyncio.create_task(self._release(particao))
+            self._releases.add(task)
+            task.add_done_callback(self._releases.discard)
+
+        # Começar num ponto diferente por consumidor para as réplicas não disputarem as mesmas
+        inicio = zlib.crc32(self.consumer_id.encode()) % self.num_shards
+        for passo in range(self.num_shards):
+            if len(ativas) >= cota:
+                break
+            indice = (inicio + passo) % self.num_shards
+            if indice in self._owned:
+                continue
+            particao = self._particao(indice)
+            if await self.redis.set(particao.lease_key, self.consumer_id, nx=True, ex=self.lease_ttl):
+                await self._acquire(particao)
+                ativas.append(particao)
+
+    async def _acquire(self, particao: _Particao):
+        """Assumir a partição: o que o dono anterior deixou em processamento volta para a fila"""
+        self._owned[particao.indice] = particao
+        recovered = await self._recover(particao)
+        if recovered:
+            self.reclaimed += recovered
+            logger.warning(f"♻️ {recovered} webhook(s) da partição {particao.indice} de volta à fila")
+        particao.fetchers = [
+            asyncio.create_task(self._fetch_loop(particao), name=f"webhook-shard-{particao.indice}")
+        ]
+
+    async def _release(self, particao: _Particao):
+        """Devolver a partição: parar a busca, esperar os itens em andamento e soltar a lease"""
+        await asyncio.gather(*particao.fetchers, return_exceptions=True)
+        while particao.tasks:
+            await asyncio.wait(set(particao.tasks))
+        if particao.retomada is not None:
+            # Os adiados ficam na lista de processamento e voltam com o próximo dono
+            particao.retomada.cancel()
+            await asyncio.gather(particao.retomada, return_exceptions=True)
+        try:
+            await self.redis.eval(_LIBERAR_SE_DONO, 1, particao.lease_key, self.consumer_id)
+        finally:
+            self._owned.pop(particao.indice, None)
+        logger.info(f"↪️ Partição {particao.indice} da fila de webhooks liberada")
+
+    async def _heartbeat_loop(self):
+        """Renovar as leases e redistribuir as partições entre as réplicas"""
+        while self._running:
+            await asyncio.sleep(max(1.0, self.lease_ttl / 3))
+            try:
+                await self._balance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Erro no heartbeat da fila de webhooks: {e}")
+
+    async def enqueue(self, event: str, payload: Dict[str, Any], key: Optional[str] = None) -> str:
+        """Gravar webhook na fila e retornar o id do envelope
+
+        key define a partição (webhooks com a mesma chave saem na ordem de chegada);
+        sem chave, a partição é sorteada pelo id do envelope.
+
+        Raises:
+            WebhookQueueFull: se a fila atingiu o tamanho máximo
+        """
+        envelope = {
+            "id": uuid.uuid4().hex,
+            "event": event,
+            "received_at": time.time(),
+            "payload": payload,
+        }
+
+        if self.durable:
+            if await self.get_depth() >= self.max_size:
+                self.rejected += 1
+                raise WebhookQueueFull(f"Fila de webhooks cheia ({self.max_size})")
+            pending_key = self._pending_key(self._shard_of(key or envelope["id"]))
+            await self.redis.lpush(pending_key, json.dumps(envelope, separators=(",", ":")))
+        else:
+            if self._local_queue is None:
+                raise RuntimeError("Fila de webhooks não iniciada")
+            try:
+                self._local_queue.put_nowait(envelope)
+            except asyncio.QueueFull:
+                self.rejected += 1
+                raise WebhookQueueFull(f"Fila de webhooks cheia ({self.max_size})")
+
+        self.received[event] += 1
+        return envelope["id"]
+
+    async def _fetch_loop(self, particao: _Particao):
+        """Buscar itens da partição até o shutdown e processar cada um numa tarefa"""
+        while self._running and not particao.liberando:
+            try:
+                if not particao.ativa.is_set():
+                    # Webhook adiado: nada sai da partição até a retomada
+                    try:
+                        await asyncio.wait_for(particao.ativa.wait(), timeout=1)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._slots.acquire()
+                particao.buscando += 1
+                try:
+                    item = await self._fetch(particao)
+                except BaseException:
+                    self._slots.release()
+                    raise
+                finally:
+                    particao.buscando -= 1
+                if item is None:
+                    self._slots.release()
+                    continue
+                task = asyncio.create_task(self._run(particao, item))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                particao.tasks.add(task)
+                task.add_done_callback(particao.tasks.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Erro na busca da partição {particao.indice} da fila de webhooks: {e}")
+                await asyncio.sleep(1)
+
+    async def _fetch(self, particao: _Particao):
+        """Próximo item (texto no Redis, envelope na fila local) ou None após 1s"""
+        if self.durable:
+            return await self.redis.blmove(particao.pending_key, particao.processing_key, 1, "RIGHT", "LEFT")
+        if self._local_retry:
+            return self._local_retry.popleft()
+        try:
+            return await asyncio.wait_for(self._local_queue.get(), timeout=1)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _run(self, particao: _Particao, item):
+        """Processar o item e retirá-lo da lista de processamento
+
+        Cancelado no shutdown, o item continua na lista de processamento e volta para a
+        fila quando a partição for assumida de novo.
+        """
+        try:
+            if not particao.ativa.is_set():
+                # Buscado depois de um adiado: espera a retomada para não passar na frente dele
+                self._hold(particao, item)
+                return
+            envelope = item
+            if self.durable:
+                try:
+                    envelope = json.loads(item)
+                except ValueError as e:
+                    logger.error(f"❌ Webhook inválido descartado da fila: {e}")
+                    envelope = None
+            if envelope is not None:
+                # Erros do handler são tratados em _process; CancelledError sobe sem o LREM
+                try:
+                    await self._process(envelope)
+                except WebhookRetry as e:
+                    self._defer(particao, item, envelope, e)
+                    return
+            if self.durable:
+                await self.redis.lrem(particao.processing_key, 1, item)
+            particao.tentativas = 0
+        except Exception as e:
+            logger.error(f"❌ Erro ao finalizar webhook: {e}")
+        finally:
+            self._slots.release()
+
+    def _hold(self, particao: _Particao, item):
+        """Guardar o item até a retomada (no Redis ele já está na lista de processamento)"""
+        if not self.durable:
+            particao.adiados.append(item)
+
+    def _defer(self, particao: _Particao, item, envelope: Dict[str, Any], erro: WebhookRetry):
+        """Adiar o webhook: parar a partição e agendar a retomada com espera crescente"""
+        # Síncrono até aqui: nenhum item buscado depois deste começa antes da pausa
+        particao.ativa.clear()
+        self._hold(particao, item)
+        event = envelope.get("event", "unknown")
+        self.retried[event] += 1
+        if particao.retomada is None:
+            particao.retomada = asyncio.create_task(self._resume(particao))
+        logger.warning(f"⏳ Webhook {event} ({envelope.get('id')}) adiado: {erro}")
+
+    async def _resume(self, particao: _Particao):
+        """Devolver os adiados para o início da partição e voltar a buscar"""
+        try:
+            atraso = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** particao.tentativas)
+            particao.tentativas += 1
+            await asyncio.sleep(atraso)
+
+            # Itens aceitos antes do adiado terminam primeiro; a busca em andamento também
+            while particao.buscando or particao.tasks:
+                if particao.tasks:
+                    await asyncio.wait(set(particao.tasks))
+                else:
+                    await asyncio.sleep(0.05)
+
+            if self.durable:
+                while True:
+                    try:
+                        await self._recover(particao)
+                        break
+                    except Exception as e:
+                        logger.error(f"❌ Erro ao devolver webhooks adiados para a fila: {e}")
+                        await asyncio.sleep(1)
+            else:
+                self._local_retry.extendleft(reversed(particao.adiados))
+                particao.adiados.clear()
+        finally:
+            particao.retomada = None
+            particao.ativa.set()
+
+    async def _process(self, envelope: Dict[str, Any]):
+        """Executar o handler para um envelope e registrar métricas"""
+        event = envelope.get("event", "unknown")
+        lag = max(0.0, time.time() - envelope.get("received_at", time.time()))
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._lag_total += lag
+        self._lag_count += 1
+
+        self._in_flight += 1
+        try:
+            await self.handler(envelope.get("payload", {}))
+            self.processed[event] += 1
+            self._recent[event].append(time.time())
+        except WebhookRetry:
+            raise
+        except Exception as e:
+            self.failed[event] += 1
+            logger.error(f"❌ Erro ao processar webhook {event} ({envelope.get('id')}): {e}")
+        finally:
+            self._in_flight -= 1
+
+    async def get_depth(self) -> int:
+        """Quantidade de webhooks aguardando processamento"""
+        if self.durable:
+            pipe = self.redis.pipeline(transaction=False)
+            for indice in range(self.num_shards):
+                pipe.llen(self._pending_key(indice))
+            return sum(await pipe.execute())
+        if self._local_queue is None:
+            return 0
+        return self._local_queue.qsize() + len(self._local_retry)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Profundidade da fila, atraso de processamento e vazão por evento"""
+        now = time.time()
+        events = set(self.received) | set(self.processed) | set(self.failed) | set(self.retried)
+        throughput = {}
+        for event in sorted(events):
+            recent = self._recent.get(event, ())
+            throughput[event] = {
+                "received": self.received.get(event, 0),
+                "processed": self.processed.get(event, 0),
+                "failed": self.failed.get(event, 0),
+                "retried": self.retried.get(event, 0),
+                "processed_last_minute": sum(1 for ts in recent if now - ts <= 60),
+            }
+
+        particoes = sorted(self._owned.values(), key=lambda p: p.indice)
+        return {
+            "backend": "redis" if self.durable else "local",
+            "running": self._running,
+            "workers": sum(len(p.fetchers) for p in particoes),
+            "shards": {
+                "total": self.num_shards if self.durable else 1,
+                "owned": [p.indice for p in particoes if not p.liberando],
+                "deferred": [p.indice for p in particoes if not p.ativa.is_set()],
+            },
+            "max_size": self.max_size,
+            "depth": await self.get_depth(),
+            "in_flight": self._in_flight,
+            "rejected": self.rejected,
+            "reclaimed": self.reclaimed,
+            "consumer": self.consumer_id,
+            "lag_seconds": {
+                "last": round(self.last_lag, 3),
+                "avg": round(self._lag_total / self._lag_count, 3) if self._lag_count else 0.0,
+                "max": round(self.max_lag, 3),
+            },
+            "events": throughput,
+            "uptime_seconds": round(now - self.started_at, 1) if self.started_at else 0,
+        }
@@ -1,27 +1,295 @@
 """
 WebSocket Manager para atualizações em tempo real
+
+WEBSOCKET_BACKEND: "memory" (padrão, uma réplica) ou "redis". Com "redis", os
+eventos emitidos em qualquer réplica passam pelo pub/sub (AsyncRedisManager do
+python-socketio) e chegam aos clientes conectados nas demais, e o registro de
+presença (quem está em cada conversa) fica no Redis, compartilhado entre as réplicas.
+WEBSOCKET_MESSAGE_QUEUE: URL da fila de mensagens (padrão REDIS_URL); amqp:// usa
+o AsyncAioPikaManager. WEBSOCKET_CHANNEL: canal compartilhado pelas réplicas.
+WEBSOCKET_PRESENCE_TTL: segundos sem heartbeat até uma réplica ser considerada morta.
+
+Atualizações de conversa vão só para quem pode ver a conversa: ao conectar, o painel
+envia join_panel {account_id, agent_id} e entra nas salas da conta, dos times do
+agente (agente_times) e do próprio agente. Painel sem agent_id (CHATWOOT_AGENT_ID do
+config.js ou ?agente=ID) não tem times conhecidos: entra na sala da conta inteira, que
+recebe todas as atualizações da conta, como antes das salas por time. Rajadas de
+atualizações da mesma conversa são agrupadas em WEBSOCKET_COALESCE_MS (padrão 250; 0
+desativa): a primeira sai na hora, as seguintes dentro da janela viram um único envio
+com o estado mais recente.
+WEBSOCKET_LOG_PACKETS=true liga o log de cada pacote do Socket.IO/Engine.IO.
 """
+import os
+import time
 import socketio
+import asyncio
 import logging
-from typing import Dict, Set
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from .cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Times do Chatwoot em que o agente está (agente_times), na prefeitura da conta
+TIMES_DO_AGENTE_SQL = """
+    SELECT DISTINCT t.chatwoot_team_id
+    FROM agentes a
+    JOIN prefeituras p ON p.id = a.prefeitura_id
+    JOIN agente_times at ON at.agente_id = a.id
+    JOIN times t ON t.id = at.time_id
+    WHERE a.chatwoot_agent_id = $1
+      AND p.chatwoot_account_id = $2
+      AND a.active AND t.active
+      AND t.chatwoot_team_id IS NOT NULL
+"""
+
+
+def sala_conta(account_id: int) -> str:
+    return f"account_{account_id}"
+
+
+def sala_conta_inteira(account_id: int) -> str:
+    return f"account_{account_id}_all"
+
+
+def sala_time(account_id: int, team_id: int) -> str:
+    return f"account_{account_id}_team_{team_id}"
+
+
+def sala_agente(account_id: int, agent_id: int) -> str:
+    return f"account_{account_id}_agent_{agent_id}"
+
+
+def salas_da_conversa(conversation: Dict[str, Any], default_account: int) -> List[str]:
+    """Salas que recebem a atualização: time da conversa (ou a conta, sem time), o
+    agente atribuído e os painéis sem agente identificado"""
+    meta = conversation.get("meta") or {}
+    account_id = (conversation.get("account_id")
+                  or (conversation.get("account") or {}).get("id")
+                  or default_account)
+    team_id = (meta.get("team") or {}).get("id") or conversation.get("team_id")
+    assignee_id = (meta.get("assignee") or {}).get("id") or conversation.get("assignee_id")
+
+    rooms = [sala_time(account_id, team_id) if team_id else sala_conta(account_id)]
+    if assignee_id:
+        rooms.append(sala_agente(account_id, assignee_id))
+    rooms.append(sala_conta_inteira(account_id))
+    return rooms
+
+
+class InMemoryPresence:
+    """Presença em memória do processo (uma réplica)"""
+
+    backend = "memory"
+
+    def __init__(self):
+        self.user_rooms: Dict[str, Set[str]] = {}
+
+    async def join(self, sid: str, room: str):
+        self.user_rooms.setdefault(sid, set()).add(room)
+
+    async def leave(self, sid: str, room: str):
+        if sid in self.user_rooms:
+            self.user_rooms[sid].discard(room)
+
+    async def remove(self, sid: str) -> Set[str]:
+        return self.user_rooms.pop(sid, set())
+
+    async def members(self, room: str) -> List[str]:
+        return [sid for sid, rooms in self.user_rooms.items() if room in rooms]
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "local_sids": len(self.user_rooms)}
+
+
+class RedisPresence:
+    """Presença compartilhada no Redis
+
+    <prefix>:room:<sala> é um hash sid -> réplica e <prefix>:sid:<sid> o conjunto de
+    salas do cliente. Cada réplica renova <prefix>:node:<id> a cada ttl/3 segundos;
+    membros de réplicas sem heartbeat (derrubadas sem shutdown) são descartados na
+    leitura.
+    """
+
+    backend = "redis"
+
+    def __init__(self, node_id: str, ttl: int, redis_url: Optional[str] = None,
+                 key_prefix: str = "cidadaoai:ws"):
+        self.node_id = node_id
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self.key_prefix = key_prefix
+        self._redis = None
+        self._task: Optional[asyncio.Task] = None
+        self._local_sids: Set[str] = set()
+        self.stale_removed = 0
+        self.errors = 0
+
+    def _client(self):
+        if self._redis is None:
+            import redis.asyncio as redis
+            url = self.redis_url or os.getenv("REDIS_URL", "redis://localhost:6380")
+            self._redis = redis.from_url(url, decode_responses=True)
+        return self._redis
+
+    def _room_key(self, room: str) -> str:
+        return f"{self.key_prefix}:room:{room}"
+
+    def _sid_key(self, sid: str) -> str:
+        return f"{self.key_prefix}:sid:{sid}"
+
+    def _node_key(self, node_id: str) -> str:
+        return f"{self.key_prefix}:node:{node_id}"
+
+    async def join(self, sid: str, room: str):
+        self._local_sids.add(sid)
+        pipe = self._client().pipeline(transaction=False)
+        pipe.hset(self._room_key(room), sid, self.node_id)
+        pipe.sadd(self._sid_key(sid), room)
+        pipe.expire(self._sid_key(sid), 86400)
+        await pipe.execute()
+
+    async def leave(self, sid: str, room: str):
+        pipe = self._client().pipeline(transaction=False)
+        pipe.hdel(self._room_key(room), sid)
+        pipe.srem(self._sid_key(sid), room)
+        await pipe.execute()
+
+    async def remove(self, sid: str) -> Set[str]:
+        self._local_sids.discard(sid)
+        client = self._client()
+        rooms = set(await client.smembers(self._sid_key(sid)))
+        pipe = client.pipeline(transaction=False)
+        for room in rooms:
+            pipe.hdel(self._room_key(room), sid)
+        pipe.delete(self._sid_key(sid))
+        await pipe.execute()
+        return rooms
+
+    async def members(self, room: str) -> List[str]:
+        client = self._client()
+        owners = await client.hgetall(self._room_key(room))
+        if not owners:
+            return []
+        nodes = sorted(set(owners.values()))
+        alive = await client.mget([self._node_key(node) for node in nodes])
+        dead = {node for node, beat in zip(nodes, alive) if beat is None and node != self.node_id}
+        stale = [sid for sid, node in owners.items() if node in dead]
+        if stale:
+            await client.hdel(self._room_key(room), *stale)
+            self.stale_removed += len(stale)
+        return [sid for sid, node in owners.items() if node not in dead]
+
+    async def _heartbeat(self):
+        await self._client().set(self._node_key(self.node_id), int(time.time()), ex=self.ttl)
+
+    async def start(self):
+        await self._heartbeat()
+
+        async def _loop():
+            while True:
+                await asyncio.sleep(max(1, self.ttl // 3))
+                try:
+                    await self._heartbeat()
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"❌ Erro no heartbeat de presença do WebSocket: {e}")
+
+        self._task = asyncio.create_task(_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        # Shutdown limpo: retirar os clientes desta réplica sem esperar o TTL
+        for sid in list(self._local_sids):
+            await self.remove(sid)
+        await self._client().delete(self._node_key(self.node_id))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "node_id": self.node_id,
+            "local_sids": len(self._local_sids),
+            "stale_removed": self.stale_removed,
+            "errors": self.errors,
+        }
+
+
+def _criar_client_manager(url: str, channel: str):
+    """Client manager do python-socketio conforme o esquema da URL"""
+    if url.startswith("amqp://") or url.startswith("amqps://"):
+        return socketio.AsyncAioPikaManager(url, channel=channel)
+    return socketio.AsyncRedisManager(url, channel=channel)
+
+
 class WebSocketManager:
     def __init__(self):
         self.sio = socketio.AsyncServer(
             async_mode='asgi',
             cors_allowed_origins='*',
-            logger=True,
-            engineio_logger=True
+            logger=False,
+            engineio_logger=False
         )
-        
-        # Mapeamento de usuários para suas salas
-        self.user_rooms: Dict[str, Set[str]] = {}
-        
+
+        # Salas de cada cliente (substituído pelo registro no Redis em start())
+        self.presence = InMemoryPresence()
+        self.backend = "memory"
+        self._started = False
+
+        # Times de cada agente (consultados no join_panel); substituível em testes
+        self.team_resolver: Callable[[int, int], Awaitable[List[int]]] = self._times_do_agente
+        self._times_cache = TTLCache(max_size=5000, ttl=60)
+
+        # Agrupamento de atualizações por conversa: id -> última atualização pendente
+        # (None = janela aberta sem nada pendente)
+        self.coalesce_window = 0.25
+        self._janelas: Dict[Any, Optional[dict]] = {}
+        self._envios: Set[asyncio.Task] = set()
+        self.updates_received = 0
+        self.updates_coalesced = 0
+        self.updates_emitted = 0
+
         # Configurar handlers
         self.setup_handlers()
-    
+
+    async def start(self):
+        """Ligar o modo multi-réplica conforme WEBSOCKET_BACKEND (antes de aceitar conexões)"""
+        if self._started:
+            return
+        self._started = True
+        self.coalesce_window = max(0, int(os.getenv("WEBSOCKET_COALESCE_MS", "250"))) / 1000
+        if os.getenv("WEBSOCKET_LOG_PACKETS", "false").lower() in ("1", "true", "yes"):
+            logging.getLogger("socketio.server").setLevel(logging.INFO)
+            logging.getLogger("engineio.server").setLevel(logging.INFO)
+        if os.getenv("WEBSOCKET_BACKEND", "memory").lower() != "redis":
+            return
+
+        redis_url = os.getenv("REDIS_URL", "redis://localhost:6380")
+        queue_url = os.getenv("WEBSOCKET_MESSAGE_QUEUE", redis_url)
+        channel = os.getenv("WEBSOCKET_CHANNEL", "cidadaoai-socketio")
+        manager = _criar_client_manager(queue_url, channel)
+        manager.set_server(self.sio)
+        self.sio.manager = manager
+        # Assinar o canal já na subida, não só na primeira conexão desta réplica
+        self.sio.manager_initialized = True
+        manager.initialize()
+
+        presence = RedisPresence(manager.host_id, int(os.getenv("WEBSOCKET_PRESENCE_TTL", "30")), redis_url)
+        await presence.start()
+        self.presence = presence
+        self.backend = "redis"
+        logger.info(f"🔌 WebSocket multi-réplica: {manager.name} (canal {channel}, réplica {manager.host_id})")
+
+    async def stop(self):
+        await self.presence.stop()
+
     def setup_handlers(self):
         @self.sio.event
         async def connect(sid, environ):
@@ -31,52 +299,97 @@ class WebSocketManager:
             await self.sio.emit('welcome', {
                 'message': 'Conectado ao Cidadão.AI'
             }, room=sid)
-        
+
         @self.sio.event
         async def disconnect(sid):
             """Cliente desconectou"""
             logger.info(f"❌ Cliente desconectado: {sid}")
             # Remover das salas
-            if sid in self.user_rooms:
-                for room in self.user_rooms[sid]:
-                    await self.sio.leave_room(sid, room)
-                del self.user_rooms[sid]
-        
+            try:
+                rooms = await self.presence.remove(sid)
+            except Exception as e:
+                logger.error(f"❌ Erro ao remover presença de {sid}: {e}")
+                return
+            for room in rooms:
+                await self.sio.leave_room(sid, room)
+
+        @self.sio.event
+        async def join_panel(sid, data):
+            """Painel do técnico: entrar nas salas da conta, dos times e do agente"""
+            data = data or {}
+            try:
+                account_id = int(data.get('account_id') or os.getenv("CHATWOOT_ACCOUNT_ID", "1"))
+                agent_id = int(data['agent_id']) if data.get('agent_id') else None
+            except (TypeError, ValueError):
+                return {'error': 'account_id/agent_id inválido'}
+
+            teams: List[int] = []
+            if agent_id:
+                try:
+                    teams = await self.team_resolver(agent_id, account_id)
+                except Exception as e:
+                    logger.error(f"❌ Erro ao buscar times do agente {agent_id}: {e}")
+
+            if agent_id:
+                rooms = [sala_conta(account_id)] + [sala_time(account_id, team) for team in teams]
+                rooms.append(sala_agente(account_id, agent_id))
+            else:
+                # Sem agente não há como saber os times: receber todas as conversas da conta
+                logger.warning(f"⚠️ Painel {sid} sem agent_id: recebendo todas as conversas da conta "
+                               f"{account_id} (defina CHATWOOT_AGENT_ID no config.js ou ?agente=ID)")
+                rooms = [sala_conta_inteira(account_id)]
+            for room in rooms:
+                await self.sio.enter_room(sid, room)
+                try:
+                    await self.presence.join(sid, room)
+                except Exception as e:
+                    logger.error(f"❌ Erro ao registrar presença de {sid}: {e}")
+
+            logger.info(f"🧑‍💼 Painel {sid}: conta {account_id}, agente {agent_id}, times {teams}")
+            return {'account_id': account_id, 'agent_id': agent_id, 'teams': teams}
+
         @self.sio.event
         async def join_conversation(sid, data):
             """Cliente entrou em uma conversa"""
             conversation_id = str(data.get('conversation_id'))
             if not conversation_id:
                 return
-            
+
             # Adicionar à sala da conversa
             room = f"conversation_{conversation_id}"
             await self.sio.enter_room(sid, room)
-            
+
             # Registrar sala do usuário
-            if sid not in self.user_rooms:
-                self.user_rooms[sid] = set()
-            self.user_rooms[sid].add(room)
-            
+            try:
+                await self.presence.join(sid, room)
+            except Exception as e:
+                logger.error(f"❌ Erro ao registrar presença de {sid}: {e}")
+
             logger.info(f"👥 Cliente {sid} entrou na conversa {conversation_id}")
-        
+
         @self.sio.event
         async def leave_conversation(sid, data):
             """Cliente saiu de uma conversa"""
             conversation_id = str(data.get('conversation_id'))
             if not conversation_id:
                 return
-            
+
             # Remover da sala
             room = f"conversation_{conversation_id}"
             await self.sio.leave_room(sid, room)
-            
+
             # Atualizar registro
-            if sid in self.user_rooms:
-                self.user_rooms[sid].discard(room)
-            
+            try:
+                await self.presence.leave(sid, room)
+            except Exception as e:
+                logger.error(f"❌ Erro ao atualizar presença de {sid}: {e}")
+
             logger.info(f"👋 Cliente {sid} saiu da conversa {conversation_id}")
-    
+
+    async def conversation_members(self, conversation_id: int) -> List[str]:
+        """Clientes (de todas as réplicas) na sala da conversa"""
+        return await self.presence.members(f"conversation_{conversation_id}")
+
     async def emit_new_message(self, conversation_id: int, message: dict):
         """Emitir nova mensagem para todos na conversa"""
         room = f"conversation_{conversation_id}"
@@ -85,14 +398,72 @@ class WebSocketManager:
             'message': message
         }, room=room)
         logger.info(f"📨 Nova mensagem emitida para conversa {conversation_id}")
-    
+
+    async def emit_message_transcription(self, conversation_id: int, message_id: int, text: str):
+        """Emitir transcrição de um áudio recebido"""
+        room = f"conversation_{conversation_id}"
+        await self.sio.emit('message_transcription', {
+            'conversation_id': conversation_id,
+            'message_id': message_id,
+            'text': text
+        }, room=room)
+        logger.info(f"📝 Transcrição emitida para conversa {conversation_id}")
+
+    async def _times_do_agente(self, agent_id: int, account_id: int) -> List[int]:
+        """chatwoot_team_id dos times do agente (cache de 60s)"""
+        key = (account_id, agent_id)
+        teams = self._times_cache.get(key)
+        if teams is not None:
+            return teams
+        from .chamados_service import chamados_service
+        if chamados_service.pool is None:
+            return []
+        async with chamados_service.pool.acquire() as conn:
+            rows = await conn.fetch(TIMES_DO_AGENTE_SQL, agent_id, account_id)
+        teams = sorted(row["chatwoot_team_id"] for row in rows)
+        self._times_cache.set(key, teams)
+        return teams
+
     async def emit_conversation_update(self, conversation: dict):
-        """Emitir atualização de conversa para todos"""
-        await self.sio.emit('conversation_update', {
-            'conversation': conversation
-        })
-        logger.info(f"📝 Atualização de conversa emitida: {conversation.get('id')}")
-    
+        """Emitir atualização de conversa para os técnicos que a veem (agrupando rajadas)"""
+        self.updates_received += 1
+        key = conversation.get('id')
+        if not self.coalesce_window or key is None:
+            await self._emitir_atualizacao(conversation)
+            return
+        if key in self._janelas:
+            # Janela aberta: guardar só o estado mais recente
+            if self._janelas[key] is not None:
+                self.updates_coalesced += 1
+            self._janelas[key] = conversation
+            return
+        self._janelas[key] = None
+        await self._emitir_atualizacao(conversation)
+        asyncio.get_running_loop().call_later(self.coalesce_window, self._fechar_janela, key)
+
+    def _fechar_janela(self, key):
+        pendente = self._janelas.pop(key, None)
+        if pendente is not None:
+            # Reabrir a janela para o envio atrasado e o que vier depois dele
+            self._janelas[key] = None
+            asyncio.get_running_loop().call_later(self.coalesce_window, self._fechar_janela, key)
+            task = asyncio.create_task(self._emitir_atualizacao(pendente))
+            self._envios.add(task)
+            task.add_done_callback(self._envios.discard)
+
+    async def _emitir_atualizacao(self, conversation: dict):
+        default_account = int(os.getenv("CHATWOOT_ACCOUNT_ID", "1"))
+        rooms = salas_da_conversa(conversation, default_account)
+        try:
+            await self.sio.emit('conversation_update', {
+                'conversation': conversation
+            }, room=rooms)
+            self.updates_emitted += 1
+        except Exception as e:
+            logger.error(f"❌ Erro ao emitir atualização da conversa {conversation.get('id')}: {e}")
+            return
+        logger.info(f"📝 Atualização de conversa emitida: {conversation.get('id')} -> {rooms}")
+
     async def emit_typing_status(self, conversation_id: int, user: dict, is_typing: bool):
         """Emitir status de digitação"""
         room = f"conversation_{conversation_id}"
@@ -103,8 +474,23 @@ class WebSocketManager:
         }, room=room)
         logger.info(f"⌨️ Status de digitação emitido para conversa {conversation_id}")
 
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "presence": self.presence.get_stats(),
+            "conversation_updates": {
+                "received": self.updates_received,
+                "coalesced": self.updates_coalesced,
+                "emitted": self.updates_emitted,
+                "pending": sum(1 for pendente in self._janelas.values() if pendente is not None),
+                "coalesce_window_ms": int(self.coalesce_window * 1000),
+            },
+            "team_cache": self._times_cache.get_stats(),
+        }
+
 # Criar instância global
 ws_manager = WebSocketManager()
 
-# Criar aplicativo ASGI
-app = socketio.ASGIApp(ws_manager.sio)
\ No newline at end of file
+# Criar aplicativo ASGI (on_startup/on_shutdown valem quando servido sozinho;
+# montado no FastAPI, main.py chama start()/stop())
+app = socketio.ASGIApp(ws_manager.sio, on_startup=ws_manager.start, on_shutdown=ws_manager.stop)
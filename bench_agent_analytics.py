@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos analytics do AI Builder: agregação sobre agent_interactions vs rollups
+
+Mede get_agent_analytics e get_agent_performance_metrics (que leem os rollups da
+migration 013) contra as consultas antigas sobre agent_interactions, para os
+agentes criados por seed_agent_interactions.py, e confere que os totais batem.
+Falha se o p99 dos rollups passar de --limite-ms (padrão 50).
+
+Uso:
+    python seed_agent_interactions.py --interacoes 2000000
+    python bench_agent_analytics.py [--repeticoes 50] [--dias 30] [--sem-bruto]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.chamados_service import chamados_service  # noqa: E402
+from backend.ai_builder_service import ai_builder_service  # noqa: E402
+from seed_agent_interactions import PREFIXO_AGENTE  # noqa: E402
+
+# Consultas anteriores (agregação direta, parametrizadas para comparar só o custo do plano)
+BRUTO_ANALYTICS = [
+    """
+    SELECT COUNT(*), AVG(response_time), COUNT(CASE WHEN success THEN 1 END),
+           COUNT(CASE WHEN NOT success THEN 1 END), AVG(tokens_used), SUM(cost)
+    FROM agent_interactions WHERE agent_id = $1 AND created_at >= NOW() - make_interval(days => $2)
+    """,
+    """
+    SELECT category, COUNT(*) FROM agent_interactions
+    WHERE agent_id = $1 AND created_at >= NOW() - make_interval(days => $2)
+    GROUP BY category
+    """,
+    """
+    SELECT DATE(created_at), COUNT(*), AVG(response_time), COUNT(CASE WHEN success THEN 1 END)
+    FROM agent_interactions WHERE agent_id = $1 AND created_at >= NOW() - make_interval(days => $2)
+    GROUP BY DATE(created_at)
+    """,
+]
+BRUTO_PERFORMANCE = [
+    """
+    SELECT COUNT(*), AVG(response_time), MIN(response_time), MAX(response_time),
+           COUNT(CASE WHEN success THEN 1 END), COUNT(CASE WHEN NOT success THEN 1 END),
+           AVG(tokens_used), SUM(cost)
+    FROM agent_interactions WHERE agent_id = $1
+    """,
+    """
+    SELECT EXTRACT(HOUR FROM created_at), COUNT(*), AVG(response_time)
+    FROM agent_interactions WHERE agent_id = $1 GROUP BY 1
+    """,
+    """
+    SELECT user_message, COUNT(*) AS frequency FROM agent_interactions
+    WHERE agent_id = $1 GROUP BY user_message ORDER BY frequency DESC LIMIT 10
+    """,
+]
+
+
+def resumo(tempos: list) -> str:
+    tempos = sorted(tempos)
+    p99 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.99))]
+    return f"p50={statistics.median(tempos):8.2f}ms  p99={p99:8.2f}ms"
+
+
+async def medir(func, repeticoes: int) -> list:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        await func()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return tempos
+
+
+async def bruto(sqls: list, *args):
+    async with chamados_service.pool.acquire() as conn:
+        for sql in sqls:
+            await conn.fetch(sql, *args)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos analytics do AI Builder")
+    parser.add_argument("--repeticoes", type=int, default=50)
+    parser.add_argument("--dias", type=int, default=30)
+    parser.add_argument("--limite-ms", type=float, default=50.0)
+    parser.add_argument("--sem-bruto", action="store_true", help="não medir as consultas antigas")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        print("❌ DATABASE_URL não configurada!")
+        return False
+
+    await chamados_service.init_db()
+    ok = True
+    try:
+        async with chamados_service.pool.acquire() as conn:
+            agentes = await conn.fetch("""
+                SELECT c.id, COUNT(i.id) AS interacoes
+                FROM config_ia c JOIN agent_interactions i ON i.agent_id = c.id
+                WHERE c.nome LIKE $1
+                GROUP BY c.id ORDER BY c.id
+            """, PREFIXO_AGENTE + "%")
+        if not agentes:
+            print("❌ Nenhum agente de teste; rode seed_agent_interactions.py antes")
+            return False
+
+        for agente in agentes:
+            agent_id = agente["id"]
+            print(f"\n🤖 Agente {agent_id}: {agente['interacoes']:,} interações")
+
+            performance = await ai_builder_service.get_agent_performance_metrics(agent_id)
+            total = performance["metrics"]["general"]["total_requests"]
+            if total != agente["interacoes"]:
+                print(f"   ❌ total dos rollups ({total}) difere da tabela ({agente['interacoes']})")
+                ok = False
+
+            rollup_analytics = await medir(
+                lambda: ai_builder_service.get_agent_analytics(agent_id, args.dias), args.repeticoes
+            )
+            rollup_performance = await medir(
+                lambda: ai_builder_service.get_agent_performance_metrics(agent_id), args.repeticoes
+            )
+            print(f"   📊 analytics ({args.dias}d)  rollups: {resumo(rollup_analytics)}")
+            print(f"   📊 performance      rollups: {resumo(rollup_performance)}")
+
+            if not args.sem_bruto:
+                repeticoes = max(3, args.repeticoes // 10)
+                bruto_analytics = await medir(lambda: bruto(BRUTO_ANALYTICS, agent_id, args.dias), repeticoes)
+                bruto_performance = await medir(lambda: bruto(BRUTO_PERFORMANCE, agent_id), repeticoes)
+                print(f"   🐢 analytics ({args.dias}d)  bruto:   {resumo(bruto_analytics)}")
+                print(f"   🐢 performance      bruto:   {resumo(bruto_performance)}")
+
+            for nome, tempos in (("analytics", rollup_analytics), ("performance", rollup_performance)):
+                p99 = sorted(tempos)[min(len(tempos) - 1, int(len(tempos) * 0.99))]
+                if p99 > args.limite_ms:
+                    print(f"   ❌ {nome}: p99 {p99:.1f}ms acima de {args.limite_ms}ms")
+                    ok = False
+
+        print("\n✅ Rollups dentro do limite" if ok else "\n❌ Benchmark falhou")
+    finally:
+        await chamados_service.close()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
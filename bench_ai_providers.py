@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark do atraso do event loop durante chamadas de IA
+
+Sobe um servidor LLM falso local (compatível com /v1/chat/completions da OpenAI)
+que demora STUB_DELAY_MS para responder e dispara N completions simultâneas:
+
+- antes: cliente síncrono (openai.OpenAI) chamado dentro de async def
+- depois: OpenAIProvider (AsyncOpenAI + semáforo + prazo)
+
+Enquanto isso um ticker mede o atraso do event loop (quanto um sleep de 10ms atrasa).
+
+Uso:
+    python bench_ai_providers.py [--completions 50] [--stub-delay-ms 300]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "stub",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Olá!"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class StubLLM:
+    """Servidor HTTP mínimo que responde completions após um atraso fixo
+
+    Roda em uma thread com event loop próprio, para continuar respondendo
+    mesmo quando o loop medido está bloqueado pelo cliente síncrono.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        self._ready = threading.Event()
+
+    def start(self) -> int:
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+        return self.port
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.decode().split("\r\n")[1:]:
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                await asyncio.sleep(self.delay)
+                data = json.dumps(COMPLETION).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.01) -> list:
+    """Atraso (ms) de cada tick do event loop em relação ao intervalo esperado"""
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, (time.perf_counter() - start - interval) * 1000))
+    return lags
+
+
+async def run(name: str, completions: int, call) -> None:
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(call(i) for i in range(completions)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lags = sorted(await ticker)
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0
+    ok = sum(1 for r in results if r)
+    print(
+        f"{name:<32} total={elapsed:6.2f}s  ok={ok}/{completions}  "
+        f"lag p50={statistics.median(lags) if lags else 0:7.2f}ms  p99={p99:7.2f}ms  max={lags[-1] if lags else 0:7.2f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--completions", type=int, default=50)
+    parser.add_argument("--stub-delay-ms", type=float, default=300.0)
+    parser.add_argument("--max-concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    stub = StubLLM(args.stub_delay_ms / 1000)
+    port = stub.start()
+    base_url = f"http://127.0.0.1:{port}/v1"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_MAX_CONCURRENCY"] = str(args.max_concurrency)
+
+    print(f"🔧 LLM falso em {base_url} (delay={args.stub_delay_ms}ms)")
+    print(f"📊 {args.completions} completions simultâneas\n")
+
+    messages = [{"role": "user", "content": "Olá"}]
+
+    # Antes: SDK síncrono dentro de async def (bloqueia o event loop)
+    from openai import OpenAI
+    sync_client = OpenAI(api_key="bench", base_url=base_url)
+
+    async def sync_call(i: int):
+        response = sync_client.chat.completions.create(model="stub", messages=messages)
+        return response.choices[0].message.content
+
+    await sync_call(-1)  # aquecimento (conexão e inicialização do cliente)
+    await run("antes (SDK síncrono)", args.completions, sync_call)
+
+    # Depois: provedor assíncrono
+    from backend.ai_providers import OpenAIProvider
+    provider = OpenAIProvider("bench")
+
+    async def async_call(i: int):
+        return await provider.generate_response(messages, model="stub")
+
+    await async_call(-1)  # aquecimento (conexão e inicialização do cliente)
+    await run("depois (OpenAIProvider async)", args.completions, async_call)
+    print(f"\n📈 {OpenAIProvider.get_stats()}")
+
+    sync_client.close()
+    await provider.client.close()
+    await asyncio.sleep(0.1)
+    stub.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
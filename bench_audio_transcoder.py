@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark da conversão de áudio (webm -> MP3) das mensagens de voz
+
+Gera um corpus sintético de WebM/Opus (voz simulada: tons + ruído, como o
+MediaRecorder do painel) com as durações de --duracoes e dispara --pedidos
+pedidos chegando ao mesmo tempo para cada nível de --concorrencia, em dois modos:
+
+    bloqueante: comportamento anterior (subprocess.run + arquivos temporários no event loop)
+    pool:       audio_transcoder.to_mp3 (pipes, asyncio e --pool conversões por vez,
+                padrão a cota de CPU)
+
+Mede latência p50/p99 por pedido, vazão, pedidos recusados (fila cheia) e o atraso
+máximo do event loop (um timer de 10ms rodando em paralelo às conversões).
+
+Uso:
+    python bench_audio_transcoder.py [--duracoes 5,30,120,600] [--concorrencia 1,4,16] [--pedidos 16] [--pool N]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.audio_transcoder import AudioTranscoder, TranscoderBusy, WHATSAPP_MAX_BYTES  # noqa: E402
+
+FFMPEG = os.getenv("FFMPEG_PATH", "ffmpeg")
+
+
+def gerar_webm(duracao: int) -> bytes:
+    """WebM/Opus mono 48kHz com tons e ruído (evita o Opus comprimir silêncio)"""
+    return subprocess.run([
+        FFMPEG, "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"sine=frequency=220:duration={duracao}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.2:duration={duracao}",
+        "-filter_complex", "amix=inputs=2",
+        "-ac", "1", "-ar", "48000", "-c:a", "libopus", "-b:a", "32k",
+        "-f", "webm", "pipe:1",
+    ], check=True, stdout=subprocess.PIPE).stdout
+
+
+def converter_bloqueante(data: bytes) -> bytes:
+    """Conversão como era feita antes em send_voice_message"""
+    with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as temp_input:
+        temp_input.write(data)
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_output:
+        temp_output_path = temp_output.name
+    try:
+        subprocess.run([
+            FFMPEG, "-y", "-i", temp_input.name,
+            "-c:a", "libmp3lame", "-b:a", "32k", "-ar", "16000", "-ac", "1", "-q:a", "9",
+            "-af", "highpass=f=80,lowpass=f=8000",
+            temp_output_path,
+        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with open(temp_output_path, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(temp_input.name)
+        os.unlink(temp_output_path)
+
+
+def percentil(valores: list, p: float) -> float:
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+async def medir_atraso_loop(parar: asyncio.Event, atrasos: list):
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(0.01)
+        atrasos.append((time.perf_counter() - inicio - 0.01) * 1000)
+
+
+async def rodada(modo: str, audio: bytes, concorrencia: int, pedidos: int) -> dict:
+    transcoder = AudioTranscoder()
+    latencias, tamanhos, recusados = [], [], 0
+
+    async def pedido():
+        nonlocal recusados
+        inicio = time.perf_counter()
+        try:
+            if modo == "bloqueante":
+                saida = converter_bloqueante(audio)
+            else:
+                saida = (await transcoder.to_mp3(audio)).data
+        except TranscoderBusy:
+            recusados += 1
+            return
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        tamanhos.append(len(saida))
+
+    parar, atrasos = asyncio.Event(), []
+    monitor = asyncio.create_task(medir_atraso_loop(parar, atrasos))
+    await asyncio.sleep(0.05)
+    inicio = time.perf_counter()
+
+    # Lotes de pedidos chegando juntos, como vários técnicos enviando áudio ao mesmo tempo
+    for _ in range(max(1, pedidos // concorrencia)):
+        await asyncio.gather(*(pedido() for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+    parar.set()
+    await monitor
+
+    return {
+        "p50": statistics.median(latencias) if latencias else 0,
+        "p99": percentil(latencias, 0.99) if latencias else 0,
+        "vazao": len(latencias) / duracao,
+        "atraso_loop": max(atrasos) if atrasos else 0,
+        "recusados": recusados,
+        "maior_mp3": max(tamanhos) if tamanhos else 0,
+    }
+
+
+async def main(args):
+    try:
+        subprocess.run([FFMPEG, "-version"], check=True, stdout=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        print(f"❌ ffmpeg não encontrado ({FFMPEG}); defina FFMPEG_PATH")
+        return False
+
+    duracoes = [int(d) for d in args.duracoes.split(",")]
+    niveis = [int(c) for c in args.concorrencia.split(",")]
+    modos = ["pool"] if args.sem_bloqueante else ["bloqueante", "pool"]
+    ok = True
+
+    if args.pool:
+        os.environ["AUDIO_TRANSCODE_CONCURRENCY"] = str(args.pool)
+    pool = AudioTranscoder()
+    pool._configure()
+    print(f"🎛️ Pool: {pool.concurrency} conversão(ões) por vez, fila de {pool.max_queue}")
+    for duracao in duracoes:
+        audio = gerar_webm(duracao)
+        print(f"\n🎙️ {duracao}s de áudio: WebM com {len(audio) / 1024:.0f} KB")
+        print(f"{'modo':<11} {'conc.':>5} {'p50 ms':>9} {'p99 ms':>9} {'conv/s':>7} "
+              f"{'loop ms':>8} {'recus.':>6} {'MP3 KB':>7}")
+        pedidos = max(args.pedidos if duracao <= 120 else args.pedidos // 4, max(niveis))
+        for modo in modos:
+            for concorrencia in niveis:
+                r = await rodada(modo, audio, concorrencia, pedidos)
+                print(f"{modo:<11} {concorrencia:>5} {r['p50']:>9.0f} {r['p99']:>9.0f} {r['vazao']:>7.2f} "
+                      f"{r['atraso_loop']:>8.0f} {r['recusados']:>6} {r['maior_mp3'] / 1024:>7.0f}")
+                if r["maior_mp3"] > WHATSAPP_MAX_BYTES:
+                    print("   ❌ MP3 acima do limite do WhatsApp")
+                    ok = False
+                if modo == "pool" and r["atraso_loop"] > 100:
+                    print("   ⚠️ event loop atrasou mais de 100ms com o pool")
+
+    print("\n✅ Benchmark concluído" if ok else "\n❌ Benchmark com falhas")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark da conversão de áudio das mensagens de voz")
+    parser.add_argument("--duracoes", default="5,30,120,600", help="durações do corpus em segundos")
+    parser.add_argument("--concorrencia", default="1,4,16", help="conversões simultâneas por rodada")
+    parser.add_argument("--pedidos", type=int, default=16, help="pedidos por rodada (1/4 acima de 120s)")
+    parser.add_argument("--pool", type=int, default=0, help="conversões por vez no pool (0 = cota de CPU)")
+    parser.add_argument("--sem-bloqueante", action="store_true", help="medir só o pool")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(main(args)) else 1)
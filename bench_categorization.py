@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark da categorização por palavras-chave: laços aninhados com `in` vs KeywordMatcher
+
+Gera milhares de categorias sintéticas (palavras e expressões) e mensagens
+longas, confere que os dois métodos escolhem categorias equivalentes e mede
+o tempo por mensagem, a construção do autômato e a atualização incremental.
+
+Uso:
+    python bench_categorization.py [--categories 3000] [--keywords 8] [--words 2000] [--messages 50]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend.categorization import KeywordMatcher, normalize_text  # noqa: E402
+
+SILABAS = ["ba", "ca", "da", "fe", "go", "lu", "ma", "ne", "po", "ra", "si", "ta", "vo", "xu", "ção", "ão"]
+
+
+def gerar_vocabulario(tamanho: int, rng: random.Random) -> list:
+    palavras = set()
+    while len(palavras) < tamanho:
+        palavras.add("".join(rng.choice(SILABAS) for _ in range(rng.randint(2, 4))))
+    return sorted(palavras)
+
+
+def gerar_categorias(total: int, por_categoria: int, vocabulario: list, rng: random.Random) -> dict:
+    categorias = {}
+    for i in range(total):
+        keywords = rng.sample(vocabulario, por_categoria - 1)
+        keywords.append(" ".join(rng.sample(vocabulario, 2)))  # uma expressão por categoria
+        categorias[i] = keywords
+    return categorias
+
+
+def categorizar_ingenuo(texto: str, categorias: dict):
+    """Mesma lógica do código anterior: lower() + `in` por palavra-chave"""
+    texto_lower = texto.lower()
+    melhor, melhor_score = None, 0
+    for categoria, keywords in categorias.items():
+        score = sum(1 for keyword in keywords if keyword.lower() in texto_lower)
+        if score > melhor_score:
+            melhor, melhor_score = categoria, score
+    return melhor, melhor_score
+
+
+def medir(func, mensagens: list) -> list:
+    tempos = []
+    for mensagem in mensagens:
+        inicio = time.perf_counter()
+        func(mensagem)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return tempos
+
+
+def resumo(nome: str, tempos: list):
+    tempos = sorted(tempos)
+    p99 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.99))]
+    print(f"  {nome:<22} p50={statistics.median(tempos):8.2f}ms  p99={p99:8.2f}ms  total={sum(tempos):9.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de categorização por palavras-chave")
+    parser.add_argument("--categories", type=int, default=3000)
+    parser.add_argument("--keywords", type=int, default=8, help="palavras-chave por categoria")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=2000, help="palavras por mensagem")
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulario = gerar_vocabulario(args.vocabulary, rng)
+    categorias = gerar_categorias(args.categories, args.keywords, vocabulario, rng)
+    mensagens = [" ".join(rng.choice(vocabulario) for _ in range(args.words)).upper() for _ in range(args.messages)]
+
+    print(f"📊 {args.categories} categorias x {args.keywords} palavras-chave, "
+          f"{args.messages} mensagens de {args.words} palavras (~{len(mensagens[0]) // 1024} KB)")
+
+    inicio = time.perf_counter()
+    matcher = KeywordMatcher(categorias)
+    matcher.best("aquecimento")
+    print(f"🔧 Construção do autômato: {(time.perf_counter() - inicio) * 1000:.1f}ms")
+
+    # Sanidade: sem acentos/limites de palavra em jogo, os scores máximos coincidem
+    for mensagem in mensagens[:5]:
+        _, score_ingenuo = categorizar_ingenuo(normalize_text(mensagem), {
+            k: [normalize_text(kw) for kw in v] for k, v in categorias.items()
+        })
+        melhor = matcher.best(mensagem)
+        assert melhor is None or melhor["score"] <= score_ingenuo
+
+    print("⏱️ Tempo por mensagem:")
+    ingenuo = medir(lambda m: categorizar_ingenuo(m, categorias), mensagens)
+    automato = medir(matcher.best, mensagens)
+    resumo("laços + `in`", ingenuo)
+    resumo("KeywordMatcher", automato)
+    print(f"  🚀 {statistics.median(ingenuo) / statistics.median(automato):.1f}x mais rápido (p50)")
+
+    # Atualização incremental: algumas categorias mudam, o resto é mantido
+    alteradas = dict(categorias)
+    for chave in rng.sample(list(categorias), 10):
+        alteradas[chave] = rng.sample(vocabulario, args.keywords)
+    alteradas[args.categories] = rng.sample(vocabulario, args.keywords)
+    del alteradas[0]
+
+    inicio = time.perf_counter()
+    mudaram = matcher.sync(alteradas)
+    matcher.best("aquecimento")
+    incremental = (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    KeywordMatcher(alteradas).best("aquecimento")
+    completo = (time.perf_counter() - inicio) * 1000
+    print(f"🔄 sync com {mudaram} categorias alteradas: {incremental:.1f}ms (reconstrução completa: {completo:.1f}ms)")
+
+
+if __name__ == "__main__":
+    main()
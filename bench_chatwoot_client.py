@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark do cliente Chatwoot: httpx.AsyncClient por chamada vs ChatwootClient compartilhado
+
+Sobe um Chatwoot falso local (HTTP/1.1 com keep-alive) que atrasa cada nova
+conexão em CONNECT_DELAY_MS para simular o handshake TCP+TLS com o servidor
+remoto, e mede p50/p99 de envio de mensagens nos dois modos.
+
+Uso:
+    python bench_chatwoot_client.py [--requests 500] [--concurrency 20] [--connect-delay-ms 40]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend.chatwoot_client import ChatwootClient  # noqa: E402
+
+TOKEN = "bench-token"
+
+
+class FakeChatwoot:
+    """Servidor HTTP mínimo que imita POST/GET de mensagens do Chatwoot"""
+
+    def __init__(self, connect_delay: float, response_delay: float):
+        self.connect_delay = connect_delay
+        self.response_delay = response_delay
+        self.connections = 0
+        self.requests = 0
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        await asyncio.sleep(self.connect_delay)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode().split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0"))
+                if length:
+                    await reader.readexactly(length)
+
+                self.requests += 1
+                await asyncio.sleep(self.response_delay)
+
+                if method == "GET":
+                    body = {"payload": [{"id": 1, "content": "Olá", "message_type": 0}]}
+                else:
+                    body = {"id": self.requests, "content": "ok", "message_type": 1}
+                data = json.dumps(body).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+async def run(total: int, concurrency: int, call) -> list:
+    """Executar `total` chamadas com `concurrency` simultâneas e retornar latências (ms)"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies
+
+
+def summary(name: str, latencies: list, connections: int) -> str:
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return (
+        f"{name:<28} p50={statistics.median(ordered):7.2f}ms  p99={p99:7.2f}ms  "
+        f"conexões={connections}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--connect-delay-ms", type=float, default=40.0)
+    parser.add_argument("--response-delay-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    fake = FakeChatwoot(args.connect_delay_ms / 1000, args.response_delay_ms / 1000)
+    port = await fake.start()
+    base_url = f"http://127.0.0.1:{port}"
+    url = f"{base_url}/api/v1/accounts/1/conversations/1/messages"
+
+    print(f"🔧 Chatwoot falso em {base_url} (connect_delay={args.connect_delay_ms}ms, "
+          f"response_delay={args.response_delay_ms}ms)")
+    print(f"📊 {args.requests} requisições, concorrência {args.concurrency}\n")
+
+    # Antes: um httpx.AsyncClient por chamada (padrão anterior em main.py)
+    async def per_call(i: int):
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                url, json={"content": f"msg {i}", "message_type": "outgoing"},
+                headers={"api_access_token": TOKEN},
+            )
+            response.raise_for_status()
+
+    fake.connections = 0
+    before = await run(args.requests, args.concurrency, per_call)
+    print(summary("antes (cliente por chamada)", before, fake.connections))
+
+    # Depois: ChatwootClient compartilhado
+    chatwoot = ChatwootClient(base_url=base_url, api_token=TOKEN, account_id=1)
+    await chatwoot.start()
+
+    async def shared(i: int):
+        await chatwoot.send_message(1, f"msg {i}")
+
+    fake.connections = 0
+    after = await run(args.requests, args.concurrency, shared)
+    print(summary("depois (ChatwootClient)", after, fake.connections))
+
+    await chatwoot.close()
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmark do agrupamento de mensagens por conversa antes da IA (backend.message_debouncer)
+
+Reproduz um log de tráfego (JSONL com conversation_id, t em segundos e content) em dois
+modos, com um LLM simulado (--llm-ms de latência):
+
+    imediato:  comportamento anterior, uma chamada ao LLM e uma resposta por mensagem
+    agrupado:  MessageDebouncer (silêncio --quiet-ms, espera máxima --max-wait-ms)
+
+Sem --log, gera um tráfego sintético de WhatsApp: rajadas de 1 a 5 mensagens curtas
+com intervalos de ~2s, e às vezes uma mensagem de resposta ~20s depois. --salvar grava o
+log gerado para reprodução posterior. --escala acelera o relógio (tempos reportados em
+segundos reais do log).
+
+Uso:
+    python bench_message_debounce.py [--log trafego.jsonl] [--conversas 200] [--escala 20]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.message_debouncer import MessageDebouncer  # noqa: E402
+
+FRASES = ["oi", "bom dia", "boa tarde", "tudo bem?", "preciso de ajuda", "tem um buraco na minha rua",
+          "a luz do poste queimou", "rua das flores 120", "perto da escola", "faz uma semana",
+          "ninguém veio ainda", "obrigado", "meu nome é maria", "cpf 123", "sim", "isso mesmo"]
+
+
+def gerar_trafego(conversas: int, janela: float, semente: int) -> list:
+    rnd = random.Random(semente)
+    eventos = []
+    for conversa in range(1, conversas + 1):
+        t = rnd.uniform(0, janela)
+        for _ in range(rnd.choice([1, 1, 2, 2, 3])):
+            tamanho = rnd.choices([1, 2, 3, 4, 5], weights=[40, 25, 20, 10, 5])[0]
+            for _ in range(tamanho):
+                eventos.append({"conversation_id": conversa, "t": round(t, 3), "content": rnd.choice(FRASES)})
+                t += min(6.0, max(0.3, rnd.expovariate(1 / 2.0)))
+            t += rnd.uniform(15, 40)  # cidadão lê a resposta e responde
+    return sorted(eventos, key=lambda e: e["t"])
+
+
+def contar_rajadas(eventos: list, quiet: float) -> int:
+    ultimo = {}
+    rajadas = 0
+    for e in eventos:
+        anterior = ultimo.get(e["conversation_id"])
+        if anterior is None or e["t"] - anterior > quiet:
+            rajadas += 1
+        ultimo[e["conversation_id"]] = e["t"]
+    return rajadas
+
+
+def percentil(valores: list, p: float) -> float:
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] if valores else 0.0
+
+
+async def reproduzir(modo: str, eventos: list, args) -> dict:
+    escala = args.escala
+    llm = {"iniciadas": 0, "concluidas": 0, "canceladas": 0}
+    respostas = defaultdict(list)       # conversa -> [(índice da última mensagem coberta, hora)]
+    chegadas = defaultdict(list)        # conversa -> horas de chegada (relógio real)
+    latencias = []
+    inicio = time.monotonic()
+    rnd = random.Random(args.semente)
+
+    def agora() -> float:
+        return (time.monotonic() - inicio) * escala
+
+    async def gerar(conversa, texto, contexto):
+        llm["iniciadas"] += 1
+        try:
+            await asyncio.sleep(args.llm_ms / 1000 * rnd.uniform(0.6, 1.4) / escala)
+        except asyncio.CancelledError:
+            llm["canceladas"] += 1
+            raise
+        llm["concluidas"] += 1
+        return f"resposta para {texto!r}"
+
+    async def entregar(conversa, resposta, contexto):
+        indice = contexto["indice"]
+        respostas[conversa].append((indice, agora()))
+        latencias.append(agora() - chegadas[conversa][indice])
+
+    debouncer = None
+    tarefas = []
+    if modo == "agrupado":
+        os.environ["MESSAGE_DEBOUNCE_QUIET_MS"] = str(args.quiet_ms / escala)
+        os.environ["MESSAGE_DEBOUNCE_MAX_WAIT_MS"] = str(args.max_wait_ms / escala)
+        debouncer = MessageDebouncer()
+        await debouncer.start(gerar, entregar)
+
+    async def imediato(conversa, texto, contexto):
+        resposta = await gerar(conversa, texto, contexto)
+        await entregar(conversa, resposta, contexto)
+
+    for evento in eventos:
+        espera = evento["t"] / escala - (time.monotonic() - inicio)
+        if espera > 0:
+            await asyncio.sleep(espera)
+        conversa = evento["conversation_id"]
+        chegadas[conversa].append(agora())
+        contexto = {"indice": len(chegadas[conversa]) - 1}
+        if debouncer:
+            await debouncer.submit(conversa, evento["content"], contexto)
+        else:
+            tarefas.append(asyncio.create_task(imediato(conversa, evento["content"], contexto)))
+
+    # Esperar os últimos turnos
+    if tarefas:
+        await asyncio.gather(*tarefas)
+    limite = time.monotonic() + (args.max_wait_ms + args.llm_ms * 3) / 1000 / escala + 1
+    while debouncer and debouncer.get_stats()["open_conversations"] and time.monotonic() < limite:
+        await asyncio.sleep(0.01)
+    if debouncer:
+        await debouncer.stop()
+
+    fora_de_ordem = sum(
+        1 for lista in respostas.values()
+        for anterior, atual in zip(lista, lista[1:]) if atual[0] < anterior[0]
+    )
+    sem_resposta = sum(
+        1 for conversa, horas in chegadas.items()
+        if not respostas[conversa] or max(i for i, _ in respostas[conversa]) != len(horas) - 1
+    )
+    return {
+        "modo": modo,
+        "llm_iniciadas": llm["iniciadas"],
+        "llm_concluidas": llm["concluidas"],
+        "llm_canceladas": llm["canceladas"],
+        "respostas": sum(len(lista) for lista in respostas.values()),
+        "fora_de_ordem": fora_de_ordem,
+        "sem_resposta": sem_resposta,
+        "latencia_p50": statistics.median(latencias) if latencias else 0.0,
+        "latencia_p95": percentil(latencias, 0.95),
+    }
+
+
+async def main(args):
+    if args.log:
+        with open(args.log) as f:
+            eventos = sorted((json.loads(linha) for linha in f if linha.strip()), key=lambda e: e["t"])
+        print(f"📜 Log {args.log}: {len(eventos)} mensagens")
+    else:
+        eventos = gerar_trafego(args.conversas, args.janela, args.semente)
+        print(f"🎲 Tráfego sintético: {len(eventos)} mensagens em {args.conversas} conversas")
+        if args.salvar:
+            with open(args.salvar, "w") as f:
+                for evento in eventos:
+                    f.write(json.dumps(evento, ensure_ascii=False) + "\n")
+            print(f"💾 Log salvo em {args.salvar}")
+
+    conversas = len({e["conversation_id"] for e in eventos})
+    rajadas = contar_rajadas(eventos, args.quiet_ms / 1000)
+    duracao = eventos[-1]["t"] if eventos else 0
+    print(f"   {conversas} conversas, {rajadas} rajadas (intervalo <= {args.quiet_ms}ms), "
+          f"{duracao:.0f}s de tráfego a {args.escala:g}x")
+
+    resultados = []
+    for modo in ("imediato", "agrupado"):
+        resultados.append(await reproduzir(modo, eventos, args))
+
+    print(f"\n{'modo':<9} {'LLM':>6} {'concl.':>6} {'cancel.':>7} {'respostas':>9} {'fora ordem':>10} "
+          f"{'sem resp.':>9} {'lat. p50':>8} {'lat. p95':>8}")
+    for r in resultados:
+        print(f"{r['modo']:<9} {r['llm_iniciadas']:>6} {r['llm_concluidas']:>6} {r['llm_canceladas']:>7} "
+              f"{r['respostas']:>9} {r['fora_de_ordem']:>10} {r['sem_resposta']:>9} "
+              f"{r['latencia_p50']:>7.1f}s {r['latencia_p95']:>7.1f}s")
+
+    imediato, agrupado = resultados
+    if agrupado["llm_concluidas"]:
+        reducao = 1 - agrupado["llm_concluidas"] / imediato["llm_concluidas"]
+        print(f"\n📉 Chamadas concluídas ao LLM: -{reducao:.0%} "
+              f"({imediato['llm_concluidas']} -> {agrupado['llm_concluidas']}), "
+              f"respostas por rajada {imediato['respostas'] / rajadas:.2f} -> {agrupado['respostas'] / rajadas:.2f}")
+    ok = agrupado["sem_resposta"] == 0 and agrupado["fora_de_ordem"] == 0
+    print("✅ Benchmark concluído" if ok else "❌ Agrupamento deixou mensagens sem resposta ou fora de ordem")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do agrupamento de mensagens por conversa")
+    parser.add_argument("--log", help="JSONL com conversation_id, t (segundos) e content")
+    parser.add_argument("--conversas", type=int, default=200)
+    parser.add_argument("--janela", type=float, default=300, help="segundos em que as conversas começam")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--salvar", help="gravar o tráfego sintético neste arquivo")
+    parser.add_argument("--quiet-ms", type=float, default=2500)
+    parser.add_argument("--max-wait-ms", type=float, default=8000)
+    parser.add_argument("--llm-ms", type=float, default=1500, help="latência média do LLM simulado")
+    parser.add_argument("--escala", type=float, default=20, help="aceleração do relógio")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(main(args)) else 1)
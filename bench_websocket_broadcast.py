@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Benchmark das atualizações de conversa no WebSocket: broadcast vs salas por time
+
+Sobe o servidor Socket.IO (backend.websocket_manager) em um subprocesso e conecta
+--clientes técnicos simulados, cada um com join_panel num dos --times times. Depois
+dispara rajadas de atualizações (--conversas conversas, --repeticoes atualizações
+seguidas de cada uma) e mede o CPU do processo do servidor por atualização e por
+evento entregue, em dois modos:
+
+    broadcast: comportamento anterior (emit para todos, log de cada pacote)
+    salas:     emit_conversation_update (salas por time + agrupamento por conversa)
+
+Uso:
+    python bench_websocket_broadcast.py [--clientes 500] [--times 10] [--conversas 50] [--repeticoes 5]
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import logging
+import subprocess
+
+import socketio
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+ACCOUNT_ID = 1
+
+
+def servidor(porta: int, modo: str, times: int):
+    """Processo do servidor: ws_manager com times simulados e eventos de controle"""
+    import uvicorn
+    from backend.websocket_manager import ws_manager, app
+
+    async def times_simulados(agent_id: int, account_id: int):
+        return [agent_id % times + 1]
+
+    ws_manager.team_resolver = times_simulados
+    if modo == "broadcast":
+        os.environ["WEBSOCKET_LOG_PACKETS"] = "true"
+        os.environ["WEBSOCKET_COALESCE_MS"] = "0"
+        # Log de pacotes como antes (StreamHandler em stderr, descartado pelo benchmark)
+        for nome in ("socketio.server", "engineio.server"):
+            logging.getLogger(nome).addHandler(logging.StreamHandler())
+
+    @ws_manager.sio.on("bench_cpu")
+    async def bench_cpu(sid):
+        return {"cpu": time.process_time(), "emitidos": ws_manager.updates_emitted}
+
+    @ws_manager.sio.on("bench_burst")
+    async def bench_burst(sid, data):
+        # Rajada: várias atualizações seguidas da mesma conversa (status, atribuição, etiquetas...)
+        for conversa in range(1, data["conversas"] + 1):
+            for repeticao in range(data["repeticoes"]):
+                conversation = {
+                    "id": conversa,
+                    "account_id": ACCOUNT_ID,
+                    "status": "open",
+                    "unread_count": repeticao,
+                    "meta": {"team": {"id": conversa % times + 1}},
+                }
+                if modo == "broadcast":
+                    await ws_manager.sio.emit("conversation_update", {"conversation": conversation})
+                    ws_manager.updates_emitted += 1
+                else:
+                    await ws_manager.emit_conversation_update(conversation)
+        return True
+
+    uvicorn.run(app, host="127.0.0.1", port=porta, log_level="warning")
+
+
+class Tecnico:
+    def __init__(self, agent_id: int):
+        self.agent_id = agent_id
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.recebidos = 0
+        self.sio.on("conversation_update", self._atualizacao)
+
+    async def _atualizacao(self, data):
+        self.recebidos += 1
+
+    async def conectar(self, porta: int):
+        await self.sio.connect(f"http://127.0.0.1:{porta}", transports=["websocket"], wait_timeout=30)
+        await self.sio.call("join_panel", {"account_id": ACCOUNT_ID, "agent_id": self.agent_id}, timeout=30)
+
+
+async def esperar_porta(porta: int, timeout: float = 15.0) -> bool:
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", porta), timeout=0.5):
+                return True
+        except OSError:
+            await asyncio.sleep(0.2)
+    return False
+
+
+async def medir(modo: str, args) -> dict:
+    porta = args.porta
+    processo = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--servidor", "--modo", modo,
+         "--porta", str(porta), "--times", str(args.times)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    tecnicos = [Tecnico(agent_id) for agent_id in range(1, args.clientes + 1)]
+    try:
+        if not await esperar_porta(porta):
+            raise RuntimeError(f"servidor ({modo}) não subiu na porta {porta}")
+        for inicio in range(0, len(tecnicos), 50):
+            await asyncio.gather(*(t.conectar(porta) for t in tecnicos[inicio:inicio + 50]))
+
+        controle = tecnicos[0].sio
+        antes = await controle.call("bench_cpu", timeout=30)
+        inicio = time.perf_counter()
+        await controle.call("bench_burst", {"conversas": args.conversas, "repeticoes": args.repeticoes}, timeout=120)
+
+        # Esperar as entregas pararem (inclui os envios atrasados do agrupamento)
+        ultimo, parado = -1, 0
+        while parado < 5:
+            await asyncio.sleep(0.1)
+            total = sum(t.recebidos for t in tecnicos)
+            parado = parado + 1 if total == ultimo else 0
+            ultimo = total
+        duracao = time.perf_counter() - inicio - 0.5
+        depois = await controle.call("bench_cpu", timeout=30)
+
+        atualizacoes = args.conversas * args.repeticoes
+        emitidos = depois["emitidos"] - antes["emitidos"]
+        cpu_ms = (depois["cpu"] - antes["cpu"]) * 1000
+        return {
+            "modo": modo,
+            "atualizacoes": atualizacoes,
+            "emitidos": emitidos,
+            "entregas": ultimo,
+            "cpu_ms": cpu_ms,
+            "cpu_ms_por_atualizacao": cpu_ms / atualizacoes,
+            "cpu_ms_por_evento": cpu_ms / max(emitidos, 1),
+            "cpu_us_por_entrega": cpu_ms * 1000 / max(ultimo, 1),
+            "duracao_s": duracao,
+        }
+    finally:
+        for tecnico in tecnicos:
+            if tecnico.sio.connected:
+                await tecnico.sio.disconnect()
+        processo.terminate()
+        processo.wait()
+
+
+async def main(args):
+    resultados = []
+    for modo in ("broadcast", "salas"):
+        print(f"⏳ {modo}: {args.clientes} técnicos, {args.times} times, "
+              f"{args.conversas}x{args.repeticoes} atualizações...")
+        resultados.append(await medir(modo, args))
+
+    print(f"\n{'modo':<10} {'atualiz.':>8} {'emitidos':>8} {'entregas':>9} {'CPU ms':>9} "
+          f"{'ms/atualiz.':>11} {'ms/evento':>10} {'µs/entrega':>10}")
+    for r in resultados:
+        print(f"{r['modo']:<10} {r['atualizacoes']:>8} {r['emitidos']:>8} {r['entregas']:>9} "
+              f"{r['cpu_ms']:>9.1f} {r['cpu_ms_por_atualizacao']:>11.2f} "
+              f"{r['cpu_ms_por_evento']:>10.2f} {r['cpu_us_por_entrega']:>10.1f}")
+
+    broadcast, salas = resultados
+    if salas["cpu_ms"]:
+        print(f"\n📉 CPU do servidor por atualização: {broadcast['cpu_ms_por_atualizacao'] / salas['cpu_ms_por_atualizacao']:.1f}x menor com salas")
+    esperado = salas["entregas"] <= broadcast["entregas"] and salas["emitidos"] <= broadcast["emitidos"]
+    print("✅ Benchmark concluído" if esperado else "❌ Salas entregaram mais que o broadcast")
+    return esperado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark das atualizações de conversa no WebSocket")
+    parser.add_argument("--clientes", type=int, default=500)
+    parser.add_argument("--times", type=int, default=10)
+    parser.add_argument("--conversas", type=int, default=50)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--porta", type=int, default=8721)
+    parser.add_argument("--servidor", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--modo", default="salas", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servidor:
+        servidor(args.porta, args.modo, args.times)
+        sys.exit(0)
+    sys.exit(0 if asyncio.run(main(args)) else 1)
@@ -7,6 +7,24 @@ const CHATWOOT_ACCOUNT_ID = CONFIG.CHATWOOT_ACCOUNT_ID;
 let currentConversation = null;
 let conversations = [];
 let socket = null;
+let reloadConversationsTimer = null;
+
+// Agente do Chatwoot deste painel (config.js, ?agente=ID ou o último usado)
+function getPanelAgentId() {
+    const fromUrl = new URLSearchParams(window.location.search).get('agente');
+    if (fromUrl) {
+        localStorage.setItem('cidadaoaiAgentId', fromUrl);
+        return Number(fromUrl);
+    }
+    const stored = CONFIG.CHATWOOT_AGENT_ID || localStorage.getItem('cidadaoaiAgentId');
+    return stored ? Number(stored) : null;
+}
+
+// Recarregar a lista uma vez por rajada de eventos
+function scheduleConversationsReload() {
+    clearTimeout(reloadConversationsTimer);
+    reloadConversationsTimer = setTimeout(loadConversations, 300);
+}
 
 // Elementos DOM
 const conversationsList = document.getElementById('conversationsList');
@@ -348,6 +366,14 @@ function setupWebSocket() {
     // Eventos do Socket.IO
     socket.on('connect', () => {
         console.log('✅ WebSocket conectado!');
+        // Entrar nas salas da conta/times/agente (também após reconectar)
+        socket.emit('join_panel', {
+            account_id: CHATWOOT_ACCOUNT_ID,
+            agent_id: getPanelAgentId()
+        }, (data) => console.log('🧑‍💼 Painel registrado:', data));
+        if (currentConversation) {
+            socket.emit('join_conversation', { conversation_id: currentConversation.id });
+        }
     });
     
     socket.on('disconnect', () => {
@@ -393,12 +419,19 @@ function setupWebSocket() {
         }
         
         // Atualizar lista de conversas
-        loadConversations();
+        scheduleConversationsReload();
     });
     
     socket.on('conversation_update', (data) => {
         console.log('📝 Atualização de conversa:', data);
-        loadConversations();
+        scheduleConversationsReload();
+    });
+    
+    socket.on('message_transcription', (data) => {
+        console.log('📝 Transcrição de áudio:', data);
+        if (currentConversation && data.conversation_id === currentConversation.id) {
+            showTranscription(data.message_id, data.text);
+        }
     });
     
     socket.on('typing_status', (data) => {
@@ -667,6 +700,9 @@ function createMessageElement(message) {
     const isAIAgent = message.content && message.content.startsWith('🤖');
     
     div.className = `mb-4 flex ${isUser ? 'justify-end' : 'justify-start'}`;
+    if (message.id) {
+        div.dataset.messageId = message.id;
+    }
     
     const time = message.timestamp.toLocaleTimeString('pt-BR', { 
         hour: '2-digit', 
@@ -701,7 +737,7 @@ function createMessageElement(message) {
         message.audio_url,                  // URL do nosso backend
         audioAttachment?.local_url,         // URL local processada
         audioAttachment?.data_url,          // URL direta do Chatwoot
-        `/media/audio/audio_${message.conversation_id}_${message.id}_*.ogg`  // Padrão do arquivo
+        `/media/audio/audio_${message.conversation_id}_${message.id}.ogg`  // Padrão do arquivo
     ].filter(Boolean);
     
     console.log('📝 Processando mensagem:', {
@@ -799,6 +835,19 @@ function createMessageElement(message) {
     return div;
 }
 
+function showTranscription(messageId, text) {
+    const element = messagesContainer.querySelector(`[data-message-id="${messageId}"] .message-bubble`);
+    if (!element || !text) return;
+    
+    let transcription = element.querySelector('.transcription');
+    if (!transcription) {
+        transcription = document.createElement('p');
+        transcription.className = 'transcription text-xs italic mt-2 opacity-80';
+        element.insertBefore(transcription, element.lastElementChild);
+    }
+    transcription.textContent = `📝 ${text}`;
+}
+
 async function sendMessage() {
     const content = messageText.value.trim();
     if (!content || !currentConversation) return;
@@ -1,5 +1,8 @@
 const CONFIG = {
     API_BASE_URL: 'https://tecnico.sisgov.app.br',
     CHATWOOT_API_URL: 'https://chat.sisgov.app.br',
-    CHATWOOT_ACCOUNT_ID: 1
+    CHATWOOT_ACCOUNT_ID: 1,
+    // ID do agente no Chatwoot (define os times cujas conversas o painel recebe);
+    // também pode vir de ?agente=ID na URL
+    CHATWOOT_AGENT_ID: null
 };
\ No newline at end of file
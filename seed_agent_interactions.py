@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Script para popular agent_interactions com milhões de interações sintéticas
+
+Cria agentes de teste em config_ia (nome "[bench] ...", inativos) e gera as
+interações no próprio banco com generate_series, em lotes; o trigger de rollup
+(migration 013) atualiza agent_interactions_hourly/daily e agent_query_stats a
+cada lote. Usado por bench_agent_analytics.py.
+
+Uso:
+    python seed_agent_interactions.py [--interacoes 2000000] [--agentes 3] [--dias 365] [--lote 200000]
+    python seed_agent_interactions.py --limpar
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import asyncpg
+from dotenv import load_dotenv
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+PREFIXO_AGENTE = "[bench]"
+CATEGORIAS = ["infraestrutura", "saude", "educacao", "assistencia_social", "geral"]
+PERGUNTAS = [
+    "Qual o horário do posto de saúde",
+    "Tem um buraco na minha rua",
+    "Como faço a matrícula na escola",
+    "Quero consultar meu protocolo",
+    "O poste da minha rua está apagado",
+    "Como recebo o auxílio",
+    "Falta remédio no posto",
+    "O ônibus escolar não passou",
+]
+
+INSERT_LOTE_SQL = """
+    INSERT INTO agent_interactions (
+        agent_id, user_message, ai_response, response_time, tokens_used, cost, success, category, created_at
+    )
+    SELECT
+        ($1::INT[])[1 + (g % array_length($1::INT[], 1))],
+        -- perguntas repetidas com variações de caixa/espaço e uma cauda longa de perguntas únicas
+        CASE WHEN g % 10 = 0
+             THEN 'pergunta rara ' || g
+             ELSE (CASE WHEN g % 3 = 0 THEN UPPER(p.texto) ELSE p.texto END) || '  ' || (g % 50)
+        END,
+        'Resposta automática',
+        round((0.2 + random() * 3)::NUMERIC, 3),
+        50 + (random() * 700)::INT,
+        round((random() * 0.01)::NUMERIC, 6),
+        random() > 0.05,
+        ($2::TEXT[])[1 + (g % array_length($2::TEXT[], 1))],
+        NOW() - random() * make_interval(days => $4::INT)
+    FROM generate_series($5::BIGINT, $5::BIGINT + $3::INT - 1) g
+    CROSS JOIN LATERAL (
+        SELECT ($6::TEXT[])[1 + (g % array_length($6::TEXT[], 1))] AS texto
+    ) p
+"""
+
+
+async def criar_agentes(conn, quantidade: int) -> list:
+    ids = await conn.fetch(
+        "SELECT id FROM config_ia WHERE nome LIKE $1 ORDER BY id", PREFIXO_AGENTE + "%"
+    )
+    ids = [row["id"] for row in ids]
+    for i in range(len(ids), quantidade):
+        ids.append(await conn.fetchval("""
+            INSERT INTO config_ia (prefeitura_id, nome, provider, config, active)
+            VALUES (1, $1, 'groq', '{"category": "geral"}', false)
+            RETURNING id
+        """, f"{PREFIXO_AGENTE} Agente {i + 1}"))
+    return ids[:quantidade]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Popular agent_interactions")
+    parser.add_argument("--interacoes", type=int, default=2_000_000)
+    parser.add_argument("--agentes", type=int, default=3)
+    parser.add_argument("--dias", type=int, default=365)
+    parser.add_argument("--lote", type=int, default=200_000)
+    parser.add_argument("--limpar", action="store_true", help="remover agentes de teste (e interações)")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ DATABASE_URL não configurada!")
+        return False
+
+    conn = await asyncpg.connect(database_url)
+    try:
+        if args.limpar:
+            removidos = await conn.execute("DELETE FROM config_ia WHERE nome LIKE $1", PREFIXO_AGENTE + "%")
+            print(f"🧹 {removidos}")
+            return True
+
+        agentes = await criar_agentes(conn, args.agentes)
+        print(f"🤖 Agentes de teste: {agentes}")
+
+        inicio = time.perf_counter()
+        base = await conn.fetchval("SELECT COALESCE(MAX(id), 0) + 1 FROM agent_interactions")
+        inseridas = 0
+        while inseridas < args.interacoes:
+            lote = min(args.lote, args.interacoes - inseridas)
+            await conn.execute(
+                INSERT_LOTE_SQL, agentes, CATEGORIAS, lote, args.dias, base + inseridas, PERGUNTAS
+            )
+            inseridas += lote
+            print(f"   ➕ {inseridas:,} interações ({time.perf_counter() - inicio:.0f}s)")
+
+        await conn.execute("ANALYZE agent_interactions, agent_interactions_hourly, "
+                           "agent_interactions_daily, agent_query_stats")
+        print(f"✅ {inseridas:,} interações em {time.perf_counter() - inicio:.1f}s")
+        return True
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
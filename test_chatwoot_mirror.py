@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Script para testar o espelho local do Chatwoot (backend.chatwoot_mirror)
+
+Gera webhooks de contatos, conversas (várias mudanças de status) e mensagens (algumas
+editadas), entregues fora de ordem e com repetições, e grava de duas formas:
+
+    linha a linha: um UPSERT por webhook, esperando o banco (como um handler síncrono)
+    em lote:       ChatwootMirror (buffer + COPY numa tabela temporária + UPSERT)
+
+Verifica que o estado final no banco é a versão mais nova de cada contato, conversa e
+mensagem, mesmo com as entregas fora de ordem, e compara tempo e idas ao banco. Confere
+também a leitura do histórico (conversation_messages): conversa anterior ao espelho fica
+para o Chatwoot, conversa nova é servida pelo espelho, em ordem e no formato da API. Requer
+DATABASE_URL com a migration 015. As linhas de teste (ids a partir de 9e12) são removidas.
+
+Uso:
+    python test_chatwoot_mirror.py [--conversas 300] [--mensagens 10] [--atraso 20]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime, timezone
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.chatwoot_mirror import (  # noqa: E402
+    ChatwootMirror, linha_contato, linha_conversa, linha_mensagem,
+)
+
+BASE_ID = 9_000_000_000_000
+INICIO = 1_760_000_000
+STATUS = ["open", "pending", "open", "resolved"]
+
+
+def gerar_webhooks(args, rnd: random.Random):
+    """Lista de (instante real, evento, payload) e o estado final esperado"""
+    eventos = []
+    esperado = {"chatwoot_contacts": {}, "chatwoot_conversations": {}, "chatwoot_messages": {}}
+    msg_id = BASE_ID
+    for c in range(args.conversas):
+        conversa_id = BASE_ID + c
+        contato_id = BASE_ID + c
+        t = INICIO + rnd.uniform(0, 3600)
+        for versao in range(rnd.randint(1, 2)):
+            contato = {"id": contato_id, "name": f"Cidadão {c} v{versao}", "phone_number": f"+55{c:011d}",
+                       "updated_at": datetime.fromtimestamp(t + versao * 30, timezone.utc).isoformat()}
+            eventos.append((t + versao * 30, "contact_updated", contato))
+            esperado["chatwoot_contacts"][contato_id] = contato["name"]
+        for k in range(rnd.randint(1, len(STATUS))):
+            quando = t + k * 15
+            conversa = {"id": conversa_id, "account": {"id": 1}, "inbox_id": 1, "status": STATUS[k],
+                        "meta": {"sender": {"id": contato_id}}, "created_at": int(t),
+                        "timestamp": int(quando), "updated_at": quando}
+            evento = "conversation_created" if k == 0 else "conversation_status_changed"
+            eventos.append((quando, evento, conversa))
+            esperado["chatwoot_conversations"][conversa_id] = STATUS[k]
+        for m in range(max(1, int(rnd.expovariate(1 / args.mensagens)))):
+            msg_id += 1
+            criada = int(t + m * 5)
+            mensagem = {"id": msg_id, "content": f"mensagem {m}", "message_type": "incoming",
+                        "created_at": criada, "conversation": {"id": conversa_id},
+                        "sender": {"id": contato_id, "type": "contact"}, "account": {"id": 1}}
+            eventos.append((criada, "message_created", mensagem))
+            esperado["chatwoot_messages"][msg_id] = mensagem["content"]
+            if rnd.random() < 0.2:
+                editada = dict(mensagem, content=f"mensagem {m} (editada)",
+                               updated_at=datetime.fromtimestamp(criada + 40, timezone.utc).isoformat())
+                eventos.append((criada + 40, "message_updated", editada))
+                esperado["chatwoot_messages"][msg_id] = editada["content"]
+
+    # Entrega: atraso aleatório (fora de ordem) e repetições do Chatwoot
+    entregas = [(quando + rnd.expovariate(1 / args.atraso), evento, payload) for quando, evento, payload in eventos]
+    entregas += [(quando + args.atraso * 2, evento, payload) for quando, evento, payload in eventos
+                 if rnd.random() < 0.05]
+    entregas.sort(key=lambda item: item[0])
+    return [(evento, payload) for _, evento, payload in entregas], esperado
+
+
+def fora_de_ordem(entregas) -> int:
+    """Conversas cuja última entrega não é a versão mais nova (último a chegar vence)"""
+    ultima, maior = {}, {}
+    for evento, payload in entregas:
+        if evento.startswith("conversation_"):
+            ultima[payload["id"]] = payload["updated_at"]
+            maior[payload["id"]] = max(maior.get(payload["id"], 0), payload["updated_at"])
+    return sum(1 for conversa_id in ultima if ultima[conversa_id] != maior[conversa_id])
+
+
+async def limpar(pool):
+    async with pool.acquire() as conn:
+        for tabela in ("chatwoot_contacts", "chatwoot_conversations", "chatwoot_messages"):
+            await conn.execute(f"DELETE FROM {tabela} WHERE id >= $1", BASE_ID)
+
+
+async def conferir(pool, esperado) -> int:
+    colunas = {"chatwoot_contacts": "name", "chatwoot_conversations": "status", "chatwoot_messages": "content"}
+    erros = 0
+    async with pool.acquire() as conn:
+        for tabela, coluna in colunas.items():
+            linhas = dict(await conn.fetch(f"SELECT id, {coluna} FROM {tabela} WHERE id >= $1", BASE_ID))
+            erros += sum(1 for id_, valor in esperado[tabela].items() if linhas.get(id_) != valor)
+    return erros
+
+
+async def conferir_leitura(mirror: ChatwootMirror, args) -> bool:
+    """Histórico pelo espelho só para conversas que começaram depois dele"""
+    antiga = await mirror.conversation_messages(BASE_ID)
+
+    nova_id = BASE_ID + args.conversas
+    agora = int(time.time()) + 1
+    await mirror.start()
+    await mirror.save_conversation({"id": nova_id, "status": "open", "created_at": agora, "updated_at": agora})
+    for m in range(3):
+        await mirror.save_message({"id": BASE_ID * 2 + m, "content": f"nova {m}", "message_type": "outgoing",
+                                   "created_at": agora + m, "attachments": [{"file_type": "image"}]},
+                                  {"id": nova_id})
+    await mirror.stop()
+    nova = await mirror.conversation_messages(nova_id) or []
+    recentes = await mirror.conversation_messages(nova_id, since=datetime.fromtimestamp(agora, timezone.utc))
+
+    print(f"📖 Leitura: conversa anterior ao espelho -> {'Chatwoot' if antiga is None else 'espelho'}, "
+          f"conversa nova -> {len(nova)} mensagem(ns) do espelho, {len(recentes or [])} após since")
+    ok = (antiga is None
+          and [msg["content"] for msg in nova] == ["nova 0", "nova 1", "nova 2"]
+          and all(msg["message_type"] == 1 and msg["created_at"] >= agora and msg["attachments"] for msg in nova)
+          and [msg["content"] for msg in recentes or []] == ["nova 1", "nova 2"])
+    if not ok:
+        print("❌ Leitura do histórico pelo espelho incorreta")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste do espelho local do Chatwoot")
+    parser.add_argument("--conversas", type=int, default=300)
+    parser.add_argument("--mensagens", type=int, default=10, help="média de mensagens por conversa")
+    parser.add_argument("--atraso", type=float, default=20, help="atraso médio de entrega (s)")
+    parser.add_argument("--semente", type=int, default=11)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        print("❌ DATABASE_URL não configurada!")
+        return False
+
+    rnd = random.Random(args.semente)
+    entregas, esperado = gerar_webhooks(args, rnd)
+    print(f"📨 {len(entregas)} webhooks ({len(esperado['chatwoot_conversations'])} conversas, "
+          f"{len(esperado['chatwoot_messages'])} mensagens), {fora_de_ordem(entregas)} conversa(s) "
+          f"em que a última entrega não é a versão mais nova")
+
+    os.environ.setdefault("CHATWOOT_MIRROR_SPILL_DIR", tempfile.mkdtemp(prefix="mirror-spill-"))
+    pool = await asyncpg.create_pool(os.getenv("DATABASE_URL"), min_size=1, max_size=4)
+    mirror = ChatwootMirror(pool_getter=lambda: pool)
+    ok = True
+    try:
+        await limpar(pool)
+
+        # Linha a linha: um UPSERT por webhook
+        escritores = {"contact": mirror.contacts, "conversation": mirror.conversations, "message": mirror.messages}
+        inicio = time.perf_counter()
+        async with pool.acquire() as conn:
+            for evento, payload in entregas:
+                tipo = evento.split("_")[0]
+                if tipo == "contact":
+                    linha = linha_contato(payload)
+                elif tipo == "conversation":
+                    linha = linha_conversa(payload)
+                else:
+                    linha = linha_mensagem(payload, payload["conversation"], evento == "message_created")
+                await conn.execute(escritores[tipo]._insert_sql(), *linha)
+        antes = time.perf_counter() - inicio
+        erros_antes = await conferir(pool, esperado)
+        print(f"🐢 Linha a linha: {antes * 1000:.0f}ms, {len(entregas)} idas ao banco, "
+              f"{erros_antes} linha(s) divergente(s)")
+        await limpar(pool)
+
+        # Em lote: handlers só colocam no buffer
+        await mirror.start()
+        inicio = time.perf_counter()
+        for evento, payload in entregas:
+            if evento == "contact_updated":
+                await mirror.save_contact(payload)
+            elif evento.startswith("conversation_"):
+                await mirror.save_conversation(payload)
+            else:
+                await mirror.save_message(payload, payload["conversation"], criada=evento == "message_created")
+        enfileirar = time.perf_counter() - inicio
+        await mirror.stop()
+        depois = time.perf_counter() - inicio
+        stats = mirror.get_stats()
+        lotes = sum(s["batches"] for s in stats.values())
+        erros = await conferir(pool, esperado)
+        print(f"🚀 Em lote: {depois * 1000:.0f}ms ({enfileirar * 1000:.0f}ms nos handlers), {lotes} lote(s), "
+              f"{erros} linha(s) divergente(s)")
+        for tabela, s in stats.items():
+            print(f"   {tabela}: {s['written']} aplicada(s), {s['coalesced']} agrupada(s) no lote, "
+                  f"{s['stale']} versão(ões) antiga(s) ignorada(s)")
+
+        if erros or erros_antes:
+            print("❌ Estado final diferente da versão mais nova")
+            ok = False
+        if not await conferir_leitura(mirror, args):
+            ok = False
+        if depois >= antes:
+            print("❌ Gravação em lote não foi mais rápida")
+            ok = False
+        print(f"\n⏱️ {antes * 1000:.0f}ms -> {depois * 1000:.0f}ms")
+        print("✅ Espelho do Chatwoot OK" if ok else "❌ Teste falhou")
+        return ok
+    finally:
+        await limpar(pool)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
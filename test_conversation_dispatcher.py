@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Script para testar o dispatcher de conversas (backend.communication.conversation_dispatcher)
+
+Passa uma rajada de webhooks pela fila local (WebhookQueue sem Redis) com um handler que
+imita o fluxo de chamados: lê o estado da conversa, espera (banco/IA) e grava o próximo
+passo. Compara a fila chamando o handler direto com --antes handlers ao mesmo tempo
+(comportamento anterior: 4 workers) com a fila encaminhando pelo dispatcher, e verifica:
+  - mensagens da mesma conversa processadas uma de cada vez, na ordem de chegada
+  - nenhuma atualização de estado perdida
+  - no máximo CONVERSATION_WORKERS conversas em paralelo, e paralelismo entre conversas
+  - caixa cheia recusada, profundidade das caixas nas métricas, atores inativos descartados
+
+Uso:
+    python test_conversation_dispatcher.py [--conversas 50] [--mensagens 8] [--workers 8]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.webhook_queue import WebhookQueue  # noqa: E402
+from backend.communication import ConversationDispatcher, MailboxFull  # noqa: E402
+
+
+class FluxoSimulado:
+    """Estado por conversa lido e gravado com uma espera no meio (como o ChamadosAIService)"""
+
+    def __init__(self, semente: int):
+        self.rnd = random.Random(semente)
+        self.estado = defaultdict(int)
+        self.ordem = defaultdict(list)
+        self.em_execucao = defaultdict(int)
+        self.simultaneas_mesma_conversa = 0
+        self.simultaneas = 0
+        self.max_simultaneas = 0
+
+    async def processar(self, payload):
+        conversa = payload["conversation"]["id"]
+        self.em_execucao[conversa] += 1
+        self.simultaneas += 1
+        self.max_simultaneas = max(self.max_simultaneas, self.simultaneas)
+        if self.em_execucao[conversa] > 1:
+            self.simultaneas_mesma_conversa += 1
+        try:
+            passo = self.estado[conversa]
+            await asyncio.sleep(self.rnd.uniform(0.005, 0.03))
+            self.estado[conversa] = passo + 1
+            self.ordem[conversa].append(payload["seq"])
+        finally:
+            self.em_execucao[conversa] -= 1
+            self.simultaneas -= 1
+
+
+async def rodar(modo: str, args) -> dict:
+    fluxo = FluxoSimulado(args.semente)
+    os.environ["WEBHOOK_MAX_IN_FLIGHT"] = str(args.antes if modo == "direto" else 200)
+    fila = WebhookQueue(redis_client=None, max_size=100000, workers=1)
+    dispatcher = None
+
+    if modo == "dispatcher":
+        dispatcher = ConversationDispatcher(workers=args.workers, mailbox_size=1000, idle_seconds=0.2)
+        await dispatcher.start(lambda message: fluxo.processar(message.data))
+
+        async def handler(payload):
+            await dispatcher.dispatch(f"conversation:{payload['conversation']['id']}", payload["event"],
+                                      payload, conversation_id=payload["conversation"]["id"])
+    else:
+        handler = fluxo.processar
+
+    await fila.start(handler)
+    inicio = time.perf_counter()
+    # Rajadas: cada conversa recebe várias mensagens seguidas
+    for conversa in range(1, args.conversas + 1):
+        for seq in range(args.mensagens):
+            await fila.enqueue("message_created", {"event": "message_created", "seq": seq,
+                                                   "conversation": {"id": conversa}})
+    total = args.conversas * args.mensagens
+    while sum(fila.processed.values()) + sum(fila.failed.values()) < total:
+        await asyncio.sleep(0.01)
+    duracao = time.perf_counter() - inicio
+
+    stats = dispatcher.get_stats() if dispatcher else None
+    await fila.stop()
+    resultado = {
+        "modo": modo,
+        "duracao": duracao,
+        "perdidas": total - sum(fluxo.estado.values()),
+        "fora_de_ordem": sum(1 for ordem in fluxo.ordem.values() if ordem != sorted(ordem)),
+        "sobrepostas": fluxo.simultaneas_mesma_conversa,
+        "max_paralelo": fluxo.max_simultaneas,
+        "stats": stats,
+        "dispatcher": dispatcher,
+    }
+    return resultado
+
+
+async def testar_limites(ok: bool) -> bool:
+    """Caixa cheia e descarte de atores inativos"""
+    liberar = asyncio.Event()
+
+    async def lento(message):
+        await liberar.wait()
+
+    dispatcher = ConversationDispatcher(workers=2, mailbox_size=3, idle_seconds=0.2)
+    await dispatcher.start(lento)
+    try:
+        # Uma em processamento e três aguardando: caixa cheia
+        pendentes = []
+        for _ in range(4):
+            pendentes.append(asyncio.create_task(dispatcher.dispatch("conversation:1", "message_created", {})))
+            await asyncio.sleep(0.02)
+        try:
+            await asyncio.wait_for(dispatcher.dispatch("conversation:1", "message_created", {}), 1)
+            print("❌ Caixa cheia aceitou mensagem")
+            ok = False
+        except asyncio.TimeoutError:
+            print("❌ Caixa cheia aceitou mensagem")
+            ok = False
+        except MailboxFull:
+            profundidade = dispatcher.get_stats()["mailbox_depth"]
+            print(f"🚫 Caixa cheia recusada (profundidade {profundidade['max']}, "
+                  f"{profundidade['deepest']})")
+
+        liberar.set()
+        await asyncio.gather(*pendentes)
+        await asyncio.sleep(0.3)
+        if dispatcher.evict_idle() != 1 or dispatcher.get_stats()["actors"] or dispatcher.mailboxes.queues:
+            print("❌ Ator inativo não foi descartado")
+            ok = False
+        else:
+            print("🧹 Ator inativo descartado junto com a caixa")
+    finally:
+        await dispatcher.stop()
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste do dispatcher de conversas")
+    parser.add_argument("--conversas", type=int, default=50)
+    parser.add_argument("--mensagens", type=int, default=8, help="mensagens por conversa")
+    parser.add_argument("--workers", type=int, default=8, help="CONVERSATION_WORKERS")
+    parser.add_argument("--antes", type=int, default=4, help="workers da fila no comportamento anterior")
+    parser.add_argument("--semente", type=int, default=7)
+    args = parser.parse_args()
+
+    total = args.conversas * args.mensagens
+    print(f"📨 {total} webhooks ({args.conversas} conversas x {args.mensagens} mensagens), "
+          f"antes {args.antes} workers na fila, agora {args.workers} no dispatcher\n")
+
+    ok = True
+    antes = await rodar("direto", args)
+    depois = await rodar("dispatcher", args)
+    for r in (antes, depois):
+        print(f"{r['modo']:<10} {r['duracao'] * 1000:7.0f}ms  perdidas={r['perdidas']:<4} "
+              f"conversas fora de ordem={r['fora_de_ordem']:<3} sobrepostas={r['sobrepostas']:<4} "
+              f"paralelo máx={r['max_paralelo']}")
+
+    stats = depois["stats"]
+    print(f"\n📊 caixas: {stats['mailbox_depth']}, espera {stats['wait_seconds']}")
+    if depois["perdidas"] or depois["fora_de_ordem"] or depois["sobrepostas"]:
+        print("❌ Mensagens da mesma conversa se sobrepuseram ou saíram de ordem")
+        ok = False
+    if depois["max_paralelo"] > args.workers:
+        print("❌ Pool passou de CONVERSATION_WORKERS")
+        ok = False
+    if depois["max_paralelo"] < min(args.workers, args.conversas):
+        print("❌ Conversas diferentes não rodaram em paralelo")
+        ok = False
+    if stats["mailbox_depth"]["max_seen"] < 2:
+        print("❌ Profundidade das caixas não registrada")
+        ok = False
+
+    await depois["dispatcher"].stop()
+    ok = await testar_limites(ok)
+
+    print("\n✅ Dispatcher de conversas OK" if ok else "\n❌ Teste falhou")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
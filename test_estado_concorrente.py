@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Script para testar turnos concorrentes no estado da conversa (ChamadosAIService)
+
+Duas réplicas processam ao mesmo tempo mensagens seguidas da mesma conversa durante o
+cadastro (collecting_data): as duas leem a mesma versão do estado e a segunda grava
+depois da primeira. Verifica que nenhum campo de dados_coletados preenchido por um
+turno é apagado pelo outro:
+
+    turno refeito:  o segundo turno é refeito sobre o estado novo e os dois campos ficam
+                    gravados (CPF do primeiro, endereço do segundo)
+    turno mesclado: sem poder refazer, os dados_coletados são unidos campo a campo e o
+                    CPF do primeiro turno não é apagado pelo estado lido antes dele
+
+Usa o estado em memória (ou o Redis com --redis-url).
+
+Uso:
+    python test_estado_concorrente.py [--redis-url redis://localhost:6379]
+"""
+import os
+import sys
+import asyncio
+import argparse
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend import chamados_ai_service as modulo  # noqa: E402
+from backend.chamados_ai_service import ChamadosAIService  # noqa: E402
+from backend.conversation_state import InMemoryStateStore, RedisStateStore  # noqa: E402
+
+CONVERSA = 987_654_321
+TELEFONE = "+5500000000001"
+
+
+class LeituraSimultanea:
+    """Visão do estado de uma réplica: a primeira leitura espera a da outra réplica"""
+
+    def __init__(self, store, barreira: dict, atraso: float):
+        self.store = store
+        self.barreira = barreira
+        self.atraso = atraso
+        self.primeira = True
+
+    async def load(self, conversation_id):
+        resultado = await self.store.load(conversation_id)
+        if self.primeira:
+            self.primeira = False
+            self.barreira["leituras"] += 1
+            if self.barreira["leituras"] >= 2:
+                self.barreira["evento"].set()
+            await self.barreira["evento"].wait()
+            # A réplica com atraso grava depois da outra
+            await asyncio.sleep(self.atraso)
+        return resultado
+
+    async def save(self, conversation_id, state, expected_version):
+        return await self.store.save(conversation_id, state, expected_version)
+
+
+async def cenario(store, nome: str, tentativas: int) -> bool:
+    modulo.MAX_TENTATIVAS_TURNO = tentativas
+    await store.delete(CONVERSA)
+    inicial = {"step": "collecting_data", "dados_coletados": {"nome": "Maria Teste", "telefone": TELEFONE}}
+    await store.save(CONVERSA, inicial, 0)
+
+    barreira = {"leituras": 0, "evento": asyncio.Event()}
+    replicas = []
+    for atraso in (0.0, 0.05):
+        service = ChamadosAIService()
+        service.conversation_states = LeituraSimultanea(store, barreira, atraso)
+        replicas.append(service)
+
+    contato = {"phone_number": TELEFONE}
+    respostas = await asyncio.gather(
+        replicas[0].process_citizen_message("123.456.789-01", CONVERSA, contato),
+        replicas[1].process_citizen_message("Rua das Flores, 10, Centro", CONVERSA, contato),
+    )
+    estado, versao = await store.load(CONVERSA)
+    dados = estado.get("dados_coletados", {})
+    await store.delete(CONVERSA)
+
+    print(f"\n🧪 {nome} (até {tentativas} tentativa(s) por turno): versão {versao}")
+    print(f"   dados_coletados: {dados}")
+    for indice, resposta in enumerate(respostas):
+        print(f"   resposta da réplica {indice + 1}: {resposta.splitlines()[0]}")
+
+    ok = dados.get("nome") == "Maria Teste" and dados.get("cpf") == "12345678901"
+    if tentativas > 1:
+        # Refeito sobre o estado novo, o segundo turno é lido como endereço
+        ok = ok and dados.get("endereco") == "Rua das Flores, 10, Centro"
+    print("   ✅ nenhum campo perdido" if ok else "   ❌ campo de um turno apagado pelo outro")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste de turnos concorrentes no estado da conversa")
+    parser.add_argument("--redis-url", default=None, help="usar o estado no Redis")
+    args = parser.parse_args()
+
+    if args.redis_url:
+        store = RedisStateStore(ttl=600, redis_url=args.redis_url, key_prefix="cidadaoai:state_teste")
+        print(f"🔗 Estado no Redis ({args.redis_url})")
+    else:
+        store = InMemoryStateStore(ttl=600)
+        print("🧠 Estado em memória")
+
+    original = modulo.MAX_TENTATIVAS_TURNO
+    try:
+        resultados = [
+            await cenario(store, "Turno refeito", original),
+            await cenario(store, "Turno mesclado", 1),
+        ]
+    finally:
+        modulo.MAX_TENTATIVAS_TURNO = original
+
+    ok = all(resultados)
+    print("\n✅ Estado da conversa consistente" if ok else "\n❌ Teste falhou")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Script para testar o armazenamento de mídia por hash (backend.media_store)
+
+Sobe um servidor HTTP local que gera arquivos em streaming e verifica, num diretório
+temporário:
+  - download grande com memória estável (pico do tracemalloc bem abaixo do arquivo)
+  - webhook reenviado (mesma mensagem) não baixa de novo
+  - mesmo conteúdo em outra mensagem vira hard link para o mesmo blob
+  - a cota remove os arquivos menos usados, junto com seus nomes públicos
+
+Uso:
+    python test_media_store.py [--tamanho-mb 50] [--porta 8731]
+"""
+import os
+import sys
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+import uvicorn
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.media_store import MediaStore, MediaTooLarge  # noqa: E402
+
+requisicoes = []
+
+
+async def servidor_de_arquivos(scope, receive, send):
+    """GET /<semente>/<bytes>: conteúdo determinístico em pedaços de 64KB"""
+    if scope["type"] != "http":
+        return
+    _, semente, tamanho = scope["path"].split("/")
+    tamanho = int(tamanho)
+    requisicoes.append(scope["path"])
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"audio/ogg")]})
+    bloco = (semente.encode() * 65536)[:65536]
+    enviados = 0
+    while enviados < tamanho:
+        parte = bloco[:min(65536, tamanho - enviados)]
+        enviados += len(parte)
+        await send({"type": "http.response.body", "body": parte, "more_body": enviados < tamanho})
+
+
+def porta_livre(porta: int) -> bool:
+    with socket.socket() as s:
+        return s.connect_ex(("127.0.0.1", porta)) != 0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste do armazenamento de mídia por hash")
+    parser.add_argument("--tamanho-mb", type=int, default=50)
+    parser.add_argument("--porta", type=int, default=8731)
+    args = parser.parse_args()
+
+    if not porta_livre(args.porta):
+        print(f"❌ Porta {args.porta} ocupada")
+        return False
+
+    server = uvicorn.Server(uvicorn.Config(servidor_de_arquivos, host="127.0.0.1", port=args.porta,
+                                           log_level="warning"))
+    tarefa = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    raiz = tempfile.mkdtemp(prefix="media-teste-")
+    base = f"http://127.0.0.1:{args.porta}"
+    ok = True
+    try:
+        os.environ["MEDIA_MAX_DOWNLOAD_MB"] = str(args.tamanho_mb * 2)
+        os.environ["MEDIA_QUOTA_MB"] = str(args.tamanho_mb * 4)
+        store = MediaStore(raiz)
+
+        # 1. Download grande: memória não acompanha o tamanho do arquivo
+        tamanho = args.tamanho_mb * 1024 * 1024
+        tracemalloc.start()
+        grande = await store.download(f"{base}/a/{tamanho}", "audio/audio_1_1.ogg", "ogg")
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"⬇️ {grande.size / 1024 / 1024:.0f} MB baixados, pico de memória {pico / 1024 / 1024:.1f} MB")
+        if grande.size != tamanho or pico > tamanho / 10:
+            print("❌ Download grande ficou em memória")
+            ok = False
+
+        # 2. Webhook reenviado: nome já existe, sem nova requisição
+        antes = len(requisicoes)
+        repetido = await store.find_alias("audio/audio_1_1.ogg")
+        if repetido is None or len(requisicoes) != antes or repetido.public_url != grande.public_url:
+            print("❌ Webhook reenviado baixou de novo")
+            ok = False
+        elif repetido.sha256 != grande.sha256 or await store.find_alias("audio/nao_existe.ogg") is not None:
+            print("❌ Nome público resolvido para o blob errado")
+            ok = False
+        else:
+            print(f"♻️ Reenvio reaproveitado: {repetido.public_url}")
+
+        # 3. Mesmo conteúdo em outra mensagem: hard link para o mesmo blob
+        copia = await store.download(f"{base}/a/{tamanho}", "audio/audio_1_2.ogg", "ogg")
+        st1, st2 = os.stat(grande.filepath), os.stat(copia.filepath)
+        if not copia.deduplicated or st1.st_ino != st2.st_ino or store.get_stats()["used_bytes"] != tamanho:
+            print("❌ Conteúdo repetido ocupou espaço de novo")
+            ok = False
+        else:
+            print(f"🔗 Conteúdo repetido: mesmo blob ({st1.st_nlink} nomes), {tamanho / 1024 / 1024:.0f} MB usados")
+
+        # 4. Limite por arquivo
+        try:
+            await store.download(f"{base}/z/{tamanho * 3}", "audio/audio_1_3.ogg", "ogg")
+            print("❌ Arquivo acima de MEDIA_MAX_DOWNLOAD_MB foi aceito")
+            ok = False
+        except MediaTooLarge:
+            print("🚫 Arquivo acima do limite recusado")
+        if os.listdir(store.tmp_dir):
+            print("❌ Arquivo temporário ficou para trás")
+            ok = False
+
+        # 5. Cota: arquivos novos empurram os menos usados para fora
+        await store.find_alias("audio/audio_1_1.ogg")  # renova o primeiro
+        nomes = []
+        for i, semente in enumerate("bcdef"):
+            nome = f"audio/audio_2_{i}.ogg"
+            await store.download(f"{base}/{semente}/{tamanho}", nome, "ogg")
+            nomes.append(nome)
+        stats = store.get_stats()
+        usados = sum(
+            os.stat(os.path.join(d, f)).st_size
+            for d, _, fs in os.walk(store.blobs_dir) for f in fs
+        )
+        print(f"🧹 Cota {stats['quota_bytes'] / 1024 / 1024:.0f} MB: {stats['evicted']} removido(s), "
+              f"{usados / 1024 / 1024:.0f} MB em disco")
+        if usados > stats["quota_bytes"] or usados != stats["used_bytes"]:
+            print("❌ Volume acima da cota ou contagem errada")
+            ok = False
+        sobrando = [n for n in nomes if os.path.exists(os.path.join(raiz, n))]
+        if nomes[-1] not in sobrando or os.path.exists(os.path.join(raiz, nomes[0])):
+            print("❌ Remoção não seguiu a ordem de uso")
+            ok = False
+
+        # 6. Índice refeito do disco confere com o incremental
+        reaberto = MediaStore(raiz)
+        await reaberto._ensure_index()
+        if reaberto.get_stats()["used_bytes"] != stats["used_bytes"]:
+            print("❌ Índice relido do disco diverge")
+            ok = False
+
+        print("\n✅ Armazenamento de mídia OK" if ok else "\n❌ Teste falhou")
+        return ok
+    finally:
+        shutil.rmtree(raiz, ignore_errors=True)
+        server.should_exit = True
+        await tarefa
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
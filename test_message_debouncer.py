@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Script para testar o agrupamento de mensagens por conversa (backend.message_debouncer)
+
+Reproduz a sequência em que dois turnos da mesma conversa chegavam a gerar ao mesmo tempo:
+  1. turno A chama sem_cancelamento() e continua gravando
+  2. turno B é criado e fica esperando A terminar
+  3. mensagem nova cancela B; o turno C seguinte também tem que esperar A
+
+Verifica que a geração nunca roda duas vezes ao mesmo tempo na conversa, que as
+respostas saem na ordem e que nenhuma mensagem se perde.
+
+Uso:
+    python test_message_debouncer.py
+"""
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend.message_debouncer import MessageDebouncer, sem_cancelamento  # noqa: E402
+
+
+async def main():
+    os.environ["MESSAGE_DEBOUNCE_QUIET_MS"] = "20"
+    os.environ["MESSAGE_DEBOUNCE_MAX_WAIT_MS"] = "1000"
+    liberar_a = asyncio.Event()
+    a_gravando = asyncio.Event()
+    em_execucao = 0
+    max_simultaneas = 0
+    geradas = []
+    entregues = []
+
+    async def generate(conversa, texto, contexto):
+        nonlocal em_execucao, max_simultaneas
+        em_execucao += 1
+        max_simultaneas = max(max_simultaneas, em_execucao)
+        try:
+            if texto == "a":
+                sem_cancelamento()
+                a_gravando.set()
+                await liberar_a.wait()
+            else:
+                await asyncio.sleep(0.05)
+            geradas.append(texto)
+            return f"resposta: {texto}"
+        finally:
+            em_execucao -= 1
+
+    async def deliver(conversa, resposta, contexto):
+        entregues.append(resposta)
+
+    debouncer = MessageDebouncer()
+    await debouncer.start(generate, deliver)
+    ok = True
+    try:
+        await debouncer.submit(1, "a")
+        await asyncio.wait_for(a_gravando.wait(), 1)
+        # B fecha a janela e fica esperando A (sem volta)
+        await debouncer.submit(1, "b")
+        await asyncio.sleep(0.1)
+        # Mensagem nova cancela B; C tem que continuar esperando A
+        await debouncer.submit(1, "c")
+        await asyncio.sleep(0.1)
+        if max_simultaneas > 1:
+            print("❌ Turno C gerou junto com o turno A")
+            ok = False
+        liberar_a.set()
+        await asyncio.sleep(0.3)
+    finally:
+        await debouncer.stop(timeout=1)
+
+    print(f"📨 geradas={geradas} entregues={entregues} paralelo máx={max_simultaneas} "
+          f"canceladas={debouncer.cancelled}")
+    if max_simultaneas > 1:
+        print("❌ Dois turnos da mesma conversa geraram ao mesmo tempo")
+        ok = False
+    if geradas != ["a", "b\nc"]:
+        print("❌ Turnos fora de ordem ou mensagens perdidas")
+        ok = False
+    if debouncer.cancelled != 1:
+        print("❌ Turno em espera não foi cancelado pela mensagem nova")
+        ok = False
+
+    print("\n✅ Agrupamento de mensagens OK" if ok else "\n❌ Teste falhou")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
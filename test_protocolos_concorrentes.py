@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Script para testar a geração concorrente de protocolos de chamados
+
+Cria milhares de chamados em paralelo a partir de várias instâncias de
+ChamadosService (cada uma com seu pool, como réplicas separadas) e verifica
+que nenhum protocolo se repete. Requer DATABASE_URL com as migrations 001-009.
+
+Os chamados criados são removidos ao final (--keep para manter); os contadores
+em protocolo_contadores continuam avançados.
+
+Uso:
+    python test_protocolos_concorrentes.py [--chamados 2000] [--processos 4] [--block-size 1]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from collections import Counter
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.chamados_service import ChamadosService  # noqa: E402
+from backend.protocolo_allocator import ProtocoloAllocator  # noqa: E402
+from backend.models import CriarChamadoRequest  # noqa: E402
+
+TELEFONE_TESTE = "+5500000000000"
+MARCADOR = "[teste-protocolos]"
+DESCRICOES = [
+    "Tem um buraco enorme na rua",
+    "Posto de saúde sem médico",
+    "Falta merenda na escola",
+    "Poste sem luz, rua escura",
+    "Solicitação sem categoria definida",
+]
+
+
+async def preparar_cidadao(service: ChamadosService):
+    async with service.pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO cidadaos (prefeitura_id, nome, telefone)
+            SELECT 1, 'Cidadão Teste Protocolos', $1::varchar
+            WHERE NOT EXISTS (SELECT 1 FROM cidadaos WHERE telefone = $1::varchar)
+        """, TELEFONE_TESTE)
+
+
+async def criar(service: ChamadosService, indice: int, semaforo: asyncio.Semaphore):
+    async with semaforo:
+        request = CriarChamadoRequest(
+            cidadao_telefone=TELEFONE_TESTE,
+            titulo=f"{MARCADOR} #{indice}",
+            descricao=DESCRICOES[indice % len(DESCRICOES)],
+            fonte="web",
+        )
+        return await service.criar_chamado(request)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste de protocolos concorrentes")
+    parser.add_argument("--chamados", type=int, default=2000)
+    parser.add_argument("--processos", type=int, default=4, help="instâncias de ChamadosService")
+    parser.add_argument("--concorrencia", type=int, default=200, help="criações simultâneas por instância")
+    parser.add_argument("--block-size", type=int, default=1, help="PROTOCOLO_BLOCK_SIZE de cada instância")
+    parser.add_argument("--keep", action="store_true", help="não remover os chamados criados")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        print("❌ DATABASE_URL não configurada!")
+        return False
+
+    services = []
+    for _ in range(args.processos):
+        service = ChamadosService()
+        service.protocolos = ProtocoloAllocator(block_size=args.block_size)
+        await service.init_db()
+        services.append(service)
+
+    ok = False
+    try:
+        await preparar_cidadao(services[0])
+
+        print(f"🧪 {args.chamados} chamados, {args.processos} instâncias, block_size={args.block_size}")
+        inicio = time.perf_counter()
+        tarefas = []
+        for numero, service in enumerate(services):
+            semaforo = asyncio.Semaphore(args.concorrencia)
+            tarefas.extend(
+                criar(service, indice, semaforo)
+                for indice in range(numero, args.chamados, args.processos)
+            )
+        respostas = await asyncio.gather(*tarefas)
+        duracao = time.perf_counter() - inicio
+
+        erros = [r.message for r in respostas if r.status != "success"]
+        protocolos = [r.protocolo for r in respostas if r.status == "success"]
+        repetidos = {p: n for p, n in Counter(protocolos).items() if n > 1}
+        fallback = [p for p in protocolos if p.startswith("CHAMADO-")]
+
+        print(f"⏱️ {len(protocolos)} criados em {duracao:.1f}s ({len(protocolos) / duracao:.0f}/s)")
+        for prefixo, total in sorted(Counter(p.rsplit("-", 2)[0] for p in protocolos).items()):
+            print(f"   - {prefixo}: {total}")
+        for service in services:
+            print(f"   📊 {service.protocolos.get_stats()}")
+
+        async with services[0].pool.acquire() as conn:
+            distintos = await conn.fetchval(
+                "SELECT COUNT(DISTINCT protocolo) FROM chamados WHERE titulo LIKE $1", MARCADOR + "%"
+            )
+
+        if erros:
+            print(f"❌ {len(erros)} erro(s), ex.: {erros[0]}")
+        if repetidos:
+            print(f"❌ Protocolos repetidos: {list(repetidos.items())[:5]}")
+        if fallback:
+            print(f"❌ {len(fallback)} protocolo(s) de fallback (migration 009 aplicada?)")
+        ok = not erros and not repetidos and not fallback and distintos == args.chamados
+        print("✅ Nenhum protocolo duplicado" if ok else f"❌ Falhou ({distintos} distintos no banco)")
+    finally:
+        if not args.keep:
+            async with services[0].pool.acquire() as conn:
+                await conn.execute("DELETE FROM chamados WHERE titulo LIKE $1", MARCADOR + "%")
+        for service in services:
+            await service.close()
+
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Script para testar a fila de transcrição de áudios (backend.transcription_service)
+
+Sobe um servidor local que imita POST /v1/audio/transcriptions da OpenAI (latência
+proporcional à duração enviada, como o Whisper) e verifica:
+  - submit não espera a transcrição (o webhook segue na hora)
+  - silêncios são recortados (segundos cobrados < duração do áudio)
+  - áudio longo vira vários blocos transcritos em paralelo e unidos na ordem
+  - mesmo áudio de novo (cache por hash) e áudio sem fala não chamam o servidor
+  - no shutdown, áudio que não termina a tempo recebe None no callback
+Compara com o envio do OGG original de uma vez (comportamento anterior). Requer ffmpeg
+(sem ele o teste é pulado).
+
+Uso:
+    python test_transcription_queue.py [--duracao 180] [--bloco 30] [--porta 8741]
+"""
+import io
+import os
+import sys
+import time
+import wave
+import asyncio
+import argparse
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+import uvicorn
+from fastapi import FastAPI, File, Form, UploadFile
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+FFMPEG = os.getenv("FFMPEG_PATH", "ffmpeg")
+
+# Latência simulada do Whisper: fixa + proporcional ao áudio enviado
+LATENCIA_BASE = 0.3
+LATENCIA_POR_SEGUNDO = 0.02
+
+
+class StubWhisper:
+    def __init__(self):
+        self.chamadas = 0
+        self.segundos = 0.0
+        self.simultaneas = 0
+        self.max_simultaneas = 0
+        self.app = FastAPI()
+        self.app.post("/v1/audio/transcriptions")(self.transcrever)
+
+    async def transcrever(self, file: UploadFile = File(...), model: str = Form(...),
+                          language: str = Form(None)):
+        data = await file.read()
+        if file.filename.endswith(".wav"):
+            with wave.open(io.BytesIO(data)) as wav:
+                duracao = wav.getnframes() / wav.getframerate()
+        else:
+            pcm = subprocess.run(
+                [FFMPEG, "-loglevel", "error", "-i", "pipe:0", "-ac", "1", "-ar", "16000", "-f", "s16le", "pipe:1"],
+                input=data, stdout=subprocess.PIPE, check=True,
+            ).stdout
+            duracao = len(pcm) / 32000
+        self.chamadas += 1
+        self.segundos += duracao
+        self.simultaneas += 1
+        self.max_simultaneas = max(self.max_simultaneas, self.simultaneas)
+        try:
+            await asyncio.sleep(LATENCIA_BASE + duracao * LATENCIA_POR_SEGUNDO)
+        finally:
+            self.simultaneas -= 1
+        return {"text": f"[{file.filename} {duracao:.1f}s]"}
+
+
+def gerar_audio(caminho: str, duracao: int, fala: bool = True):
+    """OGG/Opus: 6s de "fala" (tom + ruído) e 4s de silêncio, repetidos"""
+    expr = "0.4*sin(2*PI*220*t)*lt(mod(t,10),6)" if fala else "0"
+    subprocess.run([
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"aevalsrc=exprs='{expr}':d={duracao}:s=48000",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.003:duration={duracao}",
+        "-filter_complex", "amix=inputs=2:normalize=0",
+        "-ac", "1", "-c:a", "libopus", "-b:a", "24k", caminho,
+    ], check=True)
+
+
+def sha256(caminho: str) -> str:
+    with open(caminho, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste da fila de transcrição de áudios")
+    parser.add_argument("--duracao", type=int, default=180)
+    parser.add_argument("--bloco", type=int, default=30, help="TRANSCRIPTION_CHUNK_SECONDS")
+    parser.add_argument("--porta", type=int, default=8741)
+    args = parser.parse_args()
+
+    if not shutil.which(FFMPEG):
+        print(f"⏭️ {FFMPEG} não encontrado (FFMPEG_PATH): teste da fila de transcrição pulado")
+        return True
+
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-teste-local",
+        "AUDIO_TRANSCRIBE_BASE_URL": f"http://127.0.0.1:{args.porta}/v1",
+        "TRANSCRIPTION_CHUNK_SECONDS": str(args.bloco),
+    })
+    from backend.transcription_service import TranscriptionService
+    from backend.audio_transcriber import transcriber
+
+    stub = StubWhisper()
+    server = uvicorn.Server(uvicorn.Config(stub.app, host="127.0.0.1", port=args.porta, log_level="warning"))
+    tarefa = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    pasta = tempfile.mkdtemp(prefix="transcricao-teste-")
+    longo = os.path.join(pasta, "longo.ogg")
+    silencio = os.path.join(pasta, "silencio.ogg")
+    gerar_audio(longo, args.duracao)
+    gerar_audio(silencio, 20, fala=False)
+
+    service = TranscriptionService()
+    ok = True
+    try:
+        # Comportamento anterior: OGG inteiro numa chamada
+        inicio = time.perf_counter()
+        with open(longo, "rb") as f:
+            await transcriber.transcribe_bytes("longo.ogg", f.read())
+        antes_ms = (time.perf_counter() - inicio) * 1000
+        antes_segundos = stub.segundos
+        print(f"📼 Original: {antes_segundos:.0f}s cobrados, {antes_ms:.0f}ms")
+
+        await service.start()
+        stub.chamadas, stub.segundos, stub.max_simultaneas = 0, 0.0, 0
+        resultados = {}
+
+        def callback(nome, evento):
+            async def receber(texto):
+                resultados[nome] = texto
+                evento.set()
+            return receber
+
+        pronto = asyncio.Event()
+        inicio = time.perf_counter()
+        aceito = service.submit(longo, sha256(longo), callback("longo", pronto))
+        # Mesmo áudio reenviado enquanto está na fila: uma transcrição só
+        service.submit(longo, sha256(longo), callback("repetido", asyncio.Event()))
+        submit_ms = (time.perf_counter() - inicio) * 1000
+        await asyncio.wait_for(pronto.wait(), 120)
+        depois_ms = (time.perf_counter() - inicio) * 1000
+        await asyncio.sleep(0.1)
+
+        texto = resultados.get("longo") or ""
+        blocos = [f"bloco_{i}.wav" for i in range(stub.chamadas)]
+        print(f"🎧 Fila: submit em {submit_ms:.2f}ms, transcrição em {depois_ms:.0f}ms")
+        print(f"✂️ {stub.segundos:.0f}s cobrados (de {args.duracao}s), {stub.chamadas} bloco(s), "
+              f"até {stub.max_simultaneas} em paralelo")
+        print(f"📝 {texto[:160]}")
+        if not aceito or submit_ms > 50:
+            print("❌ submit segurou o chamador")
+            ok = False
+        if stub.segundos >= args.duracao * 0.8:
+            print("❌ Silêncios não foram recortados")
+            ok = False
+        if stub.chamadas < 2 or stub.max_simultaneas < 2:
+            print("❌ Áudio longo não foi dividido e transcrito em paralelo")
+            ok = False
+        if [b for b in blocos if b in texto] != blocos or texto.index(blocos[-1]) < texto.index(blocos[0]):
+            print("❌ Blocos fora de ordem na transcrição")
+            ok = False
+        if resultados.get("repetido") != texto:
+            print("❌ Áudio repetido na fila não recebeu a mesma transcrição")
+            ok = False
+
+        # Cache por hash e áudio sem fala
+        chamadas = stub.chamadas
+        for nome, caminho in (("cache", longo), ("silencio", silencio)):
+            evento = asyncio.Event()
+            service.submit(caminho, sha256(caminho), callback(nome, evento))
+            await asyncio.wait_for(evento.wait(), 60)
+        if resultados["cache"] != texto or stub.chamadas != chamadas:
+            print("❌ Cache por hash não evitou nova transcrição")
+            ok = False
+        if resultados["silencio"] != "" or stub.chamadas != chamadas:
+            print("❌ Áudio sem fala foi enviado ao Whisper")
+            ok = False
+        else:
+            print("♻️ Cache por hash e áudio sem fala: nenhuma chamada ao Whisper")
+
+        # Shutdown com áudio ainda em transcrição: o callback recebe None
+        depois_segundos = stub.segundos
+        parando = TranscriptionService()
+        await parando.start()
+        evento = asyncio.Event()
+        parando.submit(longo, None, callback("shutdown", evento))
+        await asyncio.sleep(0.1)
+        await parando.stop(timeout=0.2)
+        if not evento.is_set() or resultados.get("shutdown") is not None:
+            print("❌ Áudio pendente no shutdown ficou sem resposta")
+            ok = False
+        else:
+            print("🛑 Shutdown: áudio pendente respondido com None")
+
+        print(f"📊 {service.get_stats()}")
+        print(f"\n⏱️ {antes_ms:.0f}ms -> {depois_ms:.0f}ms, "
+              f"{antes_segundos:.0f}s -> {depois_segundos:.0f}s cobrados")
+        print("✅ Fila de transcrição OK" if ok else "❌ Teste falhou")
+        return ok
+    finally:
+        await service.stop()
+        server.should_exit = True
+        await tarefa
+        for nome in os.listdir(pasta):
+            os.unlink(os.path.join(pasta, nome))
+        os.rmdir(pasta)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Script para testar a deduplicação de webhooks do Chatwoot (backend.webhook_dedup)
+
+Gera um tráfego de webhooks em que parte das entregas é reenviada (como o Chatwoot faz
+após um timeout), às vezes para a outra réplica, e passa tudo por duas instâncias do
+WebhookDeduplicator compartilhando o Redis. Verifica:
+  - cada entrega processada uma vez só (reenvios na mesma réplica ou na outra)
+  - atualizações diferentes do mesmo objeto (message_updated, conversation_updated) não
+    são confundidas com reenvio
+  - eventos sem id (digitando) passam sempre
+  - entrega liberada após falha pode ser reenviada
+
+Uso:
+    python test_webhook_dedup.py [--webhooks 2000] [--reenvios 0.15] [--redis-url redis://localhost:6379]
+"""
+import os
+import sys
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.webhook_dedup import WebhookDeduplicator  # noqa: E402
+
+
+def gerar_webhooks(total: int, semente: int) -> list:
+    """Entregas distintas de vários eventos, com atualizações repetidas do mesmo objeto"""
+    rnd = random.Random(semente)
+    webhooks = []
+    for i in range(total):
+        sorteio = rnd.random()
+        if sorteio < 0.55:
+            payload = {"event": "message_created", "id": 10_000 + i, "content": f"mensagem {i}",
+                       "conversation": {"id": rnd.randint(1, 200)}}
+        elif sorteio < 0.65:
+            # Mesma mensagem editada várias vezes: corpo diferente a cada vez
+            payload = {"event": "message_updated", "id": rnd.randint(1, 50), "content": f"editada {i}",
+                       "conversation": {"id": 1}}
+        elif sorteio < 0.85:
+            payload = {"event": "conversation_updated", "id": rnd.randint(1, 200), "status": "open",
+                       "updated_at": 1_700_000_000 + i}
+        else:
+            payload = {"event": "conversation_typing_on", "conversation": {"id": rnd.randint(1, 200)},
+                       "user": {"id": 1}}
+        webhooks.append(payload)
+    return webhooks
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste da deduplicação de webhooks")
+    parser.add_argument("--webhooks", type=int, default=2000, help="entregas distintas")
+    parser.add_argument("--reenvios", type=float, default=0.15, help="fração reenviada pelo Chatwoot")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--semente", type=int, default=3)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.semente)
+    cliente = redis.from_url(args.redis_url)
+    prefixo = f"cidadaoai:webhook_dedup_teste:{os.getpid()}"
+    try:
+        await cliente.ping()
+        replicas = [WebhookDeduplicator(cliente, key_prefix=prefixo) for _ in range(2)]
+        print(f"🔗 Redis em {args.redis_url}: 2 réplicas")
+    except Exception as e:
+        print(f"⚠️ Redis indisponível ({e}): 1 réplica só com memória")
+        cliente = None
+        replicas = [WebhookDeduplicator(None)]
+
+    webhooks = gerar_webhooks(args.webhooks, args.semente)
+    entregas = []
+    for indice, payload in enumerate(webhooks):
+        entregas.append((indice, payload))
+        if rnd.random() < args.reenvios:
+            # Reenvio: 1 a 3 vezes, um pouco depois (outras entregas no meio)
+            for _ in range(rnd.randint(1, 3)):
+                entregas.append((indice, dict(payload)))
+    entregas.sort(key=lambda item: item[0] + rnd.random() * 20)
+
+    processadas = Counter()
+    ok = True
+    try:
+        for indice, payload in entregas:
+            replica = rnd.choice(replicas)
+            event = payload["event"]
+            if await replica.claim(event, replica.make_key(event, payload)):
+                processadas[indice] += 1
+
+        repetidas = [i for i, n in processadas.items() if n > 1 and "id" in webhooks[i]]
+        perdidas = [i for i in range(len(webhooks)) if not processadas[i]]
+        sem_id = sum(1 for w in webhooks if "id" not in w)
+        reenvios = len(entregas) - len(webhooks)
+        print(f"📨 {len(entregas)} entregas ({len(webhooks)} distintas + {reenvios} reenvios)")
+        print(f"⚙️ Processadas: antes {len(entregas)}, agora {sum(processadas.values())}")
+        if repetidas:
+            print(f"❌ {len(repetidas)} entrega(s) processada(s) mais de uma vez")
+            ok = False
+        if perdidas:
+            print(f"❌ {len(perdidas)} entrega(s) distinta(s) tomada(s) por reenvio")
+            ok = False
+
+        total = Counter()
+        for replica in replicas:
+            stats = replica.get_stats()
+            total.update(stats["detected_by"])
+            print(f"📊 réplica: {stats['checked']} verificadas, taxa de repetidas {stats['duplicate_rate']:.1%}, "
+                  f"detectadas {stats['detected_by']}, sem chave {stats['unkeyed']}")
+        if len(replicas) > 1 and not total.get("redis"):
+            print("❌ Reenvio para a outra réplica não foi detectado pelo Redis")
+            ok = False
+        print(f"   digitando (sem id) sempre processado: {sem_id}")
+
+        # Falha no processamento: liberar permite o reenvio
+        replica = replicas[0]
+        payload = {"event": "message_created", "id": 1, "content": "falhou"}
+        chave = replica.make_key("message_created", payload)
+        primeira = await replica.claim("message_created", chave)
+        await replica.release(chave)
+        outra = replicas[-1]
+        if not (primeira and await outra.claim("message_created", chave)):
+            print("❌ Entrega liberada após falha não foi aceita de novo")
+            ok = False
+        else:
+            print("🔓 Entrega liberada após falha aceita no reenvio")
+
+        print("\n✅ Deduplicação de webhooks OK" if ok else "\n❌ Teste falhou")
+        return ok
+    finally:
+        if cliente is not None:
+            chaves = [chave async for chave in cliente.scan_iter(f"{prefixo}:*")]
+            if chaves:
+                await cliente.delete(*chaves)
+            await cliente.aclose()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
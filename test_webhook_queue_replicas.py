@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Script para testar a fila de webhooks no Redis com várias réplicas (backend.webhook_queue)
+
+Duas réplicas (WebhookQueue + ConversationDispatcher cada) consomem a mesma fila. A
+segunda sobe depois, no meio da rajada, e recebe parte das partições da primeira.
+Verifica que:
+  - as mensagens de cada conversa são processadas na ordem de chegada e nunca ao mesmo
+    tempo nas duas réplicas, inclusive durante a troca de partições
+  - as duas réplicas processam webhooks (partições divididas)
+  - a réplica que perde a lease de uma partição cancela os itens em andamento dela: o
+    novo dono refaz a conversa sozinho, sem sobreposição nem processamento duplicado
+  - com a caixa da conversa cheia (MailboxFull), o webhook volta para a fila e é tentado
+    de novo, sem perder mensagens nem sair de ordem (no Redis e na fila local)
+
+Uso:
+    python test_webhook_queue_replicas.py [--conversas 40] [--mensagens 10] [--redis-url redis://localhost:6379]
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.webhook_queue import WebhookQueue, WebhookRetry  # noqa: E402
+from backend.communication import ConversationDispatcher, MailboxFull  # noqa: E402
+
+
+class Registro:
+    """Ordem de processamento por conversa e sobreposição entre réplicas"""
+
+    def __init__(self, semente: int):
+        self.rnd = random.Random(semente)
+        self.ordem = defaultdict(list)
+        self.em_execucao = defaultdict(int)
+        self.sobrepostas = 0
+        self.por_replica = defaultdict(int)
+
+    async def processar(self, replica: str, payload, espera=(0.002, 0.01)):
+        conversa = payload["conversation"]["id"]
+        self.em_execucao[conversa] += 1
+        if self.em_execucao[conversa] > 1:
+            self.sobrepostas += 1
+        try:
+            await asyncio.sleep(self.rnd.uniform(*espera))
+            self.ordem[conversa].append(payload["seq"])
+            self.por_replica[replica] += 1
+        finally:
+            self.em_execucao[conversa] -= 1
+
+    def fora_de_ordem(self) -> int:
+        return sum(1 for ordem in self.ordem.values() if ordem != sorted(ordem))
+
+
+async def subir_replica(nome: str, redis_client, prefixo: str, registro: Registro, mailbox_size: int,
+                        espera=(0.002, 0.01)):
+    os.environ["WEBHOOK_QUEUE_CONSUMER"] = nome
+    fila = WebhookQueue(redis_client=redis_client, max_size=100000, key_prefix=prefixo)
+    dispatcher = ConversationDispatcher(workers=8, mailbox_size=mailbox_size, idle_seconds=5)
+    await dispatcher.start(lambda message: registro.processar(nome, message.data, espera))
+
+    async def handler(payload):
+        try:
+            await dispatcher.dispatch(f"conversation:{payload['conversation']['id']}", payload["event"],
+                                      payload, conversation_id=payload["conversation"]["id"])
+        except MailboxFull as e:
+            raise WebhookRetry(str(e))
+
+    await fila.start(handler)
+    return fila, dispatcher
+
+
+async def esperar(filas, total: int, limite: float) -> bool:
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        if sum(sum(f.processed.values()) + sum(f.failed.values()) for f in filas) >= total:
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def limpar(redis_client, prefixo: str):
+    chaves = [chave async for chave in redis_client.scan_iter(f"{prefixo}:*")]
+    if chaves:
+        await redis_client.delete(*chaves)
+
+
+async def cenario_replicas(redis_client, args) -> bool:
+    prefixo = f"cidadaoai:webhooks_teste:{uuid.uuid4().hex[:8]}"
+    registro = Registro(args.semente)
+    replicas = [await subir_replica("replica-1", redis_client, prefixo, registro, 1000)]
+    total = args.conversas * args.mensagens
+    inicio = time.perf_counter()
+    try:
+        for seq in range(args.mensagens):
+            if seq == args.mensagens // 2:
+                # Segunda réplica no meio da rajada: recebe partições da primeira no heartbeat
+                replicas.append(await subir_replica("replica-2", redis_client, prefixo, registro, 1000))
+            for conversa in range(1, args.conversas + 1):
+                # Cada webhook chega por uma réplica diferente (como atrás do balanceador)
+                fila = replicas[(conversa + seq) % len(replicas)][0]
+                await fila.enqueue("message_created", {"event": "message_created", "seq": seq,
+                                                       "conversation": {"id": conversa}},
+                                   key=f"conversation:{conversa}")
+            await asyncio.sleep(0.2)
+        concluido = await esperar([f for f, _ in replicas], total, 30)
+        duracao = time.perf_counter() - inicio
+        particoes = [(await f.get_stats())["shards"]["owned"] for f, _ in replicas]
+    finally:
+        for fila, dispatcher in reversed(replicas):
+            await fila.stop()
+            await dispatcher.stop()
+        await limpar(redis_client, prefixo)
+
+    processadas = sum(len(ordem) for ordem in registro.ordem.values())
+    print(f"\n🧪 Duas réplicas: {processadas}/{total} em {duracao:.1f}s, "
+          f"por réplica {dict(registro.por_replica)}, partições {particoes}")
+    print(f"   conversas fora de ordem={registro.fora_de_ordem()} sobrepostas={registro.sobrepostas}")
+    ok = concluido and processadas == total and not registro.fora_de_ordem() and not registro.sobrepostas
+    if len(registro.por_replica) < 2:
+        print("   ❌ A segunda réplica não recebeu partições")
+        ok = False
+    print("   ✅ Ordem por conversa mantida entre réplicas" if ok else "   ❌ Falhou")
+    return ok
+
+
+async def cenario_lease_perdida(redis_client, args) -> bool:
+    prefixo = f"cidadaoai:webhooks_teste:{uuid.uuid4().hex[:8]}"
+    registro = Registro(args.semente)
+    # Handler lento: o primeiro webhook ainda está em andamento quando a lease vence
+    replicas = [await subir_replica("replica-1", redis_client, prefixo, registro, 1000, espera=(3.0, 3.0))]
+    fila = replicas[0][0]
+    total = 3
+    perdida = False
+    try:
+        for seq in range(total):
+            await fila.enqueue("message_created", {"event": "message_created", "seq": seq,
+                                                   "conversation": {"id": 1}}, key="conversation:1")
+        fim = time.monotonic() + 5
+        while not registro.em_execucao[1] and time.monotonic() < fim:
+            await asyncio.sleep(0.01)
+
+        # Réplica 1 travada além da lease: outra réplica fica com a partição
+        particao = fila._particao(fila._shard_of("conversation:1"))
+        await redis_client.set(particao.lease_key, "replica-2", ex=30)
+        fim = time.monotonic() + 5
+        while particao.indice in fila._owned and time.monotonic() < fim:
+            await asyncio.sleep(0.05)
+        perdida = particao.indice not in fila._owned
+        await redis_client.delete(particao.lease_key)
+        replicas.append(await subir_replica("replica-2", redis_client, prefixo, registro, 1000,
+                                            espera=(0.01, 0.01)))
+        concluido = await esperar([replicas[1][0]], total, 15)
+        await asyncio.sleep(3)  # tempo para um processamento antigo da réplica 1 terminar
+    finally:
+        for f, dispatcher in reversed(replicas):
+            await f.stop()
+            await dispatcher.stop()
+        await limpar(redis_client, prefixo)
+
+    ordem = registro.ordem[1]
+    print(f"\n🧪 Lease perdida: ordem {ordem}, por réplica {dict(registro.por_replica)}, "
+          f"sobrepostas={registro.sobrepostas}")
+    ok = perdida and concluido and ordem == list(range(total)) and not registro.sobrepostas
+    print("   ✅ Réplica antiga parou, novo dono refez a conversa" if ok else "   ❌ Falhou")
+    return ok
+
+
+async def cenario_caixa_cheia(redis_client, args) -> bool:
+    nome = "Redis" if redis_client is not None else "fila local"
+    prefixo = f"cidadaoai:webhooks_teste:{uuid.uuid4().hex[:8]}"
+    registro = Registro(args.semente)
+    # Caixa de 2 mensagens e handler lento: a rajada da conversa enche a caixa
+    fila, dispatcher = await subir_replica("replica-1", redis_client, prefixo, registro, 2, espera=(0.05, 0.05))
+    total = args.mensagens * 2
+    try:
+        for seq in range(total):
+            await fila.enqueue("message_created", {"event": "message_created", "seq": seq,
+                                                   "conversation": {"id": 1}}, key="conversation:1")
+        concluido = await esperar([fila], total, 60)
+        adiados = sum(fila.retried.values())
+    finally:
+        await fila.stop()
+        await dispatcher.stop()
+        if redis_client is not None:
+            await limpar(redis_client, prefixo)
+
+    ordem = registro.ordem[1]
+    print(f"\n🧪 Caixa cheia ({nome}): {len(ordem)}/{total} processadas, {adiados} adiamento(s), "
+          f"falhas={sum(fila.failed.values())}")
+    ok = concluido and ordem == list(range(total)) and adiados > 0
+    print("   ✅ Adiados tentados de novo, em ordem" if ok else f"   ❌ Falhou: {ordem}")
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste da fila de webhooks com várias réplicas")
+    parser.add_argument("--conversas", type=int, default=40)
+    parser.add_argument("--mensagens", type=int, default=10, help="mensagens por conversa")
+    parser.add_argument("--semente", type=int, default=7)
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    args = parser.parse_args()
+
+    # Leases curtas para a troca de partições acontecer durante o teste
+    os.environ["WEBHOOK_CONSUMER_LEASE_SECONDS"] = "3"
+    os.environ["WEBHOOK_QUEUE_SHARDS"] = "8"
+
+    redis_client = redis.from_url(args.redis_url)
+    try:
+        await redis_client.ping()
+    except Exception as e:
+        print(f"❌ Redis indisponível em {args.redis_url}: {e}")
+        return False
+    print(f"🔗 Redis em {args.redis_url}")
+
+    try:
+        resultados = [
+            await cenario_replicas(redis_client, args),
+            await cenario_lease_perdida(redis_client, args),
+            await cenario_caixa_cheia(redis_client, args),
+            await cenario_caixa_cheia(None, args),
+        ]
+    finally:
+        await redis_client.aclose()
+
+    ok = all(resultados)
+    print("\n✅ Fila de webhooks OK" if ok else "\n❌ Teste falhou")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Script para testar o WebSocket com várias réplicas (WEBSOCKET_BACKEND=redis)
+
+Sobe duas réplicas locais do servidor Socket.IO (backend.websocket_manager:app, uma
+por processo uvicorn), conecta metade dos clientes em cada uma e emite as mensagens
+a partir deste processo, que faz o papel de uma terceira réplica sem clientes (como
+a que recebe o webhook do Chatwoot). Verifica que todos os clientes recebem todas as
+mensagens, mede a latência do fan-out e confere o registro de presença no Redis,
+inclusive a remoção dos clientes de uma réplica derrubada sem shutdown.
+
+Uso:
+    python test_websocket_cluster.py [--clientes 20] [--mensagens 200] [--redis-url redis://localhost:6379]
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import logging
+import statistics
+import subprocess
+
+import socketio
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from backend.websocket_manager import WebSocketManager  # noqa: E402
+
+CONVERSA = 990001
+PRESENCE_TTL = 3
+
+
+def percentil(valores: list, p: float) -> float:
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def subir_replica(porta: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.websocket_manager:app",
+         "--host", "127.0.0.1", "--port", str(porta), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def esperar_porta(porta: int, timeout: float = 15.0) -> bool:
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", porta), timeout=0.5):
+                return True
+        except OSError:
+            await asyncio.sleep(0.2)
+    return False
+
+
+class Cliente:
+    def __init__(self, porta: int):
+        self.porta = porta
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.latencias = {}
+        self.atualizacoes = 0
+        self.sio.on("new_message", self._nova_mensagem)
+        self.sio.on("conversation_update", self._atualizacao)
+
+    async def _nova_mensagem(self, data):
+        mensagem = data["message"]
+        self.latencias[mensagem["id"]] = (time.time() - mensagem["t0"]) * 1000
+
+    async def _atualizacao(self, data):
+        self.atualizacoes += 1
+
+    async def conectar(self):
+        await self.sio.connect(f"http://127.0.0.1:{self.porta}", transports=["websocket"], wait_timeout=10)
+        await self.sio.call("join_panel", {"account_id": 1}, timeout=10)
+        await self.sio.emit("join_conversation", {"conversation_id": CONVERSA})
+
+
+async def esperar(condicao, timeout: float) -> bool:
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if await condicao():
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Teste do WebSocket com várias réplicas")
+    parser.add_argument("--clientes", type=int, default=20)
+    parser.add_argument("--mensagens", type=int, default=200)
+    parser.add_argument("--intervalo-ms", type=float, default=5.0)
+    parser.add_argument("--porta", type=int, default=8701, help="porta da réplica A (B usa a seguinte)")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("socketio.server").setLevel(logging.ERROR)
+    logging.getLogger("engineio.server").setLevel(logging.ERROR)
+
+    # Canal próprio para não misturar com réplicas reais no mesmo Redis
+    canal = f"cidadaoai-socketio-teste-{os.getpid()}"
+    os.environ.update({
+        "WEBSOCKET_BACKEND": "redis",
+        "REDIS_URL": args.redis_url,
+        "WEBSOCKET_CHANNEL": canal,
+        "WEBSOCKET_PRESENCE_TTL": str(PRESENCE_TTL),
+    })
+    env = dict(os.environ)
+    env.pop("WEBSOCKET_MESSAGE_QUEUE", None)
+
+    portas = [args.porta, args.porta + 1]
+    replicas = [subir_replica(porta, env) for porta in portas]
+    emissor = WebSocketManager()
+    clientes = []
+    ok = True
+    try:
+        for porta in portas:
+            if not await esperar_porta(porta):
+                print(f"❌ Réplica na porta {porta} não subiu")
+                return False
+        await emissor.start()
+        print(f"🔌 Réplicas em {portas}, canal {canal}")
+
+        clientes = [Cliente(portas[i % 2]) for i in range(args.clientes)]
+        await asyncio.gather(*(cliente.conectar() for cliente in clientes))
+
+        async def todos_presentes():
+            return len(await emissor.conversation_members(CONVERSA)) == args.clientes
+
+        if not await esperar(todos_presentes, 5):
+            membros = len(await emissor.conversation_members(CONVERSA))
+            print(f"❌ Presença: {membros} de {args.clientes} clientes registrados")
+            ok = False
+        else:
+            print(f"👥 Presença compartilhada: {args.clientes} clientes nas duas réplicas")
+
+        inicio = time.perf_counter()
+        for i in range(args.mensagens):
+            await emissor.emit_new_message(CONVERSA, {"id": i, "t0": time.time(), "content": f"mensagem {i}"})
+            if args.intervalo_ms:
+                await asyncio.sleep(args.intervalo_ms / 1000)
+        await emissor.emit_conversation_update({"id": CONVERSA, "account_id": 1, "status": "open"})
+
+        async def todas_entregues():
+            return all(len(c.latencias) == args.mensagens and c.atualizacoes for c in clientes)
+
+        await esperar(todas_entregues, 10)
+        duracao = time.perf_counter() - inicio
+
+        for porta in portas:
+            recebidas = [len(c.latencias) for c in clientes if c.porta == porta]
+            print(f"   📨 réplica {porta}: {sum(recebidas)}/{len(recebidas) * args.mensagens} mensagens entregues")
+        faltando = sum(args.mensagens - len(c.latencias) for c in clientes)
+        sem_update = sum(1 for c in clientes if not c.atualizacoes)
+        if faltando or sem_update:
+            print(f"❌ {faltando} entrega(s) faltando, {sem_update} cliente(s) sem conversation_update")
+            ok = False
+
+        entregas = [lat for c in clientes for lat in c.latencias.values()]
+        fanout = [
+            max(c.latencias[i] for c in clientes if i in c.latencias)
+            for i in range(args.mensagens) if any(i in c.latencias for c in clientes)
+        ]
+        if entregas:
+            print(f"⏱️ Entrega:  p50={statistics.median(entregas):.2f}ms  p99={percentil(entregas, 0.99):.2f}ms")
+            print(f"⏱️ Fan-out ({args.clientes} clientes): p50={statistics.median(fanout):.2f}ms  "
+                  f"p99={percentil(fanout, 0.99):.2f}ms  ({len(entregas) / duracao:.0f} entregas/s)")
+
+        # Réplica B derrubada sem shutdown: seus clientes somem da presença após o TTL
+        replicas[1].send_signal(signal.SIGKILL)
+        replicas[1].wait()
+        restantes = sum(1 for c in clientes if c.porta == portas[0])
+
+        async def so_replica_a():
+            return len(await emissor.conversation_members(CONVERSA)) == restantes
+
+        if await esperar(so_replica_a, PRESENCE_TTL * 3):
+            print(f"💀 Réplica {portas[1]} derrubada: presença com {restantes} clientes da réplica {portas[0]}")
+        else:
+            print("❌ Clientes da réplica derrubada continuam na presença")
+            ok = False
+
+        print("\n✅ Entrega entre réplicas OK" if ok else "\n❌ Teste falhou")
+        return ok
+    finally:
+        for cliente in clientes:
+            if cliente.sio.connected:
+                await cliente.sio.disconnect()
+        await emissor.stop()
+        for replica in replicas:
+            if replica.poll() is None:
+                replica.terminate()
+                replica.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)